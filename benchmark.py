@@ -0,0 +1,730 @@
+#!/usr/bin/env python3 -u
+##########################################################################
+##
+##  Local benchmarks for the recorder
+##
+##  Goals:
+##                      Measure the pieces of recordTV3.py that have to
+##                      keep up on a BeagleBone without a real HDhomerun
+##                      device on the network
+##
+##                      Drive the real scheduler end to end against the
+##                      simulated device (fakeHDHR.py) through scripted
+##                      schedules, with packet loss and device outages
+##
+##  Usage:
+##                      benchmark.py [options] capture|analyze|schedule|demux|filter|write|e2e|metrics|guide
+##
+##########################################################################
+import os
+import sys
+import time
+import random
+import datetime
+import getopt
+import shutil
+import tempfile
+import json
+import tracemalloc
+import multiprocessing
+
+import fakeHDHR
+import hdhrCapture
+import tsAnalyzer
+import tsDemux
+import scheduleIndex
+import diskWriter
+import hdhrDiscover
+import configWatch
+import recordingCatalog
+import recordTV3
+import recorderMetrics
+import xmltvGuide
+
+ATSC_BITRATE = 19392658  ## Full ATSC multiplex, bits/second
+
+
+def benchCapture(num_streams,bitrate,duration,out_dir):
+	## Blast num_streams synthetic UDP transport streams at the capture engine from
+	## separate processes and report what made it to disk
+	engine = hdhrCapture.getEngine()
+	streams = []
+	for n in range(num_streams):
+		streams.append(engine.openStream(os.path.join(out_dir,'bench%d.ts' %(n))))
+
+	pool = multiprocessing.Pool(num_streams)
+	cpu_start = engine.cpu_time
+	wall_start = time.time()
+	results = [pool.apply_async(fakeHDHR.sendStream,('127.0.0.1',stream.port,bitrate,duration)) for stream in streams]
+	sent = [result.get() for result in results]
+	pool.close()
+	pool.join()
+	time.sleep(hdhrCapture.FLUSH_INTERVAL)
+	wall = time.time() - wall_start
+	cpu = engine.cpu_time - cpu_start
+
+	print('%-8s %10s %10s %10s %10s' %('STREAM','SENT','RECEIVED','LOSS %','MB/s'))
+	total_bytes = 0
+	for n,stream in enumerate(streams):
+		counters = stream.counters()
+		stream.kill()
+		total_bytes += counters['bytes']
+		loss = 100.0 * (sent[n] - counters['datagrams']) / sent[n] if sent[n] else 0.0
+		print('%-8d %10d %10d %10.2f %10.2f' %(n,sent[n],counters['datagrams'],loss,counters['bytes'] / wall / 1e6))
+
+	print('')
+	print('INFO:    %d STREAMS, %.1f MB IN %.1f s = %.2f MB/s' %(num_streams,total_bytes / 1e6,wall,total_bytes / wall / 1e6))
+	print('INFO:    CAPTURE THREAD CPU %.2f s (%.1f%% OF ONE CORE, %.2f ms PER MB)' %(cpu,100.0 * cpu / wall,1000.0 * cpu / max(total_bytes / 1e6,1e-9)))
+
+
+def benchAnalyze(megabytes):
+	## Run the TS analyzer over synthetic data in capture-sized chunks, with and without NumPy
+	dgrams = fakeHDHR.buildDatagrams()
+	chunk = b''.join(dgrams * (hdhrCapture.CAPTURE_BUF_SIZE // len(b''.join(dgrams))))
+	num_chunks = max(1,int(megabytes * 1e6 / len(chunk)))
+
+	modes = [False]
+	if tsAnalyzer.HAVE_NUMPY:
+		modes.insert(0,True)
+	else:
+		print('NOTICE:  NUMPY IS NOT INSTALLED; ONLY THE PURE PYTHON ANALYZER WILL BE MEASURED')
+
+	print('%-8s %10s %10s %12s' %('MODE','MB','MB/s','x REALTIME'))
+	for use_numpy in modes:
+		analyzer = tsAnalyzer.TSAnalyzer(use_numpy)
+		cpu_start = time.process_time()
+		for n in range(num_chunks):
+			analyzer.feed(chunk)
+		cpu = time.process_time() - cpu_start
+		rate = len(chunk) * num_chunks / max(cpu,1e-9)
+		print('%-8s %10.1f %10.2f %12.1f' %('numpy' if use_numpy else 'python',len(chunk) * num_chunks / 1e6,rate / 1e6,rate * 8 / ATSC_BITRATE))
+		if analyzer.errors():
+			print('WARNING: ANALYZER REPORTED %d ERRORS ON CLEAN DATA' %(analyzer.errors()))
+
+
+class _CountingSink(object):
+	def __init__(self):
+		self.bytes = 0
+
+	def write(self,data):
+		self.bytes += len(data)
+
+
+def benchDemux(megabytes,num_programs):
+	## Split num_programs programs out of a synthetic 5 program multiplex in capture-sized
+	## chunks, with and without NumPy
+	dgrams = fakeHDHR.buildMultiplex()
+	chunk = b''.join(dgrams * max(1,hdhrCapture.CAPTURE_BUF_SIZE // len(b''.join(dgrams))))
+	num_chunks = max(1,int(megabytes * 1e6 / len(chunk)))
+	programs = fakeHDHR.FAKE_PROGRAMS[:num_programs]
+
+	modes = [False]
+	if tsDemux.HAVE_NUMPY:
+		modes.insert(0,True)
+	else:
+		print('NOTICE:  NUMPY IS NOT INSTALLED; ONLY THE PURE PYTHON DEMUXER WILL BE MEASURED')
+
+	print('%-8s %10s %10s %12s %10s' %('MODE','MB','MB/s','x REALTIME','OUT MB'))
+	for use_numpy in modes:
+		demux = tsDemux.TSDemux(use_numpy)
+		sinks = [_CountingSink() for program in programs]
+		for program,sink in zip(programs,sinks):
+			demux.addProgram(program,sink)
+		cpu_start = time.process_time()
+		for n in range(num_chunks):
+			demux.feed(chunk)
+		cpu = time.process_time() - cpu_start
+		rate = len(chunk) * num_chunks / max(cpu,1e-9)
+		print('%-8s %10.1f %10.2f %12.1f %10.1f' %('numpy' if use_numpy else 'python',len(chunk) * num_chunks / 1e6,rate / 1e6,\
+			rate * 8 / ATSC_BITRATE,sum(sink.bytes for sink in sinks) / 1e6))
+
+
+## What a PID filter test multiplex carries for every 1300 packets (about a tenth of a second of a
+## full multiplex): pid -> (packets,stream_type or None,language); 0x30 is the PMT of program 3
+FILTER_PIDS = {tsDemux.PAT_PID:(1,None,None),
+               0x30:(1,None,None),
+               0x1FFB:(3,None,None),                 ## PSIP: MGT, TVCT, EIT
+               0x31:(1010,0x02,None),                ## Video (and PCR)
+               0x34:(26,0x81,'eng'),                 ## Main audio, AC-3 5.1 384 kbit/s
+               0x35:(13,0x81,'spa'),                 ## Secondary audio (SAP)
+               0x36:(9,0x81,'eng'),                  ## Descriptive video service (DVS)
+               0x37:(2,0x86,None),                   ## SCTE-35 cue data
+               0x38:(4,0x05,None),                   ## Private sections (data broadcast)
+               0x41:(150,0x02,None),                 ## The SD subchannel, program 4
+               0x44:(9,0x81,'eng'),
+               tsDemux.NUM_PIDS - 1:(72,None,None)}  ## Null packets
+
+
+def filterMultiplex():
+	## One round of a multiplex whose program 3 has all of the streams a station sends with
+	## a show (with language descriptors on the audio), interleaved the way a mux would
+	program_info = []
+	for pid in (0x31,0x34,0x35,0x36,0x37,0x38):
+		packets,stream_type,language = FILTER_PIDS[pid]
+		descriptors = bytes([tsDemux.DESCRIPTOR_LANGUAGE,4]) + language.encode() + b'\x00' if language else b''
+		program_info.append(bytes([stream_type,0xE0 | (pid >> 8),pid & 0xFF,0xF0,len(descriptors)]) + descriptors)
+	pmt = tsDemux.buildSection(tsDemux.TABLE_PMT,3,0,bytes([0xE0,0x31,0xF0,0x00]) + b''.join(program_info))
+	pat = tsDemux.buildPAT(fakeHDHR.FAKE_TSID,[(3,0x30),(4,0x40)])
+	pmt4 = tsDemux.buildPMT(4,0x41,[(0x02,0x41),(0x81,0x44)])
+	total = sum(packets for packets,stream_type,language in FILTER_PIDS.values())
+	order = sorted(((n + 0.5) / packets,pid) for pid,(packets,stream_type,language) in FILTER_PIDS.items() for n in range(packets))
+	cc = {}
+	out = []
+	for position,pid in order:
+		count = cc.get(pid,0)
+		cc[pid] = (count + 1) & 0x0F
+		if pid == tsDemux.PAT_PID:
+			out.append(tsDemux.sectionPacket(pid,pat,count))
+		elif pid == 0x30:
+			out.append(tsDemux.sectionPacket(pid,pmt,count))
+		else:
+			out.append(fakeHDHR.buildTSPacket(pid,count,bytes([pid & 0xFF]) * 184))
+	## The PMT of program 4 rides along in place of one null packet
+	out[-1] = tsDemux.sectionPacket(0x40,pmt4)
+	assert len(out) == total
+	return b''.join(out)
+
+
+def benchFilter(megabytes,keep):
+	## Split program 3 out of a full multiplex with all of its streams and with only the ones
+	## keep wants, with and without NumPy.  CPU time of this one thread is what is measured,
+	## so the rates are those of a single core.
+	one = filterMultiplex()
+	chunk = one * max(1,hdhrCapture.CAPTURE_BUF_SIZE // len(one))
+	num_chunks = max(1,int(megabytes * 1e6 / len(chunk)))
+
+	modes = [False]
+	if tsDemux.HAVE_NUMPY:
+		modes.insert(0,True)
+	else:
+		print('NOTICE:  NUMPY IS NOT INSTALLED; ONLY THE PURE PYTHON DEMUXER WILL BE MEASURED')
+
+	print('%-8s %-20s %10s %10s %12s %10s %8s' %('MODE','STREAMS','MB','MB/s','x REALTIME','OUT MB','OUT %'))
+	for use_numpy in modes:
+		for filter in (None,keep):
+			demux = tsDemux.TSDemux(use_numpy)
+			sink = _CountingSink()
+			demux.addProgram(3,sink,keep=filter)
+			cpu_start = time.process_time()
+			for n in range(num_chunks):
+				demux.feed(chunk)
+			cpu = time.process_time() - cpu_start
+			rate = len(chunk) * num_chunks / max(cpu,1e-9)
+			print('%-8s %-20s %10.1f %10.2f %12.1f %10.1f %8.1f' %('numpy' if use_numpy else 'python',\
+				','.join(sorted(str(item) for item in filter)) if filter else 'all',len(chunk) * num_chunks / 1e6,rate / 1e6,\
+				rate * 8 / ATSC_BITRATE,sink.bytes / 1e6,100.0 * sink.bytes / (len(chunk) * num_chunks)))
+	print('')
+	print('INFO:    PROGRAM 3 KEEPS PIDS %s OF %s' %(', '.join('0x%04x' %(pid) for pid in sorted(demux.outputs[3]['pids'])),\
+		', '.join('0x%04x' %(pid) for pid in sorted(FILTER_PIDS) if pid not in (0x40,0x41,0x44,tsDemux.NUM_PIDS - 1))))
+
+
+## Write policies compared by the write test
+WRITE_POLICIES = [
+	('unbuffered',diskWriter.UNBUFFERED),
+	('batched',diskWriter.WritePolicy(preallocate=False,drop_cache=False,fsync_interval=None)),
+	('prealloc',diskWriter.WritePolicy(drop_cache=False,fsync_interval=None)),
+	('fadvise',diskWriter.WritePolicy(fsync_interval=None)),
+	('default',diskWriter.WritePolicy()),
+	('fsync-1s',diskWriter.WritePolicy(fsync_interval=1)),
+	('fsync-all',diskWriter.WritePolicy(batch_size=0,align=1,fsync_interval=1e-9)),
+]
+
+
+def benchWrite(megabytes,num_streams,out_dir,chunk_size):
+	## Write num_streams recordings of megabytes each side by side, chunk_size bytes at a time
+	## (interleaved like the capture thread does), under each write policy
+	chunk = b''.join(fakeHDHR.buildDatagrams())
+	chunk = (chunk * (chunk_size // len(chunk) + 1))[:chunk_size]
+	num_chunks = max(1,int(megabytes * 1e6 / chunk_size))
+	expected = num_chunks * chunk_size
+
+	print('INFO:    %d STREAMS x %.1f MB IN %d BYTE WRITES TO %s' %(num_streams,expected / 1e6,chunk_size,out_dir))
+	print('INFO:    FALLOCATE %s, POSIX_FADVISE %s' %('AVAILABLE' if diskWriter.HAVE_FALLOCATE else 'NOT AVAILABLE','AVAILABLE' if diskWriter.HAVE_FADVISE else 'NOT AVAILABLE'))
+	print('%-12s %10s %14s %14s %10s %8s' %('POLICY','MB/s','MB/s/STREAM','CPU ms/MB','WRITES','SYNCS'))
+	for name,policy in WRITE_POLICIES:
+		filenames = [os.path.join(out_dir,'write%d.ts' %(n)) for n in range(num_streams)]
+		for filename in filenames:
+			if os.path.exists(filename):
+				os.unlink(filename)
+		## Start every policy with nothing left for writeback from the one before
+		os.sync()
+		cpu_start = time.process_time()
+		wall_start = time.time()
+		writers = [diskWriter.RecordingWriter(filename,expected,policy) for filename in filenames]
+		for n in range(num_chunks):
+			for writer in writers:
+				writer.write(chunk)
+		writes = 0
+		syncs = 0
+		for writer in writers:
+			writer.close()
+			writes += writer.writes
+			syncs += writer.syncs
+		wall = time.time() - wall_start
+		cpu = time.process_time() - cpu_start
+		total = expected * num_streams
+		print('%-12s %10.2f %14.2f %14.3f %10d %8d' %(name,total / wall / 1e6,total / wall / 1e6 / num_streams,1000.0 * cpu / (total / 1e6),writes,syncs))
+		for filename in filenames:
+			os.unlink(filename)
+
+
+## Scripted schedules for the end to end test: the shows (name,channel,start offset,duration,priority),
+## the device outages (offset,duration), the times its tuners stop streaming (offset) and the stations
+## it moves (offset,virtual,rf,program), in seconds from the start of the run, and recordTV3 settings
+## for the run.  CBS and GRIT are on the same RF channel, so with demuxing they share a tuner.
+E2E_DEVICE = '10BEEF01'
+E2E_TIMESHIFT = {'CFG_Timeshift':True,'CFG_Warm_Channels':['CBS','NBC'],'CFG_Timeshift_MB':32,'CFG_Pre_Roll':3}
+E2E_LINEUP = {'CFG_Scan_Channels':[10,19,27,30,39],'CFG_Scan_Lock_Time':0.5,'CFG_Scan_Time':1.5,'CFG_Lineup_Check_Time':3,\
+	'CFG_Lineup_Max_Age':2,'CFG_Scan_Guard':1.5}
+E2E_SCENARIOS = {
+	'single':     ([('A','CBS',2,10,0)],[],[],[],{}),
+	'shared':     ([('A','CBS',2,12,0),('B','GRIT',2,12,0),('C','NBC',2,12,0)],[],[],[],{}),
+	'backtoback': ([('A','CBS',2,6,0),('B','NBC',2,6,0),('C','FOX',8,6,0),('D','ABC',8,6,0)],[],[],[],{}),
+	'preempt':    ([('A','CBS',2,14,0),('B','NBC',2,14,0),('C','FOX',6,8,5)],[],[],[],{}),
+	'outage':     ([('A','CBS',2,20,0),('B','NBC',2,20,0)],[(7,4)],[],[],{}),
+	'stall':      ([('A','CBS',2,20,0),('B','GRIT',2,20,0),('C','NBC',2,20,0)],[],[7],[],{}),
+	'timeshift':  ([('A','CBS',5,6,0),('B','NBC',5,6,0),('C','GRIT',7,6,0),('D','FOX',14,4,0),('E','CBS',15,4,0)],[],[],[],E2E_TIMESHIFT),
+	'repack':     ([('B','NBC',2,18,0),('A','CBS',15,5,0)],[],[],[(1,'46.1',30,7)],E2E_LINEUP),
+	'filtered':   ([('A','CBS',2,10,0),('B','GRIT',2,10,0)],[],[],[],{'CFG_PID_Filter':'video'}),
+}
+
+
+def benchEndToEnd(scenario,out_dir,bitrate,loss):
+	## Run recordTV3's own scheduler and event handlers in this process against a simulated
+	## device, following one of E2E_SCENARIOS, and report what it took to record it
+	shows,outages,stalls,repacks,settings = E2E_SCENARIOS[scenario]
+	device = fakeHDHR.FakeDevice(E2E_DEVICE,2,0,bitrate,loss)
+	control = fakeHDHR.startFakeDevice(device,'127.0.0.1',0)
+	port = control.server_address[1]
+	discover = fakeHDHR.startFakeDiscover(device,'127.0.0.1',port)
+
+	## Point the recorder at the simulator and shorten the timers so a run takes seconds
+	recordTV3.CFG_DEVICES = {E2E_DEVICE:{'ip':None,'tuners':2}}
+	recordTV3.CFG_Use_All_Devices = False
+	recordTV3.CFG_HDHRPort = port
+	recordTV3.CFG_DISCOVERY = hdhrDiscover.DiscoveryCache('127.0.0.1',port)
+	recordTV3.CFG_OS_cmd = os.path.join(os.path.dirname(os.path.abspath(__file__)),'fakeHDHRConfig.py')
+	os.environ['HDHR_TARGET'] = '127.0.0.1'
+	os.environ['HDHR_PORT'] = str(port)
+	recordTV3.CFG_Save_Dir = os.path.join(out_dir,'')
+	recordTV3.CFG_Catalog_File = os.path.join(out_dir,'catalog.db')
+	recordTV3.CFG_Journal_File = os.path.join(out_dir,'journal')
+	recordTV3.CFG_Rec_Check_Time = 2
+	recordTV3.CFG_Probe_Time = 1
+	recordTV3.CFG_Retry_Time = 1
+	recordTV3.CFG_Metrics_Port = None
+	recordTV3.CFG_Timeshift_Dir = out_dir
+	recordTV3.CFG_Lineup_File = os.path.join(out_dir,'lineup')
+	for setting,value in settings.items():
+		setattr(recordTV3,setting,value)
+
+	## The day/start/end rules are never consulted during the run: every show gets its
+	## unix start/stop time directly, like updateUnixTimes() would have set it
+	config_file = os.path.join(out_dir,'e2e.cfg')
+	with open(config_file,'w') as fptr:
+		json.dump(dict((name,{'day':list(scheduleIndex.WEEKDAYS),'start':'00:00','end':'00:01','channel_name':channel_name,\
+			'filename_prefix':name,'priority':priority}) for name,channel_name,offset,duration,priority in shows),fptr)
+	recordTV3.CFG_CONFIG = configWatch.ConfigWatcher(config_file)
+	recordTV3.CFG_RECORDINGS = recordTV3.CFG_CONFIG.load()
+	t0 = time.time() + 1
+	for name,channel_name,offset,duration,priority in shows:
+		recording = recordTV3.CFG_RECORDINGS[name]
+		recording['status'] = None
+		recording['unix_start_time'] = t0 + offset
+		recording['unix_stop_time'] = t0 + offset + duration
+	for offset,duration in outages:
+		timer = fakeHDHR.threading.Timer(t0 + offset - time.time(),device.outage,(duration,))
+		timer.daemon = True
+		timer.start()
+	for offset in stalls:
+		timer = fakeHDHR.threading.Timer(t0 + offset - time.time(),device.stall)
+		timer.daemon = True
+		timer.start()
+	for offset,virtual,rf,program in repacks:
+		timer = fakeHDHR.threading.Timer(t0 + offset - time.time(),device.repack,(virtual,rf,program))
+		timer.daemon = True
+		timer.start()
+
+	## Time every tune-and-start the scheduler does
+	tune_times = {}
+	tuneAndSave = recordTV3.tuneAndSave
+	def timedTuneAndSave(name,tuner_id,results):
+		start = time.time()
+		tuneAndSave(name,tuner_id,results)
+		tune_times.setdefault(name,[]).append(time.time() - start)
+	recordTV3.tuneAndSave = timedTuneAndSave
+
+	end = t0 + max(offset + duration for name,channel_name,offset,duration,priority in shows) + 1
+	scheduler = recordTV3.startRecorder(0)
+	scheduler.schedule(end,'e2e-end')
+	engine = hdhrCapture.getEngine()
+	capture_cpu = engine.cpu_time
+	loop_cpu = []
+	while True:
+		events = scheduler.waitForEvents()
+		cpu_start = time.thread_time()
+		recordTV3.handleEvents(scheduler,events,0)
+		loop_cpu.append(time.thread_time() - cpu_start)
+		if [event for event in events if event.kind == 'e2e-end']:
+			break
+	## What a scrape of the metrics costs with the recordings still running
+	scrape_start = time.time()
+	for scrape in range(10):
+		metrics_text = recordTV3.CFG_METRICS.render()
+	scrape_time = (time.time() - scrape_start) / 10
+	for name in recordTV3.CFG_RECORDINGS:
+		if recordTV3.CFG_RECORDINGS[name]['status'] == 'active':
+			recordTV3.killRecording(recordTV3.CFG_RECORDINGS[name])
+	warm = len(recordTV3.CFG_WARM)
+	for tuner_id in list(recordTV3.CFG_WARM):
+		recordTV3.coolTuner(tuner_id)
+	for tuner_id in list(recordTV3.CFG_SCANS):
+		recordTV3.endScan(tuner_id)
+	capture_cpu = engine.cpu_time - capture_cpu
+	wall = time.time() - t0
+	recordTV3.CFG_HEALTH.shutdown()
+	recordTV3.tuneAndSave = tuneAndSave
+	control.shutdown()
+	discover.shutdown()
+
+	catalog = recordingCatalog.RecordingCatalog(recordTV3.CFG_Catalog_File)
+	recordings = catalog.recordings()
+	print('')
+	print('INFO:    SCENARIO %s: %d SHOWS ON %d TUNERS, %.2f Mbit/s MULTIPLEX, %.1f%% DATAGRAM LOSS, %d OUTAGES, %d STALLS' %(\
+		scenario,len(shows),device.num_tuners,bitrate / 1e6,100.0 * loss,len(device.outages),len(device.stalls)))
+	print('%-6s %4s %10s %14s %8s %8s %10s %9s %8s' %('SHOW','SEG','TUNE ms','START SKEW ms','MB','MB/s','CC ERRORS','RESTARTS','GAP ms'))
+	total_bytes = 0
+	for recording in sorted(recordings,key=lambda recording: (recording['show'],recording['segment'])):
+		total_bytes += recording['bytes']
+		tunes = tune_times.get(recording['show'],[])
+		tune = 1000.0 * tunes[recording['segment']] if recording['segment'] < len(tunes) else float('nan')
+		skew = 1000.0 * (recording['start_time'] - recording['occurrence'])
+		duration = (recording['stop_time'] or time.time()) - recording['start_time']
+		print('%-6s %4d %10.1f %14.1f %8.1f %8.2f %10d %9d %8.0f' %(recording['show'],recording['segment'],tune,skew,recording['bytes'] / 1e6,\
+			recording['bytes'] / max(duration,1e-9) / 1e6,recording['cc_errors'],recording['restarts'],recording['gap_ms']))
+
+	print('')
+	print('INFO:    MAIN LOOP: %d PASSES, %.1f ms CPU (%.2f ms PER PASS, %.2f ms MAX)' %(len(loop_cpu),1000.0 * sum(loop_cpu),\
+		1000.0 * sum(loop_cpu) / max(len(loop_cpu),1),1000.0 * max(loop_cpu or [0])))
+	print('INFO:    CAPTURE THREAD: %.1f ms CPU (%.1f%% OF ONE CORE)' %(1000.0 * capture_cpu,100.0 * capture_cpu / wall))
+	print('INFO:    WRITTEN: %.1f MB IN %.1f s = %.2f MB/s' %(total_bytes / 1e6,wall,total_bytes / wall / 1e6))
+	print('INFO:    METRICS SCRAPE: %.2f ms FOR %d LINES' %(1000.0 * scrape_time,metrics_text.count('\n')))
+	if recordTV3.CFG_Timeshift:
+		print('INFO:    TIMESHIFT: %d TUNERS STILL WARM AT THE END, %d MB BUFFERS, %.0f s PRE-ROLL (A NEGATIVE SKEW IS PRE-ROLL FROM A BUFFER)' %(\
+			warm,recordTV3.timeshiftBytes() // (1024 * 1024),recordTV3.CFG_Pre_Roll))
+	scans = dict((sample['labels']['result'],sample['count']) for sample in recordTV3.MET_SCAN.snapshot())
+	if scans:
+		print('INFO:    SCANS: %s' %(', '.join('%d %s' %(scans[result],result.upper()) for result in sorted(scans))))
+	for when,virtual,old_rf,rf in device.repacks:
+		found = [channel_name for channel_name in recordTV3.CFG_CHANNELS if recordTV3.channelScan.virtualOf(recordTV3.CFG_CHANNELS[channel_name]) == virtual]
+		print('INFO:    REPACK AT +%.1f s: %s MOVED FROM RF %d TO RF %d; THE RECORDER HAS %s' %(when - t0,virtual,old_rf,rf,\
+			', '.join('%s ON RF %d PROGRAM %d' %(channel_name,recordTV3.CFG_CHANNELS[channel_name]['channel'],\
+			recordTV3.CFG_CHANNELS[channel_name]['subchannel']) for channel_name in found) or 'NOTHING'))
+	for start,stop in device.outages:
+		print('INFO:    OUTAGE AT +%.1f s FOR %.1f s' %(start - t0,(stop or time.time()) - start))
+		for name in sorted(set(recording['show'] for recording in recordings)):
+			segments = sorted((recording for recording in recordings if recording['show'] == name),key=lambda recording: recording['segment'])
+			cut = [recording for recording in segments if recording['stop_time'] and start <= recording['stop_time'] and recording['start_time'] < start]
+			resumed = [recording for recording in segments if recording['start_time'] >= start]
+			if not cut:
+				continue
+			line = 'INFO:      %-6s LOST AFTER %.1f s' %(name,cut[0]['stop_time'] - start)
+			if resumed and stop:
+				line += ', RECORDING AGAIN %.1f s AFTER THE DEVICE CAME BACK' %(resumed[0]['start_time'] - stop)
+			else:
+				line += ', NEVER RECOVERED'
+			print(line)
+
+
+def benchMetrics(num_streams):
+	## Cost of the instrumentation the recorder leaves on: per event, and per scrape with
+	## num_streams shows' worth of labels
+	registry = recorderMetrics.Registry()
+	counter = registry.counter('bench_total','Counter',('show',))
+	histogram = registry.histogram('bench_seconds','Histogram',('show',))
+	shows = [('SHOW%d' %(index),) for index in range(num_streams)]
+	calls = 200000
+
+	start = time.time()
+	for index in range(calls):
+		counter.inc(shows[index % num_streams])
+	inc_time = time.time() - start
+
+	start = time.time()
+	for index in range(calls):
+		histogram.observe((index % 1000) / 1000.0,shows[index % num_streams])
+	observe_time = time.time() - start
+
+	start = time.time()
+	for index in range(calls):
+		with histogram.time(shows[index % num_streams]):
+			pass
+	timer_time = time.time() - start
+
+	start = time.time()
+	for index in range(100):
+		text = registry.render()
+	render_time = (time.time() - start) / 100
+
+	start = time.time()
+	for index in range(100):
+		snapshot = json.dumps(registry.snapshot())
+	json_time = (time.time() - start) / 100
+
+	print('INFO:    COUNTER INC                 %8.2f us' %(1e6 * inc_time / calls))
+	print('INFO:    HISTOGRAM OBSERVE           %8.2f us' %(1e6 * observe_time / calls))
+	print('INFO:    HISTOGRAM TIMER (with)      %8.2f us' %(1e6 * timer_time / calls))
+	print('INFO:    PROMETHEUS TEXT, %d SHOWS   %8.2f ms (%d BYTES)' %(num_streams,1000.0 * render_time,len(text)))
+	print('INFO:    JSON SNAPSHOT, %d SHOWS     %8.2f ms (%d BYTES)' %(num_streams,1000.0 * json_time,len(snapshot)))
+
+
+def legacyNextOccurrence(rule,now):
+	## The day-walking search recordTV3.updateUnixTimes() used before the schedule index,
+	## kept here only to compare against
+	today_midnight = datetime.datetime.fromtimestamp(now).replace(hour=0,minute=0,second=0,microsecond=0)
+	for num_days in range(8):
+		test_day_datetime = today_midnight + datetime.timedelta(seconds=86400 * num_days)
+		test_day = test_day_datetime.strftime('%a')
+		if test_day in rule['day'] or test_day == rule['day']:
+			test_start_time = int(test_day_datetime.replace(hour=int(rule['start'][:2]),minute=int(rule['start'][-2:])).strftime('%s'))
+			test_end_time = int(test_day_datetime.replace(hour=int(rule['end'][:2]),minute=int(rule['end'][-2:])).strftime('%s'))
+			if test_end_time < test_start_time:
+				test_end_time += 86400
+			if now < test_end_time:
+				return (test_start_time,test_end_time)
+	return None
+
+
+def benchSchedule(num_rules):
+	## Compile num_rules random weekly rules and time next-occurrence / live-now queries
+	rng = random.Random(1)
+	rules = {}
+	for n in range(num_rules):
+		rules['show%d' %(n)] = {'day':rng.sample(scheduleIndex.WEEKDAYS,rng.randint(1,7)),\
+			'start':'%02d:%02d' %(rng.randrange(24),rng.randrange(60)),'end':'%02d:%02d' %(rng.randrange(24),rng.randrange(60))}
+	now = time.time()
+
+	index = scheduleIndex.ScheduleIndex()
+	start = time.process_time()
+	for name in rules:
+		index.update(name,rules[name])
+	index.rebuild()
+	compile_time = time.process_time() - start
+
+	start = time.process_time()
+	for name in rules:
+		index.update(name,rules[name])
+	recheck_time = time.process_time() - start
+
+	start = time.process_time()
+	for name in rules:
+		index.nextOccurrence(name,now)
+	next_time = time.process_time() - start
+
+	## A query costs about as much as the list it returns; random rules are long, so many are live
+	queries = 1000
+	live = 0
+	start = time.process_time()
+	for n in range(queries):
+		live += len(index.liveAt(now + n * 600))
+	live_time = time.process_time() - start
+
+	start = time.process_time()
+	for name in rules:
+		legacyNextOccurrence(rules[name],now)
+	legacy_time = time.process_time() - start
+
+	print('INFO:    %d RULES' %(num_rules))
+	print('INFO:    COMPILE ALL RULES                %10.2f ms' %(1000.0 * compile_time))
+	print('INFO:    RE-CHECK UNCHANGED RULES         %10.2f ms' %(1000.0 * recheck_time))
+	print('INFO:    NEXT OCCURRENCE, EVERY RULE      %10.2f ms (%.2f us EACH)' %(1000.0 * next_time,1e6 * next_time / num_rules))
+	print('INFO:    LIVE NOW QUERY                   %10.2f us EACH (%d LIVE ON AVERAGE)' %(1e6 * live_time / queries,live // queries))
+	print('INFO:    LEGACY DAY WALK, EVERY RULE      %10.2f ms (%.2f us EACH)' %(1000.0 * legacy_time,1e6 * legacy_time / num_rules))
+
+
+def writeGuide(filename,megabytes,titles,start,changes=()):
+	## A synthetic XMLTV guide of about megabytes MB: 200 channels of half hour listings, the
+	## first ones numbered like CFG_CHANNELS, for as many days as it takes.  changes: (channel,
+	## slot) of listings to move by 15 minutes.
+	rng = random.Random(1)
+	channels = [('I%s.%d.bench' %(recordTV3.CFG_CHANNELS[name]['name'].split(' ')[0],n),recordTV3.CFG_CHANNELS[name]['name']) \
+		for n,name in enumerate(sorted(recordTV3.CFG_CHANNELS))]
+	channels += [('C%d.bench' %(n),'%d CABLE%d' %(100 + n,n)) for n in range(200 - len(channels))]
+	stamp = lambda when: time.strftime('%Y%m%d%H%M%S +0000',time.gmtime(when))
+	with open(filename,'w') as fptr:
+		fptr.write('<?xml version="1.0" encoding="UTF-8"?>\n<tv generator-info-name="benchmark">\n')
+		for channel_id,name in channels:
+			fptr.write('  <channel id="%s"><display-name>%s</display-name><display-name>%s</display-name></channel>\n' %(channel_id,name,name.split(' ')[0]))
+		slot = 0
+		while fptr.tell() < megabytes * 1e6:
+			for n,(channel_id,name) in enumerate(channels):
+				when = start + slot * 1800 + (900 if (n,slot) in changes else 0)
+				number = rng.randrange(len(titles))
+				title = titles[number]
+				episode = rng.randrange(200)
+				fptr.write('  <programme start="%s" stop="%s" channel="%s"><title lang="en">%s</title><sub-title lang="en">Episode %d</sub-title>'\
+					'<desc lang="en">%s</desc><episode-num system="dd_progid">EP%06d.%04d</episode-num>%s</programme>\n' %(stamp(when),stamp(when + 1800),\
+					channel_id,title,episode,'A description of episode %d of %s that goes on for a while. ' %(episode,title) * 2,number,\
+					episode,'<new/>' if rng.random() < 0.3 else '<previously-shown/>'))
+			slot += 1
+		fptr.write('</tv>\n')
+	return slot
+
+
+def benchGuide(megabytes,num_rules,out_dir):
+	## Streaming XMLTV ingestion: read time and peak memory, matching series rules, and how much a
+	## new guide with a few changed listings reschedules
+	titles = ['Show %d' %(n) for n in range(3000)]
+	start = int(time.time()) // 1800 * 1800
+	filename = os.path.join(out_dir,'guide.xml')
+	slots = writeGuide(filename,megabytes,titles,start)
+	size = os.path.getsize(filename)
+	wanted = xmltvGuide.channelMatcher(recordTV3.CFG_CHANNELS)
+
+	index = xmltvGuide.GuideIndex(filename)
+	started = time.process_time()
+	index.load(wanted)
+	load_time = time.process_time() - started
+	tracemalloc.start()
+	xmltvGuide.GuideIndex(filename).load(wanted)
+	peak = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+
+	rules = dict((title,{'series':title,'new_only':n % 2 == 0,'filename_prefix':title.replace(' ','')}) for n,title in enumerate(titles[:num_rules]))
+	now = time.time()
+	started = time.process_time()
+	airings = xmltvGuide.seriesAirings(index,rules,now,now + 7 * 86400)
+	match_time = time.process_time() - started
+
+	## The same guide again with a few listings of the channels kept moved
+	changes = set((n,slot) for n in range(5) for slot in (2,50,100) if slot < slots)
+	writeGuide(filename,megabytes,titles,start,changes)
+	new_index = xmltvGuide.GuideIndex(filename)
+	new_index.load(wanted)
+	added,changed,removed = new_index.diff(index)
+	new_airings = xmltvGuide.seriesAirings(new_index,rules,now,now + 7 * 86400)
+	entries = configWatch.diffConfigs(airings,new_airings)
+
+	print('INFO:    GUIDE OF %.1f MB: %d CHANNELS, %.1f DAYS OF LISTINGS' %(size / 1e6,200,slots / 48.0))
+	print('INFO:    READ (STREAMING)                 %10.2f s CPU (%.1f MB/s), %d LISTINGS KEPT, %d ON OTHER CHANNELS LEFT OUT' %(load_time,\
+		size / 1e6 / max(load_time,1e-9),len(index.listings),index.skipped))
+	print('INFO:    PEAK MEMORY WHILE READING        %10.1f MB (%.1f%% OF THE FILE)' %(peak / 1e6,100.0 * peak / size))
+	print('INFO:    MATCH %d SERIES RULES, 7 DAYS   %10.2f ms -> %d AIRINGS' %(len(rules),1000.0 * match_time,len(airings)))
+	print('INFO:    NEW GUIDE: %d LISTINGS ADDED, %d CHANGED, %d REMOVED -> %d AIRINGS ADDED, %d MODIFIED, %d REMOVED (OF %d)' %(added,changed,removed,\
+		len(entries[0]),len(entries[1]),len(entries[2]),len(new_airings)))
+
+
+def usage():
+	print('Usage:' , sys.argv[0] , '[options] test')
+	print('Description: Benchmark pieces of the recorder locally')
+	print('')
+	print('Tests:')
+	print('capture		In-process UDP transport stream capture')
+	print('analyze		TS integrity analyzer throughput')
+	print('schedule	Schedule index compile and query times')
+	print('demux		Program demultiplexer throughput on a full multiplex')
+	print('filter		Demultiplexer throughput and output size with and without a PID filter (see -k)')
+	print('write		Recording write policies (preallocation, batching, fadvise, fsync) on the output file system')
+	print('e2e		The recorder\'s scheduler end to end against a simulated device (see -e)')
+	print('metrics		Cost of the metrics instrumentation and of a scrape')
+	print('guide		XMLTV guide read time and memory, series rule matching (-m guide size, -r rules)')
+	print('')
+	print('Options:')
+	print('-h  --help			Show this helpful information')
+	print('-n  --streams=[n]	Number of simultaneous streams / demuxed programs (default 2)')
+	print('-b  --bitrate=[bps]	Bitrate per stream, 0 = as fast as possible (default 19390000)')
+	print('-t  --time=[seconds]	Duration of the test (default 10)')
+	print('-r  --rules=[n]		Number of schedule rules (default 5000)')
+	print('-m  --megabytes=[n]	Amount of data for throughput tests (default 100)')
+	print('-s  --chunk=[bytes]	Size of each piece of data handed to the writer (default 65800)')
+	print('-e  --scenario=[name]	End to end schedule: %s (default shared)' %(', '.join(sorted(E2E_SCENARIOS))))
+	print('-l  --loss=[fraction]	Fraction of datagrams the simulated device drops (default 0)')
+	print('-o  --output=[dir]	Where to write test files (default: a temporary directory)')
+	print('-k  --keep=[streams]	Streams the filter test keeps (default video,audio,eng)')
+	print('')
+
+
+if __name__ == '__main__':
+	num_streams = 2
+	bitrate = 19390000
+	duration = 10
+	megabytes = 100
+	num_rules = 5000
+	out_dir = None
+	chunk_size = 350 * tsDemux.TS_PACKET_SIZE
+	scenario = 'shared'
+	loss = 0.0
+	keep = 'video,audio,eng'
+
+	try:
+		opts, args = getopt.getopt(sys.argv[1:], 'hn:b:t:m:r:o:s:e:l:k:', ['help', 'streams=', 'bitrate=', 'time=', 'megabytes=', 'rules=', 'output=', 'chunk=', 'scenario=', 'loss=', 'keep='])
+	except getopt.GetoptError as err:
+		print(str(err))
+		usage()
+		sys.exit(2)
+
+	for opt, arg in opts:
+		if opt in ('-h', '--help'):
+			usage()
+			sys.exit()
+		elif opt in ('-n', '--streams'):
+			num_streams = int(arg)
+		elif opt in ('-b', '--bitrate'):
+			bitrate = int(arg)
+		elif opt in ('-t', '--time'):
+			duration = float(arg)
+		elif opt in ('-m', '--megabytes'):
+			megabytes = float(arg)
+		elif opt in ('-r', '--rules'):
+			num_rules = int(arg)
+		elif opt in ('-o', '--output'):
+			out_dir = arg
+		elif opt in ('-s', '--chunk'):
+			chunk_size = int(arg)
+		elif opt in ('-e', '--scenario'):
+			scenario = arg
+			if scenario not in E2E_SCENARIOS:
+				print('ERROR:   UNKNOWN SCENARIO %s' %(scenario))
+				usage()
+				sys.exit(2)
+		elif opt in ('-l', '--loss'):
+			loss = float(arg)
+		elif opt in ('-k', '--keep'):
+			keep = arg
+		else:
+			assert False, 'unhandled option'
+
+	if len(args) != 1:
+		usage()
+		sys.exit(2)
+
+	tmp_dir = None
+	if not out_dir:
+		out_dir = tmp_dir = tempfile.mkdtemp(prefix='recordTV_bench_')
+
+	try:
+		if args[0] == 'capture':
+			benchCapture(num_streams,bitrate,duration,out_dir)
+		elif args[0] == 'analyze':
+			benchAnalyze(megabytes)
+		elif args[0] == 'schedule':
+			benchSchedule(num_rules)
+		elif args[0] == 'demux':
+			benchDemux(megabytes,num_streams)
+		elif args[0] == 'filter':
+			benchFilter(megabytes,tsDemux.pidFilter(keep))
+		elif args[0] == 'write':
+			benchWrite(megabytes,num_streams,out_dir,chunk_size)
+		elif args[0] == 'e2e':
+			benchEndToEnd(scenario,out_dir,bitrate,loss)
+		elif args[0] == 'metrics':
+			benchMetrics(num_streams)
+		elif args[0] == 'guide':
+			benchGuide(megabytes,num_rules,out_dir)
+		else:
+			print('ERROR:   UNKNOWN TEST %s' %(args[0]))
+			usage()
+			sys.exit(2)
+	finally:
+		if tmp_dir:
+			shutil.rmtree(tmp_dir,ignore_errors=True)
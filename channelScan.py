@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+##########################################################################
+##
+##  Channel lineup from the broadcast tables (PAT/PMT/PSIP TVCT)
+##
+##  Goals:
+##                      Work out which RF channel and program number each
+##                      virtual channel ("5.1 WAGA-HD") is on from what the
+##                      stations themselves broadcast, instead of a table
+##                      typed in for one market that a repack silently
+##                      breaks
+##
+##                      Collect the tables from a tuned multiplex with the
+##                      same demuxer that records it (PSIPDemux), so a
+##                      tuner that is streaming a channel anyway (a warm
+##                      one) can be checked without tuning anything
+##
+##                      Keep the lineup in a small JSON file (written to a
+##                      new file and renamed over the old) that startup
+##                      loads instantly, with when each RF channel was
+##                      last scanned so it can be re-checked a channel at
+##                      a time
+##
+##  Usage:
+##                      channelScan.py [lineup]             list the cached lineup
+##                      channelScan.py -f file.ts [-r rf]   list the channels a recorded multiplex carries
+##
+##########################################################################
+import os
+import re
+import sys
+import json
+import getopt
+import time
+
+import tsDemux
+
+DEFAULT_LINEUP = os.path.expanduser('~/.recordTV.lineup')
+LINEUP_VERSION = 1
+
+PSIP_PID   = 0x1FFB      ## ATSC base PID: MGT, TVCT/CVCT, STT, RRT
+TABLE_TVCT = 0xC8        ## Terrestrial virtual channel table
+TABLE_CVCT = 0xC9        ## Cable virtual channel table
+
+## ATSC service_type: only these are worth recording
+SERVICE_TV    = 0x02
+SERVICE_AUDIO = 0x03
+SERVICE_TYPES = (SERVICE_TV,SERVICE_AUDIO)
+
+VIRTUAL_RE = re.compile(r'^(\d+)[.-](\d+)$')
+
+
+def buildVCT(transport_stream_id,channels,version=0,table_id=TABLE_TVCT):
+	## channels is a list of (major,minor,short_name,program_number); one section, no descriptors
+	body = bytes([0,len(channels)])
+	for major,minor,name,program in channels:
+		body += name[:7].ljust(7,'\0').encode('utf-16-be')
+		body += bytes([0xF0 | ((major >> 6) & 0x0F),((major & 0x3F) << 2) | ((minor >> 8) & 0x03),minor & 0xFF])
+		body += bytes([0x04,0,0,0,0,(transport_stream_id >> 8) & 0xFF,transport_stream_id & 0xFF,(program >> 8) & 0xFF,program & 0xFF])
+		body += bytes([0x0D,0xC0 | SERVICE_TV,(program >> 8) & 0xFF,program & 0xFF,0xFC,0x00])
+	body += bytes([0xFC,0x00])
+	return tsDemux.buildSection(table_id,transport_stream_id,version,body)
+
+
+def parseVCT(section):
+	## -> (transport_stream_id,section_number,last_section_number,[channel,...]) where each channel
+	## is a dict: virtual ('5.1'), name, program, tsid, service_type, hidden
+	end = 3 + (((section[1] & 0x0F) << 8) | section[2]) - 4
+	channels = []
+	pos = 10
+	for n in range(section[9]):
+		if pos + 32 > end:
+			break
+		name = bytes(section[pos:pos + 14]).decode('utf-16-be','replace').split('\0')[0].strip()
+		major = ((section[pos + 14] & 0x0F) << 6) | (section[pos + 15] >> 2)
+		minor = ((section[pos + 15] & 0x03) << 8) | section[pos + 16]
+		channels.append({'virtual':'%d.%d' %(major,minor),'name':name,\
+			'tsid':(section[pos + 22] << 8) | section[pos + 23],\
+			'program':(section[pos + 24] << 8) | section[pos + 25],\
+			'hidden':bool(section[pos + 26] & 0x10),\
+			'service_type':section[pos + 27] & 0x3F})
+		pos += 32 + (((section[pos + 30] & 0x03) << 8) | section[pos + 31])
+	return ((section[3] << 8) | section[4],section[6],section[7],channels)
+
+
+def virtualOf(channel):
+	## The virtual channel number ('5.1') of a CFG_CHANNELS entry: its 'virtual', or the
+	## start of its 'name' ('5.1 WAGA-HD'); None if it has neither
+	match = VIRTUAL_RE.match(str(channel.get('virtual') or channel.get('name','').split(' ')[0]))
+	return '%d.%d' %(int(match.group(1)),int(match.group(2))) if match else None
+
+
+class PSIPDemux(tsDemux.TSDemux):
+	"""A TSDemux that also follows the PSIP virtual channel table, so the multiplex it
+	demuxes can tell which virtual channels it carries (lineup())"""
+
+	def __init__(self,use_numpy=tsDemux.HAVE_NUMPY):
+		self.vct = {}              ## section_number -> channels in it
+		self.vct_sections = None   ## last_section_number + 1, once any section was seen
+		tsDemux.TSDemux.__init__(self,use_numpy)
+
+	def rebuildRoutes(self):
+		tsDemux.TSDemux.rebuildRoutes(self)
+		self.psi_pids.add(PSIP_PID)
+		if self.use_numpy:
+			self.psi_lut[PSIP_PID] = True
+
+	def handleSection(self,pid,section):
+		if pid != PSIP_PID:
+			tsDemux.TSDemux.handleSection(self,pid,section)
+			return
+		## The base PID carries the STT every second too; only the VCT is of interest
+		key = (PSIP_PID,section[0],section[6]) if len(section) > 6 else None
+		if section[0] not in (TABLE_TVCT,TABLE_CVCT) or self.lastSection.get(key) == section:
+			return
+		if len(section) < 14 or not section[1] & 0x80 or tsDemux.crc32(section):
+			self.psi_errors += 1
+			return
+		if not section[5] & 0x01:
+			return
+		self.lastSection[key] = section
+		tsid,number,last,channels = parseVCT(section)
+		if self.vct_sections != last + 1:
+			self.vct = {}
+			self.vct_sections = last + 1
+		self.vct[number] = channels
+
+	def patSeen(self):
+		return tsDemux.PAT_PID in self.lastSection
+
+	def complete(self):
+		## Have the PAT, the PMT of every program in it and the whole VCT been seen?
+		return self.patSeen() and all(program in self.pmts for program in self.pmt_pids) and \
+			self.vct_sections is not None and len(self.vct) == self.vct_sections
+
+	def lineup(self):
+		## [channel,...] of the programs in the PAT, named after the VCT where it has them (a
+		## program the VCT doesn't list has no virtual number); each has its PMT's streams
+		if not self.patSeen():
+			return []
+		named = dict((channel['program'],channel) for section in self.vct.values() for channel in section)
+		channels = []
+		for program in sorted(self.pmt_pids):
+			channel = dict(named.get(program) or {'virtual':None,'name':'PROGRAM %d' %(program),'program':program,\
+				'tsid':self.tsid,'hidden':False,'service_type':None})
+			info = self.pmts.get(program)
+			channel['streams'] = [[stream_type,pid] for stream_type,pid in info[1]] if info else []
+			if channel['hidden'] or (channel['service_type'] is not None and channel['service_type'] not in SERVICE_TYPES):
+				continue
+			channels.append(channel)
+		return channels
+
+
+class Lineup(object):
+	"""The cached lineup: RF channel -> what the last scan of it found"""
+
+	def __init__(self,filename=DEFAULT_LINEUP):
+		self.filename = filename
+		self.channels = {}          ## rf -> {'scanned','tsid','programs':[channel,...],'missing'}
+
+	def load(self):
+		## False if there is no usable cache
+		try:
+			with open(self.filename,'r') as fptr:
+				data = json.load(fptr)
+		except (OSError,ValueError):
+			return False
+		if data.get('version') != LINEUP_VERSION:
+			return False
+		self.channels = dict((int(rf),entry) for rf,entry in data.get('channels',{}).items())
+		return True
+
+	def save(self):
+		tmp = self.filename + '.new'
+		with open(tmp,'w') as fptr:
+			json.dump({'version':LINEUP_VERSION,'saved':time.time(),'channels':dict((str(rf),self.channels[rf]) for rf in sorted(self.channels))},\
+				fptr,sort_keys=True,indent=1)
+			fptr.flush()
+			os.fsync(fptr.fileno())
+		os.replace(tmp,self.filename)
+
+	def update(self,rf,channels,now=None):
+		## A scan of rf found channels; returns the virtual numbers that came or went or changed program
+		if now is None:
+			now = time.time()
+		old = dict((channel['virtual'],channel['program']) for channel in self.programs(rf))
+		new = dict((channel['virtual'],channel['program']) for channel in channels)
+		self.channels[rf] = {'scanned':now,'tsid':channels[0]['tsid'] if channels else None,'programs':channels,'missing':None}
+		return sorted(virtual for virtual in set(old) | set(new) if virtual and old.get(virtual) != new.get(virtual))
+
+	def missing(self,rf,forget=False,now=None):
+		## Nothing was received on rf.  Unless told to forget it (a full scan), what was there is
+		## kept: one failed look is more likely the antenna than a repack.
+		if now is None:
+			now = time.time()
+		if forget:
+			self.channels.pop(rf,None)
+		elif rf in self.channels:
+			self.channels[rf]['missing'] = now
+
+	def programs(self,rf):
+		return self.channels.get(rf,{}).get('programs',[])
+
+	def scanned(self,rf):
+		return self.channels.get(rf,{}).get('scanned',0)
+
+	def find(self,virtual):
+		## (rf,channel) where virtual was found last, or None
+		found = None
+		for rf,entry in self.channels.items():
+			for channel in entry['programs']:
+				if channel['virtual'] == virtual and (not found or entry['scanned'] > self.channels[found[0]]['scanned']):
+					found = (rf,channel)
+		return found
+
+	def virtuals(self):
+		## virtual -> (rf,channel) of every named channel
+		result = {}
+		for rf in sorted(self.channels):
+			for channel in self.channels[rf]['programs']:
+				if channel['virtual']:
+					result[channel['virtual']] = self.find(channel['virtual'])
+		return result
+
+
+def scanFile(filename,use_numpy=tsDemux.HAVE_NUMPY):
+	## The demuxer after reading a recorded multiplex
+	demux = PSIPDemux(use_numpy)
+	with open(filename,'rb') as fptr:
+		while True:
+			chunk = fptr.read(tsDemux.READ_SIZE)
+			if not chunk:
+				break
+			demux.feed(chunk)
+	return demux
+
+
+def printChannels(rf,channels):
+	for channel in channels:
+		print('INFO:    RF %3d  PROGRAM %3d  %-6s %-8s %s' %(rf,channel['program'],channel['virtual'] or '-',channel['name'],\
+			', '.join('0x%04x (type 0x%02x)' %(pid,stream_type) for stream_type,pid in channel['streams'])))
+
+
+def usage():
+	print('Usage:' , sys.argv[0] , '[options] [lineup]')
+	print('Description: List the cached channel lineup (default %s) or the channels a recording carries' %(DEFAULT_LINEUP))
+	print('')
+	print('Options:')
+	print('-h  --help			Show this helpful information')
+	print('-f  --file=[file.ts]	List the channels of a recorded multiplex instead')
+	print('-r  --rf=[n]		RF channel the recording was made on (default 0)')
+	print('')
+
+
+if __name__ == '__main__':
+	filename = None
+	rf = 0
+	try:
+		opts, args = getopt.getopt(sys.argv[1:], 'hf:r:', ['help', 'file=', 'rf='])
+	except getopt.GetoptError as err:
+		print(str(err))
+		usage()
+		sys.exit(2)
+
+	for opt, arg in opts:
+		if opt in ('-h', '--help'):
+			usage()
+			sys.exit()
+		elif opt in ('-f', '--file'):
+			filename = arg
+		elif opt in ('-r', '--rf'):
+			rf = int(arg)
+		else:
+			assert False, 'unhandled option'
+
+	if len(args) > 1:
+		usage()
+		sys.exit(2)
+
+	if filename:
+		start = time.time()
+		demux = scanFile(filename)
+		print('INFO:    READ %s IN %.1f ms: %s' %(filename,1000.0 * (time.time() - start),'COMPLETE' if demux.complete() else 'INCOMPLETE TABLES'))
+		printChannels(rf,demux.lineup())
+		sys.exit(0)
+
+	lineup = Lineup(args[0] if args else DEFAULT_LINEUP)
+	start = time.time()
+	if not lineup.load():
+		print('ERROR:   NO LINEUP IN %s' %(lineup.filename))
+		sys.exit(1)
+	print('INFO:    LOADED %s IN %.2f ms: %d RF CHANNELS, %d VIRTUAL CHANNELS' %(lineup.filename,1000.0 * (time.time() - start),\
+		len(lineup.channels),len(lineup.virtuals())))
+	for rf in sorted(lineup.channels):
+		print('INFO:    RF %3d SCANNED %s%s' %(rf,time.strftime('%Y-%m-%d %H:%M',time.localtime(lineup.scanned(rf))),\
+			' (NOTHING RECEIVED %s)' %(time.strftime('%Y-%m-%d %H:%M',time.localtime(lineup.channels[rf]['missing']))) if lineup.channels[rf].get('missing') else ''))
+		printChannels(rf,lineup.programs(rf))
@@ -17,15 +17,5 @@ fi
 /usr/bin/find /mnt/nas/TV -type f -name "record*.log" -mmin +1440 | /usr/bin/xargs --no-run-if-empty --max-lines=1 /bin/bzip2
 /usr/bin/find /mnt/nas/TV -type f -name "record*.log*" -mmin +7200 | /usr/bin/xargs --no-run-if-empty /bin/rm -f
 
-/usr/bin/find /mnt/nas/TV/CBS\ Nightly\ News/ -name "*.ts" -mtime +1 | /usr/bin/xargs --max-lines=1 -t --no-run-if-empty -i /bin/rm -f "{}" 
-/usr/bin/find /mnt/nas/TV/CBS\ This\ Morning/ -name "*.ts" -mtime +1 | /usr/bin/xargs --max-lines=1 -t --no-run-if-empty -i /bin/rm -f "{}"
-/usr/bin/find /mnt/nas/TV/The\ Late\ Late\ Show/ -name "*.ts" -mtime +2 | /usr/bin/xargs --max-lines=1 -t --no-run-if-empty -i /bin/rm -f "{}"
-/usr/bin/find /mnt/nas/TV/The\ Tonight\ Show/ -name "*.ts" -mtime +2 | /usr/bin/xargs --max-lines=1 -t --no-run-if-empty -i /bin/rm -f "{}" 
-
-## Keep the file system under 97% usage
-while [ `/bin/df -hP | /bin/grep nas | /usr/bin/awk '{print $5}' | /bin/sed 's/\%//g'` -gt 97 ]; do
-	fileToRemove=`/usr/bin/find /mnt/nas/TV/ -type f -name "*.ts" -printf "%p:%T@\n" | /usr/bin/sort -t : -n --key 2 | /usr/bin/head -1 | /usr/bin/awk -F : '{print $1}'`
-	echo "NOTICE:   [`/bin/date +'%Y-%m-%d %H:%M:%S'`] REMOVING FILE ${fileToRemove}"
-	/bin/rm -f "${fileToRemove}"
-done
-
+## Expiring old recordings and keeping the file system under 97% usage is done by
+## recordTV3.py itself (see retention.py and 'keep_days' in the recording config)
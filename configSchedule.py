@@ -4,10 +4,10 @@ import sys
 import json
 import pprint
 
-CFG_RECORDINGS = {'CBS Nightly News':{'day':['Mon','Tue','Wed','Thu','Fri'],'start':'18:29','end':'19:01','channel_name':'CBS','filename_prefix':'CBSNightlyNews'},
-                  'The Late Late Show':{'day':['Tue','Wed','Thu','Fri','Sat'],'start':'00:36','end':'01:40','channel_name':'CBS','filename_prefix':'LateLateShow'},
-                  'The Tonight Show':{'day':['Mon','Tue','Wed','Thu','Fri'],'start':'23:34','end':'00:38','channel_name':'NBC','filename_prefix':'TheTonightShow'},
-                  'CBS This Morning':{'day':['Mon','Tue','Wed','Thu','Fri'],'start':'06:59','end':'07:23','channel_name':'CBS','filename_prefix':'CBS_ThisMorning'},
+CFG_RECORDINGS = {'CBS Nightly News':{'day':['Mon','Tue','Wed','Thu','Fri'],'start':'18:29','end':'19:01','channel_name':'CBS','filename_prefix':'CBSNightlyNews','keep_days':2},
+                  'The Late Late Show':{'day':['Tue','Wed','Thu','Fri','Sat'],'start':'00:36','end':'01:40','channel_name':'CBS','filename_prefix':'LateLateShow','keep_days':3},
+                  'The Tonight Show':{'day':['Mon','Tue','Wed','Thu','Fri'],'start':'23:34','end':'00:38','channel_name':'NBC','filename_prefix':'TheTonightShow','keep_days':3},
+                  'CBS This Morning':{'day':['Mon','Tue','Wed','Thu','Fri'],'start':'06:59','end':'07:23','channel_name':'CBS','filename_prefix':'CBS_ThisMorning','keep_days':2},
 
                   ## Sunday stuff
                   '60 Minutes':{'day':'Sun','start':'18:59','end':'21:01','channel_name':'CBS','filename_prefix':'60Minutes'},
@@ -41,6 +41,12 @@ CFG_RECORDINGS = {'CBS Nightly News':{'day':['Mon','Tue','Wed','Thu','Fri'],'sta
                   ## Saturday
 #                  '48 Hours':{'day':'Sat','start':'21:59','end':'23:01','channel_name':'CBS','filename_prefix':'48Hours'},
 #                  'Saturday Night Live':{'day':'Sat','start':'23:28','end':'01:02','channel_name':'NBC','filename_prefix':'SNL'}}
+
+                  ## Only the video and the English audio (no Spanish audio, data, PSIP) in the file
+#                  'Jeopardy':{'day':['Mon','Tue','Wed','Thu','Fri'],'start':'19:29','end':'20:01','channel_name':'NBC','filename_prefix':'Jeopardy','streams':'video,audio,eng'},
+
+                  ## Series: whenever the XMLTV guide (recordTV3.py -g) lists them
+#                  'NCIS':{'series':'NCIS','channel_name':'CBS','new_only':True,'filename_prefix':'NCIS','keep_days':7},
 }
 
 fptr = open(sys.argv[1],'w')
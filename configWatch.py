@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+##########################################################################
+##
+##  Change-triggered reloads of the recording configuration
+##
+##  Goals:
+##                      Only re-read and re-parse the JSON file written by
+##                      configSchedule.py when it has actually changed
+##                      (cheap stat() check, then a content hash so a
+##                      rewrite with identical contents is ignored)
+##
+##                      Work out exactly which recordings were added,
+##                      modified or removed so only those get
+##                      rescheduled and unrelated active recordings are
+##                      never touched
+##
+##########################################################################
+import os
+import json
+import hashlib
+
+## Keys the recorder adds to a recording at run time; they never come from the file
+RUNTIME_KEYS = ('status','handle','device','tuner','filename','lastCheck','hotRestarts','recordedUntil','unix_start_time','unix_stop_time')
+
+## Changing any of these moves the recording in time
+SCHEDULE_KEYS = ('day','start','end','airing')
+
+
+class ConfigWatcher(object):
+	def __init__(self,filename):
+		self.filename = filename
+		self.signature = None
+		self.digest = None
+
+	def statSignature(self):
+		try:
+			st = os.stat(self.filename)
+		except OSError:
+			return None
+		return (st.st_ino,st.st_size,st.st_mtime_ns)
+
+	def changed(self):
+		## Cheap check: has the file been touched since the last successful load?
+		return self.statSignature() != self.signature
+
+	def load(self):
+		## Returns the parsed configuration, or None if the contents are unchanged.
+		## Raises ValueError/OSError if the file can't be read or parsed; the
+		## signature is only updated on success so a half-written file is retried.
+		signature = self.statSignature()
+		with open(self.filename,'rb') as fptr:
+			raw = fptr.read()
+		digest = hashlib.sha1(raw).hexdigest()
+		if digest == self.digest:
+			self.signature = signature
+			return None
+
+		recordings = json.loads(raw.decode('utf-8'))
+		if not isinstance(recordings,dict):
+			raise ValueError('recording configuration must be a JSON object')
+		self.signature = signature
+		self.digest = digest
+		return recordings
+
+
+def configOf(recording):
+	return dict((key,value) for key,value in recording.items() if key not in RUNTIME_KEYS)
+
+
+def diffConfigs(current,new):
+	## Returns (added,modified,removed) lists of recording names
+	added = [name for name in new if name not in current]
+	removed = [name for name in current if name not in new]
+	modified = [name for name in new if name in current and configOf(current[name]) != configOf(new[name])]
+	return (added,modified,removed)
+
+
+def scheduleChanged(old,new):
+	for key in SCHEDULE_KEYS:
+		if old.get(key) != new.get(key):
+			return True
+	return False
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+##########################################################################
+##
+##  Recording file writer for the capture path
+##
+##  Goals:
+##                      Write recordings to the NAS the way it likes to be
+##                      written to instead of however the capture happens
+##                      to hand data over
+##
+##                      Preallocate the whole recording (expected duration
+##                      x channel bitrate) up front so the file isn't
+##                      fragmented by the other recordings growing next
+##                      to it; whatever isn't used is given back at close
+##
+##                      Coalesce the stream into large writes that start
+##                      and end on WRITE_ALIGN boundaries of the file
+##
+##                      Keep recorded data out of the page cache
+##                      (posix_fadvise DONTNEED behind the write position)
+##                      so a BeagleBone's memory isn't spent caching
+##                      recordings nobody reads back
+##
+##                      Make how often data is forced to disk (fdatasync)
+##                      a policy instead of an accident
+##
+##  Everything is best effort: a file system that can't preallocate or
+##  take advice is simply written to without it.
+##
+##########################################################################
+import os
+import time
+import ctypes
+import ctypes.util
+
+WRITE_ALIGN    = 64 * 1024           ## Writes start and end on multiples of this (except the last)
+BATCH_SIZE     = 4 * 1024 * 1024     ## Data is held back until there is at least this much to write
+MAX_DELAY      = 5.0                 ## ... or until it has been held back this long
+CACHE_WINDOW   = 8 * 1024 * 1024     ## Drop written data from the page cache this much at a time
+CACHE_LAG      = 16 * 1024 * 1024    ## and only once it is this far behind the write position
+
+FALLOC_FL_KEEP_SIZE  = 0x01
+
+try:
+	_libc = ctypes.CDLL(ctypes.util.find_library('c'),use_errno=True)
+	_fallocate = _libc.fallocate
+	_fallocate.argtypes = [ctypes.c_int,ctypes.c_int,ctypes.c_longlong,ctypes.c_longlong]
+	_fallocate.restype = ctypes.c_int
+except (OSError,AttributeError,TypeError):
+	_fallocate = None
+
+HAVE_FALLOCATE = _fallocate is not None
+HAVE_FADVISE   = hasattr(os,'posix_fadvise')
+
+
+def fallocate(fd,mode,offset,length):
+	## Linux fallocate(2); unlike os.posix_fallocate it can reserve space without changing
+	## the file size (FALLOC_FL_KEEP_SIZE), so the file still only shows what was recorded
+	if not HAVE_FALLOCATE:
+		raise OSError(95,'fallocate is not available')
+	if _fallocate(fd,mode,offset,length) != 0:
+		errno = ctypes.get_errno()
+		raise OSError(errno,os.strerror(errno))
+
+
+class WritePolicy(object):
+	"""How recordings are written.  fsync_interval: None = leave it to the kernel,
+	0 = fdatasync once at close, n = also every n seconds while recording."""
+
+	def __init__(self,preallocate=True,batch_size=BATCH_SIZE,align=WRITE_ALIGN,drop_cache=True,fsync_interval=0,max_delay=MAX_DELAY):
+		self.preallocate = preallocate
+		self.batch_size = batch_size
+		self.align = align
+		self.drop_cache = drop_cache
+		self.fsync_interval = fsync_interval
+		self.max_delay = max_delay
+
+	def __repr__(self):
+		return 'WritePolicy(preallocate=%s,batch_size=%d,align=%d,drop_cache=%s,fsync_interval=%s)' %(\
+			self.preallocate,self.batch_size,self.align,self.drop_cache,self.fsync_interval)
+
+
+## What hdhomerun_config save and the first capture engine did: every piece of data written as
+## it arrives, nothing preallocated, cached or synced
+UNBUFFERED = WritePolicy(preallocate=False,batch_size=0,align=1,drop_cache=False,fsync_interval=None)
+
+
+class RecordingWriter(object):
+	"""Appends a recording to filename according to a WritePolicy"""
+
+	def __init__(self,filename,expected_bytes=0,policy=None):
+		self.filename = filename
+		self.policy = policy or WritePolicy()
+		self.fd = os.open(filename,os.O_WRONLY | os.O_CREAT | os.O_APPEND,0o644)
+		self.offset = os.fstat(self.fd).st_size
+		self.pending = bytearray()
+		self.reserved = 0
+		self.cache_start = self.offset
+		self.lastWrite = time.time()
+		self.lastSync = time.time()
+		self.writes = 0
+		self.syncs = 0
+		if self.policy.preallocate and expected_bytes > 0:
+			self.preallocate(expected_bytes)
+
+	def preallocate(self,expected_bytes):
+		try:
+			fallocate(self.fd,FALLOC_FL_KEEP_SIZE,self.offset,expected_bytes)
+			self.reserved = self.offset + expected_bytes
+		except OSError:
+			## NFS/CIFS mounts often can't; not worth complaining about
+			self.reserved = 0
+
+	def write(self,data):
+		## Returns the number of bytes that went to disk (the rest is held back)
+		policy = self.policy
+		if self.pending:
+			self.pending += data
+			data = self.pending
+		if len(data) < policy.batch_size and time.time() - self.lastWrite < policy.max_delay:
+			if data is not self.pending:
+				self.pending += data
+			return 0
+
+		## Write everything that ends on an alignment boundary and keep the tail for next time
+		length = len(data)
+		if policy.align > 1 and length >= policy.batch_size:
+			length = (self.offset + length) // policy.align * policy.align - self.offset
+		with memoryview(data) as view:
+			written = self.writeOut(view[:length]) if length > 0 else 0
+			if data is not self.pending:
+				self.pending += view[written:]
+		if data is self.pending:
+			del(self.pending[:written])
+		return written
+
+	def writeOut(self,data):
+		written = 0
+		length = len(data)
+		while written < length:
+			written += os.write(self.fd,data[written:] if written else data)
+		self.offset += written
+		self.writes += 1
+		self.lastWrite = time.time()
+		self.afterWrite()
+		return written
+
+	def afterWrite(self):
+		policy = self.policy
+		if policy.fsync_interval and self.lastWrite - self.lastSync >= policy.fsync_interval:
+			self.sync()
+		if policy.drop_cache and HAVE_FADVISE and self.offset - CACHE_LAG - self.cache_start >= CACHE_WINDOW:
+			## Pages that are still dirty aren't dropped, so every call starts a lag behind where the
+			## last one ended to catch the ones writeback has cleaned since
+			end = self.offset - CACHE_LAG
+			try:
+				os.posix_fadvise(self.fd,self.cache_start,end - self.cache_start,os.POSIX_FADV_DONTNEED)
+			except OSError:
+				pass
+			self.cache_start = max(0,end - CACHE_LAG)
+
+	def sync(self):
+		try:
+			os.fdatasync(self.fd)
+			self.syncs += 1
+		except OSError:
+			pass
+		self.lastSync = time.time()
+
+	def flush(self):
+		## Write out everything held back, aligned or not
+		if self.pending:
+			written = self.writeOut(self.pending)
+			del(self.pending[:written])
+
+	def close(self):
+		try:
+			self.flush()
+			if self.policy.fsync_interval is not None:
+				self.sync()
+			## Give back the part of the preallocation that wasn't recorded into (truncating to the
+			## current size frees the blocks reserved past the end of the file)
+			if self.reserved > self.offset:
+				try:
+					os.ftruncate(self.fd,self.offset)
+				except OSError:
+					pass
+			if self.policy.drop_cache and HAVE_FADVISE:
+				try:
+					os.posix_fadvise(self.fd,0,0,os.POSIX_FADV_DONTNEED)
+				except OSError:
+					pass
+		finally:
+			os.close(self.fd)
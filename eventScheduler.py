@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+##########################################################################
+##
+##  Timer queue for the recorder main loop
+##
+##  Goals:
+##                      Sleep until the next thing that actually has to
+##                      happen (start, stop, health check, housekeeping)
+##                      instead of waking every second and walking every
+##                      configured recording
+##
+##                      Scale to thousands of scheduled events: adding,
+##                      cancelling and popping are O(log n)
+##
+##  Events are kept in a heap ordered by due time.  Cancelled events stay
+##  in the heap and are skipped when they reach the top (lazy deletion),
+##  so cancelling never has to search the heap.
+##
+##########################################################################
+import heapq
+import itertools
+import threading
+import time
+
+MAX_SLEEP = 60.0  ## Never sleep longer than this, so wall clock jumps are noticed
+
+
+class Event(object):
+	__slots__ = ('when','kind','key','data','cancelled')
+
+	def __init__(self,when,kind,key,data):
+		self.when = when
+		self.kind = kind
+		self.key = key
+		self.data = data
+		self.cancelled = False
+
+	def __repr__(self):
+		return 'Event(%s,%r,%s)' %(time.strftime('%H:%M:%S',time.localtime(self.when)),self.kind,self.key)
+
+
+class EventScheduler(object):
+	def __init__(self):
+		self.heap = []
+		self.counter = itertools.count()
+		self.byKey = {}
+		self.numCancelled = 0
+		self.cond = threading.Condition()
+
+	def schedule(self,when,kind,key=None,data=None):
+		event = Event(when,kind,key,data)
+		with self.cond:
+			heapq.heappush(self.heap,(when,next(self.counter),event))
+			self.byKey.setdefault((kind,key),[]).append(event)
+			## Wake the main loop if this is now the earliest event
+			if self.heap[0][2] is event:
+				self.cond.notify()
+		return event
+
+	def cancel(self,kind,key=None):
+		with self.cond:
+			for event in self.byKey.pop((kind,key),[]):
+				event.cancelled = True
+				self.numCancelled += 1
+
+			## Rebuild the heap once it is mostly dead entries so it can't grow without bound
+			if self.numCancelled > 64 and self.numCancelled > len(self.heap) // 2:
+				self.heap = [entry for entry in self.heap if not entry[2].cancelled]
+				heapq.heapify(self.heap)
+				self.numCancelled = 0
+
+	def pending(self,kind,key=None):
+		with self.cond:
+			return [event for event in self.byKey.get((kind,key),[]) if not event.cancelled]
+
+	def wake(self):
+		with self.cond:
+			self.cond.notify()
+
+	def _discard(self,event):
+		events = self.byKey.get((event.kind,event.key))
+		if events:
+			try:
+				events.remove(event)
+			except ValueError:
+				pass
+			if not events:
+				del(self.byKey[(event.kind,event.key)])
+
+	def popDue(self,now=None):
+		## Remove and return every event due at or before now, in time order
+		if now is None:
+			now = time.time()
+		due = []
+		with self.cond:
+			while self.heap and self.heap[0][0] <= now:
+				event = heapq.heappop(self.heap)[2]
+				if event.cancelled:
+					self.numCancelled -= 1
+					continue
+				self._discard(event)
+				due.append(event)
+		return due
+
+	def nextTime(self):
+		with self.cond:
+			while self.heap and self.heap[0][2].cancelled:
+				heapq.heappop(self.heap)
+				self.numCancelled -= 1
+			return self.heap[0][0] if self.heap else None
+
+	def waitForEvents(self):
+		## Block until at least one event is due (or wake() is called) and return the due events
+		with self.cond:
+			while True:
+				due = self.popDue()
+				if due:
+					return due
+				next_time = self.nextTime()
+				delay = MAX_SLEEP if next_time is None else min(MAX_SLEEP,next_time - time.time())
+				if delay > 0:
+					if self.cond.wait(delay):
+						## Woken early: let the caller look at anything that became due
+						due = self.popDue()
+						if due:
+							return due
+
+	def __len__(self):
+		with self.cond:
+			return sum(len(events) for events in self.byKey.values())
@@ -0,0 +1,494 @@
+#!/usr/bin/env python3 -u
+##########################################################################
+##
+##  Stand-in HDHomeRun device for exercising the recorder without real
+##  hardware on the LAN
+##
+##  Goals:
+##                      Answer control protocol get/set requests on TCP
+##                      the same way a real tuner does, including lockkey
+##                      enforcement
+##
+##                      Answer UDP discover requests (broadcast or unicast)
+##                      on the same port number
+##
+##                      Stream a synthetic MPEG-TS over UDP to whatever
+##                      /tunerN/target is set to, at a configurable
+##                      bitrate: the whole multiplex of the RF channel
+##                      /tunerN/channel is on (PAT, PSIP TVCT, a PMT and
+##                      video/audio PIDs per program) or just the program
+##                      /tunerN/program selects.  RF channels with nothing
+##                      on them (see FAKE_LINEUP) send nothing.
+##
+##                      Simulate a repack: a station moving to another RF
+##                      channel (and program number) while it runs
+##
+##                      Simulate a bad antenna (random datagram loss) and
+##                      the device dropping off the network: while it is
+##                      out it answers nothing and comes back rebooted
+##                      (tuners unlocked, nothing streaming)
+##
+##                      Simulate a stuck stream: the tuners stop sending
+##                      while the device stays up and keeps its state,
+##                      until a tuner's target is set again
+##
+##  Usage:
+##                      fakeHDHR.py [-p port] [-i device_id] [-t tuners] [-b bitrate]
+##                                  [-l loss] [-o at:seconds ...] [-s at ...] [-r at:virtual:rf[:program] ...]
+##
+##########################################################################
+import sys
+import getopt
+import random
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+import hdhrControl
+import hdhrDiscover
+import tsDemux
+import channelScan
+
+TS_PACKET_SIZE     = 188
+PACKETS_PER_DGRAM  = 7        ## Same as the real device: 1316 byte datagrams
+DEFAULT_BITRATE    = 8000000  ## bits/second of the synthetic stream
+VIDEO_PID          = 0x31
+FAKE_PROGRAMS      = (1,2,3,4,5)  ## Programs carried by the synthetic multiplex
+FAKE_TSID          = 0x0815
+
+## RF channel -> [(major,minor,short name,program)]: the market recordTV3's CFG_CHANNELS was typed in for
+FAKE_LINEUP        = {10:[(11,1,'WXIA-TV',3),(11,3,'WXIA-JN',5)],
+                      19:[(46,1,'WGCL-TV',3),(46,3,'WGCLSD2',5)],
+                      20:[(17,1,'WPCH-DT',3)],
+                      21:[(30,1,'WPBA-HD',3)],
+                      25:[(36,1,'WATL-DT',3),(36,2,'Bounce',4)],
+                      27:[(5,1,'WAGA-HD',3)],
+                      31:[(14,1,'ION',3)],
+                      39:[(2,1,'WSB-HD',1),(2,2,'Me TV',2)],
+                      43:[(69,1,'WUPA-HD',1)],
+                      48:[(34,1,'WUVG-DT',1)]}
+
+
+def buildTSPacket(pid,cc,payload=b'',pusi=False):
+	header = bytes([0x47,(0x40 if pusi else 0x00) | ((pid >> 8) & 0x1F),pid & 0xFF,0x10 | (cc & 0x0F)])
+	return header + payload[:184] + b'\xff' * (184 - len(payload[:184]))
+
+
+def buildDatagrams(pid=VIDEO_PID):
+	## 16 datagrams of 7 packets = 112 packets, a whole number of continuity counter cycles,
+	## so the list can be sent round-robin forever without a CC discontinuity
+	dgrams = []
+	cc = 0
+	for n in range(16):
+		packets = []
+		for i in range(PACKETS_PER_DGRAM):
+			packets.append(buildTSPacket(pid,cc))
+			cc = (cc + 1) & 0x0F
+		dgrams.append(b''.join(packets))
+	return dgrams
+
+
+def programPIDs(program):
+	## (pmt_pid,video_pid,audio_pid) of a program in the synthetic multiplex
+	return (0x30 + 0x10 * program,0x31 + 0x10 * program,0x34 + 0x10 * program)
+
+
+def buildMultiplex(programs=FAKE_PROGRAMS,channels=None,tsid=FAKE_TSID):
+	## Datagrams of a multiplex carrying programs, each with a PMT, one video PID (4 packets
+	## per round) and one audio PID, plus a TVCT naming channels (a FAKE_LINEUP entry) when
+	## given.  Every PID appears a multiple of 16 times, so the list can be sent round-robin
+	## forever without a CC discontinuity.
+	pat = tsDemux.buildPAT(tsid,[(program,programPIDs(program)[0]) for program in programs])
+	vct = channelScan.buildVCT(tsid,channels) if channels else None
+	pmts = dict((program,tsDemux.buildPMT(program,programPIDs(program)[1],[(0x02,programPIDs(program)[1]),(0x81,programPIDs(program)[2])])) for program in programs)
+	cc = {}
+	def packet(pid,section=None):
+		count = cc.get(pid,0)
+		cc[pid] = (count + 1) & 0x0F
+		if section:
+			return tsDemux.sectionPacket(pid,section,count)
+		return buildTSPacket(pid,count,bytes([pid & 0xFF]) * 184)
+
+	packets = []
+	for repeat in range(PACKETS_PER_DGRAM):
+		for round in range(16):
+			packets.append(packet(tsDemux.PAT_PID,pat))
+			if vct:
+				packets.append(packet(channelScan.PSIP_PID,vct))
+			for program in programs:
+				pmt_pid,video_pid,audio_pid = programPIDs(program)
+				packets.append(packet(pmt_pid,pmts[program]))
+				packets.extend(packet(video_pid) for n in range(4))
+				packets.append(packet(audio_pid))
+	return [b''.join(packets[n:n + PACKETS_PER_DGRAM]) for n in range(0,len(packets),PACKETS_PER_DGRAM)]
+
+
+def parseTarget(target):
+	## 'udp://192.168.1.10:5000' -> ('udp','192.168.1.10',5000)
+	if '://' not in target:
+		return None
+	proto,rest = target.split('://',1)
+	if ':' not in rest:
+		return None
+	ip,port = rest.rsplit(':',1)
+	return (proto,ip,int(port.split('/')[0]))
+
+
+def sendStream(ip,port,bitrate=DEFAULT_BITRATE,duration=None,stop=None,rtp=False,programs=None,loss=0.0,channels=None,tsid=FAKE_TSID):
+	## Send the synthetic stream to ip:port until duration expires or stop is set; a single
+	## PID with no PSI, or the multiplex of programs (with a TVCT of channels).  bitrate of 0
+	## sends as fast as possible.  loss is the fraction of datagrams silently dropped.  Returns
+	## the number of datagrams sent (dropped ones included).
+	dgrams = buildMultiplex(programs,channels,tsid) if programs else buildDatagrams()
+	rng = random.Random()
+	if rtp:
+		dgrams = [bytes([0x80,0x21,0,0,0,0,0,0,0,0,0,0]) + d for d in dgrams]
+	sock = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+	sent = 0
+	start = time.time()
+	rate = float(bitrate) / 8 / (TS_PACKET_SIZE * PACKETS_PER_DGRAM) if bitrate else 0
+	burst = 64 if not rate else max(1,int(rate / 100))
+	try:
+		while True:
+			now = time.time()
+			if stop is not None and stop.is_set():
+				break
+			if duration is not None and now - start >= duration:
+				break
+			if rate:
+				due = int((now - start) * rate) - sent
+				if due <= 0:
+					time.sleep(0.005)
+					continue
+				count = min(due,burst)
+			else:
+				count = burst
+			for i in range(count):
+				if not loss or rng.random() >= loss:
+					try:
+						sock.sendto(dgrams[sent % len(dgrams)],(ip,port))
+					except OSError:
+						pass
+				sent += 1
+	finally:
+		sock.close()
+	return sent
+
+
+class FakeDevice(object):
+	"""Tuner state of the simulated device, shared by every client connection"""
+
+	def __init__(self,device_id='1052A5C2',num_tuners=2,debug=0,bitrate=DEFAULT_BITRATE,loss=0.0):
+		self.device_id = device_id
+		self.num_tuners = num_tuners
+		self.debug = debug
+		self.bitrate = bitrate
+		self.loss = loss
+		self.online = True
+		self.outages = []       ## (start,end) of every outage; end is None while it lasts
+		self.stalls = []        ## When the tuners were made to stop streaming
+		self.repacks = []       ## (time,virtual,old rf,new rf) of every station moved
+		self.lineup = dict((rf,list(channels)) for rf,channels in FAKE_LINEUP.items())
+		self.lock = threading.Lock()
+		self.tuners = []
+		self.senders = {}
+		self.reset()
+
+	def reset(self):
+		## Power-on state: every tuner idle and unlocked
+		for stop in self.senders.values():
+			stop.set()
+		self.senders = {}
+		self.tuners = [{'channel':'none','program':'0','lockkey':0,'target':'none'} for tuner in range(self.num_tuners)]
+
+	def outage(self,duration):
+		## Drop off the network for duration seconds and come back rebooted
+		with self.lock:
+			self.online = False
+			self.outages.append((time.time(),None))
+			self.reset()
+		print('NOTICE:  FAKE DEVICE %s IS OFF THE NETWORK FOR %.1f SECONDS' %(self.device_id,duration))
+		timer = threading.Timer(duration,self.restore)
+		timer.daemon = True
+		timer.start()
+		return timer
+
+	def stall(self):
+		## Every tuner stops sending but keeps its channel, lock and target
+		with self.lock:
+			for stop in self.senders.values():
+				stop.set()
+			self.senders = {}
+			self.stalls.append(time.time())
+		print('NOTICE:  FAKE DEVICE %s STOPPED STREAMING' %(self.device_id))
+
+	def repack(self,virtual,rf,program=None):
+		## Move the station broadcasting virtual ('46.1') to rf, keeping its program number unless
+		## given a new one; tuners on either RF channel carry on with what is there now
+		with self.lock:
+			for old_rf,channels in list(self.lineup.items()):
+				for channel in channels:
+					if '%d.%d' %(channel[0],channel[1]) == virtual:
+						channels.remove(channel)
+						if not channels:
+							del(self.lineup[old_rf])
+						self.lineup.setdefault(rf,[]).append(channel[:3] + (program or channel[3],))
+						self.repacks.append((time.time(),virtual,old_rf,rf))
+						for tuner,state in enumerate(self.tuners):
+							if tuner in self.senders and self.rfOf(state['channel']) in (old_rf,rf):
+								self.setTarget(tuner,state['target'])
+						print('NOTICE:  FAKE DEVICE %s MOVED %s FROM RF %d TO RF %d' %(self.device_id,virtual,old_rf,rf))
+						return True
+		return False
+
+	def rfOf(self,channel):
+		## '19', 'auto:19' or '8vsb:19' -> 19
+		try:
+			return int(str(channel).split(':')[-1])
+		except ValueError:
+			return None
+
+	def restore(self):
+		with self.lock:
+			self.online = True
+			self.outages[-1] = (self.outages[-1][0],time.time())
+		print('NOTICE:  FAKE DEVICE %s IS BACK ON THE NETWORK' %(self.device_id))
+
+	def setTarget(self,tuner,target):
+		## Stop whatever this tuner was streaming and start streaming to the new target
+		if tuner in self.senders:
+			self.senders.pop(tuner).set()
+		dest = parseTarget(target)
+		if not dest:
+			return
+		## Like the real device: program 0/none streams the whole multiplex, and nothing comes
+		## from an RF channel (or program) nobody broadcasts on
+		rf = self.rfOf(self.tuners[tuner]['channel'])
+		channels = self.lineup.get(rf)
+		if not channels:
+			return
+		program = self.tuners[tuner]['program']
+		programs = sorted(channel[3] for channel in channels)
+		if program not in ('0','none'):
+			if int(program) not in programs:
+				return
+			programs = [int(program)]
+		stop = threading.Event()
+		thread = threading.Thread(target=sendStream,args=(dest[1],dest[2],self.bitrate,None,stop,dest[0] == 'rtp',programs,self.loss,\
+			channels,FAKE_TSID + rf),name='fakeHDHR-tuner%d' %(tuner))
+		thread.daemon = True
+		thread.start()
+		self.senders[tuner] = stop
+
+	def getset(self,name,value,lockkey):
+		if self.debug:
+			print('INFO:    FAKE DEVICE %s %s %s (key %d)' %('SET' if value is not None else 'GET',name,value,lockkey))
+
+		parts = name.strip('/').split('/')
+		if name == '/sys/model':
+			return 'hdhomerun_atsc'
+		if name == '/sys/hwmodel':
+			return 'HDHR-2US'
+		if len(parts) != 2 or not parts[0].startswith('tuner'):
+			raise hdhrControl.HDHRError('ERROR: unknown getset variable')
+		try:
+			tuner = int(parts[0][5:])
+			state = self.tuners[tuner]
+		except (ValueError,IndexError):
+			raise hdhrControl.HDHRError('ERROR: invalid tuner')
+		var = parts[1]
+
+		with self.lock:
+			if value is None:
+				if var == 'lockkey':
+					return 'none' if not state['lockkey'] else 'locked'
+				if var not in state:
+					raise hdhrControl.HDHRError('ERROR: unknown getset variable')
+				return str(state[var])
+
+			if state['lockkey'] and lockkey != state['lockkey']:
+				raise hdhrControl.HDHRError('ERROR: resource locked by 127.0.0.1')
+
+			if var == 'lockkey':
+				if value == 'none':
+					state['lockkey'] = 0
+				else:
+					state['lockkey'] = hdhrControl.lockkeyValue(value)
+				return value
+			if var not in state:
+				raise hdhrControl.HDHRError('ERROR: unknown getset variable')
+			state[var] = value
+			if var == 'target':
+				self.setTarget(tuner,value)
+			return value
+
+
+class ControlHandler(socketserver.BaseRequestHandler):
+	def handle(self):
+		device = self.server.device
+		sock = self.request
+		while True:
+			try:
+				packet = hdhrControl.recvPacket(sock)
+			except (OSError,ConnectionError):
+				return
+			if not packet or packet[0] != hdhrControl.HDHOMERUN_TYPE_GETSET_REQ or not device.online:
+				return
+
+			tags = hdhrControl.decodeTLVs(packet[1])
+			name = hdhrControl.tagString(tags.get(hdhrControl.HDHOMERUN_TAG_GETSET_NAME,b''))
+			value = None
+			if hdhrControl.HDHOMERUN_TAG_GETSET_VALUE in tags:
+				value = hdhrControl.tagString(tags[hdhrControl.HDHOMERUN_TAG_GETSET_VALUE])
+			lockkey = 0
+			if hdhrControl.HDHOMERUN_TAG_GETSET_LOCKKEY in tags:
+				lockkey = struct.unpack('>I',tags[hdhrControl.HDHOMERUN_TAG_GETSET_LOCKKEY])[0]
+
+			payload = hdhrControl.encodeTLV(hdhrControl.HDHOMERUN_TAG_GETSET_NAME,name)
+			try:
+				result = device.getset(name,value,lockkey)
+				payload += hdhrControl.encodeTLV(hdhrControl.HDHOMERUN_TAG_GETSET_VALUE,result)
+			except hdhrControl.HDHRError as diag:
+				payload += hdhrControl.encodeTLV(hdhrControl.HDHOMERUN_TAG_ERROR_MESSAGE,str(diag))
+
+			try:
+				sock.sendall(hdhrControl.buildPacket(hdhrControl.HDHOMERUN_TYPE_GETSET_RPY,payload))
+			except OSError:
+				return
+
+
+class DiscoverHandler(socketserver.BaseRequestHandler):
+	def handle(self):
+		device = self.server.device
+		frame,sock = self.request
+		wanted = hdhrDiscover.parseRequest(frame)
+		if wanted is None or not self.server.answering or not device.online:
+			return
+		if wanted not in ('%08X' %(hdhrControl.HDHOMERUN_DEVICE_ID_WILDCARD),device.device_id.upper()):
+			return
+		if device.debug:
+			print('INFO:    FAKE DEVICE DISCOVER FROM %s' %(self.client_address[0]))
+		sock.sendto(hdhrDiscover.discoverReply(device.device_id,device.num_tuners),self.client_address)
+
+
+class DiscoverServer(socketserver.UDPServer):
+	allow_reuse_address = True
+
+	def __init__(self,address,device):
+		self.device = device
+		self.answering = True   ## Clear to simulate the device dropping off the network
+		socketserver.UDPServer.__init__(self,address,DiscoverHandler)
+
+
+class ControlServer(socketserver.ThreadingMixIn,socketserver.TCPServer):
+	allow_reuse_address = True
+	daemon_threads = True
+
+	def __init__(self,address,device):
+		self.device = device
+		socketserver.TCPServer.__init__(self,address,ControlHandler)
+
+
+def startFakeDevice(device,host='127.0.0.1',port=0):
+	## Start serving in a background thread; returns the server (server_address has the real port)
+	server = ControlServer((host,port),device)
+	thread = threading.Thread(target=server.serve_forever,name='fakeHDHR-control')
+	thread.daemon = True
+	thread.start()
+	return server
+
+
+def startFakeDiscover(device,host='127.0.0.1',port=0):
+	## Answer discover requests in a background thread; returns the server
+	server = DiscoverServer((host,port),device)
+	thread = threading.Thread(target=server.serve_forever,name='fakeHDHR-discover')
+	thread.daemon = True
+	thread.start()
+	return server
+
+
+def usage():
+	print('Usage:' , sys.argv[0] , '[options]')
+	print('Description: Simulated HDhomerun device for testing recordTV3.py')
+	print('')
+	print('Options:')
+	print('-h  --help			Show this helpful information')
+	print('-p  --port=[port]	Control port to listen on (default %d)' %(hdhrControl.HDHOMERUN_CONTROL_TCP_PORT))
+	print('-i  --id=[id]		Device ID to report (default 1052A5C2)')
+	print('-t  --tuners=[n]	Number of tuners (default 2)')
+	print('-b  --bitrate=[bps]	Bitrate of the synthetic stream (default %d)' %(DEFAULT_BITRATE))
+	print('-l  --loss=[fraction]	Fraction of stream datagrams to drop (default 0)')
+	print('-o  --outage=[at:secs]	Drop off the network at seconds after start for secs seconds (may be repeated)')
+	print('-s  --stall=[at]	Stop streaming at seconds after start until the target is set again (may be repeated)')
+	print('-r  --repack=[at:virtual:rf[:program]]	Move a station to another RF channel at seconds after start (may be repeated)')
+	print('-d  --debug[=level]	print debug info')
+	print('')
+
+
+if __name__ == '__main__':
+	port = hdhrControl.HDHOMERUN_CONTROL_TCP_PORT
+	device_id = '1052A5C2'
+	num_tuners = 2
+	bitrate = DEFAULT_BITRATE
+	loss = 0.0
+	outages = []
+	stalls = []
+	repacks = []
+	debug = 0
+
+	try:
+		opts, args = getopt.getopt(sys.argv[1:], 'hp:i:t:b:l:o:s:r:d:', ['help', 'port=', 'id=', 'tuners=', 'bitrate=', 'loss=', 'outage=', 'stall=', 'repack=', 'debug='])
+	except getopt.GetoptError as err:
+		print(str(err))
+		usage()
+		sys.exit(2)
+
+	for opt, arg in opts:
+		if opt in ('-h', '--help'):
+			usage()
+			sys.exit()
+		elif opt in ('-p', '--port'):
+			port = int(arg)
+		elif opt in ('-i', '--id'):
+			device_id = arg
+		elif opt in ('-t', '--tuners'):
+			num_tuners = int(arg)
+		elif opt in ('-b', '--bitrate'):
+			bitrate = int(arg)
+		elif opt in ('-l', '--loss'):
+			loss = float(arg)
+		elif opt in ('-o', '--outage'):
+			at,seconds = arg.split(':')
+			outages.append((float(at),float(seconds)))
+		elif opt in ('-s', '--stall'):
+			stalls.append(float(arg))
+		elif opt in ('-r', '--repack'):
+			fields = arg.split(':')
+			repacks.append((float(fields[0]),fields[1],int(fields[2]),int(fields[3]) if len(fields) > 3 else None))
+		elif opt in ('-d', '--debug'):
+			debug = int(arg)
+		else:
+			assert False, 'unhandled option'
+
+	device = FakeDevice(device_id,num_tuners,debug,bitrate,loss)
+	server = ControlServer(('0.0.0.0',port),device)
+	startFakeDiscover(device,'0.0.0.0',port)
+	for at,seconds in outages:
+		timer = threading.Timer(at,device.outage,(seconds,))
+		timer.daemon = True
+		timer.start()
+	for at in stalls:
+		timer = threading.Timer(at,device.stall)
+		timer.daemon = True
+		timer.start()
+	for at,virtual,rf,program in repacks:
+		timer = threading.Timer(at,device.repack,(virtual,rf,program))
+		timer.daemon = True
+		timer.start()
+	print('INFO:    FAKE HD HOMERUN DEVICE %s LISTENING ON PORT %d' %(device_id,port))
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+##########################################################################
+##
+##  Stand-in for the hdhomerun_config command line tool
+##
+##  Goals:
+##                      Let the recorder's CFG_OS_cmd paths (discover,
+##                      set, save) run against fakeHDHR.py on a machine
+##                      without libhdhomerun, using the same native
+##                      control and discovery code as the recorder
+##
+##                      Understand just the commands recordTV3.py runs,
+##                      with the same output and exit status
+##
+##  The device is found with a discover request sent to $HDHR_TARGET
+##  (default: broadcast) on port $HDHR_PORT (default 65001), which is
+##  also the control port used.
+##
+##  Usage:
+##                      fakeHDHRConfig.py discover
+##                      fakeHDHRConfig.py <id|ip> [key <lockkey>] get <item>
+##                      fakeHDHRConfig.py <id|ip> [key <lockkey>] set <item> <value>
+##                      fakeHDHRConfig.py <id|ip> [key <lockkey>] save /tunerN <file|->
+##
+##########################################################################
+import os
+import sys
+import signal
+import socket
+
+import hdhrControl
+import hdhrDiscover
+
+HDHR_TARGET = os.environ.get('HDHR_TARGET',hdhrDiscover.BROADCAST_TARGET)
+HDHR_PORT   = int(os.environ.get('HDHR_PORT',hdhrDiscover.HDHOMERUN_DISCOVER_UDP_PORT))
+
+
+def findDevice(device):
+	## (device_id,ip) of a device given by ID or IP address, or None
+	if '.' in device:
+		return ('FFFFFFFF',device)
+	cache = hdhrDiscover.DiscoveryCache(HDHR_TARGET,HDHR_PORT)
+	device_id = device.upper()
+	replies = cache.exchange([(device_id,hdhrDiscover.discoverRequest(device_id),(HDHR_TARGET,HDHR_PORT))],hdhrDiscover.DISCOVER_TIMEOUT,set([device_id]))
+	if device_id not in replies:
+		return None
+	return (device_id,replies[device_id][0])
+
+
+def save(control,tuner,filename,lockkey):
+	## Point the tuner at a local socket and append whatever arrives to filename ('-' = stdout) until killed
+	sock = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+	sock.bind(('',0))
+	control.set('%s/target' %(tuner),'udp://%s:%d' %(control.localAddress(),sock.getsockname()[1]),lockkey)
+	signal.signal(signal.SIGTERM,lambda signum,frame: sys.exit(0))
+	with (os.fdopen(os.dup(sys.stdout.fileno()),'wb',0) if filename == '-' else open(filename,'ab')) as fptr:
+		try:
+			while True:
+				fptr.write(sock.recv(65536))
+		except KeyboardInterrupt:
+			pass
+		finally:
+			try:
+				control.set('%s/target' %(tuner),'none',lockkey)
+			except (hdhrControl.HDHRError,OSError,ConnectionError):
+				pass
+
+
+def run(args):
+	if args == ['discover']:
+		cache = hdhrDiscover.DiscoveryCache(HDHR_TARGET,HDHR_PORT)
+		found = cache.discover()
+		if not found:
+			print('no devices found')
+		for device_id in sorted(found):
+			print('hdhomerun device %s found at %s' %(device_id,cache.devices[device_id]['ip']))
+		return 0
+
+	if len(args) < 3:
+		print('invalid command')
+		return 1
+	device = findDevice(args[0])
+	if not device:
+		print('unable to connect to device')
+		return 1
+	args = args[1:]
+	lockkey = None
+	if args[0] == 'key' and len(args) > 2:
+		lockkey = args[1]
+		args = args[2:]
+
+	control = hdhrControl.HDHRControl(device[0],device[1],HDHR_PORT)
+	try:
+		if args[0] == 'get' and len(args) == 2:
+			print(control.get(args[1]))
+		elif args[0] == 'set' and len(args) == 3:
+			value = args[2]
+			if args[1].endswith('/lockkey') and value != 'none':
+				value = hdhrControl.lockkeyValue(value)
+			control.set(args[1],value,lockkey)
+		elif args[0] == 'save' and len(args) == 3:
+			save(control,args[1],args[2],lockkey)
+		else:
+			print('invalid command')
+			return 1
+	except hdhrControl.HDHRError as diag:
+		print(str(diag))
+		return 1
+	except (OSError,ConnectionError) as diag:
+		print('communication error sending request to hdhomerun device (%s)' %(diag))
+		return 1
+	finally:
+		control.close()
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(run(sys.argv[1:]))
@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+##########################################################################
+##
+##  In-process MPEG-TS capture engine
+##
+##  Goals:
+##                      Receive the UDP transport stream the HDhomerun
+##                      sends to a stream target and write it to disk
+##                      without a hdhomerun_config child per recording
+##
+##                      One thread services every active stream; each
+##                      stream receives straight into a preallocated
+##                      buffer (recv_into a memoryview) which is written
+##                      out in large batches
+##
+##                      Byte/packet counters per stream so the main loop
+##                      can check health without stat-ing the NAS, and the
+##                      time data first arrived after a (re)start so the
+##                      gap of a hot restart can be measured
+##
+##                      Optionally run every batch through a TSAnalyzer
+##                      before it is written, so damaged streams are
+##                      noticed while they are being recorded
+##
+##                      A MuxStream receives a tuner's whole multiplex and
+##                      demuxes several programs into their own files, so
+##                      shows on the same RF channel share one tuner;
+##                      each program can keep just some of its streams
+##                      (a tsDemux.pidFilter), so less is written to disk
+##
+##                      A MuxStream can also keep the last few minutes of
+##                      its multiplex in a timeshift.RingBuffer, so a
+##                      program added later can start from before it was
+##                      added
+##
+##                      Files are written by a diskWriter.RecordingWriter,
+##                      which preallocates, coalesces, keeps recordings
+##                      out of the page cache and syncs per its WritePolicy
+##
+##########################################################################
+import socket
+import selectors
+import threading
+import time
+
+import tsDemux
+import diskWriter
+
+TS_PACKET_SIZE   = 188
+CAPTURE_BUF_SIZE = 1024 * 1024   ## Per-stream buffer; written to disk when it gets close to full
+MAX_DATAGRAM     = 8192          ## Headroom kept free so a single recv_into can never truncate
+FLUSH_INTERVAL   = 1.0           ## Write out a partial buffer after this many seconds
+SOCKET_RCVBUF    = 2 * 1024 * 1024
+RTP_HEADER_SIZE  = 12
+
+
+class CaptureStream(object):
+	"""One transport stream being received on a UDP socket and written to a file
+
+	Looks enough like a subprocess.Popen handle (kill/poll/pid) that the
+	recorder can treat it the same way as a hdhomerun_config child."""
+
+	def __init__(self,engine,filename,bind_ip='',rtp=False,analyzer=None,expected_bytes=0,policy=None,port=0):
+		## port: bind a particular port, e.g. the one a tuner is still streaming to after a crash
+		self.engine = engine
+		self.filename = filename
+		self.rtp = rtp
+		self.analyzer = analyzer
+		self.pid = -1
+
+		self.sock = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+		try:
+			self.sock.setsockopt(socket.SOL_SOCKET,socket.SO_RCVBUF,SOCKET_RCVBUF)
+		except OSError:
+			pass
+		self.sock.bind((bind_ip,port))
+		self.sock.setblocking(False)
+		self.port = self.sock.getsockname()[1]
+
+		self.writer = diskWriter.RecordingWriter(filename,expected_bytes,policy) if filename else None
+		self.buf = bytearray(CAPTURE_BUF_SIZE)
+		self.view = memoryview(self.buf)
+		self.fill = 0
+		self.limit = CAPTURE_BUF_SIZE - MAX_DATAGRAM
+
+		self.bytes = 0
+		self.packets = 0
+		self.datagrams = 0
+		self.writes = 0
+		self.write_errors = 0
+		self.started = time.time()
+		self.lastData = 0
+		self.firstData = None
+		self.lastFlush = time.time()
+		self.returncode = None
+
+	def receive(self):
+		## Drain everything queued on the socket into the buffer
+		sock = self.sock
+		view = self.view
+		got_data = False
+		while True:
+			try:
+				n = sock.recv_into(view[self.fill:])
+			except (BlockingIOError,InterruptedError):
+				break
+			except OSError:
+				break
+			if n <= 0:
+				break
+			if self.rtp and n > RTP_HEADER_SIZE:
+				## Drop the RTP header by sliding the payload down over it
+				view[self.fill:self.fill + n - RTP_HEADER_SIZE] = view[self.fill + RTP_HEADER_SIZE:self.fill + n]
+				n -= RTP_HEADER_SIZE
+			self.fill += n
+			self.datagrams += 1
+			got_data = True
+			if self.fill >= self.limit:
+				self.flush()
+		if got_data:
+			self.lastData = time.time()
+			if self.firstData is None:
+				self.firstData = self.lastData
+
+	def flush(self):
+		if not self.fill:
+			return
+		if self.analyzer:
+			self.analyzer.feed(self.view[:self.fill])
+		try:
+			self.writer.write(self.view[:self.fill])
+			self.writes += 1
+		except OSError:
+			self.write_errors += 1
+		self.bytes += self.fill
+		self.packets = self.bytes // TS_PACKET_SIZE
+		self.fill = 0
+		self.lastFlush = time.time()
+
+	def close(self):
+		self.flush()
+		try:
+			self.sock.close()
+		except OSError:
+			pass
+		try:
+			if self.writer:
+				self.writer.close()
+		except OSError:
+			self.write_errors += 1
+		self.returncode = 0
+
+	def counters(self):
+		## Received bytes include whatever is still sitting in the buffer
+		return {'bytes':self.bytes + self.fill,'packets':(self.bytes + self.fill) // TS_PACKET_SIZE,\
+			'datagrams':self.datagrams,'writes':self.writes,'write_errors':self.write_errors,'lastData':self.lastData,\
+			'firstData':self.firstData}
+
+	def markRestart(self):
+		## The tuner is about to be told to stream again; firstData will say when it did
+		self.firstData = None
+
+	def poll(self):
+		return self.returncode
+
+	def kill(self):
+		self.engine.removeStream(self)
+
+	terminate = kill
+
+
+class ProgramOutput(object):
+	"""One program of a MuxStream being written to its own file; the handle the
+	recorder keeps for a demuxed recording"""
+
+	def __init__(self,mux,program,filename,analyzer=None,expected_bytes=0,policy=None):
+		self.mux = mux
+		self.program = program
+		self.filename = filename
+		self.analyzer = analyzer
+		self.pid = -1
+		self.writer = diskWriter.RecordingWriter(filename,expected_bytes,policy)
+		self.bytes = 0
+		self.writes = 0
+		self.write_errors = 0
+		self.lastData = 0
+		self.firstData = None
+		self.backfill = 0.0        ## Seconds of stream taken from the mux's timeshift buffer at the start
+		self.returncode = None
+
+	def write(self,data):
+		## Called by the demuxer from the capture thread
+		if self.analyzer:
+			self.analyzer.feed(data)
+		try:
+			self.writer.write(data)
+			self.writes += 1
+		except OSError:
+			self.write_errors += 1
+		self.bytes += len(data)
+		self.lastData = time.time()
+		if self.firstData is None:
+			self.firstData = self.lastData
+
+	def close(self):
+		try:
+			self.writer.close()
+		except OSError:
+			self.write_errors += 1
+		self.returncode = 0
+
+	def counters(self):
+		return {'bytes':self.bytes,'packets':self.bytes // TS_PACKET_SIZE,'datagrams':self.mux.datagrams,\
+			'writes':self.writes,'write_errors':self.write_errors,'lastData':self.lastData,'firstData':self.firstData}
+
+	def poll(self):
+		return self.returncode
+
+	def kill(self):
+		self.mux.removeProgram(self)
+
+	terminate = kill
+
+
+class MuxStream(CaptureStream):
+	"""A whole multiplex received on one UDP socket and demuxed into a ProgramOutput per
+	program.  Programs can be added and removed while it runs; it closes itself when
+	the last one is removed, unless it keeps a timeshift ring (then it runs until it
+	is killed)."""
+
+	def __init__(self,engine,bind_ip='',rtp=False,port=0,ring=None,demux=None):
+		## demux: a TSDemux (subclass) to use, e.g. one that also collects the channel lineup
+		CaptureStream.__init__(self,engine,None,bind_ip,rtp,port=port)
+		self.demux = demux or tsDemux.TSDemux()
+		self.outputs = {}
+		self.ring = ring
+		self.lock = threading.RLock()
+
+	def addProgram(self,program,filename,analyzer=None,expected_bytes=0,policy=None,since=None,keep=None):
+		## since: start the output with what the ring still holds of the stream from this time on;
+		## keep: a tsDemux.pidFilter() of the streams to write (None = all of them)
+		output = ProgramOutput(self,program,filename,analyzer,expected_bytes,policy)
+		backlog = None
+		if since is not None and self.ring:
+			## Most of the backlog is demuxed here while the capture thread goes on; only what it
+			## flushes in the meantime is caught up on under the lock, right before the output
+			## joins the live demux (which carries on exactly where the ring left off)
+			start,arrived = self.ring.find(since)
+			if arrived is not None:
+				backlog = tsDemux.TSDemux(self.demux.use_numpy)
+				backlog.addProgram(program,output,keep=keep)
+				end = self.ring.total
+				for piece in self.ring.read(start,end):
+					backlog.feed(piece)
+				output.backfill = max(0.0,time.time() - arrived)
+		with self.lock:
+			if backlog:
+				self.flush()
+				for piece in self.ring.read(end,self.ring.total):
+					backlog.feed(piece)
+			self.outputs[program] = output
+			self.demux.addProgram(program,output,backlog,keep)
+		return output
+
+	def removeProgram(self,output):
+		with self.lock:
+			if self.outputs.get(output.program) is not output:
+				return
+			self.flush()
+			self.demux.removeProgram(output.program)
+			del(self.outputs[output.program])
+			last = not self.outputs and not self.ring
+			output.close()
+		if last:
+			self.engine.removeStream(self)
+
+	def users(self):
+		with self.lock:
+			return len(self.outputs)
+
+	def markRestart(self):
+		with self.lock:
+			CaptureStream.markRestart(self)
+			for output in self.outputs.values():
+				output.firstData = None
+
+	def receive(self):
+		with self.lock:
+			CaptureStream.receive(self)
+
+	def close(self):
+		CaptureStream.close(self)
+		if self.ring:
+			self.ring.close()
+
+	def flush(self):
+		with self.lock:
+			if not self.fill:
+				return
+			if self.ring:
+				self.ring.write(self.view[:self.fill])
+			self.demux.feed(self.view[:self.fill])
+			self.writes += 1
+			self.bytes += self.fill
+			self.packets = self.bytes // TS_PACKET_SIZE
+			self.fill = 0
+			self.lastFlush = time.time()
+
+
+class CaptureEngine(object):
+	"""Services every CaptureStream from a single background thread"""
+
+	def __init__(self):
+		self.selector = selectors.DefaultSelector()
+		self.lock = threading.Lock()
+		self.streams = []
+		self.pending_add = []
+		self.pending_remove = []
+		self.wake_r,self.wake_w = socket.socketpair()
+		self.wake_r.setblocking(False)
+		self.selector.register(self.wake_r,selectors.EVENT_READ,None)
+		self.cpu_time = 0.0
+		self.running = True
+		self.thread = threading.Thread(target=self.run,name='capture-engine')
+		self.thread.daemon = True
+		self.thread.start()
+
+	def openStream(self,filename,bind_ip='',rtp=False,analyzer=None,expected_bytes=0,policy=None,port=0):
+		stream = CaptureStream(self,filename,bind_ip,rtp,analyzer,expected_bytes,policy,port)
+		with self.lock:
+			self.pending_add.append(stream)
+		self.wake()
+		return stream
+
+	def openMux(self,bind_ip='',rtp=False,port=0,ring=None,demux=None):
+		stream = MuxStream(self,bind_ip,rtp,port,ring,demux)
+		with self.lock:
+			self.pending_add.append(stream)
+		self.wake()
+		return stream
+
+	def removeStream(self,stream,wait=True):
+		done = threading.Event()
+		with self.lock:
+			self.pending_remove.append((stream,done))
+		self.wake()
+		if wait and threading.current_thread() is not self.thread:
+			done.wait(5)
+
+	def wake(self):
+		try:
+			self.wake_w.send(b'x')
+		except OSError:
+			pass
+
+	def stats(self):
+		with self.lock:
+			return dict((stream.filename,stream.counters()) for stream in self.streams)
+
+	def applyPending(self):
+		with self.lock:
+			adds,self.pending_add = self.pending_add,[]
+			removes,self.pending_remove = self.pending_remove,[]
+		for stream in adds:
+			self.selector.register(stream.sock,selectors.EVENT_READ,stream)
+			with self.lock:
+				self.streams.append(stream)
+		for stream,done in removes:
+			if stream in self.streams:
+				stream.receive()
+				self.selector.unregister(stream.sock)
+				with self.lock:
+					self.streams.remove(stream)
+			stream.close()
+			done.set()
+
+	def run(self):
+		while self.running:
+			events = self.selector.select(FLUSH_INTERVAL / 2)
+			for key,mask in events:
+				if key.data is None:
+					try:
+						while self.wake_r.recv(512):
+							pass
+					except (BlockingIOError,InterruptedError):
+						pass
+					self.applyPending()
+				else:
+					key.data.receive()
+
+			## Keep files growing even when the buffer is not full
+			now = time.time()
+			for stream in self.streams:
+				if stream.fill and now - stream.lastFlush >= FLUSH_INTERVAL:
+					stream.flush()
+			self.cpu_time = time.thread_time()
+
+	def shutdown(self):
+		with self.lock:
+			streams = list(self.streams) + list(self.pending_add)
+		for stream in streams:
+			self.removeStream(stream)
+		self.running = False
+		self.wake()
+		self.thread.join(2)
+		if not self.thread.is_alive():
+			self.selector.close()
+			self.wake_r.close()
+			self.wake_w.close()
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def getEngine():
+	global _engine
+	with _engine_lock:
+		if not _engine:
+			_engine = CaptureEngine()
+		return _engine
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+##########################################################################
+##
+##  Native client for the HDHomeRun TCP control protocol
+##
+##  Goals:
+##                      Get/set device variables (channel, program,
+##                      lockkey, target, ...) without forking a copy of
+##                      hdhomerun_config for every command
+##
+##                      Keep one persistent connection per device so a
+##                      tune costs a few small round trips instead of
+##                      three process start-ups
+##
+##  Packet format (all integers big endian except the CRC):
+##
+##      [type:2][payload length:2][payload][crc32:4 little endian]
+##
+##  The payload is a list of tag/length/value items.  Lengths below 128
+##  use a single byte; longer lengths use two bytes, low 7 bits first
+##  with the high bit set on the first byte.
+##
+##########################################################################
+import re
+import socket
+import struct
+import threading
+import zlib
+
+HDHOMERUN_CONTROL_TCP_PORT = 65001
+
+HDHOMERUN_TYPE_DISCOVER_REQ = 0x0002
+HDHOMERUN_TYPE_DISCOVER_RPY = 0x0003
+HDHOMERUN_TYPE_GETSET_REQ   = 0x0004
+HDHOMERUN_TYPE_GETSET_RPY   = 0x0005
+
+HDHOMERUN_TAG_DEVICE_TYPE   = 0x01
+HDHOMERUN_TAG_DEVICE_ID     = 0x02
+HDHOMERUN_TAG_GETSET_NAME   = 0x03
+HDHOMERUN_TAG_GETSET_VALUE  = 0x04
+HDHOMERUN_TAG_ERROR_MESSAGE = 0x05
+HDHOMERUN_TAG_TUNER_COUNT   = 0x10
+HDHOMERUN_TAG_GETSET_LOCKKEY = 0x15
+
+HDHOMERUN_DEVICE_TYPE_WILDCARD = 0xFFFFFFFF
+HDHOMERUN_DEVICE_TYPE_TUNER    = 0x00000001
+HDHOMERUN_DEVICE_ID_WILDCARD   = 0xFFFFFFFF
+
+CONTROL_TIMEOUT = 2.5  ## Seconds to wait for a reply before giving up on the connection
+
+
+class HDHRError(Exception):
+	"""The device answered a request with an error message"""
+	pass
+
+
+def lockkeyValue(lockkey):
+	## hdhomerun_config turns the key argument into a number with strtoul(),
+	## so only the leading digits of CFG_LOCKKEY are ever sent to the device.
+	## Do exactly the same so a tuner locked by one path can be used/released
+	## by the other.
+	if lockkey is None:
+		return 0
+	if isinstance(lockkey,int):
+		return lockkey & 0xFFFFFFFF
+	match = re.match(r'\s*(\d+)',str(lockkey))
+	if not match:
+		return 0
+	return int(match.group(1)) & 0xFFFFFFFF
+
+
+def encodeTLV(tag,value):
+	if isinstance(value,str):
+		value = value.encode('utf-8') + b'\x00'
+	length = len(value)
+	if length < 128:
+		header = struct.pack('>BB',tag,length)
+	else:
+		header = struct.pack('>BBB',tag,(length & 0x7F) | 0x80,length >> 7)
+	return header + value
+
+
+def decodeTLVs(payload):
+	tags = {}
+	pos = 0
+	end = len(payload)
+	while pos + 2 <= end:
+		tag = payload[pos]
+		length = payload[pos + 1]
+		pos += 2
+		if length & 0x80:
+			if pos >= end:
+				break
+			length = (length & 0x7F) | (payload[pos] << 7)
+			pos += 1
+		if pos + length > end:
+			break
+		tags[tag] = bytes(payload[pos:pos + length])
+		pos += length
+	return tags
+
+
+def tagString(value):
+	return value.rstrip(b'\x00').decode('utf-8','replace')
+
+
+def buildPacket(packet_type,payload):
+	frame = struct.pack('>HH',packet_type,len(payload)) + payload
+	return frame + struct.pack('<I',zlib.crc32(frame) & 0xFFFFFFFF)
+
+
+def parsePacket(frame):
+	## Returns (type,payload) or None if the frame is short or the CRC is bad
+	if len(frame) < 8:
+		return None
+	packet_type,length = struct.unpack('>HH',frame[:4])
+	if len(frame) != length + 8:
+		return None
+	crc = struct.unpack('<I',frame[-4:])[0]
+	if zlib.crc32(frame[:-4]) & 0xFFFFFFFF != crc:
+		return None
+	return (packet_type,frame[4:-4])
+
+
+def recvPacket(sock):
+	header = recvExactly(sock,4)
+	length = struct.unpack('>H',header[2:4])[0]
+	body = recvExactly(sock,length + 4)
+	return parsePacket(header + body)
+
+
+def recvExactly(sock,count):
+	buf = bytearray(count)
+	view = memoryview(buf)
+	got = 0
+	while got < count:
+		n = sock.recv_into(view[got:])
+		if n == 0:
+			raise ConnectionError('connection closed by device')
+		got += n
+	return bytes(buf)
+
+
+class HDHRControl(object):
+	"""Persistent control connection to a single HDHomeRun device"""
+
+	def __init__(self,device_id,ip,port=HDHOMERUN_CONTROL_TCP_PORT,timeout=CONTROL_TIMEOUT):
+		self.device_id = device_id
+		self.ip = ip
+		self.port = port
+		self.timeout = timeout
+		self.sock = None
+		self.lock = threading.Lock()
+
+	def connect(self):
+		sock = socket.create_connection((self.ip,self.port),self.timeout)
+		sock.setsockopt(socket.IPPROTO_TCP,socket.TCP_NODELAY,1)
+		self.sock = sock
+
+	def close(self):
+		if self.sock:
+			try:
+				self.sock.close()
+			except OSError:
+				pass
+		self.sock = None
+
+	def localAddress(self):
+		## The address the device sees us as; used to point stream targets back at us
+		with self.lock:
+			if not self.sock:
+				self.connect()
+			return self.sock.getsockname()[0]
+
+	def getset(self,name,value=None,lockkey=None):
+		payload = encodeTLV(HDHOMERUN_TAG_GETSET_NAME,name)
+		if value is not None:
+			payload += encodeTLV(HDHOMERUN_TAG_GETSET_VALUE,str(value))
+			key = lockkeyValue(lockkey)
+			if key:
+				payload += encodeTLV(HDHOMERUN_TAG_GETSET_LOCKKEY,struct.pack('>I',key))
+		request = buildPacket(HDHOMERUN_TYPE_GETSET_REQ,payload)
+
+		with self.lock:
+			## A stale connection (device rebooted, idle timeout) gets one retry on a fresh socket
+			for attempt in range(2):
+				try:
+					if not self.sock:
+						self.connect()
+					self.sock.sendall(request)
+					reply = recvPacket(self.sock)
+					break
+				except (OSError,ConnectionError):
+					self.close()
+					if attempt:
+						raise
+			if not reply or reply[0] != HDHOMERUN_TYPE_GETSET_RPY:
+				self.close()
+				raise ConnectionError('invalid reply from device %s' %(self.device_id))
+
+		tags = decodeTLVs(reply[1])
+		if HDHOMERUN_TAG_ERROR_MESSAGE in tags:
+			raise HDHRError(tagString(tags[HDHOMERUN_TAG_ERROR_MESSAGE]))
+		return tagString(tags.get(HDHOMERUN_TAG_GETSET_VALUE,b''))
+
+	def get(self,name):
+		return self.getset(name)
+
+	def set(self,name,value,lockkey=None):
+		return self.getset(name,value,lockkey)
+
+
+#################################################################
+## Connection pool: one persistent connection per device
+#################################################################
+_pool = {}
+_pool_lock = threading.Lock()
+
+def getControl(device_id,ip,port=HDHOMERUN_CONTROL_TCP_PORT):
+	with _pool_lock:
+		control = _pool.get(device_id)
+		if control and (control.ip != ip or control.port != port):
+			## Device moved to a new address; drop the old connection
+			control.close()
+			control = None
+		if not control:
+			control = HDHRControl(device_id,ip,port)
+			_pool[device_id] = control
+		return control
+
+
+def closeControl(device_id):
+	with _pool_lock:
+		control = _pool.pop(device_id,None)
+	if control:
+		control.close()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+##########################################################################
+##
+##  Native HDHomeRun discovery and device liveness tracking
+##
+##  Goals:
+##                      Find devices with the UDP discover request that
+##                      hdhomerun_config broadcasts, without forking it
+##
+##                      Remember what was found (device ID -> IP, tuner
+##                      count, last seen) and check that known devices are
+##                      still alive with a single unicast request each
+##                      instead of broadcasting again
+##
+##                      Back off exponentially while a device is missing
+##                      so an outage is noticed within seconds but a dead
+##                      device isn't hammered
+##
+##  Usage:
+##                      hdhrDiscover.py [target_ip]
+##
+##########################################################################
+import sys
+import socket
+import select
+import struct
+import time
+
+import hdhrControl
+
+HDHOMERUN_DISCOVER_UDP_PORT = 65001
+BROADCAST_TARGET  = '255.255.255.255'
+
+DISCOVER_TIMEOUT  = 1.0    ## Seconds to collect replies to a broadcast
+PROBE_TIMEOUT     = 0.5    ## Seconds to wait for a unicast probe reply (sent twice)
+OUTAGE_MIN_DELAY  = 2.0    ## First re-check after a device goes missing
+OUTAGE_MAX_DELAY  = 60.0   ## Back-off limit while it stays missing
+REDISCOVER_TIME   = 300.0  ## Broadcast this often anyway to pick up new devices / address changes
+
+
+def discoverRequest(device_id=None):
+	payload = hdhrControl.encodeTLV(hdhrControl.HDHOMERUN_TAG_DEVICE_TYPE,struct.pack('>I',hdhrControl.HDHOMERUN_DEVICE_TYPE_TUNER))
+	device = hdhrControl.HDHOMERUN_DEVICE_ID_WILDCARD if device_id is None else int(device_id,16)
+	payload += hdhrControl.encodeTLV(hdhrControl.HDHOMERUN_TAG_DEVICE_ID,struct.pack('>I',device))
+	return hdhrControl.buildPacket(hdhrControl.HDHOMERUN_TYPE_DISCOVER_REQ,payload)
+
+
+def discoverReply(device_id,num_tuners):
+	payload = hdhrControl.encodeTLV(hdhrControl.HDHOMERUN_TAG_DEVICE_TYPE,struct.pack('>I',hdhrControl.HDHOMERUN_DEVICE_TYPE_TUNER))
+	payload += hdhrControl.encodeTLV(hdhrControl.HDHOMERUN_TAG_DEVICE_ID,struct.pack('>I',int(device_id,16)))
+	payload += hdhrControl.encodeTLV(hdhrControl.HDHOMERUN_TAG_TUNER_COUNT,bytes([num_tuners]))
+	return hdhrControl.buildPacket(hdhrControl.HDHOMERUN_TYPE_DISCOVER_RPY,payload)
+
+
+def parseRequest(frame):
+	## Device ID asked for ('FFFFFFFF' = any) of a discover request, or None if it isn't one
+	packet = hdhrControl.parsePacket(frame)
+	if not packet or packet[0] != hdhrControl.HDHOMERUN_TYPE_DISCOVER_REQ:
+		return None
+	tags = hdhrControl.decodeTLVs(packet[1])
+	value = tags.get(hdhrControl.HDHOMERUN_TAG_DEVICE_ID,struct.pack('>I',hdhrControl.HDHOMERUN_DEVICE_ID_WILDCARD))
+	return '%08X' %(struct.unpack('>I',value)[0])
+
+
+def parseReply(frame):
+	## (device_id,num_tuners) of a discover reply, or None
+	packet = hdhrControl.parsePacket(frame)
+	if not packet or packet[0] != hdhrControl.HDHOMERUN_TYPE_DISCOVER_RPY:
+		return None
+	tags = hdhrControl.decodeTLVs(packet[1])
+	if hdhrControl.HDHOMERUN_TAG_DEVICE_ID not in tags:
+		return None
+	device_id = '%08X' %(struct.unpack('>I',tags[hdhrControl.HDHOMERUN_TAG_DEVICE_ID])[0])
+	num_tuners = tags.get(hdhrControl.HDHOMERUN_TAG_TUNER_COUNT,b'\x00')[0]
+	return (device_id,num_tuners)
+
+
+class DiscoveryCache(object):
+	"""What is known about every device that has ever answered, and when to look again"""
+
+	def __init__(self,target=BROADCAST_TARGET,port=HDHOMERUN_DISCOVER_UDP_PORT):
+		self.target = target
+		self.port = port
+		self.devices = {}          ## device_id -> {'ip','tuners','lastSeen','failures'}
+		self.lastBroadcast = 0
+
+	def remember(self,device_id,ip=None,num_tuners=None):
+		entry = self.devices.setdefault(device_id,{'ip':None,'tuners':None,'lastSeen':0,'failures':0})
+		if ip:
+			entry['ip'] = ip
+		if num_tuners:
+			entry['tuners'] = num_tuners
+		return entry
+
+	def exchange(self,requests,timeout,wanted=None):
+		## Send every (device_id,request,address), again at half the timeout to the devices
+		## that haven't answered, and collect replies until the timeout or until every wanted
+		## device answered.  Returns device_id -> (ip,num_tuners).
+		replies = {}
+		sock = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+		try:
+			sock.setsockopt(socket.SOL_SOCKET,socket.SO_BROADCAST,1)
+			start = time.time()
+			for attempt in range(2):
+				for device_id,request,address in requests:
+					if device_id not in replies:
+						try:
+							sock.sendto(request,address)
+						except OSError:
+							pass
+				deadline = start + timeout * (attempt + 1) / 2
+				while not (wanted and wanted <= set(replies)):
+					remaining = deadline - time.time()
+					if remaining <= 0 or not select.select([sock],[],[],remaining)[0]:
+						break
+					try:
+						frame,address = sock.recvfrom(2048)
+					except OSError:
+						continue
+					reply = parseReply(frame)
+					if reply:
+						replies[reply[0]] = (address[0],reply[1])
+				if wanted and wanted <= set(replies):
+					break
+		finally:
+			sock.close()
+		return replies
+
+	def record(self,replies,now):
+		for device_id,(ip,num_tuners) in replies.items():
+			entry = self.remember(device_id,ip,num_tuners)
+			entry['lastSeen'] = now
+			entry['failures'] = 0
+
+	def discover(self,timeout=DISCOVER_TIMEOUT):
+		## Broadcast for every device on the network; returns the IDs that answered
+		now = time.time()
+		self.lastBroadcast = now
+		replies = self.exchange([(None,discoverRequest(),(self.target,self.port))],timeout)
+		self.record(replies,now)
+		return set(replies)
+
+	def probe(self,device_ids,timeout=PROBE_TIMEOUT):
+		## One unicast discover request per known device; returns the IDs that answered
+		requests = []
+		for device_id in device_ids:
+			entry = self.devices.get(device_id)
+			if entry and entry['ip']:
+				requests.append((device_id,discoverRequest(device_id),(entry['ip'],self.port)))
+		if not requests:
+			return set()
+		now = time.time()
+		replies = self.exchange(requests,timeout,set(device_ids))
+		replies = dict((device_id,replies[device_id]) for device_id in replies if device_id in device_ids)
+		self.record(replies,now)
+		return set(replies)
+
+	def check(self,device_ids,find_new=False):
+		#################################################################
+		## Which of device_ids are alive?  Known devices are probed by
+		## unicast; only if one is missing (its address may have changed)
+		## or a periodic look for new devices is due does it broadcast.
+		## With find_new, other devices that answered are included.
+		#################################################################
+		device_ids = set(device_ids)
+		alive = self.probe(device_ids)
+		missing = device_ids - alive
+		if missing or (find_new and time.time() - self.lastBroadcast >= REDISCOVER_TIME):
+			found = self.discover()
+			alive |= found if find_new else found & device_ids
+		for device_id in missing - alive:
+			self.remember(device_id)['failures'] += 1
+		return alive
+
+	def retryDelay(self,device_id):
+		## Seconds until a missing device should be looked for again
+		failures = self.devices.get(device_id,{}).get('failures',0)
+		if not failures:
+			return OUTAGE_MIN_DELAY
+		return min(OUTAGE_MIN_DELAY * (2 ** (failures - 1)),OUTAGE_MAX_DELAY)
+
+
+if __name__ == '__main__':
+	cache = DiscoveryCache(sys.argv[1] if len(sys.argv) > 1 else BROADCAST_TARGET)
+	start = time.time()
+	found = cache.discover()
+	if not found:
+		print('no devices found')
+	for device_id in sorted(found):
+		print('hdhomerun device %s found at %s (%d tuners)' %(device_id,cache.devices[device_id]['ip'],cache.devices[device_id]['tuners']))
+	if found:
+		start = time.time()
+		alive = cache.probe(found)
+		print('INFO:    PROBED %d DEVICES IN %.1f ms (%d ALIVE)' %(len(found),1000.0 * (time.time() - start),len(alive)))
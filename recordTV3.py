@@ -19,28 +19,142 @@
 ##
 ##                      Different levels of debug
 ##
+##                      Metrics (Prometheus text or JSON) on a local
+##                      HTTP port
+##
+##                      Journal of the run time state, so a recorder
+##                      restarted after a crash adopts the recordings
+##                      the last one left going
+##
+##                      Optionally keep idle tuners warm on the busiest
+##                      channels, buffering the last few minutes, so a
+##                      show's pre-roll comes out of the buffer instead
+##                      of costing tuner time
+##
+##                      Channel lineup (RF channel and program of every
+##                      virtual channel) from the stations' own PAT/PMT/
+##                      TVCT, cached on disk and re-checked in the
+##                      background for the channels about to be recorded
+##
+##                      Series rules matched against an XMLTV guide, so
+##                      shows are recorded when the guide says they air
+##
+##                      Optionally record only some of a program's
+##                      streams (video, audio in one language, ...), so
+##                      recordings and the writes to the NAS are smaller
+##
 ##########################################################################
 import os
 import sys
 import time
-import datetime
 import subprocess
 import getopt
-import stat
-import json
-import math
 import random
 import string
 import pprint
-
-CFG_HDHRID         = '1052A5C2'
-CFG_Num_Tuners     = 2
+import re
+import threading
+
+import hdhrControl
+import hdhrCapture
+import hdhrDiscover
+import eventScheduler
+import streamHealth
+import tsAnalyzer
+import tsDemux
+import configWatch
+import scheduleIndex
+import tunerPool
+import retention
+import recordingCatalog
+import diskWriter
+import recorderMetrics
+import stateJournal
+import timeshift
+import channelScan
+import xmltvGuide
+
+## HDhomerun devices to record from: device ID -> IP address (None = learn it from
+## 'hdhomerun_config discover') and number of tuners
+CFG_DEVICES        = {'1052A5C2':{'ip':None,'tuners':2}}
+CFG_Use_All_Devices = True  ## Add every other HDhomerun found by discover to the tuner pool too
+CFG_Num_Tuners     = 2     ## Tuner count assumed for discovered devices
+CFG_HDHRPort       = hdhrControl.HDHOMERUN_CONTROL_TCP_PORT
 CFG_Dev_Check_Time = 60  ## How often to check to make sure the HDhomerun device is still alive on the network
+CFG_Outage_Check_Time = 10  ## How often to look for a device that has dropped off the network (hdhomerun_config discover only)
+CFG_Probe_Time     = 5   ## How often to probe the devices with native discovery (one small UDP packet each)
 CFG_Rec_Check_Time = 15  ## How often to check to make sure an active recording is working
+CFG_Config_Check_Time = 10  ## How often to check whether the recording configuration file has changed
+CFG_Retry_Time     = 5   ## How long to wait before retrying a recording that failed to start
+CFG_Hot_Restart    = True  ## Restart a bad recording on the tuner it holds, appending to the same file, before giving the tuner up
+CFG_Max_Hot_Restarts = 3   ## Hot restarts in a row (without the recording turning healthy in between) before it is restarted from scratch
+CFG_Restart_Wait   = 2.0   ## Seconds to wait for the stream to come back after a hot restart
+CFG_Retention_Check_Time = 300  ## How often to expire old recordings and make sure the NAS isn't too full
+CFG_Max_Disk_Usage = 97  ## Oldest recordings are removed while the NAS is fuller than this (percent)
+CFG_RETENTION      = None  ## Index of the recordings on the NAS (started in main)
+CFG_Catalog_File   = recordingCatalog.DEFAULT_CATALOG  ## SQLite catalog of every recording (keep it off the NAS; WAL needs a local disk)
+CFG_CATALOG        = None  ## The catalog (opened in main)
+CFG_Journal_File   = stateJournal.DEFAULT_JOURNAL  ## Journal of active recordings and the lockkey (local disk, like the catalog)
+CFG_JOURNAL        = None  ## The journal (opened in main)
+CFG_CONFIG         = None  ## Watcher of the recording configuration file (set in main)
+CFG_RECORDINGS     = {}    ## Recording configuration plus the run time state of every recording
+CFG_HEALTH         = None  ## Background stream health monitor (started in main)
+CFG_SCHEDULE       = scheduleIndex.ScheduleIndex()  ## Compiled day/start/end rules of every recording
+CFG_POOL           = tunerPool.TunerPool()  ## Tuners of every device, and the plan for who records on which
 CFG_OS_cmd         = '/home/cmwilki/libhdhomerun/hdhomerun_config'
 CFG_Save_Dir       = '/mnt/nas/TV/'
+CFG_Native_Control = True  ## Talk the control protocol directly instead of forking CFG_OS_cmd (falls back to CFG_OS_cmd on failure)
+CFG_Native_Discovery = True  ## Find/probe devices with our own UDP discover requests instead of 'hdhomerun_config discover'
+CFG_Discover_Target = hdhrDiscover.BROADCAST_TARGET  ## Where discover requests are broadcast
+CFG_DISCOVERY      = hdhrDiscover.DiscoveryCache(CFG_Discover_Target)  ## Devices found so far and their outage back-off
+CFG_Native_Capture = True  ## Receive the stream in-process instead of running 'hdhomerun_config save' per recording
+CFG_Analyze_Live   = tsAnalyzer.HAVE_NUMPY  ## Check in-process captures for TS errors as they are written (needs NumPy to be cheap)
+CFG_Demux          = True  ## Tune whole multiplexes and demux programs in-process, so shows on one RF channel share a tuner
+CFG_PID_Filter     = None  ## Streams recordings keep, e.g. 'video,audio,eng' (see tsDemux.pidFilter; a channel's or recording's 'streams' overrides it; None = all)
+## How in-process captures write to the NAS: preallocate each recording, write in large aligned batches,
+## keep recordings out of the page cache, fdatasync only at close (fsync_interval=n syncs every n seconds)
+CFG_WRITE_POLICY   = diskWriter.WritePolicy(preallocate=True,batch_size=4 * 1024 * 1024,drop_cache=True,fsync_interval=0)
+CFG_Default_Bitrate = 19392658  ## bits/second assumed when preallocating a channel whose rate isn't known (a full ATSC multiplex)
+CFG_Metrics_Port   = 9143  ## Serve /metrics (Prometheus) and /metrics.json on this port (None = don't)
+CFG_Metrics_Bind   = '127.0.0.1'  ## Address the metrics server listens on ('' = every interface)
+CFG_METRICS        = recorderMetrics.Registry()  ## Everything the metrics server reports
+CFG_METRICS_SERVER = None  ## The metrics HTTP server (started in main)
+CFG_Timeshift      = False  ## Keep idle tuners streaming CFG_Warm_Channels into timeshift buffers (needs in-process capture and demuxing)
+CFG_Warm_Channels  = ['CBS','NBC']  ## Channels (CFG_CHANNELS names) to keep an idle tuner on, most wanted first; one tuner per RF channel
+CFG_Timeshift_MB   = None  ## Size of each warm tuner's buffer (None = enough for CFG_Pre_Roll of a full multiplex, about 190 MB for 60 s)
+CFG_Timeshift_Dir  = '/var/tmp'  ## Where the buffers live (local disk or tmpfs, never the NAS)
+CFG_Pre_Roll       = 60    ## Seconds before its start a recording begins when its channel is warm (a recording's 'pre_roll' overrides it)
+CFG_Warm_Retry_Time = 60   ## How long to leave a tuner alone after it failed to warm up
+CFG_WARM           = {}    ## tuner_id -> the warm tuner's MuxStream, channel and channel name
+CFG_WARM_FAILED    = {}    ## tuner_id -> when it last failed to warm up or to start a scan
+CFG_Lineup_File    = channelScan.DEFAULT_LINEUP  ## Channel lineup found by scanning (local disk, like the catalog)
+CFG_LINEUP         = None  ## The lineup (loaded in main); CFG_CHANNELS follows it
+CFG_Scan_Channels  = None  ## RF channels a full scan looks at (None = 2-36, the US band since the repack, and any RF in CFG_CHANNELS)
+CFG_Scan_Lock_Time = 1.5   ## Seconds to wait for anything at all from an RF channel before calling it empty
+CFG_Scan_Time      = 3.0   ## Seconds to wait for an RF channel's PAT, PMTs and TVCT once it is streaming
+CFG_Lineup_Check_Time = 6 * 3600  ## How often to re-check the RF channels of the recordings coming up ...
+CFG_Lineup_Horizon = 24 * 3600    ## ... that start within this long ...
+CFG_Lineup_Max_Age = 12 * 3600    ## ... and haven't been scanned for this long
+CFG_Scan_Guard     = 120   ## No background scan is started this close to a recording starting (one that needs the tuner ends it)
+CFG_SCANS          = {}    ## tuner_id -> the scan running on it
+CFG_SCAN_QUEUE     = []    ## (rf,full) waiting for a tuner to scan them; full = part of a full scan
+CFG_LOST           = set() ## Configured channels a full scan has already looked for
+TIMESHIFT_JOURNAL  = 'timeshift:'  ## Journal names of warm tuners start with this (they are never adopted, only let go of)
+SCAN_JOURNAL       = 'scan:'  ## ... and those of tuners scanning
+CFG_Guide_File     = None  ## XMLTV guide (plain or .gz) the 'series' rules of the recording config are matched against (None = no guide)
+CFG_Guide_Check_Time = 60  ## How often to check whether the guide file has changed (and drop airings that are over)
+CFG_Guide_Horizon  = 7 * 24 * 3600  ## How far ahead airings of series rules are scheduled
+CFG_Guide_Start_Early = 60  ## Seconds an airing is recorded from before its listed start (a rule's 'start_early' overrides it) ...
+CFG_Guide_End_Late = 60    ## ... and after its listed end (a rule's 'end_late')
+CFG_GUIDE          = None  ## The guide index (loaded in main)
+CFG_GUIDE_LOAD     = {}    ## A changed guide being read in the background ('thread', then 'index'), or the 'failed' one
+CFG_SERIES         = {}    ## The series rules of the recording config; their airings are in CFG_RECORDINGS
 CFG_LOCKKEY        = str(random.SystemRandom().choice(list(range(1,10)))) + ''.join(random.SystemRandom().choice(string.ascii_uppercase + string.digits) for _ in range(7))
 
+## Each channel may also carry a 'bitrate' (bits/second) the health monitor should expect;
+## channels without one have their normal rate learned from healthy recordings.  Guide
+## channels are matched up by the virtual number or call sign in 'name', or by an 'xmltv' id.
+## A 'streams' PID filter (see CFG_PID_Filter) applies to every recording of the channel.
 CFG_CHANNELS       = {'ABC':{'name':'2.1 WSB-HD','channel':39,'subchannel':1},
                       'MeTV':{'name':'2.2 Me TV','channel':39,'subchannel':2},
                       'FOX':{'name':'5.1 WAGA-HD','channel':27,'subchannel':3},
@@ -56,6 +170,30 @@ CFG_CHANNELS       = {'ABC':{'name':'2.1 WSB-HD','channel':39,'subchannel':1},
                       'PBS':{'name':'30.1 WPBA-HD','channel':21,'subchannel':3},
                       'Univision':{'name':'34.1 WUVG-DT','channel':48,'subchannel':1}}
 
+## What the recorder counts and times as it goes; the state of tuners and recordings is
+## only looked at when the metrics are scraped (collectMetrics)
+MET_TUNE           = CFG_METRICS.histogram('recordtv_tune_seconds','Time to lock a tuner and change its channel',('device',))
+MET_START          = CFG_METRICS.histogram('recordtv_start_seconds','Time from picking a tuner to the recording running (tune and start capture)')
+MET_LOOP_LAG       = CFG_METRICS.histogram('recordtv_loop_lag_seconds','How late the main loop handled the earliest of the timer events due at once')
+MET_LOOP           = CFG_METRICS.histogram('recordtv_loop_seconds','Time the main loop spent handling the timer events due at once')
+MET_CONFIG_RELOAD  = CFG_METRICS.histogram('recordtv_config_reload_seconds','Time to re-read and apply a changed recording configuration')
+MET_DEVICE_CHECK   = CFG_METRICS.histogram('recordtv_device_check_seconds','Time to check which HDhomerun devices are on the network')
+MET_RETENTION      = CFG_METRICS.histogram('recordtv_retention_seconds','Time to reconcile the recording index, expire and evict')
+MET_STARTED        = CFG_METRICS.counter('recordtv_recordings_started_total','Recordings (segments) started',('show',))
+MET_FAILED         = CFG_METRICS.counter('recordtv_recording_failures_total','Attempts to start a recording that failed',('show','reason'))
+MET_RESTARTS       = CFG_METRICS.counter('recordtv_health_restarts_total','Recordings restarted because the stream went bad',('show','state','kind'))
+MET_RESTART_GAP    = CFG_METRICS.histogram('recordtv_restart_gap_seconds','Stream missing from a recording across a hot restart (last data before to first data after)')
+MET_RESTART_TIME   = CFG_METRICS.histogram('recordtv_restart_seconds','Time from a hot restart to the stream coming back')
+MET_BACKFILL       = CFG_METRICS.histogram('recordtv_timeshift_backfill_seconds','Stream a recording started with from a warm tuner\'s timeshift buffer',\
+	buckets=(1,5,10,30,60,90,120,180,300,600))
+MET_SCAN           = CFG_METRICS.histogram('recordtv_scan_seconds','Time to scan an RF channel (tune, and collect its tables or give up)',('result',))
+MET_GUIDE_LOAD     = CFG_METRICS.histogram('recordtv_guide_load_seconds','Time to read the XMLTV guide',buckets=(0.5,1,2,5,10,20,30,60,120,300))
+MET_MOVED          = CFG_METRICS.counter('recordtv_channels_moved_total','Channels found on another RF channel or program than configured',('channel',))
+MET_PREEMPTED      = CFG_METRICS.counter('recordtv_preemptions_total','Recordings stopped to free a tuner for a higher priority show',('show',))
+MET_OUTAGES        = CFG_METRICS.counter('recordtv_device_outages_total','Times a device dropped off the network',('device',))
+MET_RELOADS        = CFG_METRICS.counter('recordtv_config_reloads_total','Recording configuration changes picked up')
+MET_REMOVED        = CFG_METRICS.counter('recordtv_files_removed_total','Recordings removed by retention')
+
 def usage():
 	print('Usage:' , sys.argv[0] , '[options]')
 	print('Description: Record TV from HDhomerun')
@@ -64,104 +202,609 @@ def usage():
 	print('-h  --help			Show this helpful information')
 	print('-c  --config=[file]	Specifies the recording configuration filename (required argument)')
 	print('-d  --debug[=level]	print debug info')
+	print('-m  --metrics=[port]	Serve metrics on this local port (default %s, 0 = off)' %(CFG_Metrics_Port))
+	print('-g  --guide=[file]	XMLTV guide to record the \'series\' rules from')
+	print('-s  --scan		Scan for channels with every free tuner, update the lineup (%s) and exit' %(CFG_Lineup_File))
 	print('')
 
 
-def changeChannel(tuner,channel,subchannel):
-	cmd = [CFG_OS_cmd,CFG_HDHRID,'set','/tuner' + str(tuner) + '/lockkey',CFG_LOCKKEY]
-	resp = subprocess.call(cmd)
-	if resp != 0:
-		print('ERROR:   FAILED TO SET LOCKKEY ON TUNER %d TO %s' %(tuner,CFG_LOCKKEY))
+def tunerSet(device_id,tuner,name,value,use_key=True):
+	path = '/tuner' + str(tuner) + '/' + name
+
+	## Use the persistent control connection when we know where the device is
+	device = CFG_POOL.devices.get(device_id)
+	if CFG_Native_Control and device and device['ip']:
+		control = hdhrControl.getControl(device_id,device['ip'],device['port'] or CFG_HDHRPort)
+		try:
+			if name == 'lockkey' and value != 'none':
+				value = hdhrControl.lockkeyValue(value)
+			control.set(path,value,CFG_LOCKKEY if use_key else None)
+			return True
+		except hdhrControl.HDHRError as diag:
+			print('ERROR:   DEVICE REJECTED SET %s %s (%s)' %(path,value,diag))
+			return False
+		except (OSError,ConnectionError) as diag:
+			print('WARNING: NATIVE CONTROL OF %s FAILED (%s); FALLING BACK TO %s' %(device_id,diag,CFG_OS_cmd))
+
+	if use_key:
+		cmd = [CFG_OS_cmd,device_id,'key',CFG_LOCKKEY,'set',path,str(value)]
+	else:
+		cmd = [CFG_OS_cmd,device_id,'set',path,str(value)]
+	return subprocess.call(cmd) == 0
+
+
+def changeChannel(device_id,tuner,channel,subchannel):
+	if not tunerSet(device_id,tuner,'lockkey',CFG_LOCKKEY,use_key=False):
+		print('ERROR:   FAILED TO SET LOCKKEY ON TUNER %s-%d TO %s' %(device_id,tuner,CFG_LOCKKEY))
 		return False
 
-	cmd = [CFG_OS_cmd,CFG_HDHRID,'key',CFG_LOCKKEY,'set','/tuner' + str(tuner) + '/channel',str(channel)]
-	resp = subprocess.call(cmd)
-	if resp != 0:
-		print('ERROR:   FAILED TO CHANGE CHANNEL ON TUNDER %d TO %d' %(tuner,channel))
+	if not tunerSet(device_id,tuner,'channel',channel):
+		print('ERROR:   FAILED TO CHANGE CHANNEL ON TUNER %s-%d TO %d' %(device_id,tuner,channel))
 		return False
 
-	cmd = [CFG_OS_cmd,CFG_HDHRID,'key',CFG_LOCKKEY,'set','/tuner' + str(tuner) + '/program',str(subchannel)]
-	resp = subprocess.call(cmd)
-	if resp != 0:
-		print('ERROR:   FAILED TO CHANGE SUB-CHANNEL ON TUNDER %d TO %d' %(tuner,subchannel))
+	if not tunerSet(device_id,tuner,'program',subchannel):
+		print('ERROR:   FAILED TO CHANGE SUB-CHANNEL ON TUNER %s-%d TO %d' %(device_id,tuner,subchannel))
 		return False
 
 	return True
 
 
-def saveChannel(tuner,title,filename_prefix):
-	if not os.path.exists(CFG_Save_Dir + title + '/'):
-		try:
-			os.mkdir(CFG_Save_Dir + title + '/')
-		except Exception as diag:
-			print('ERROR:   FAILED TO CREATE DESTINATION DIRECTORY %s' %(CFG_Save_Dir + title + '/'))
-			return False
+def showOf(name):
+	## The show a recording's files go under: an airing of a series rule records into the rule's
+	return CFG_RECORDINGS[name].get('show') or name
+
+
+def recordingFilename(title,filename_prefix):
+	try:
+		os.mkdir(CFG_Save_Dir + title + '/')
+	except FileExistsError:
+		pass
+	except Exception as diag:
+		print('ERROR:   FAILED TO CREATE DESTINATION DIRECTORY %s' %(CFG_Save_Dir + title + '/'))
+		return None
 
 	filename = CFG_Save_Dir + title + '/' + filename_prefix + '_' + time.strftime('%d%b%Y') + '.ts'
 
-	## Make sure we don't overwrite any previous recordings of this show (in case of device reboot)
+	## Make sure we don't overwrite any previous recordings of this show (in case of device reboot).
+	## The catalog knows every file in the directory, so this doesn't stat() anything on the NAS.
+	taken = CFG_CATALOG.paths(filename[:-len('.ts')])
 	attempt = 1
-	while os.path.exists(filename) and attempt < 100:
+	while filename in taken and attempt < 100:
 		filename = CFG_Save_Dir + title + '/' + filename_prefix + '_' + time.strftime('%d%b%Y') + '_%02d.ts' %(attempt)
 		attempt += 1
+	return filename
+
+
+def expectedBytes(recording):
+	## Size to preallocate for the rest of a recording: time left x the channel's bitrate
+	channel_name = recording['channel_name']
+	bitrate = CFG_CHANNELS[channel_name].get('bitrate') or (CFG_HEALTH and CFG_HEALTH.expectedRate(channel_name)) or CFG_Default_Bitrate
+	return int(max(0,recording['unix_stop_time'] - time.time()) * bitrate / 8)
+
+
+def streamsOf(recording):
+	## The tsDemux.pidFilter() of the streams a recording keeps, or None to keep them all
+	spec = recording.get('streams',CFG_CHANNELS[recording['channel_name']].get('streams',CFG_PID_Filter))
+	try:
+		return tsDemux.pidFilter(spec)
+	except ValueError as diag:
+		print('WARNING: IGNORING STREAMS %r OF %s (%s)' %(spec,recording['filename_prefix'],diag))
+		return None
+
+
+def timeshiftBytes():
+	## Size of a warm tuner's buffer.  It holds the whole multiplex, and 1/timeshift.SAFETY_MARGIN
+	## of it is never handed out, so a full multiplex's bitrate decides what a pre-roll needs.
+	if CFG_Timeshift_MB:
+		return int(CFG_Timeshift_MB * 1024 * 1024)
+	return timeshift.ringSize(CFG_Pre_Roll,CFG_Default_Bitrate)
 
-	cmd = [CFG_OS_cmd,CFG_HDHRID,'key',CFG_LOCKKEY,'save','/tuner' + str(tuner),filename]
+
+def preRollOf(recording):
+	## Seconds of pre-roll a recording wants out of a warm tuner's buffer
+	try:
+		return max(0.0,float(recording.get('pre_roll',CFG_Pre_Roll)))
+	except (TypeError,ValueError):
+		return CFG_Pre_Roll
+
+
+def saveChannel(device_id,tuner,title,filename_prefix,program=None,mux=None,since=None,keep=None):
+	## program is set when program has to be demuxed out of what the tuner streams (the whole
+	## multiplex, or just program when only keep's streams are to be written); mux is the
+	## MuxStream to join when another recording already has the tuner streaming (or it is
+	## warm), since how far back into a warm tuner's timeshift buffer the recording starts
+	filename = recordingFilename(showOf(title),filename_prefix)
+	if not filename:
+		return (False,None)
+
+	if mux:
+		return (mux.addProgram(program,filename,tsAnalyzer.TSAnalyzer() if CFG_Analyze_Live else None,\
+			expectedBytes(CFG_RECORDINGS[title]),CFG_WRITE_POLICY,since,keep),filename)
+
+	if CFG_Native_Capture and CFG_Native_Control and CFG_POOL.devices[device_id]['ip']:
+		stream = startCapture(device_id,tuner,filename,program,expectedBytes(CFG_RECORDINGS[title]),keep)
+		if stream:
+			return (stream,filename)
+
+	## hdhomerun_config can't demux or filter; let the device filter the program instead
+	if keep:
+		print('NOTICE:  %s IS RECORDED WITH ALL OF ITS STREAMS (NO IN-PROCESS CAPTURE TO FILTER THEM)' %(filename))
+	if program is not None and not tunerSet(device_id,tuner,'program',program):
+		print('ERROR:   FAILED TO CHANGE SUB-CHANNEL ON TUNER %s-%d TO %d' %(device_id,tuner,program))
+		return (False,None)
+
+	cmd = [CFG_OS_cmd,device_id,'key',CFG_LOCKKEY,'save','/tuner' + str(tuner),filename]
 
 	DEVNULL = open(os.devnull,'wb')
 	p = subprocess.Popen(cmd,stdout=DEVNULL,stderr=DEVNULL)
 	if p.pid == 0:
 		print('ERROR:   FAILED TO SAVE CHANNEL TO %s' %(CFG_Save_Dir))
-		return False
+		return (False,None)
 
 	return (p,filename)
 
 
-def killRecording(recording):
+def startCapture(device_id,tuner,filename,program=None,expected_bytes=0,keep=None):
+	## Point the tuner's stream target at a socket owned by the in-process capture engine;
+	## program (and keep, its streams to write) when it has to be demuxed
+	device = CFG_POOL.devices[device_id]
+	analyzer = tsAnalyzer.TSAnalyzer() if CFG_Analyze_Live else None
+	try:
+		local_ip = hdhrControl.getControl(device_id,device['ip'],device['port'] or CFG_HDHRPort).localAddress()
+		if program is None:
+			stream = handle = hdhrCapture.getEngine().openStream(filename,analyzer=analyzer,expected_bytes=expected_bytes,policy=CFG_WRITE_POLICY)
+		else:
+			stream = hdhrCapture.getEngine().openMux(demux=channelScan.PSIPDemux())
+			handle = stream.addProgram(program,filename,analyzer,expected_bytes,CFG_WRITE_POLICY,keep=keep)
+	except (OSError,ConnectionError) as diag:
+		print('WARNING: FAILED TO START IN-PROCESS CAPTURE TO %s (%s)' %(filename,diag))
+		return None
+
+	if not tunerSet(device_id,tuner,'target','udp://%s:%d' %(local_ip,stream.port)):
+		print('WARNING: FAILED TO SET STREAM TARGET ON TUNER %s-%d' %(device_id,tuner))
+		handle.kill()
+		return None
+
+	return handle
+
+
+def multiplexOf(recording):
+	## Recordings with the same key can share a tuner: same RF channel, demuxed in-process
+	if not (CFG_Demux and CFG_Native_Capture and CFG_Native_Control):
+		return None
+	if 'handle' in recording and not isinstance(recording['handle'],hdhrCapture.ProgramOutput):
+		return None
+	return CFG_CHANNELS[recording['channel_name']]['channel']
+
+
+def sharedMux(tuner_id):
+	## The MuxStream a tuner is already streaming into, if any
+	if tuner_id in CFG_WARM:
+		return CFG_WARM[tuner_id]['mux']
+	for recording in CFG_RECORDINGS.values():
+		if recording['status'] == 'active' and (recording.get('device'),recording.get('tuner')) == tuner_id and \
+			isinstance(recording.get('handle'),hdhrCapture.ProgramOutput) and recording['handle'].mux.users():
+			return recording['handle'].mux
+	return None
+
+
+def journalEntry(name):
+	## How an active recording is being made, for the state journal
+	recording = CFG_RECORDINGS[name]
+	handle = recording['handle']
+	if isinstance(handle,hdhrCapture.ProgramOutput):
+		how = {'port':handle.mux.port,'program':handle.program}
+	elif isinstance(handle,hdhrCapture.CaptureStream):
+		how = {'port':handle.port}
+	else:
+		how = {'pid':handle.pid}
+	return CFG_JOURNAL.record(name,recording['device'],recording['tuner'],recording['filename'],**how)
+
+
+def killRecording(recording,release=True):
+	## release=False skips talking to the device (it has dropped off the network)
 	recording['status'] = None
-	recording['handle'].kill()
-
-	cmd = [CFG_OS_cmd,CFG_HDHRID,'key',CFG_LOCKKEY,'set','/tuner' + str(recording['tuner']) + '/lockkey','none']
-
-	resp = subprocess.call(cmd)
-	if resp != 0:
-		print('ERROR:   FAILED TO REMOVE LOCK KEY ON TUNER %d' %(recording['tuner']))
-
+	if CFG_HEALTH:
+		CFG_HEALTH.unwatch(recording['filename'])
+	if CFG_JOURNAL:
+		CFG_JOURNAL.stopped(recording['filename'])
+	handle = recording['handle']
+	handle.kill()
+	if hasattr(handle,'counters'):
+		## What a restart of this airing can pick up from a warm tuner's buffer
+		recording['recordedUntil'] = handle.counters()['lastData']
+	if CFG_RETENTION:
+		CFG_RETENTION.refresh(recording['filename'])
+	if CFG_CATALOG:
+		analyzer = getattr(handle,'analyzer',None)
+		CFG_CATALOG.finish(recording['filename'],analyzer.counters() if analyzer else None)
+
+	## A demuxed program only lets go of the tuner when it was the last one on it, and
+	## never of a warm one
+	if isinstance(handle,hdhrCapture.ProgramOutput) and (handle.mux.users() or handle.mux.ring):
+		release = False
+
+	## In-process captures leave the device streaming until the target is cleared
+	if isinstance(handle,(hdhrCapture.CaptureStream,hdhrCapture.ProgramOutput)):
+		if release:
+			tunerSet(recording['device'],recording['tuner'],'target','none')
+		if handle.analyzer:
+			tsAnalyzer.report(recording['filename'],handle.analyzer)
+
+	if release and not tunerSet(recording['device'],recording['tuner'],'lockkey','none'):
+		print('ERROR:   FAILED TO REMOVE LOCK KEY ON TUNER %s-%d' %(recording['device'],recording['tuner']))
+
+	CFG_POOL.dirty = True
 	del(recording['handle'])
+	del(recording['device'])
 	del(recording['tuner'])
 	del(recording['filename'])
 	del(recording['lastCheck'])
+	recording.pop('hotRestarts',None)
 
 
-def findOpenTuner(debug):
-	avail_tuners = list(range(CFG_Num_Tuners))
-	for name in CFG_RECORDINGS:
-		if 'tuner' in CFG_RECORDINGS[name] and CFG_RECORDINGS[name]['tuner'] in avail_tuners:
-			if debug:
-				print('INFO:    TUNER %d IS CURRENTLY BUSY' %(CFG_RECORDINGS[name]['tuner']))
-			avail_tuners.remove(CFG_RECORDINGS[name]['tuner'])
-	return avail_tuners
+def warmTuner(tuner_id,channel_name,debug):
+	#################################################################
+	## Lock an idle tuner on channel_name's multiplex and stream it
+	## into a timeshift buffer.  Recordings on that RF channel join
+	## it like any shared tuner, with no tuning at all.
+	#################################################################
+	device_id,tuner = tuner_id
+	device = CFG_POOL.devices[device_id]
+	channel = CFG_CHANNELS[channel_name]['channel']
+	filename = os.path.join(CFG_Timeshift_Dir,'recordTV_timeshift_%s.ring' %(tunerPool.tunerName(tuner_id)))
+	try:
+		local_ip = hdhrControl.getControl(device_id,device['ip'],device['port'] or CFG_HDHRPort).localAddress()
+		ring = timeshift.RingBuffer(filename,timeshiftBytes())
+	except (OSError,ConnectionError) as diag:
+		print('WARNING: FAILED TO START A TIMESHIFT BUFFER FOR TUNER %s (%s)' %(tunerPool.tunerName(tuner_id),diag))
+		return False
+	try:
+		mux = hdhrCapture.getEngine().openMux(ring=ring,demux=channelScan.PSIPDemux())
+	except OSError as diag:
+		print('WARNING: FAILED TO START A TIMESHIFT BUFFER FOR TUNER %s (%s)' %(tunerPool.tunerName(tuner_id),diag))
+		ring.close()
+		return False
 
+	with MET_TUNE.time((device_id,)):
+		tuned = changeChannel(device_id,tuner,channel,0) and tunerSet(device_id,tuner,'target','udp://%s:%d' %(local_ip,mux.port))
+	if not tuned:
+		print('WARNING: FAILED TO WARM UP TUNER %s ON %s' %(tunerPool.tunerName(tuner_id),channel_name))
+		mux.kill()
+		tunerSet(device_id,tuner,'lockkey','none')
+		return False
 
-def detectDevice(debug):
-	cmd = [CFG_OS_cmd,'discover']
-	p = subprocess.Popen(cmd,stdout=subprocess.PIPE,stderr=subprocess.PIPE)
-	stdout,stderr = p.communicate()
+	CFG_WARM[tuner_id] = {'mux':mux,'channel':channel,'channel_name':channel_name,'since':time.time()}
+	CFG_JOURNAL.started(CFG_JOURNAL.record(TIMESHIFT_JOURNAL + channel_name,device_id,tuner,filename,port=mux.port))
+	if debug:
+		print('INFO:    KEEPING TUNER %s WARM ON %s (%d MB TIMESHIFT BUFFER)' %(tunerPool.tunerName(tuner_id),channel_name,ring.size // (1024 * 1024)))
+	return True
+
+
+def coolTuner(tuner_id,release=True):
+	## Stop keeping a warm tuner on its channel (there must be no recordings on it); release=False
+	## skips talking to the device
+	warm = CFG_WARM.pop(tuner_id)
+	warm['mux'].kill()
+	CFG_JOURNAL.stopped(warm['mux'].ring.filename)
+	if release:
+		tunerSet(tuner_id[0],tuner_id[1],'target','none')
+		tunerSet(tuner_id[0],tuner_id[1],'lockkey','none')
+
+
+def warmTuners(debug):
+	#################################################################
+	## Put idle tuners on the warm channels nothing is streaming yet,
+	## most wanted channel first, and give up on warm tuners that
+	## stopped streaming.  Tuners are only ever idle here: anything
+	## that needs a warm tuner for another channel cools it first.
+	#################################################################
+	if not (CFG_Timeshift and CFG_Demux and CFG_Native_Capture and CFG_Native_Control):
+		return
+	now = time.time()
+	for tuner_id in list(CFG_WARM):
+		mux = CFG_WARM[tuner_id]['mux']
+		if not mux.users() and now - max(mux.lastData,CFG_WARM[tuner_id]['since']) > CFG_Rec_Check_Time:
+			print('WARNING: WARM TUNER %s STOPPED STREAMING %s' %(tunerPool.tunerName(tuner_id),CFG_WARM[tuner_id]['channel_name']))
+			coolTuner(tuner_id)
+			CFG_WARM_FAILED[tuner_id] = now
+
+	streaming = set(warm['channel'] for warm in CFG_WARM.values())
+	for recording in CFG_RECORDINGS.values():
+		if recording['status'] == 'active' and isinstance(recording.get('handle'),hdhrCapture.ProgramOutput):
+			streaming.add(CFG_CHANNELS[recording['channel_name']]['channel'])
+	## The allocator plans from the first tuner on, so warm from the last one back
+	free = [tuner_id for tuner_id in CFG_POOL.freeTuners(CFG_RECORDINGS,list(CFG_WARM) + list(CFG_SCANS)) if now - CFG_WARM_FAILED.get(tuner_id,0) > CFG_Warm_Retry_Time]
+	for channel_name in CFG_Warm_Channels:
+		if not free:
+			break
+		if channel_name not in CFG_CHANNELS or CFG_CHANNELS[channel_name]['channel'] in streaming:
+			continue
+		tuner_id = free.pop()
+		if warmTuner(tuner_id,channel_name,debug):
+			streaming.add(CFG_CHANNELS[channel_name]['channel'])
+		else:
+			CFG_WARM_FAILED[tuner_id] = now
+
+
+def warmTunerFor(key,exclude=()):
+	## A warm tuner on multiplex key, if any
+	for tuner_id in sorted(CFG_WARM):
+		if CFG_WARM[tuner_id]['channel'] == key and tuner_id not in exclude and CFG_POOL.devices[tuner_id[0]]['online']:
+			return tuner_id
+	return None
+
+
+def scanBand():
+	## RF channels a full scan looks at
+	if CFG_Scan_Channels is not None:
+		return list(CFG_Scan_Channels)
+	return sorted(set(range(2,37)) | set(CFG_CHANNELS[channel_name]['channel'] for channel_name in CFG_CHANNELS))
+
+
+def applyLineup(debug):
+	#################################################################
+	## Bring CFG_CHANNELS in line with the lineup: a channel is found
+	## by its virtual number ('5.1 WAGA-HD') wherever it is broadcast
+	## now, and virtual channels CFG_CHANNELS doesn't have are added
+	## under their number ('5.4').  Returns the configured channels
+	## that are gone from the RF channel they were on.
+	#################################################################
+	found = CFG_LINEUP.virtuals()
+	known = set()
+	missing = []
+	for channel_name in sorted(CFG_CHANNELS):
+		channel = CFG_CHANNELS[channel_name]
+		virtual = channelScan.virtualOf(channel)
+		if not virtual:
+			continue
+		known.add(virtual)
+		if virtual not in found:
+			scanned = CFG_LINEUP.channels.get(channel['channel'])
+			if scanned and not scanned.get('missing'):
+				missing.append(channel_name)
+			continue
+		CFG_LOST.discard(channel_name)
+		rf,entry = found[virtual]
+		if (channel['channel'],channel['subchannel']) != (rf,entry['program']):
+			print('NOTICE:  %s (%s) HAS MOVED FROM RF %d PROGRAM %d TO RF %d PROGRAM %d' %(channel_name,channel['name'],\
+				channel['channel'],channel['subchannel'],rf,entry['program']))
+			MET_MOVED.inc((channel_name,))
+			channel['channel'] = rf
+			channel['subchannel'] = entry['program']
+			CFG_POOL.dirty = True
+	for virtual in sorted(set(found) - known):
+		rf,entry = found[virtual]
+		CFG_CHANNELS[virtual] = {'name':'%s %s' %(virtual,entry['name']),'channel':rf,'subchannel':entry['program'],'virtual':virtual}
+		if debug:
+			print('INFO:    ADDED CHANNEL %s (RF %d PROGRAM %d) FROM THE LINEUP' %(CFG_CHANNELS[virtual]['name'],rf,entry['program']))
+	return missing
+
+
+def startScan(tuner_id,rf,full,debug):
+	## Tune an idle tuner to rf and collect its tables in the capture engine; scanStep() picks
+	## up the result
+	device_id,tuner = tuner_id
+	device = CFG_POOL.devices[device_id]
+	try:
+		local_ip = hdhrControl.getControl(device_id,device['ip'],device['port'] or CFG_HDHRPort).localAddress()
+		mux = hdhrCapture.getEngine().openMux(demux=channelScan.PSIPDemux())
+	except (OSError,ConnectionError) as diag:
+		print('WARNING: FAILED TO START A SCAN ON TUNER %s (%s)' %(tunerPool.tunerName(tuner_id),diag))
+		return False
+	started = time.time()
+	if not (changeChannel(device_id,tuner,rf,0) and tunerSet(device_id,tuner,'target','udp://%s:%d' %(local_ip,mux.port))):
+		print('WARNING: FAILED TO TUNE TUNER %s TO RF %d TO SCAN IT' %(tunerPool.tunerName(tuner_id),rf))
+		mux.kill()
+		tunerSet(device_id,tuner,'lockkey','none')
+		return False
+	CFG_SCANS[tuner_id] = {'mux':mux,'rf':rf,'full':full,'started':started}
+	if CFG_JOURNAL:
+		CFG_JOURNAL.started(CFG_JOURNAL.record(SCAN_JOURNAL + tunerPool.tunerName(tuner_id),device_id,tuner,SCAN_JOURNAL + tunerPool.tunerName(tuner_id),port=mux.port))
 	if debug > 1:
-		print(stdout, end=' ')
+		print('INFO:    SCANNING RF %d ON TUNER %s' %(rf,tunerPool.tunerName(tuner_id)))
+	return True
 
-	return str(stdout).find(CFG_HDHRID)
 
+def endScan(tuner_id,release=True):
+	## Stop a scan (finished or not); release=False skips talking to the device
+	scan = CFG_SCANS.pop(tuner_id)
+	scan['mux'].kill()
+	if CFG_JOURNAL:
+		CFG_JOURNAL.stopped(SCAN_JOURNAL + tunerPool.tunerName(tuner_id))
+	if release:
+		tunerSet(tuner_id[0],tuner_id[1],'target','none')
+		tunerSet(tuner_id[0],tuner_id[1],'lockkey','none')
+	return scan
+
+
+def abortScan(tuner_id):
+	## A recording needs the tuner: the RF channel goes back to the front of the queue
+	scan = endScan(tuner_id)
+	CFG_SCAN_QUEUE.insert(0,(scan['rf'],scan['full']))
+	MET_SCAN.observe(time.time() - scan['started'],('aborted',))
+
+
+def recordScan(rf,demux,received,full,debug):
+	## What scanning rf found (demux: its PSIPDemux; received: whether anything arrived) goes
+	## into the lineup; returns True if the lineup changed
+	if not received:
+		if debug or full:
+			print('INFO:    NOTHING RECEIVED ON RF %d' %(rf))
+		had = rf in CFG_LINEUP.channels
+		CFG_LINEUP.missing(rf,forget=full)
+		return had and full
+	channels = demux.lineup()
+	changed = CFG_LINEUP.update(rf,channels)
+	if debug or full or changed:
+		print('INFO:    RF %d CARRIES %s' %(rf,', '.join('%s (PROGRAM %d)' %(channel['virtual'] or channel['name'],channel['program']) for channel in channels) or 'NOTHING'))
+	return True
 
-def readRecordingConfig(config_filename):
-	with open(config_filename,'r') as fptr:
-		recordings = json.load(fptr)
 
-	return recordings
+def scanStep(debug):
+	#################################################################
+	## Drive the scans in the queue: collect the ones that are done,
+	## then start more on idle tuners, unless a recording is about to
+	## start.  An RF channel a warm tuner is on, or that is being
+	## recorded, is read from its demux without tuning anything.  When
+	## a configured channel turns out to be gone from its RF channel,
+	## the whole band is queued to find where it went.  Returns how
+	## soon to be called again, or None when there is nothing to do.
+	#################################################################
+	now = time.time()
+	changed = False
+	for tuner_id in sorted(CFG_SCANS):
+		scan = CFG_SCANS[tuner_id]
+		mux = scan['mux']
+		with mux.lock:
+			complete = mux.demux.complete()
+			received = mux.firstData is not None
+		elapsed = now - scan['started']
+		if complete or (not received and elapsed >= CFG_Scan_Lock_Time) or elapsed >= CFG_Scan_Lock_Time + CFG_Scan_Time:
+			endScan(tuner_id)
+			with mux.lock:
+				changed = recordScan(scan['rf'],mux.demux,received,scan['full'],debug) or changed
+			MET_SCAN.observe(elapsed,('complete' if complete else 'partial' if received else 'empty',))
+
+	## Multiplexes already streaming (warm, or being recorded) are read without tuning anything
+	streaming = dict((warm['channel'],warm['mux']) for warm in CFG_WARM.values())
+	for recording in CFG_RECORDINGS.values():
+		if recording['status'] == 'active' and isinstance(recording.get('handle'),hdhrCapture.ProgramOutput):
+			streaming[CFG_CHANNELS[recording['channel_name']]['channel']] = recording['handle'].mux
+	for rf,full in list(CFG_SCAN_QUEUE):
+		if rf not in streaming:
+			continue
+		with streaming[rf].lock:
+			if streaming[rf].demux.complete():
+				changed = recordScan(rf,streaming[rf].demux,True,full,debug) or changed
+				CFG_SCAN_QUEUE.remove((rf,full))
+
+	if changed:
+		try:
+			CFG_LINEUP.save()
+		except OSError as diag:
+			print('WARNING: FAILED TO SAVE THE CHANNEL LINEUP TO %s (%s)' %(CFG_LINEUP.filename,diag))
+		## Every channel gone missing is looked for once
+		missing = [channel_name for channel_name in applyLineup(debug) if channel_name not in CFG_LOST]
+		CFG_LOST.update(missing)
+		if missing and not [full for rf,full in CFG_SCAN_QUEUE if full] and not [scan for scan in CFG_SCANS.values() if scan['full']]:
+			print('WARNING: %s NOT FOUND WHERE %s WAS; SCANNING FOR %s' %(', '.join(missing),'IT' if len(missing) == 1 else 'THEY',\
+				'IT' if len(missing) == 1 else 'THEM'))
+			scanning = set(scan['rf'] for scan in CFG_SCANS.values())
+			CFG_SCAN_QUEUE[:] = [(rf,True) for rf in scanBand() if rf not in scanning]
+
+	## Background scans keep out of the way of recordings
+	soon = [name for name in CFG_RECORDINGS if not CFG_RECORDINGS[name]['status'] and \
+		CFG_RECORDINGS[name]['unix_start_time'] - CFG_Scan_Guard <= now < CFG_RECORDINGS[name]['unix_stop_time']]
+	while CFG_SCAN_QUEUE and not soon:
+		free = [tuner_id for tuner_id in CFG_POOL.freeTuners(CFG_RECORDINGS,list(CFG_WARM) + list(CFG_SCANS)) if now - CFG_WARM_FAILED.get(tuner_id,0) > CFG_Warm_Retry_Time]
+		if not free:
+			break
+		rf,full = CFG_SCAN_QUEUE.pop(0)
+		if not startScan(free[-1],rf,full,debug):
+			CFG_WARM_FAILED[free[-1]] = now
+			CFG_SCAN_QUEUE.insert(0,(rf,full))
+
+	if CFG_SCANS:
+		return 0.25
+	if CFG_SCAN_QUEUE:
+		return CFG_Retry_Time
+	return None
+
+
+def checkLineup(debug):
+	## Queue the RF channels of the recordings coming up that haven't been scanned for a while
+	now = time.time()
+	due = set()
+	for name,recording in CFG_RECORDINGS.items():
+		if recording['status'] or not now < recording['unix_start_time'] <= now + CFG_Lineup_Horizon:
+			continue
+		if recording['channel_name'] not in CFG_CHANNELS:
+			continue
+		rf = CFG_CHANNELS[recording['channel_name']]['channel']
+		if now - CFG_LINEUP.scanned(rf) > CFG_Lineup_Max_Age:
+			due.add(rf)
+	queued = set(rf for rf,full in CFG_SCAN_QUEUE) | set(scan['rf'] for scan in CFG_SCANS.values())
+	for rf in sorted(due - queued):
+		CFG_SCAN_QUEUE.append((rf,False))
+	if debug and due - queued:
+		print('INFO:    RE-CHECKING THE LINEUP OF RF %s' %(', '.join(str(rf) for rf in sorted(due - queued))))
+
+
+def scanChannels(debug):
+	#################################################################
+	## --scan: look at every RF channel of the band with every tuner
+	## that is free, save the lineup and show what it changes
+	#################################################################
+	global CFG_LINEUP
+	CFG_LINEUP = channelScan.Lineup(CFG_Lineup_File)
+	CFG_LINEUP.load()
+	for device_id in CFG_DEVICES:
+		CFG_POOL.addDevice(device_id,CFG_DEVICES[device_id].get('ip'),CFG_DEVICES[device_id].get('tuners',CFG_Num_Tuners),CFG_HDHRPort)
+		CFG_DISCOVERY.remember(device_id,CFG_DEVICES[device_id].get('ip'))
+	found = detectDevice(debug)
+	for device_id in found:
+		CFG_POOL.setOnline(device_id,True)
+	if not found:
+		print('ERROR:   FAILED TO DETECT ANY HD HOME RUN DEVICE (%s)' %(', '.join(sorted(CFG_POOL.devices))))
+		return False
+
+	band = scanBand()
+	print('INFO:    SCANNING %d RF CHANNELS WITH %d TUNERS' %(len(band),len(CFG_POOL.tuners())))
+	start = time.time()
+	CFG_SCAN_QUEUE[:] = [(rf,True) for rf in band]
+	while True:
+		delay = scanStep(debug)
+		if delay is None:
+			break
+		if not CFG_SCANS:
+			print('ERROR:   NO TUNER IS FREE TO SCAN WITH')
+			return False
+		time.sleep(delay)
+	CFG_LINEUP.save()
+	applyLineup(debug)
+	print('INFO:    SCANNED %d RF CHANNELS IN %.1f s: %d VIRTUAL CHANNELS, SAVED TO %s' %(len(band),time.time() - start,len(CFG_LINEUP.virtuals()),CFG_LINEUP.filename))
+	return True
 
 
-def updateUnixTimes(recordings,debug):
+def detectDevice(debug):
+	## Returns the IDs of the configured (and, with CFG_Use_All_Devices, any other) devices found
+	if CFG_Native_Discovery:
+		## Known devices are probed by unicast; broadcasts only happen when one is missing
+		found = CFG_DISCOVERY.check(CFG_POOL.devices,CFG_Use_All_Devices)
+		replies = [(device_id,CFG_DISCOVERY.devices[device_id]['ip'],CFG_DISCOVERY.devices[device_id]['tuners']) for device_id in sorted(found)]
+		if debug > 1:
+			for device_id,ip,num_tuners in replies:
+				print('hdhomerun device %s found at %s' %(device_id,ip))
+	else:
+		cmd = [CFG_OS_cmd,'discover']
+		p = subprocess.Popen(cmd,stdout=subprocess.PIPE,stderr=subprocess.PIPE)
+		stdout,stderr = p.communicate()
+		if debug > 1:
+			print(stdout, end=' ')
+		replies = [(device_id.upper(),ip,None) for device_id,ip in re.findall(r'device ([0-9A-Fa-f]{8}) found at ([0-9.]+)',stdout.decode('utf-8','replace'))]
+
+	## Remember where each device lives so the native control client can reach it
+	found = []
+	for device_id,ip,num_tuners in replies:
+		if device_id not in CFG_POOL.devices:
+			if not CFG_Use_All_Devices:
+				continue
+			print('INFO:    ADDING HD HOMERUN DEVICE %s TO THE TUNER POOL' %(device_id))
+			CFG_POOL.addDevice(device_id,None,num_tuners or CFG_Num_Tuners,CFG_HDHRPort)
+		device = CFG_POOL.devices[device_id]
+		if device['ip'] != ip and not CFG_DEVICES.get(device_id,{}).get('ip'):
+			device['ip'] = ip
+			if debug:
+				print('INFO:    HD HOMERUN DEVICE %s IS AT %s' %(device_id,ip))
+		found.append(device_id)
+
+	return found
+
+
+def updateUnixTimes(recordings,debug,names=None):
 	global CFG_Dev_Check_Time
-	for name in list(recordings.keys()):
+	for name in (list(recordings.keys()) if names is None else names):
 
 		## Check to make sure the status keyword exists
 		if 'status' not in recordings[name]:
@@ -172,62 +815,1007 @@ def updateUnixTimes(recordings,debug):
 			recordings[name]['unix_start_time'] = 0
 			recordings[name]['unix_stop_time'] = 0
 
+		## An airing from the guide happens once, when the guide says
+		if 'airing' in recordings[name]:
+			recordings[name]['unix_start_time'],recordings[name]['unix_stop_time'] = recordings[name]['airing']
+			continue
+
 		## If current time < stop time, then no need to update the unix start/stop time
 		if time.time() < recordings[name]['unix_stop_time'] + CFG_Dev_Check_Time:
 			continue
 
-		today_midnight = datetime.datetime.now().replace(hour=0,minute=0,second=0,microsecond=0)
-
+		## The compiled index only recompiles a rule when its day/start/end changed
+		CFG_SCHEDULE.update(name,recordings[name])
+		occurrence = CFG_SCHEDULE.nextOccurrence(name)
 		if debug > 2:
-			print('INFO:    updateUnixTimes(), tonight_midnight = ', today_midnight)
+			print('INFO:    updateUnixTimes(), next occurrence of %s = %s' %(name,occurrence))
+
+		if occurrence:
+			recordings[name]['unix_start_time'],recordings[name]['unix_stop_time'] = occurrence
+
+			if debug > 0:
+				print('INFO:    %s SCHEDULED FOR %s -> %s' %(name,\
+				time.strftime('%a, %b %d %Y %I:%M %p %Z',time.localtime(recordings[name]['unix_start_time'])),\
+				time.strftime('%a, %b %d %Y %I:%M %p %Z',time.localtime(recordings[name]['unix_stop_time']))))
+				print('- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -')
+
+
+def scheduleRecording(scheduler,name):
+	## (Re)queue the timer events for one recording from its current state
+	recording = CFG_RECORDINGS[name]
+	for kind in ('start','stop','check','reschedule'):
+		scheduler.cancel(kind,name)
+
+	now = time.time()
+	if recording['status'] == 'active':
+		scheduler.schedule(recording['unix_stop_time'],'stop',name)
+		scheduler.schedule(recording['lastCheck'] + CFG_Rec_Check_Time,'check',name)
+	elif now < recording['unix_stop_time']:
+		scheduler.schedule(recording['unix_start_time'],'start',name)
+
+	## Work out the next occurrence once this one is over (an airing from the guide has none)
+	if 'airing' not in recording or now < recording['unix_stop_time']:
+		scheduler.schedule(max(recording['unix_stop_time'],now) + CFG_Dev_Check_Time,'reschedule',name)
+	CFG_POOL.dirty = True
 
-		## Find next day to record based on day of week
-		num_days = 0
-		while num_days < 8:
-			if debug > 2:
-				print('INFO:    updateUnixTimes(), num_days = %d' %(num_days))
-			test_day_datetime = today_midnight + datetime.timedelta(seconds=86400 * num_days)
-			test_day = test_day_datetime.strftime('%a')
 
-			if debug > 2:
-				print('INFO:    updateUnixTimes(), test_day = %s' %(test_day))
+def planTuners(debug):
+	#################################################################
+	## Re-plan tuner assignments over the upcoming recordings and
+	## report conflicts/preemptions as soon as they appear (only
+	## changes are reported, not the same conflict every time)
+	#################################################################
+	if not CFG_POOL.dirty:
+		return
+	old_conflicts = CFG_POOL.conflicts
+	old_preemptions = CFG_POOL.preemptions
+	CFG_POOL.allocate(CFG_RECORDINGS)
+
+	for name in sorted(CFG_POOL.conflicts):
+		if old_conflicts.get(name) != CFG_POOL.conflicts[name]:
+			when = time.strftime('%a %H:%M',time.localtime(CFG_RECORDINGS[name]['unix_start_time']))
+			if CFG_POOL.conflicts[name]:
+				print('WARNING: CONFLICT: NO TUNER FOR %s AT %s; ALL TUNERS ARE TAKEN BY %s' %(name,when,', '.join(CFG_POOL.conflicts[name])))
+			else:
+				print('WARNING: CONFLICT: NO TUNER FOR %s AT %s; NO DEVICE IS ONLINE' %(name,when))
+	for name in sorted(old_conflicts):
+		if name in CFG_RECORDINGS and name not in CFG_POOL.conflicts:
+			print('INFO:    CONFLICT FOR %s IS RESOLVED' %(name))
+	for name in sorted(CFG_POOL.preemptions):
+		if old_preemptions.get(name) != CFG_POOL.preemptions[name]:
+			print('NOTICE:  %s WILL PREEMPT %s' %(name,', '.join(CFG_POOL.preemptions[name])))
+
+	if debug > 1:
+		for name in sorted(CFG_POOL.plan):
+			print('INFO:    PLANNED %s ON TUNER %s' %(name,tunerPool.tunerName(CFG_POOL.plan[name])))
+
+
+def tuneAndSave(name,tuner_id,results):
+	with MET_START.time():
+		tuneAndSaveTimed(name,tuner_id,results)
+
+
+def tuneAndSaveTimed(name,tuner_id,results):
+	recording = CFG_RECORDINGS[name]
+	device_id,tuner = tuner_id
+
+	#################################################################
+	## Determine channel information and change the assigned tuner
+	## to the proper channel
+	#################################################################
+	channel = CFG_CHANNELS[recording['channel_name']]['channel']
+	subchannel = CFG_CHANNELS[recording['channel_name']]['subchannel']
+
+	## When demuxing, the tuner gets the whole multiplex (program 0) and may already be
+	## streaming it for another show on the same RF channel.  A recording that keeps only
+	## some streams is demuxed too, out of just its program when multiplexes aren't shared.
+	mux = None
+	program = None
+	tuned_program = subchannel
+	since = None
+	keep = streamsOf(recording)
+	if multiplexOf(recording) is not None:
+		program = subchannel
+		tuned_program = 0
+		mux = sharedMux(tuner_id)
+	elif keep and CFG_Native_Capture and CFG_Native_Control:
+		program = subchannel
+
+	## A warm tuner has the start of the show (or whatever a restart of it missed) in its buffer
+	if mux and mux.ring:
+		since = max(recording['unix_start_time'] - preRollOf(recording),recording.get('recordedUntil',0))
+
+	if not mux:
+		with MET_TUNE.time((device_id,)):
+			tuned = changeChannel(device_id,tuner,channel,tuned_program)
+		if not tuned:
+			print('WARNING: FAILED TO SET CHANNEL TO RECORD %s ON TUNER %s' %(name,tunerPool.tunerName(tuner_id)))
+			results[name] = 'tune'
+			return
+
+	#################################################################
+	## Start recording the stream to disk
+	#################################################################
+	proc_handle,filename = saveChannel(device_id,tuner,name,recording['filename_prefix'],program,mux,since,keep)
+	if not proc_handle:
+		print('WARNING: FAILED TO START RECORDING %s ON TUNER %s' %(name,tunerPool.tunerName(tuner_id)))
+		results[name] = 'save'
+		return
+
+	## The buffer may not reach back that far (warmed up late, or a 'pre_roll' bigger than it holds)
+	if since is not None:
+		short = time.time() - since - getattr(proc_handle,'backfill',0.0)
+		if short > 1:
+			print('NOTICE:  %s STARTS %.1f SECONDS LATER THAN ASKED; THE TIMESHIFT BUFFER OF TUNER %s DOESN\'T REACH BACK THAT FAR' %(\
+				name,short,tunerPool.tunerName(tuner_id)))
+
+	results[name] = (proc_handle,filename)
+
+
+def preemptFor(scheduler,name,exclude,debug):
+	## Stop the lowest priority active recording(s) that name outranks; returns True if a tuner was freed
+	victims = CFG_POOL.preemptionVictims(name,CFG_RECORDINGS,exclude)
+	for victim in victims:
+		print('NOTICE:  PREEMPTING %s ON TUNER %s TO RECORD %s' %(victim,tunerPool.tunerName((CFG_RECORDINGS[victim]['device'],CFG_RECORDINGS[victim]['tuner'])),name))
+		MET_PREEMPTED.inc((victim,))
+		killRecording(CFG_RECORDINGS[victim])
+		scheduleRecording(scheduler,victim)
+	return bool(victims)
+
+
+def startRecordings(scheduler,names,debug):
+	## Tuners are handed out one after the other (that's just bookkeeping), then every
+	## show that starts at the same time is tuned and started concurrently.  Returns
+	## False if a device needs to be checked.
+	device_ok = True
+	tried = {}
+	pending = []
+	for name in names:
+		recording = CFG_RECORDINGS[name]
+		if recording['status'] or not (recording['unix_start_time'] <= time.time() < recording['unix_stop_time']):
+			continue
+		if debug:
+			print('INFO:    ATTEMPTING TO RECORD %s' %(name))
+		tried[name] = []
+		pending.append(name)
+
+	## Highest priority shows get first pick of the tuners
+	pending.sort(key=lambda name: -tunerPool.priorityOf(CFG_RECORDINGS[name]))
+
+	while pending:
+		jobs = []
+		deferred = []
+		leaders = {}
+		for name in pending:
+			## A show on a multiplex another job is about to tune waits a round and joins it
+			key = multiplexOf(CFG_RECORDINGS[name])
+			if key is not None and key in leaders:
+				deferred.append(name)
+				continue
+
+			## Join a tuner already streaming this multiplex (for another show, or kept warm on
+			## it), otherwise prefer the tuner the allocator planned for this show, but take any
+			## free tuner (on any device) that hasn't already failed for it, warm ones last
+			tuner_id = None
+			if key is not None:
+				tuner_id = CFG_POOL.sharedTuner(name,CFG_RECORDINGS,tried[name]) or warmTunerFor(key,tried[name])
+			if tuner_id is None:
+				tuner_id = CFG_POOL.chooseTuner(name,CFG_RECORDINGS,tried[name] + list(CFG_WARM) + list(CFG_SCANS)) or \
+					CFG_POOL.chooseTuner(name,CFG_RECORDINGS,tried[name])
+			if tuner_id is None and preemptFor(scheduler,name,tried[name],debug):
+				tuner_id = CFG_POOL.chooseTuner(name,CFG_RECORDINGS,tried[name])
+			if tuner_id is None:
+				if tried[name]:
+					device_ok = False
+				else:
+					print('ERROR:   FAILED TO FIND AN OPEN TUNER TO RECORD %s' %(name))
+				MET_FAILED.inc((name,'no_tuner'))
+				scheduler.schedule(time.time() + CFG_Retry_Time,'start',name)
+				continue
 
-			if test_day in recordings[name]['day'] or test_day == recordings[name]['day']:
-				#print 'INFO:    updateUnixTimes(), Day %s matched requested day' %(test_day)
+			## A tuner kept warm on another channel is given up for this show
+			if tuner_id in CFG_WARM and CFG_WARM[tuner_id]['channel'] != key:
+				if debug:
+					print('INFO:    TAKING WARM TUNER %s OFF %s' %(tunerPool.tunerName(tuner_id),CFG_WARM[tuner_id]['channel_name']))
+				coolTuner(tuner_id)
 
-				## Calculate theoretical start/end time to see if this time has already passed
-				test_start_time = int(test_day_datetime.replace(hour= int(recordings[name]['start'][:2]),minute=int(recordings[name]['start'][-2:])).strftime('%s'))
-				test_end_time = int(test_day_datetime.replace(hour= int(recordings[name]['end'][:2]),minute=int(recordings[name]['end'][-2:])).strftime('%s'))
+			## ... and so is a scan
+			if tuner_id in CFG_SCANS:
+				if debug:
+					print('INFO:    STOPPING THE SCAN OF RF %d ON TUNER %s' %(CFG_SCANS[tuner_id]['rf'],tunerPool.tunerName(tuner_id)))
+				abortScan(tuner_id)
 
-				## This recording spans midnight; adjust end time accordingly
-				if test_end_time < test_start_time:
-					test_end_time += 86400
+			## Reserve the tuner until we know whether it worked
+			if debug:
+				print('INFO:    ASSIGNING %s TO TUNER %s' %(name,tunerPool.tunerName(tuner_id)))
+			CFG_RECORDINGS[name]['device'],CFG_RECORDINGS[name]['tuner'] = tuner_id
+			tried[name].append(tuner_id)
+			jobs.append(name)
+			if key is not None:
+				leaders[key] = name
+
+		results = {}
+		threads = []
+		for name in jobs[1:]:
+			thread = threading.Thread(target=tuneAndSave,args=(name,tried[name][-1],results))
+			thread.start()
+			threads.append(thread)
+		if jobs:
+			tuneAndSave(jobs[0],tried[jobs[0]][-1],results)
+		for thread in threads:
+			thread.join()
+
+		pending = deferred
+		for name in jobs:
+			result = results.get(name)
+			if result == 'tune':
+				## Try another tuner for this show
+				MET_FAILED.inc((name,'tune'))
+				del(CFG_RECORDINGS[name]['device'])
+				del(CFG_RECORDINGS[name]['tuner'])
+				pending.append(name)
+
+			elif isinstance(result,tuple):
+				proc_handle,filename = result
+				CFG_RECORDINGS[name]['status']    = 'active'
+				CFG_RECORDINGS[name]['handle']    = proc_handle
+				CFG_RECORDINGS[name]['filename']  = filename
+				CFG_RECORDINGS[name]['lastCheck'] = time.time()
+				print('INFO:    STARTED RECORDING %s TO %s ON TUNER %s' %(name,CFG_RECORDINGS[name]['filename'],tunerPool.tunerName(tried[name][-1])))
+				backfill = getattr(proc_handle,'backfill',0.0)
+				if backfill:
+					print('INFO:    %s STARTS %.1f SECONDS BACK IN THE TIMESHIFT BUFFER OF TUNER %s' %(name,backfill,tunerPool.tunerName(tried[name][-1])))
+					MET_BACKFILL.observe(backfill)
+				CFG_HEALTH.watch(filename,name,proc_handle,CFG_RECORDINGS[name]['channel_name'])
+				segment = CFG_CATALOG.begin(filename,showOf(name),CFG_RECORDINGS[name]['channel_name'],tried[name][-1][0],tried[name][-1][1],\
+					CFG_CHANNELS[CFG_RECORDINGS[name]['channel_name']]['subchannel'],CFG_RECORDINGS[name]['unix_start_time'],time.time() - backfill)
+				if segment and debug:
+					print('INFO:    %s IS SEGMENT %d OF THIS AIRING OF %s' %(filename,segment + 1,name))
+				CFG_RETENTION.add(filename,showOf(name),0,time.time())
+				CFG_JOURNAL.started(journalEntry(name))
+				MET_STARTED.inc((name,))
+				scheduleRecording(scheduler,name)
 
-				if debug > 2:
-					print('INFO:    updateUnixTimes(), test_start_time = %d; test_end_time = %d; now = %d' %(test_start_time,test_end_time,int(time.time())))
+			else:
+				MET_FAILED.inc((name,result or 'error'))
+				del(CFG_RECORDINGS[name]['device'])
+				del(CFG_RECORDINGS[name]['tuner'])
+				device_ok = False
+				scheduler.schedule(time.time() + CFG_Retry_Time,'start',name)
 
-				if time.time() < test_end_time:
-					recordings[name]['unix_start_time'] = test_start_time
-					recordings[name]['unix_stop_time'] = test_end_time
+	CFG_POOL.dirty = True
+	return device_ok
 
-					if debug > 0:
-						print('INFO:    %s SCHEDULED FOR %s -> %s' %(name,\
-						time.strftime('%a, %b %d %Y %I:%M %p %Z',time.localtime(recordings[name]['unix_start_time'])),\
-						time.strftime('%a, %b %d %Y %I:%M %p %Z',time.localtime(recordings[name]['unix_stop_time']))))
-						print('- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -')
-					break
-			num_days += 1
+
+def hotRestart(name,debug):
+	#################################################################
+	## Get a bad recording going again without giving up its tuner:
+	## the lock is kept, the tuner is tuned and told to stream again,
+	## and the stream goes on being appended to the same file.  Every
+	## recording sharing the tuner's multiplex is restarted with it.
+	## Returns False if it has to be restarted the slow way instead.
+	#################################################################
+	recording = CFG_RECORDINGS[name]
+	handle = recording['handle']
+	device_id,tuner = recording['device'],recording['tuner']
+	channel = CFG_CHANNELS[recording['channel_name']]
+	if not CFG_POOL.devices[device_id]['online'] or recording.get('hotRestarts',0) >= CFG_Max_Hot_Restarts:
+		return False
+
+	affected = [name]
+	restart_start = time.time()
+	if isinstance(handle,(hdhrCapture.CaptureStream,hdhrCapture.ProgramOutput)):
+		## Same socket, same writer: the tuner is simply pointed at where it was already streaming
+		if isinstance(handle,hdhrCapture.ProgramOutput):
+			## Back to the whole multiplex when it is shared, or to just the program a filtered
+			## recording had the device send
+			stream,program = handle.mux,(0 if multiplexOf(recording) is not None else handle.program)
+			affected += [other for other in CFG_RECORDINGS if other != name and CFG_RECORDINGS[other]['status'] == 'active' and \
+				getattr(CFG_RECORDINGS[other]['handle'],'mux',None) is stream]
+		else:
+			stream,program = handle,channel['subchannel']
+		last_data = dict((other,CFG_RECORDINGS[other]['handle'].counters()['lastData'] or CFG_RECORDINGS[other]['lastCheck']) for other in affected)
+		device = CFG_POOL.devices[device_id]
+		try:
+			local_ip = hdhrControl.getControl(device_id,device['ip'],device['port'] or CFG_HDHRPort).localAddress()
+		except (OSError,ConnectionError) as diag:
+			print('WARNING: HOT RESTART OF %s FAILED (%s)' %(name,diag))
+			return False
+		stream.markRestart()
+		if not (tunerSet(device_id,tuner,'channel',channel['channel']) and tunerSet(device_id,tuner,'program',program) and \
+			tunerSet(device_id,tuner,'target','udp://%s:%d' %(local_ip,stream.port))):
+			print('WARNING: FAILED TO RETUNE TUNER %s FOR A HOT RESTART OF %s' %(tunerPool.tunerName((device_id,tuner)),name))
+			return False
+		firstData = lambda other: CFG_RECORDINGS[other]['handle'].counters()['firstData']
+
+	else:
+		## A hdhomerun_config child is replaced by one saving to stdout, which is appended to the
+		## file after trimming whatever partial packet the old one left at the end
+		filename = recording['filename']
+		handle.kill()
+		handle.wait()
+		try:
+			st = os.stat(filename)
+			size = st.st_size - st.st_size % tsAnalyzer.TS_PACKET_SIZE
+			os.truncate(filename,size)
+		except OSError as diag:
+			print('WARNING: HOT RESTART OF %s FAILED (%s)' %(name,diag))
+			return False
+		last_data = {name:st.st_mtime}
+		if not (tunerSet(device_id,tuner,'channel',channel['channel']) and tunerSet(device_id,tuner,'program',channel['subchannel'])):
+			print('WARNING: FAILED TO RETUNE TUNER %s FOR A HOT RESTART OF %s' %(tunerPool.tunerName((device_id,tuner)),name))
+			return False
+		DEVNULL = open(os.devnull,'wb')
+		with open(filename,'ab') as fptr:
+			recording['handle'] = subprocess.Popen([CFG_OS_cmd,device_id,'key',CFG_LOCKKEY,'save','/tuner' + str(tuner),'-'],stdout=fptr,stderr=DEVNULL)
+		CFG_JOURNAL.started(journalEntry(name))
+		def firstData(other):
+			try:
+				return time.time() if os.path.getsize(filename) > size else None
+			except OSError:
+				return None
+
+	## Wait (briefly) for the stream to come back so the gap can be measured
+	resumed = {}
+	deadline = restart_start + CFG_Restart_Wait
+	while True:
+		for other in affected:
+			if other not in resumed:
+				when = firstData(other)
+				if when is not None:
+					resumed[other] = when
+		if len(resumed) == len(affected) or time.time() >= deadline:
+			break
+		time.sleep(0.005)
+	if name not in resumed:
+		print('WARNING: NOTHING RECEIVED FOR %s WITHIN %.1f SECONDS OF A HOT RESTART' %(name,CFG_Restart_Wait))
+		return False
+
+	for other in affected:
+		recording = CFG_RECORDINGS[other]
+		recording['hotRestarts'] = recording.get('hotRestarts',0) + 1
+		recording['lastCheck'] = time.time()
+		CFG_HEALTH.watch(recording['filename'],other,recording['handle'],recording['channel_name'])
+		if other not in resumed:
+			continue
+		gap = max(0.0,resumed[other] - last_data[other])
+		CFG_CATALOG.restarted(recording['filename'],gap)
+		MET_RESTART_GAP.observe(gap)
+		MET_RESTART_TIME.observe(resumed[other] - restart_start)
+		print('INFO:    HOT RESTART OF %s ON TUNER %s: %d ms GAP IN %s (STREAM BACK %d ms AFTER THE RESTART)' %(other,\
+			tunerPool.tunerName((device_id,tuner)),1000.0 * gap,recording['filename'],1000.0 * (resumed[other] - restart_start)))
+	return True
+
+
+def checkRecording(scheduler,name,debug):
+	#################################################################
+	## Check to make sure an active recording is working properly.
+	## The health monitor does the sampling in the background, so
+	## this only has to look at its verdict.
+	#################################################################
+	recording = CFG_RECORDINGS[name]
+	health = CFG_HEALTH.status(recording['filename'])
+
+	## Keep the catalog up to date while the recording runs
+	analyzer = getattr(recording['handle'],'analyzer',None)
+	CFG_CATALOG.update(recording['filename'],health['bytes'] if health else None,analyzer.counters() if analyzer else None)
+
+	if health and health['state'] in streamHealth.BAD_STATES:
+		if health['state'] == streamHealth.STATE_MISSING:
+			print('ERROR:   FAILED TO FIND FILE %s' %(recording['filename']))
+		elif health['state'] == streamHealth.STATE_STALLED:
+			print('ERROR:   FAILED TO DETECT GROWING FILE %s' %(recording['filename']))
+		elif health['state'] == streamHealth.STATE_DAMAGED:
+			print('ERROR:   TRANSPORT STREAM ERRORS IN %s AT %.1f PER SECOND' %(recording['filename'],health['errorRate']))
+		else:
+			print('ERROR:   BITRATE OF %s COLLAPSED TO %.2f Mbit/s (EXPECTED %.2f Mbit/s)' %(recording['filename'],health['bitrate'] / 1e6,health['expected'] / 1e6))
+
+		## Try to get it going again on the same tuner and file; failing that (or when the
+		## file is gone) kill the recording now and start it again right away
+		if CFG_Hot_Restart and health['state'] != streamHealth.STATE_MISSING and hotRestart(name,debug):
+			MET_RESTARTS.inc((name,health['state'],'hot'))
+		else:
+			print('NOTICE:  KILLING RECORDING FOR %s' %(name))
+			MET_RESTARTS.inc((name,health['state'],'cold'))
+			killRecording(recording)
+
+	else:
+		if debug > 1 and health:
+			print('INFO:    %s IS %s AT %.2f Mbit/s' %(name,health['state'].upper(),health['bitrate'] / 1e6))
+		if health and health['state'] == streamHealth.STATE_OK:
+			recording['hotRestarts'] = 0
+		recording['lastCheck'] = time.time()
+
+	scheduleRecording(scheduler,name)
+
+
+def reloadConfig(scheduler,watcher,debug):
+	#################################################################
+	## Pick up changes to the recording configuration.  Nothing is
+	## re-read unless the file changed, and only the recordings that
+	## were added, modified or removed are touched.
+	#################################################################
+	scheduler.schedule(time.time() + CFG_Config_Check_Time,'config')
+	if not watcher.changed():
+		return
+
+	reload_start = time.time()
+	try:
+		tmp = watcher.load()
+	except (OSError,ValueError) as diag:
+		print('ERROR:   FAILED TO READ RECORDING CONFIGURATION %s (%s)' %(watcher.filename,diag))
+		return
+	if tmp is None:
+		return
+	MET_RELOADS.inc()
+
+	added,modified,removed = applyConfig(scheduler,expandConfig(tmp),debug)
+	MET_CONFIG_RELOAD.observe(time.time() - reload_start)
+	if debug:
+		print('INFO:    RELOADED RECORDING CONFIGURATION IN %.1f ms (%d ADDED, %d MODIFIED, %d REMOVED)' %(\
+			1000.0 * (time.time() - reload_start),len(added),len(modified),len(removed)))
+	if debug > 2:
+		pprint.pprint(CFG_RECORDINGS)
+
+
+def applyConfig(scheduler,tmp,debug):
+	#################################################################
+	## Bring CFG_RECORDINGS in line with a new set of recordings (the
+	## configuration file's and the airings of its series rules).
+	## Only the recordings that were added, modified or removed are
+	## touched; returns their names.
+	#################################################################
+	added,modified,removed = configWatch.diffConfigs(CFG_RECORDINGS,tmp)
+
+	#################################################################
+	## Remove unused recording configurations.  Kill the recording if
+	## it's actively recording
+	#################################################################
+	for name in removed:
+		print('NOTICE:  DELETING RECORDING CONFIGURATION FOR %s' %(name))
+
+		## If this is an active recording, kill the recording now
+		if CFG_RECORDINGS[name]['status']:
+			print('NOTICE:  %s WAS ACTIVELY RECORDING.  KILLING RECORDING NOW' %(name))
+			killRecording(CFG_RECORDINGS[name])
+
+		del(CFG_RECORDINGS[name])
+		CFG_SCHEDULE.remove(name)
+		for kind in ('start','stop','check','reschedule'):
+			scheduler.cancel(kind,name)
+
+	for name in added:
+		print('INFO:    ADDING NEW RECORDING INFORMATION FOR %s' %(name))
+		CFG_RECORDINGS[name] = tmp[name]
+
+	#################################################################
+	## Modified recordings keep their run time state (handle, tuner,
+	## file, ...); only the configured fields are replaced
+	#################################################################
+	reschedule = []
+	for name in modified:
+		print('NOTICE:  MODIFYING RECORDING INFORMATION FOR %s' %(name))
+		recording = CFG_RECORDINGS[name]
+		moved = configWatch.scheduleChanged(recording,tmp[name])
+		retuned = recording['channel_name'] != tmp[name]['channel_name']
+
+		for key in list(configWatch.configOf(recording).keys()):
+			del(recording[key])
+		recording.update(tmp[name])
+
+		if moved:
+			## Force the next occurrence to be worked out from the new day/start/end
+			recording['unix_start_time'] = 0
+			recording['unix_stop_time'] = 0
+			reschedule.append(name)
+
+		if recording['status']:
+			if moved:
+				updateUnixTimes(CFG_RECORDINGS,0,[name])
+			if retuned or time.time() < recording['unix_start_time'] or time.time() >= recording['unix_stop_time']:
+				print('NOTICE:  %s WAS ACTIVELY RECORDING.  KILLING RECORDING NOW' %(name))
+				killRecording(recording)
+			scheduleRecording(scheduler,name)
+
+	updateUnixTimes(CFG_RECORDINGS,1 if debug > 1 else 0,added + reschedule)
+	for name in added + reschedule:
+		scheduleRecording(scheduler,name)
+
+	## Any change can move the tuner plan (channel, priority, ...), even for recordings that
+	## weren't rescheduled, and removed ones must leave it
+	if added or modified or removed:
+		CFG_POOL.dirty = True
+	return (added,modified,removed)
+
+
+def expandConfig(config):
+	## The recordings of a recording configuration: its series rules are kept in CFG_SERIES and
+	## replaced by an entry for each of their airings in the guide
+	global CFG_SERIES
+	CFG_SERIES = dict((name,config[name]) for name in config if 'series' in config[name])
+	recordings = dict((name,config[name]) for name in config if 'series' not in config[name])
+	recordings.update(guideAirings())
+	return recordings
+
+
+def guideAirings():
+	## Entries for the airings of every series rule coming up, plus those being recorded right now
+	## (an airing the guide no longer lists is recorded to its end)
+	if not CFG_GUIDE or not CFG_SERIES:
+		return {}
+	now = time.time()
+	airings = xmltvGuide.seriesAirings(CFG_GUIDE,CFG_SERIES,now,now + CFG_Guide_Horizon,CFG_Guide_Start_Early,CFG_Guide_End_Late,\
+		CFG_CATALOG.episodes() if CFG_CATALOG else ())
+	for name,recording in CFG_RECORDINGS.items():
+		if recording['status'] and recording.get('show') in CFG_SERIES and name not in airings:
+			airings[name] = configWatch.configOf(recording)
+	return airings
+
+
+def loadGuide(index,wanted):
+	## Read the guide into index, keeping the channels wanted() maps to CFG_CHANNELS; None if it
+	## can't be read.  Runs on a thread of its own except at startup.
+	start = time.time()
+	try:
+		index.load(wanted)
+	except (OSError,xmltvGuide.ParseError) as diag:
+		print('ERROR:   FAILED TO READ THE GUIDE %s (%s)' %(index.filename,diag))
+		return None
+	MET_GUIDE_LOAD.observe(time.time() - start)
+	print('INFO:    READ THE GUIDE %s IN %.1f s: %d LISTINGS ON %d CHANNELS (%d LISTINGS ON OTHER CHANNELS LEFT OUT)' %(index.filename,\
+		time.time() - start,len(index.listings),len(index.schedules),index.skipped))
+	return index
+
+
+def guideLoader(scheduler,index,wanted):
+	CFG_GUIDE_LOAD['index'] = loadGuide(index,wanted)
+	## Wake the main loop to use it
+	scheduler.cancel('guide')
+	scheduler.schedule(time.time(),'guide')
+
+
+def checkGuide(scheduler,debug):
+	#################################################################
+	## A changed guide is read on a thread of its own (a big one takes
+	## a while) and swapped in once it is read.  Either way the airings
+	## are worked out again: only those that came, went or changed are
+	## rescheduled, and airings that are over are dropped.
+	#################################################################
+	global CFG_GUIDE
+	scheduler.cancel('guide')
+	scheduler.schedule(time.time() + CFG_Guide_Check_Time,'guide')
+	if 'index' in CFG_GUIDE_LOAD:
+		index = CFG_GUIDE_LOAD.pop('index')
+		del(CFG_GUIDE_LOAD['thread'])
+		signature = CFG_GUIDE_LOAD.pop('signature')
+		if index:
+			if CFG_GUIDE and debug:
+				print('INFO:    THE NEW GUIDE HAS %d NEW, %d CHANGED AND %d REMOVED LISTINGS' %(index.diff(CFG_GUIDE)))
+			CFG_GUIDE = index
+		else:
+			## Not read again until it changes
+			CFG_GUIDE_LOAD['failed'] = signature
+	elif 'thread' not in CFG_GUIDE_LOAD and (CFG_GUIDE is None or CFG_GUIDE.changed()):
+		signature = xmltvGuide.fileSignature(CFG_Guide_File)
+		if signature != CFG_GUIDE_LOAD.get('failed'):
+			if debug:
+				print('INFO:    THE GUIDE %s HAS CHANGED; READING IT' %(CFG_Guide_File))
+			CFG_GUIDE_LOAD['signature'] = signature
+			CFG_GUIDE_LOAD['thread'] = threading.Thread(target=guideLoader,args=(scheduler,xmltvGuide.GuideIndex(CFG_Guide_File),\
+				xmltvGuide.channelMatcher(CFG_CHANNELS)),name='guide-loader')
+			CFG_GUIDE_LOAD['thread'].daemon = True
+			CFG_GUIDE_LOAD['thread'].start()
+
+	start = time.time()
+	recordings = dict((name,configWatch.configOf(CFG_RECORDINGS[name])) for name in CFG_RECORDINGS if 'show' not in CFG_RECORDINGS[name] or \
+		CFG_RECORDINGS[name]['show'] not in CFG_SERIES)
+	recordings.update(guideAirings())
+	added,modified,removed = applyConfig(scheduler,recordings,debug)
+	if debug and (added or modified or removed):
+		print('INFO:    UPDATED THE AIRINGS FROM THE GUIDE IN %.1f ms (%d ADDED, %d MODIFIED, %d REMOVED)' %(\
+			1000.0 * (time.time() - start),len(added),len(modified),len(removed)))
+
+
+def housekeeping(scheduler,debug):
+	#################################################################
+	## Make sure every device is STILL on the network.  Recordings on
+	## a device that dropped off are moved to the other devices;
+	## nothing waits for it to come back.
+	################################################################
+	with MET_DEVICE_CHECK.time():
+		found = detectDevice(debug)
+	for device_id in sorted(CFG_POOL.devices):
+		device = CFG_POOL.devices[device_id]
+		if device_id in found:
+			if not device['online']:
+				print('INFO:    HD HOME RUN DEVICE %s IS ONLINE!' %(device_id))
+			elif debug:
+				## HDhomerun device seems to be OK!
+				print('INFO:    HD HOMERUN DEVICE %s IS STILL ALIVE' %(device_id))
+			CFG_POOL.setOnline(device_id,True)
+			continue
+
+		print('ERROR:   FAILED TO DETECT HD HOME RUN DEVICE %s' %(device_id))
+		if not device['online']:
+			continue
+		CFG_POOL.setOnline(device_id,False)
+		MET_OUTAGES.inc((device_id,))
+		hdhrControl.closeControl(device_id)
+
+		## Reset the recordings on this device to off - it has crapped itself out - and
+		## pick them back up on whatever tuners are left
+		for name in CFG_RECORDINGS:
+			if CFG_RECORDINGS[name].get('device') == device_id and 'handle' in CFG_RECORDINGS[name]:
+				print('NOTICE:  %s WAS ACTIVELY RECORDING.  KILLING RECORDING NOW' %(name))
+				killRecording(CFG_RECORDINGS[name],release=False)
+				scheduleRecording(scheduler,name)
+		for tuner_id in [tuner_id for tuner_id in CFG_WARM if tuner_id[0] == device_id]:
+			coolTuner(tuner_id,release=False)
+		for tuner_id in [tuner_id for tuner_id in CFG_SCANS if tuner_id[0] == device_id]:
+			CFG_SCAN_QUEUE.append((endScan(tuner_id,release=False)['rf'],False))
+
+	scheduler.schedule(time.time() + nextDeviceCheck(),'housekeeping')
+
+
+def enforceRetention(scheduler,debug):
+	#################################################################
+	## Remove recordings older than their show's 'keep_days' and the
+	## oldest recordings while the NAS is too full; never the ones
+	## being recorded right now
+	#################################################################
+	scheduler.schedule(time.time() + CFG_Retention_Check_Time,'retention')
+	policies = dict((showOf(name),CFG_RECORDINGS[name]['keep_days']) for name in CFG_RECORDINGS if 'keep_days' in CFG_RECORDINGS[name])
+	policies.update((name,CFG_SERIES[name]['keep_days']) for name in CFG_SERIES if 'keep_days' in CFG_SERIES[name])
+	protected = set(CFG_RECORDINGS[name]['filename'] for name in CFG_RECORDINGS if 'filename' in CFG_RECORDINGS[name])
+	start = time.time()
+	removed = CFG_RETENTION.run(policies,protected,CFG_Max_Disk_Usage)
+	MET_RETENTION.observe(time.time() - start)
+	MET_REMOVED.inc(amount=removed)
+	if debug:
+		print('INFO:    RETENTION CHECK OF %d RECORDINGS TOOK %.1f ms (%d REMOVED)' %(len(CFG_RETENTION.files),1000.0 * (time.time() - start),removed))
+
+
+def nextDeviceCheck():
+	## Seconds until the devices should be checked again; sooner while one is missing, backing
+	## off while it stays missing when native discovery is used
+	offline = [device_id for device_id in CFG_POOL.devices if not CFG_POOL.devices[device_id]['online']]
+	if not CFG_Native_Discovery:
+		return CFG_Outage_Check_Time if offline else CFG_Dev_Check_Time
+	if offline:
+		return min(CFG_DISCOVERY.retryDelay(device_id) for device_id in offline)
+	return CFG_Probe_Time
+
+
+def adoptHandle(name,entry,muxes):
+	## A handle for a recording the last run left going (see adoptRecordings), or None
+	recording = CFG_RECORDINGS[name]
+	if 'pid' in entry:
+		if not stateJournal.processWriting(entry['pid'],entry['filename']):
+			return None
+		return stateJournal.AdoptedProcess(entry['pid'])
+
+	if not (CFG_Native_Capture and CFG_Native_Control):
+		return None
+	analyzer = tsAnalyzer.TSAnalyzer() if CFG_Analyze_Live else None
+	engine = hdhrCapture.getEngine()
+	try:
+		if 'program' not in entry:
+			return engine.openStream(entry['filename'],analyzer=analyzer,expected_bytes=expectedBytes(recording),policy=CFG_WRITE_POLICY,port=entry['port'])
+		mux = muxes.get(entry['port'])
+		if not mux:
+			mux = muxes[entry['port']] = engine.openMux(port=entry['port'],demux=channelScan.PSIPDemux())
+		return mux.addProgram(entry['program'],entry['filename'],analyzer,expectedBytes(recording),CFG_WRITE_POLICY,keep=streamsOf(recording))
+	except OSError as diag:
+		## Most likely something else has the port now
+		print('WARNING: FAILED TO REOPEN THE CAPTURE OF %s ON PORT %d (%s)' %(name,entry['port'],diag))
+		return None
+
+
+def adoptRecordings(journaled,debug):
+	#################################################################
+	## Pick up the recordings a previous run (that crashed or was
+	## killed) left going.  hdhomerun_config children still saving
+	## are adopted as they are.  In-process captures died with it,
+	## but their tuners are still locked with our key and streaming
+	## to the same port, so a capture is opened on that port and
+	## goes on appending to the same file.  Tuners of anything that
+	## can't be adopted are let go of; the schedule will start those
+	## recordings again the normal way.  Returns the adopted names.
+	#################################################################
+	now = time.time()
+	adopted = []
+	muxes = {}
+	last_write = {}
+	for name in sorted(journaled):
+		entry = journaled[name]
+		if name.startswith((TIMESHIFT_JOURNAL,SCAN_JOURNAL)):
+			## Warm tuners start over with an empty buffer, scans from scratch
+			continue
+		recording = CFG_RECORDINGS.get(name)
+		handle = None
+		if recording is not None and not recording['status'] and recording['unix_start_time'] <= now < recording['unix_stop_time'] and \
+			CFG_POOL.devices.get(entry['device'],{}).get('online') and recording['channel_name'] in CFG_CHANNELS:
+			try:
+				st = os.stat(entry['filename'])
+				last_write[name] = st.st_mtime
+				handle = adoptHandle(name,entry,muxes)
+			except OSError:
+				pass
+		if not handle:
+			print('NOTICE:  NOT ADOPTING THE RECORDING OF %s THE LAST RUN LEFT IN %s' %(name,entry['filename']))
+			continue
+		if hasattr(handle,'counters'):
+			## Count what the last run recorded, so sizes reported for the file stay the size of the file
+			handle.bytes = st.st_size
+		recording['status'] = 'active'
+		recording['handle'] = handle
+		recording['device'] = entry['device']
+		recording['tuner'] = entry['tuner']
+		recording['filename'] = entry['filename']
+		recording['lastCheck'] = now
+		CFG_HEALTH.watch(entry['filename'],name,handle,recording['channel_name'])
+		adopted.append(name)
+
+	## Captures are only really adopted once the stream turns up on the old port; those it doesn't
+	## get a hot restart (retuned under the lock we still hold) and failing that are let go of
+	waiting = [name for name in adopted if hasattr(CFG_RECORDINGS[name]['handle'],'counters')]
+	deadline = time.time() + CFG_Restart_Wait
+	while waiting and time.time() < deadline:
+		time.sleep(0.005)
+		waiting = [name for name in waiting if CFG_RECORDINGS[name]['handle'].counters()['firstData'] is None]
+	for name in list(adopted):
+		recording = CFG_RECORDINGS[name]
+		first_data = recording['handle'].counters()['firstData'] if name not in waiting and hasattr(recording['handle'],'counters') else None
+		if name in waiting and not hotRestart(name,debug):
+			print('NOTICE:  NOTHING IS STREAMING TO THE ADOPTED CAPTURE OF %s; STARTING IT AGAIN' %(name))
+			killRecording(recording)
+			adopted.remove(name)
+			continue
+		print('INFO:    ADOPTED THE RECORDING OF %s IN %s ON TUNER %s%s' %(name,recording['filename'],\
+			tunerPool.tunerName((recording['device'],recording['tuner'])),\
+			' (%d ms GAP)' %(1000.0 * (first_data - last_write[name])) if first_data else ''))
+		if first_data:
+			CFG_CATALOG.restarted(recording['filename'],max(0.0,first_data - last_write[name]))
+
+	## Let go of the tuners nothing was adopted on (a left over child is killed first)
+	held = set((CFG_RECORDINGS[name]['device'],CFG_RECORDINGS[name]['tuner']) for name in adopted)
+	for name in sorted(journaled):
+		entry = journaled[name]
+		if name in adopted:
+			continue
+		if 'pid' in entry and stateJournal.processWriting(entry['pid'],entry['filename']):
+			stateJournal.AdoptedProcess(entry['pid']).kill()
+		tuner_id = (entry['device'],entry['tuner'])
+		if tuner_id in held or not CFG_POOL.devices.get(entry['device'],{}).get('online'):
+			continue
+		held.add(tuner_id)
+		if 'port' in entry:
+			tunerSet(entry['device'],entry['tuner'],'target','none')
+		tunerSet(entry['device'],entry['tuner'],'lockkey','none')
+	CFG_POOL.dirty = True
+	return adopted
+
+
+def collectMetrics(scheduler):
+	## State of the devices, tuners and recordings right now, for a scrape of the metrics server.
+	## Runs on the server's thread, so it only reads, and copes with recordings starting and
+	## stopping under it.
+	online = recorderMetrics.Gauge('recordtv_device_online','1 if the device answers on the network',('device',))
+	tuner_busy = recorderMetrics.Gauge('recordtv_tuner_in_use','1 if a recording holds the tuner',('device','tuner'))
+	tuner_show = recorderMetrics.Gauge('recordtv_tuner_recording','1 for each show being recorded from the tuner',('device','tuner','show'))
+	state = recorderMetrics.Gauge('recordtv_recording_state','1 for the health state each active recording is in',('show','state'))
+	recorded = recorderMetrics.Gauge('recordtv_recording_bytes','Bytes written to the current file of each active recording',('show',))
+	bitrate = recorderMetrics.Gauge('recordtv_recording_bitrate_bps','Rolling bitrate of each active recording (bits/second)',('show',))
+	ts_errors = recorderMetrics.Gauge('recordtv_recording_ts_errors','Transport stream errors in the current file of each active recording',('show','type'))
+	active = recorderMetrics.Gauge('recordtv_recordings_active','Recordings running right now')
+	conflicts = recorderMetrics.Gauge('recordtv_conflicts','Upcoming recordings no tuner is planned for')
+	events = recorderMetrics.Gauge('recordtv_scheduled_events','Timer events queued in the main loop')
+	capture_cpu = recorderMetrics.Counter('recordtv_capture_cpu_seconds_total','CPU time used by the in-process capture thread')
+	buffered = recorderMetrics.Gauge('recordtv_timeshift_buffer_seconds','How far back the timeshift buffer of each warm tuner reaches',('device','tuner','channel'))
+
+	held = {}
+	for name,recording in list(CFG_RECORDINGS.items()):
+		tuner_id = (recording.get('device'),recording.get('tuner'))
+		filename = recording.get('filename')
+		if recording.get('status') != 'active' or None in tuner_id or not filename:
+			continue
+		held.setdefault(tuner_id,[]).append(name)
+		health = CFG_HEALTH.status(filename) if CFG_HEALTH else None
+		if health:
+			state.set(1,(name,health['state']))
+			recorded.set(health['bytes'],(name,))
+			bitrate.set(health['bitrate'],(name,))
+		analyzer = getattr(recording.get('handle'),'analyzer',None)
+		if analyzer:
+			counters = analyzer.counters()
+			for key,kind in (('cc_errors','cc'),('tei_errors','tei'),('sync_errors','sync'),('pcr_jumps','pcr_jump')):
+				ts_errors.set(counters[key],(name,kind))
+
+	for device_id in sorted(CFG_POOL.devices):
+		device = CFG_POOL.devices[device_id]
+		online.set(1 if device['online'] else 0,(device_id,))
+		for tuner in range(device['tuners']):
+			names = held.get((device_id,tuner),())
+			tuner_busy.set(1 if names else 0,(device_id,str(tuner)))
+			for name in names:
+				tuner_show.set(1,(device_id,str(tuner),name))
+	for tuner_id,warm in list(CFG_WARM.items()):
+		buffered.set(warm['mux'].ring.seconds(),(tuner_id[0],str(tuner_id[1]),warm['channel_name']))
+
+	active.set(sum(len(names) for names in held.values()))
+	conflicts.set(len(CFG_POOL.conflicts))
+	events.set(len(scheduler))
+	if CFG_Native_Capture:
+		capture_cpu.inc(amount=hdhrCapture.getEngine().cpu_time)
+	return [online,tuner_busy,tuner_show,state,recorded,bitrate,ts_errors,active,conflicts,events,capture_cpu,buffered]
+
+
+def startRecorder(debug):
+	#################################################################
+	## Everything that happens once the recording configuration is
+	## loaded: make sure at least one HDhomerun device is on the
+	## network, start the monitors and queue the first timer events.
+	## Returns the scheduler.
+	#################################################################
+	global CFG_HEALTH,CFG_CATALOG,CFG_RETENTION,CFG_METRICS_SERVER,CFG_JOURNAL,CFG_LOCKKEY,CFG_LINEUP
+	CFG_POOL.multiplex = multiplexOf
+
+	## The cached lineup says where every channel is without tuning anything; it is re-checked
+	## in the background
+	CFG_LINEUP = channelScan.Lineup(CFG_Lineup_File)
+	lineup_start = time.time()
+	if CFG_LINEUP.load():
+		applyLineup(debug)
+		print('INFO:    LOADED THE CHANNEL LINEUP IN %.1f ms (%d VIRTUAL CHANNELS ON %d RF CHANNELS)' %(1000.0 * (time.time() - lineup_start),\
+			len(CFG_LINEUP.virtuals()),len(CFG_LINEUP.channels)))
+	else:
+		print('NOTICE:  NO CHANNEL LINEUP IN %s; USING CFG_CHANNELS AS CONFIGURED UNTIL IT IS CHECKED' %(CFG_Lineup_File))
+
+	## The tuners a previous run still has locked can only be used (or let go of) with its lockkey
+	CFG_JOURNAL = stateJournal.StateJournal(CFG_Journal_File)
+	journal_start = time.time()
+	lockkey,journaled = CFG_JOURNAL.replay()
+	if lockkey:
+		CFG_LOCKKEY = lockkey
+	if debug and (lockkey or journaled):
+		print('INFO:    REPLAYED THE STATE JOURNAL IN %.1f ms (%d RECORDINGS WERE ACTIVE)' %(1000.0 * (time.time() - journal_start),len(journaled)))
+
+	for device_id in CFG_DEVICES:
+		CFG_POOL.addDevice(device_id,CFG_DEVICES[device_id].get('ip'),CFG_DEVICES[device_id].get('tuners',CFG_Num_Tuners),CFG_HDHRPort)
+		CFG_DISCOVERY.remember(device_id,CFG_DEVICES[device_id].get('ip'))
+	while True:
+		found = detectDevice(debug)
+		if not found:
+			print('ERROR:   FAILED TO DETECT ANY HD HOME RUN DEVICE (%s)' %(', '.join(sorted(CFG_POOL.devices))))
+			print('NOTICE:  SLEEPING 10 SECONDS')
+			time.sleep(10)
+		else:
+			for device_id in sorted(CFG_POOL.devices):
+				if device_id in found:
+					print('INFO:    FOUND HD HOMERUN DEVICE %s WITH %d TUNERS' %(device_id,CFG_POOL.devices[device_id]['tuners']))
+					CFG_POOL.setOnline(device_id,True)
+				else:
+					print('WARNING: FAILED TO DETECT HD HOME RUN DEVICE %s' %(device_id))
+			lastDeviceDetectTime = time.time()
+			break
+	print('INFO:    CFG_LOCKKEY IS %s' %(CFG_LOCKKEY))
+
+	scheduler = eventScheduler.EventScheduler()
+
+	## Problems spotted by the health monitor trigger an immediate check of that recording
+	expected_rates = dict((channel_name,CFG_CHANNELS[channel_name]['bitrate']) for channel_name in CFG_CHANNELS if 'bitrate' in CFG_CHANNELS[channel_name])
+	CFG_HEALTH = streamHealth.HealthMonitor(lambda name,filename,state: scheduler.schedule(time.time(),'check',name),expected_rates)
+	CFG_CATALOG = recordingCatalog.RecordingCatalog(CFG_Catalog_File)
+
+	## Recordings the last run left going are picked up before anything is scheduled
+	adopted = adoptRecordings(journaled,debug) if journaled else []
+	CFG_JOURNAL.compact(CFG_LOCKKEY,dict((name,journalEntry(name)) for name in adopted))
+	interrupted = CFG_CATALOG.abandon([CFG_RECORDINGS[name]['filename'] for name in adopted])
+	if interrupted:
+		print('NOTICE:  %d RECORDINGS WERE NOT FINISHED BY THE LAST RUN' %(interrupted))
+
+	for name in CFG_RECORDINGS:
+		scheduleRecording(scheduler,name)
+	scheduler.schedule(lastDeviceDetectTime + nextDeviceCheck(),'housekeeping')
+	scheduler.schedule(time.time() + CFG_Config_Check_Time,'config')
+	scheduler.schedule(time.time(),'lineup')
+	if CFG_Guide_File:
+		scheduler.schedule(time.time() + CFG_Guide_Check_Time,'guide')
+
+	## The first retention pass also brings the catalog up to date with the NAS before anything starts
+	CFG_RETENTION = retention.RetentionEngine(CFG_Save_Dir,CFG_CATALOG)
+	for name in adopted:
+		CFG_RETENTION.add(CFG_RECORDINGS[name]['filename'],showOf(name))
+	enforceRetention(scheduler,debug)
+	planTuners(debug)
+	warmTuners(debug)
+
+	CFG_METRICS.addCollector(lambda: collectMetrics(scheduler))
+	if CFG_Metrics_Port:
+		try:
+			CFG_METRICS_SERVER = recorderMetrics.MetricsServer(CFG_METRICS,CFG_Metrics_Bind,CFG_Metrics_Port)
+			print('INFO:    SERVING METRICS ON http://%s:%d/metrics' %(CFG_Metrics_Bind or '0.0.0.0',CFG_METRICS_SERVER.server_address[1]))
+		except OSError as diag:
+			print('WARNING: FAILED TO START THE METRICS SERVER ON PORT %s (%s)' %(CFG_Metrics_Port,diag))
+	return scheduler
+
+
+def handleEvents(scheduler,events,debug):
+	## Handle every timer event that came due at once
+	handle_start = time.time()
+	if events:
+		MET_LOOP_LAG.observe(max(0.0,handle_start - min(event.when for event in events)))
+	starts = []
+	for event in events:
+		if event.key is not None and event.key not in CFG_RECORDINGS:
+			continue
+
+		if event.kind == 'start':
+			starts.append(event.key)
+
+		elif event.kind == 'stop':
+			if CFG_RECORDINGS[event.key]['status'] == 'active':
+				print('INFO:    ENDING RECORDING OF %s' %(event.key))
+				killRecording(CFG_RECORDINGS[event.key])
+				## Recorded to its end: a 'new_only' series rule doesn't record it again
+				if CFG_RECORDINGS[event.key].get('episode') and showOf(event.key) in CFG_SERIES:
+					CFG_CATALOG.recordedEpisode(showOf(event.key),CFG_RECORDINGS[event.key]['episode'])
+			scheduleRecording(scheduler,event.key)
+
+		elif event.kind == 'check':
+			if CFG_RECORDINGS[event.key]['status'] == 'active':
+				checkRecording(scheduler,event.key,debug)
+
+		elif event.kind == 'reschedule':
+			updateUnixTimes(CFG_RECORDINGS,debug,[event.key])
+			scheduleRecording(scheduler,event.key)
+
+	## Stops were handled first so their tuners are free for back to back shows
+	if starts and not startRecordings(scheduler,starts,debug):
+		## Force a device check now
+		scheduler.cancel('housekeeping')
+		scheduler.schedule(time.time(),'housekeeping')
+
+	if [event for event in events if event.kind == 'config']:
+		reloadConfig(scheduler,CFG_CONFIG,debug)
+
+	if [event for event in events if event.kind == 'housekeeping']:
+		housekeeping(scheduler,debug)
+
+	if [event for event in events if event.kind == 'retention']:
+		enforceRetention(scheduler,debug)
+
+	if [event for event in events if event.kind == 'guide']:
+		checkGuide(scheduler,debug)
+
+	if [event for event in events if event.kind == 'lineup']:
+		checkLineup(debug)
+		scheduler.schedule(time.time() + CFG_Lineup_Check_Time,'lineup')
+
+	## Scans run a step at a time between everything else
+	if [event for event in events if event.kind in ('lineup','scan')]:
+		delay = scanStep(debug)
+		scheduler.cancel('scan')
+		if delay is not None:
+			scheduler.schedule(time.time() + delay,'scan')
+
+	## Anything that changed the schedule or the tuners gets the plan redone, and whatever
+	## tuners are left idle are put back to work buffering the warm channels
+	planTuners(debug)
+	warmTuners(debug)
+	MET_LOOP.observe(time.time() - handle_start)
 
 
 if __name__ == '__main__':
 	debug = 0
 	confg_filename = None
+	scan = False
 
 	#################################################################
 	## Get all of the command line options
 	#################################################################
 	try:
-		opts, args = getopt.getopt(sys.argv[1:], 'hc:d:', ['help', 'config=','debug='])
+		opts, args = getopt.getopt(sys.argv[1:], 'hc:d:m:g:s', ['help', 'config=','debug=','metrics=','guide=','scan'])
 	except getopt.GetoptError as err:
 		# print help information and exit:
 		print(str(err)) # will print something like "option -a not recognized"
@@ -242,9 +1830,18 @@ if __name__ == '__main__':
 			debug = int(arg)
 		elif opt in ('-c', '--config'):
 			confg_filename = arg
+		elif opt in ('-m', '--metrics'):
+			CFG_Metrics_Port = int(arg)
+		elif opt in ('-g', '--guide'):
+			CFG_Guide_File = arg
+		elif opt in ('-s', '--scan'):
+			scan = True
 		else:
 			assert False, 'unhandled option'
 
+	if scan:
+		sys.exit(0 if scanChannels(debug) else 1)
+
 	if not confg_filename:
 		print('ERROR:   FAILED TO SPECIFY A RECORDING CONFIGURATION FILE')
 		sys.exit(3)
@@ -255,228 +1852,25 @@ if __name__ == '__main__':
 	if debug > 2:
 		print('INFO:    Attempting to open configuration file ' + confg_filename)
 
-	CFG_RECORDINGS = readRecordingConfig(confg_filename)
+	CFG_CONFIG = configWatch.ConfigWatcher(confg_filename)
+	try:
+		config = CFG_CONFIG.load()
+	except (OSError,ValueError) as diag:
+		print('ERROR:   FAILED TO READ RECORDING CONFIGURATION %s (%s)' %(confg_filename,diag))
+		sys.exit(3)
+	if CFG_Guide_File:
+		CFG_GUIDE = loadGuide(xmltvGuide.GuideIndex(CFG_Guide_File),xmltvGuide.channelMatcher(CFG_CHANNELS))
+	CFG_RECORDINGS = expandConfig(config)
 	updateUnixTimes(CFG_RECORDINGS,debug)
 
 	if debug > 2:
 		pprint.pprint(CFG_RECORDINGS)
 
 	#################################################################
-	## Make sure the HDhomerun device is on the network
+	## The main body of the process.  Sleep until the next timer event
+	## (start, stop, recording check, config check, housekeeping) is due and handle
+	## everything that is due at once
 	#################################################################
+	scheduler = startRecorder(debug)
 	while True:
-		if detectDevice(debug) < 0:
-			print('ERROR:   FAILED TO DETECT HD HOME RUN DEVICE %s' %(CFG_HDHRID))
-			print('NOTICE:  SLEEPING 10 SECONDS')
-			time.sleep(10)
-		else:
-			print('INFO:    FOUND HD HOMERUN DEVICE %s' %(CFG_HDHRID))
-			lastDeviceDetectTime = time.time()
-			break
-	print('INFO:    CFG_LOCKKEY IS %s' %(CFG_LOCKKEY))
-
-	#################################################################
-	## The main body of the process.  Loop forever, checking the
-	## status of the HDhomerun device, active recordings, and
-	## re-reading the recording configuration file periodically
-	#################################################################
-	while True:
-		ymd  = time.strftime('%Y-%m-%d')
-		day  = time.strftime('%a')
-		hour = time.strftime('%H')
-		mins = time.strftime('%M')
-
-		for name in CFG_RECORDINGS:
-			recording = CFG_RECORDINGS[name]
-
-			if debug > 2:
-				print('INFO:    RECORD DURATION FOR %s IS %02d:%02d HOURS' %(\
-				name,math.floor((recording['unix_stop_time'] - recording['unix_start_time']) / 3600),math.fmod((recording['unix_stop_time'] - recording['unix_start_time']),3600) / 60))
-
-			#################################################################
-			## Check to see if we need to start recording this show
-			#################################################################
-			if time.time() > recording['unix_start_time'] and time.time() < recording['unix_stop_time'] and type(CFG_RECORDINGS[name]['status']) == type(None):
-				if debug:
-					print('INFO:    ATTEMPTING TO RECORD %s' %(name))
-
-				## Find an open tuner on the HDhomerun device (based on our internal tracking of what
-				## we're currently recording)
-				avail_tuners = findOpenTuner(debug)
-				if len(avail_tuners) == 0:
-					print('ERROR:   FAILED TO FIND AN OPEN TUNER TO RECORD %s' %(name))
-					continue
-				else:
-					## Pick the first available tuner
-					tuner = avail_tuners[0]
-					if debug:
-						print('INFO:    ASSIGNING %s TO TUNER %d' %(name,tuner))
-
-				#################################################################
-				## Determine channel information and change the assigned tuner
-				## to the proper channel
-				#################################################################
-				channel = CFG_CHANNELS[CFG_RECORDINGS[name]['channel_name']]['channel']
-				subchannel = CFG_CHANNELS[CFG_RECORDINGS[name]['channel_name']]['subchannel']
-
-				forceCheck = False
-				if not changeChannel(tuner,channel,subchannel):
-					print('WARNING: FAILED TO SET CHANNEL TO RECORD %s ON TUNER %d' %(name,tuner))
-					if len(avail_tuners) > 1:
-						tuner = avail_tuners[1]
-						if debug:
-							print('INFO:    ASSIGNING %s TO TUNER %d' %(name,tuner))
-						if not changeChannel(tuner,channel,subchannel):
-							forceCheck = True
-					else:
-						forceCheck = True
-
-				if forceCheck:
-					del(forceCheck)
-					## Force a device check at the end of this while loop
-					lastDeviceDetectTime = time.time() - (2 * CFG_Dev_Check_Time)
-					break
-
-				#################################################################
-				## Start recording the stream to disk
-				#################################################################
-				proc_handle,filename = saveChannel(tuner,name,recording['filename_prefix'])
-				if not proc_handle:
-					print('WARNING: FAILED TO START RECORDING %s ON TUNER %d' %(name,tuner))
-
-					## Force a device check at the end of this while loop
-					lastDeviceDetectTime = time.time() - (2 * CFG_Dev_Check_Time)
-					break
-
-				CFG_RECORDINGS[name]['status']    = 'active'
-				CFG_RECORDINGS[name]['handle']    = proc_handle
-				CFG_RECORDINGS[name]['tuner']     = tuner
-				CFG_RECORDINGS[name]['filename']  = filename
-				CFG_RECORDINGS[name]['lastCheck'] = time.time()
-				print('INFO:    STARTED RECORDING %s TO %s' %(name,CFG_RECORDINGS[name]['filename']))
-
-			#################################################################
-			## Check to make sure an active recording is working properly or
-			## if it needs to be stopped
-			#################################################################
-			elif recording['status'] == 'active':
-				if time.time() >= recording['unix_stop_time']:
-					print('INFO:    ENDING RECORDING OF %s' %(name))
-					killRecording(CFG_RECORDINGS[name])
-
-				elif (time.time() - recording['lastCheck']) > CFG_Rec_Check_Time:
-					## Check to make sure the recording file is growing
-					if not os.path.exists(CFG_RECORDINGS[name]['filename']):
-						print('ERROR:   FAILED TO FIND FILE %s' %(CFG_RECORDINGS[name]['filename']))
-						print('NOTICE:  KILLING RECORDING FOR %s' %(name))
-
-						## Kill the recording now; the next iteration will restart it
-						killRecording(CFG_RECORDINGS[name])
-						continue
-
-					initial_size = os.stat(CFG_RECORDINGS[name]['filename'])[stat.ST_SIZE]
-					time.sleep(1.5)
-
-					if os.stat(CFG_RECORDINGS[name]['filename'])[stat.ST_SIZE] == initial_size:
-						print('ERROR:   FAILED TO DETECT GROWING FILE %s' %(CFG_RECORDINGS[name]['filename']))
-						print('NOTICE:  KILLING RECORDING FOR %s' %(name))
-
-						## Kill the recording now; the next iteration will restart it
-						killRecording(CFG_RECORDINGS[name])
-
-					else:
-						CFG_RECORDINGS[name]['lastCheck'] = time.time()
-
-			elif debug > 2:
-				print('NOTICE:  NOTHING TO DO FOR PROGRAM %s' %(name))
-
-		#################################################################
-		##  Do some housekeeping every CFG_Dev_Check_Time seconds
-		#################################################################
-		if (time.time() - lastDeviceDetectTime) >= CFG_Dev_Check_Time:
-
-			#################################################################
-			## Find new recording configurations
-			#################################################################
-			tmp = readRecordingConfig(confg_filename)
-			for name in tmp:
-				## If we already have this recording in our list, check to see if the
-				## configuration is different.  If so, replace it's configuration
-				## with whatever is in the updated configuration file
-				if name in list(CFG_RECORDINGS.keys()):
-					if not CFG_RECORDINGS[name]['status'] and (CFG_RECORDINGS[name]['start'] != tmp[name]['start'] or CFG_RECORDINGS[name]['end'] != tmp[name]['end'] or CFG_RECORDINGS[name]['day'] != tmp[name]['day']):
-						print('NOTICE:  MODIFYING RECORDING INFORMATION FOR %s' %(name))
-
-						if CFG_RECORDINGS[name]['status']:
-							tmp[name]['status']    = 'active'
-							tmp[name]['handle']    = CFG_RECORDINGS[name]['handle']
-							tmp[name]['handle']    = CFG_RECORDINGS[name]['tuner']
-							tmp[name]['filename']  = CFG_RECORDINGS[name]['filename']
-							tmp[name]['lastCheck'] = CFG_RECORDINGS[name]['lastCheck']
-						else:
-							tmp[name]['status'] = None
-
-						CFG_RECORDINGS[name] = tmp[name]
-
-						if CFG_RECORDINGS[name]['status']:
-							updateUnixTimes(CFG_RECORDINGS,0)
-
-							if time.time() < CFG_RECORDINGS[name]['unix_start_time'] or time.time() > CFG_RECORDINGS[name]['unix_stop_time']:
-								print('NOTICE:  %s WAS ACTIVELY RECORDING.  KILLING RECORDING NOW' %(name))
-								killRecording(CFG_RECORDINGS[name])
-				else:
-					## This is a new entry
-					print('INFO:    ADDING NEW RECORDING INFORMATION FOR %s' %(name))
-					CFG_RECORDINGS[name] = tmp[name]
-
-			#################################################################
-			## Remove unused recording configurations.  Kill the recording if
-			## it's actively recording
-			#################################################################
-			del_list = []
-			for name in CFG_RECORDINGS:
-				if name not in list(tmp.keys()):
-					print('NOTICE:  DELETING RECORDING CONFIGURATION FOR %s' %(name))
-
-					## If this is an active recording, kill the recording now
-					if CFG_RECORDINGS[name]['status']:
-						print('NOTICE:  WAS ACTIVELY RECORDING.  KILLING RECORDING NOW' %(name))
-						killRecording(CFG_RECORDINGS[name])
-
-					## Add the show to the deletion list
-					del_list.append(name)
-
-			for name in del_list:
-				del(CFG_RECORDINGS[name])
-
-			updateUnixTimes(CFG_RECORDINGS,1 if debug > 1 else 0)
-
-			if debug > 2:
-				pprint.pprint(CFG_RECORDINGS)
-
-			#################################################################
-			## Make sure the device is STILL on the network
-			################################################################
-			if detectDevice(debug) < 0:
-				print('ERROR:   FAILED TO DETECT HD HOME RUN DEVICE %s' %(CFG_HDHRID))
-
-				## Reset all of the active recordings to off - the device has crapped itself out
-				for name in CFG_RECORDINGS:
-					if 'handle' in CFG_RECORDINGS[name] and type(CFG_RECORDINGS[name]['handle']) != type(None):
-						print('NOTICE:  WAS ACTIVELY RECORDING.  KILLING RECORDING NOW' %(name))
-						killRecording(CFG_RECORDINGS[name])
-
-				## Wait forever until the device comes back online before proceeding
-				while detectDevice(debug) < 0:
-					print('ERROR:   FAILED TO DETECT HD HOME RUN DEVICE %s' %(CFG_HDHRID))
-					time.sleep(10)
-				print('INFO:    HD HOME RUN DEVICE %s IS BACK ONLINE!' %(CFG_HDHRID))
-
-			else:
-				## HDhomerun device seems to be OK!
-				lastDeviceDetectTime = time.time()
-				if debug:
-					print('INFO:    HD HOMERUN DEVICE %s IS STILL ALIVE' %(CFG_HDHRID))
-
-		time.sleep(1)
-
+		handleEvents(scheduler,scheduler.waitForEvents(),debug)
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+##########################################################################
+##
+##  Metrics for the recorder, served over a local HTTP port
+##
+##  Goals:
+##                      Let the recorder be watched (Prometheus, curl, a
+##                      dashboard) instead of reading its log: tuner and
+##                      device state, bytes/bitrate/TS errors of every
+##                      recording, and how long tuning, device checks,
+##                      config reloads and the main loop take
+##
+##                      Cheap enough to leave on all the time on a
+##                      BeagleBone: recording an event is a dict update
+##                      (counters) or a bisect plus a dict update
+##                      (histograms) under a lock; everything else
+##                      (state of tuners and recordings) is only looked at
+##                      when somebody scrapes
+##
+##  Served by MetricsServer:
+##                      /metrics        Prometheus text format (0.0.4)
+##                      /metrics.json   the same as a JSON snapshot
+##
+##########################################################################
+import bisect
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+## Seconds; wide enough for both a UDP round trip and a hdhomerun_config fork on a busy NAS
+DEFAULT_BUCKETS = (0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1.0,2.5,5.0,10.0,30.0)
+
+TEXT_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+JSON_CONTENT_TYPE = 'application/json'
+
+
+def escapeLabel(value):
+	return str(value).replace('\\','\\\\').replace('\n','\\n').replace('"','\\"')
+
+
+def formatLabels(names,values,extra=None):
+	pairs = ['%s="%s"' %(name,escapeLabel(value)) for name,value in zip(names,values)]
+	if extra:
+		pairs.append('%s="%s"' %extra)
+	return '{%s}' %(','.join(pairs)) if pairs else ''
+
+
+def formatValue(value):
+	if value == float('inf'):
+		return '+Inf'
+	if isinstance(value,float) and value.is_integer() and abs(value) < 1e15:
+		return str(int(value))
+	return repr(value)
+
+
+class Metric(object):
+	kind = 'untyped'
+
+	def __init__(self,name,help,labelnames=()):
+		self.name = name
+		self.help = help
+		self.labelnames = tuple(labelnames)
+		self.values = {}        ## tuple of label values -> value
+		self.lock = threading.Lock()
+
+	def remove(self,labels):
+		with self.lock:
+			self.values.pop(tuple(labels),None)
+
+	def samples(self):
+		## [(labels,value)] as it is right now
+		with self.lock:
+			return list(self.values.items())
+
+	def render(self,lines):
+		for labels,value in sorted(self.samples()):
+			lines.append('%s%s %s' %(self.name,formatLabels(self.labelnames,labels),formatValue(value)))
+
+	def snapshot(self):
+		return [{'labels':dict(zip(self.labelnames,labels)),'value':value} for labels,value in sorted(self.samples())]
+
+
+class Counter(Metric):
+	kind = 'counter'
+
+	def inc(self,labels=(),amount=1):
+		with self.lock:
+			self.values[labels] = self.values.get(labels,0) + amount
+
+
+class Gauge(Metric):
+	kind = 'gauge'
+
+	def set(self,value,labels=()):
+		with self.lock:
+			self.values[labels] = value
+
+
+class Histogram(Metric):
+	kind = 'histogram'
+
+	def __init__(self,name,help,labelnames=(),buckets=DEFAULT_BUCKETS):
+		Metric.__init__(self,name,help,labelnames)
+		self.buckets = tuple(sorted(buckets))
+
+	def observe(self,value,labels=()):
+		## Per bucket (not cumulative) counts; they are summed up when rendered
+		index = bisect.bisect_left(self.buckets,value)
+		with self.lock:
+			entry = self.values.get(labels)
+			if entry is None:
+				entry = self.values[labels] = [[0] * (len(self.buckets) + 1),0.0,0]
+			entry[0][index] += 1
+			entry[1] += value
+			entry[2] += 1
+
+	def time(self,labels=()):
+		return Timer(self,labels)
+
+	def samples(self):
+		with self.lock:
+			return [(labels,(list(counts),total,count)) for labels,(counts,total,count) in self.values.items()]
+
+	def cumulative(self,counts):
+		running = 0
+		result = []
+		for bound,count in zip(self.buckets + (float('inf'),),counts):
+			running += count
+			result.append((bound,running))
+		return result
+
+	def render(self,lines):
+		for labels,(counts,total,count) in sorted(self.samples()):
+			for bound,running in self.cumulative(counts):
+				lines.append('%s_bucket%s %d' %(self.name,formatLabels(self.labelnames,labels,('le',formatValue(float(bound)))),running))
+			lines.append('%s_sum%s %s' %(self.name,formatLabels(self.labelnames,labels),formatValue(total)))
+			lines.append('%s_count%s %d' %(self.name,formatLabels(self.labelnames,labels),count))
+
+	def snapshot(self):
+		return [{'labels':dict(zip(self.labelnames,labels)),'sum':total,'count':count,\
+			'buckets':dict((formatValue(float(bound)),running) for bound,running in self.cumulative(counts))}\
+			for labels,(counts,total,count) in sorted(self.samples())]
+
+
+class Timer(object):
+	"""with histogram.time(labels): ... observes how long the block took"""
+
+	def __init__(self,histogram,labels):
+		self.histogram = histogram
+		self.labels = labels
+
+	def __enter__(self):
+		self.start = time.time()
+		return self
+
+	def __exit__(self,*exc):
+		self.histogram.observe(time.time() - self.start,self.labels)
+		return False
+
+
+class Registry(object):
+	def __init__(self):
+		self.metrics = []
+		self.collectors = []
+		self.lock = threading.Lock()
+
+	def register(self,metric):
+		with self.lock:
+			self.metrics.append(metric)
+		return metric
+
+	def counter(self,name,help,labelnames=()):
+		return self.register(Counter(name,help,labelnames))
+
+	def gauge(self,name,help,labelnames=()):
+		return self.register(Gauge(name,help,labelnames))
+
+	def histogram(self,name,help,labelnames=(),buckets=DEFAULT_BUCKETS):
+		return self.register(Histogram(name,help,labelnames,buckets))
+
+	def addCollector(self,collector):
+		## collector() is called at scrape time and returns metrics describing the state right then
+		with self.lock:
+			self.collectors.append(collector)
+
+	def collect(self):
+		with self.lock:
+			metrics = list(self.metrics)
+			collectors = list(self.collectors)
+		for collector in collectors:
+			try:
+				metrics.extend(collector())
+			except Exception as diag:
+				## A scrape must never take the recorder down; the next one will probably work
+				print('WARNING: METRICS COLLECTOR %s FAILED (%s)' %(getattr(collector,'__name__',collector),diag))
+		return metrics
+
+	def render(self):
+		lines = []
+		for metric in self.collect():
+			lines.append('# HELP %s %s' %(metric.name,metric.help.replace('\\','\\\\').replace('\n','\\n')))
+			lines.append('# TYPE %s %s' %(metric.name,metric.kind))
+			metric.render(lines)
+		return '\n'.join(lines) + '\n'
+
+	def snapshot(self):
+		return {'time':time.time(),'metrics':dict((metric.name,{'type':metric.kind,'help':metric.help,'samples':metric.snapshot()})\
+			for metric in self.collect())}
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+	def do_GET(self):
+		path = self.path.split('?')[0]
+		if path in ('/','/metrics'):
+			self.reply(self.server.registry.render(),TEXT_CONTENT_TYPE)
+		elif path == '/metrics.json':
+			self.reply(json.dumps(self.server.registry.snapshot(),sort_keys=True),JSON_CONTENT_TYPE)
+		else:
+			self.send_error(404)
+
+	def reply(self,body,content_type):
+		body = body.encode('utf-8')
+		self.send_response(200)
+		self.send_header('Content-Type',content_type)
+		self.send_header('Content-Length',str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self,format,*args):
+		pass
+
+
+class MetricsServer(ThreadingHTTPServer):
+	daemon_threads = True
+
+	def __init__(self,registry,address='127.0.0.1',port=0):
+		ThreadingHTTPServer.__init__(self,(address,port),MetricsHandler)
+		self.registry = registry
+		self.thread = threading.Thread(target=self.serve_forever,name='metrics-http')
+		self.thread.daemon = True
+		self.thread.start()
+
+	def stop(self):
+		self.shutdown()
+		self.server_close()
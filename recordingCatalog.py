@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+##########################################################################
+##
+##  Catalog of every recording (SQLite)
+##
+##  Goals:
+##                      Remember what was recorded instead of rebuilding
+##                      it from file names and stat() calls on the NAS:
+##                      show, channel, tuner, start/stop, bytes, duration,
+##                      PCR start/end, TS error counts and restart
+##                      segments of every file
+##
+##                      Answer the questions the recorder asks over and
+##                      over (is this file name taken, what does a show
+##                      have on disk, what is oldest) from an index
+##
+##                      Written incrementally while a recording runs, in
+##                      WAL mode so a write is one append to the log and
+##                      readers never wait on it
+##
+##  The catalog has to live on a local disk: WAL needs shared memory,
+##  which network mounts (the NAS) can't provide.
+##
+##  A show that is restarted part way through (device reboot, bad
+##  stream, ...) ends up in several files; they share the scheduled
+##  start of the airing ('occurrence') and are numbered by 'segment'.
+##  A hot restart (same tuner, same file) doesn't start a segment; it is
+##  counted in 'restarts' and what it lost is added up in 'gap_ms'.
+##
+##  The episodes series rules have recorded are kept apart from the
+##  recordings, so a 'new_only' rule still knows it has an episode after
+##  retention has removed the file.
+##
+##  Usage:
+##                      recordingCatalog.py [-s show] [catalog.db]
+##
+##########################################################################
+import os
+import sys
+import getopt
+import sqlite3
+import threading
+import contextlib
+import time
+
+DEFAULT_CATALOG = os.path.expanduser('~/.recordTV.db')
+SCHEMA_VERSION  = 3
+
+STATUS_RECORDING   = 'recording'
+STATUS_DONE        = 'done'
+STATUS_INTERRUPTED = 'interrupted'   ## Still 'recording' when the recorder last stopped
+STATUS_FOUND       = 'found'         ## Found on disk; not recorded by this catalog
+
+SCHEMA = (
+	'''CREATE TABLE IF NOT EXISTS recordings (
+		path        TEXT PRIMARY KEY,
+		show        TEXT NOT NULL,
+		channel     TEXT,
+		device      TEXT,
+		tuner       INTEGER,
+		program     INTEGER,
+		occurrence  REAL,
+		segment     INTEGER NOT NULL DEFAULT 0,
+		start_time  REAL,
+		stop_time   REAL,
+		bytes       INTEGER NOT NULL DEFAULT 0,
+		mtime       REAL,
+		duration    REAL,
+		pcr_start   INTEGER,
+		pcr_end     INTEGER,
+		pcr_seconds REAL,
+		cc_errors   INTEGER NOT NULL DEFAULT 0,
+		tei_errors  INTEGER NOT NULL DEFAULT 0,
+		sync_errors INTEGER NOT NULL DEFAULT 0,
+		pcr_jumps   INTEGER NOT NULL DEFAULT 0,
+		status      TEXT NOT NULL,
+		restarts    INTEGER NOT NULL DEFAULT 0,
+		gap_ms      REAL NOT NULL DEFAULT 0)''',
+	'CREATE INDEX IF NOT EXISTS recordings_by_show ON recordings (show,mtime)',
+	'CREATE INDEX IF NOT EXISTS recordings_by_occurrence ON recordings (show,occurrence)',
+	'''CREATE TABLE IF NOT EXISTS directories (
+		show        TEXT PRIMARY KEY,
+		mtime_ns    INTEGER NOT NULL)''',
+	'''CREATE TABLE IF NOT EXISTS episodes (
+		show        TEXT NOT NULL,
+		episode     TEXT NOT NULL,
+		recorded    REAL,
+		PRIMARY KEY (show,episode))''',
+)
+
+## Brings a catalog written with schema version n-1 up to version n
+MIGRATIONS = {
+	2: ('ALTER TABLE recordings ADD COLUMN restarts INTEGER NOT NULL DEFAULT 0',
+	    'ALTER TABLE recordings ADD COLUMN gap_ms REAL NOT NULL DEFAULT 0'),
+	3: (),   ## The episodes table (created with the rest of SCHEMA)
+}
+
+COLUMNS = ('path','show','channel','device','tuner','program','occurrence','segment','start_time','stop_time',\
+	'bytes','mtime','duration','pcr_start','pcr_end','pcr_seconds','cc_errors','tei_errors','sync_errors','pcr_jumps','status',\
+	'restarts','gap_ms')
+
+
+class RecordingCatalog(object):
+	def __init__(self,filename=DEFAULT_CATALOG):
+		self.filename = filename
+		self.lock = threading.RLock()
+		self.depth = 0
+		## Capture start-up threads pick file names through the catalog too
+		self.db = sqlite3.connect(filename,timeout=10,check_same_thread=False)
+		self.db.execute('PRAGMA journal_mode=WAL')
+		self.db.execute('PRAGMA synchronous=NORMAL')
+		version = self.db.execute('PRAGMA user_version').fetchone()[0]
+		if version > SCHEMA_VERSION:
+			raise ValueError('%s was written by a newer recorder (schema %d)' %(filename,version))
+		for upgrade in range(version + 1,SCHEMA_VERSION + 1) if version else ():
+			for statement in MIGRATIONS[upgrade]:
+				self.db.execute(statement)
+		for statement in SCHEMA:
+			self.db.execute(statement)
+		self.db.execute('PRAGMA user_version=%d' %(SCHEMA_VERSION))
+		self.db.commit()
+
+	def close(self):
+		with self.lock:
+			self.db.close()
+
+	#################################################################
+	## Writes commit right away unless they are part of a batch()
+	#################################################################
+	@contextlib.contextmanager
+	def batch(self):
+		## Everything written inside is committed once, at the end
+		with self.lock:
+			self.depth += 1
+			try:
+				yield self
+			except:
+				self.depth -= 1
+				if not self.depth:
+					self.db.rollback()
+				raise
+			self.depth -= 1
+			if not self.depth:
+				self.db.commit()
+
+	def write(self,sql,params=()):
+		with self.lock:
+			cursor = self.db.execute(sql,params)
+			if not self.depth:
+				self.db.commit()
+			return cursor.rowcount
+
+	def writeMany(self,sql,rows):
+		with self.lock:
+			self.db.executemany(sql,rows)
+			if not self.depth:
+				self.db.commit()
+
+	def query(self,sql,params=()):
+		with self.lock:
+			return self.db.execute(sql,params).fetchall()
+
+	#################################################################
+	## Recordings made by the recorder
+	#################################################################
+	def begin(self,path,show,channel=None,device=None,tuner=None,program=None,occurrence=None,now=None):
+		## A new file of show; files of the same occurrence (airing) are its restart segments
+		if now is None:
+			now = time.time()
+		with self.batch():
+			segment = self.query('SELECT COUNT(*) FROM recordings WHERE show = ? AND occurrence = ? AND path != ?',(show,occurrence,path))[0][0]
+			self.write('INSERT OR REPLACE INTO recordings (path,show,channel,device,tuner,program,occurrence,segment,start_time,mtime,status) '\
+				'VALUES (?,?,?,?,?,?,?,?,?,?,?)',(path,show,channel,device,tuner,program,occurrence,segment,now,now,STATUS_RECORDING))
+		return segment
+
+	def update(self,path,size=None,counters=None,now=None,status=None):
+		## Progress of a running recording; counters are those of its TSAnalyzer
+		if now is None:
+			now = time.time()
+		values = {}
+		if size is not None:
+			values['bytes'] = size
+			values['mtime'] = now
+		if counters:
+			values['pcr_start'] = counters['first_pcr']
+			values['pcr_end'] = counters['last_pcr']
+			values['pcr_seconds'] = counters['pcr_seconds']
+			for key in ('cc_errors','tei_errors','sync_errors','pcr_jumps'):
+				values[key] = counters[key]
+		if status:
+			values['status'] = status
+			values['stop_time'] = now
+		if not values:
+			return 0
+		keys = sorted(values)
+		return self.write('UPDATE recordings SET %s, duration = ? - start_time WHERE path = ?' %(', '.join('%s = ?' %(key) for key in keys)),\
+			[values[key] for key in keys] + [now,path])
+
+	def finish(self,path,counters=None,now=None):
+		return self.update(path,None,counters,now,STATUS_DONE)
+
+	def restarted(self,path,gap):
+		## A hot restart of the recording in path that lost gap seconds of the stream
+		return self.write('UPDATE recordings SET restarts = restarts + 1, gap_ms = gap_ms + ? WHERE path = ?',(1000.0 * gap,path))
+
+	def abandon(self,adopted=()):
+		## Recordings the last run never finished (it crashed or was killed), except the ones
+		## in adopted, which this run has picked up and goes on recording
+		adopted = list(adopted)
+		return self.write('UPDATE recordings SET status = ? WHERE status = ? AND path NOT IN (%s)' %(','.join('?' * len(adopted))),\
+			[STATUS_INTERRUPTED,STATUS_RECORDING] + adopted)
+
+	#################################################################
+	## Episodes recorded by series rules
+	#################################################################
+	def recordedEpisode(self,show,episode,now=None):
+		if now is None:
+			now = time.time()
+		self.write('INSERT OR REPLACE INTO episodes (show,episode,recorded) VALUES (?,?,?)',(show,episode,now))
+
+	def episodes(self):
+		## (show,episode) of every episode recorded
+		return set(self.query('SELECT show,episode FROM episodes'))
+
+	#################################################################
+	## Files on disk (the retention engine keeps these in step with
+	## the file system)
+	#################################################################
+	def addFiles(self,entries):
+		## entries: (path,show,size,mtime); metadata of files already known is kept
+		entries = list(entries)
+		with self.batch():
+			self.writeMany('INSERT OR IGNORE INTO recordings (path,show,bytes,mtime,status) VALUES (?,?,?,?,?)',\
+				[(path,show,size,mtime,STATUS_FOUND) for path,show,size,mtime in entries])
+			self.writeMany('UPDATE recordings SET bytes = ?, mtime = ? WHERE path = ?',[(size,mtime,path) for path,show,size,mtime in entries])
+
+	def forgetFiles(self,paths):
+		self.writeMany('DELETE FROM recordings WHERE path = ?',[(path,) for path in paths])
+
+	def files(self):
+		## path -> (show,size,mtime)
+		return dict((path,(show,size,mtime)) for path,show,size,mtime in self.query('SELECT path,show,bytes,mtime FROM recordings'))
+
+	def paths(self,prefix):
+		## Every known path starting with prefix (a range scan of the primary key)
+		return set(row[0] for row in self.query('SELECT path FROM recordings WHERE path >= ? AND path < ?',(prefix,prefix + '\U0010ffff')))
+
+	def directories(self):
+		return dict(self.query('SELECT show,mtime_ns FROM directories'))
+
+	def setDirectory(self,show,mtime_ns):
+		self.write('INSERT OR REPLACE INTO directories (show,mtime_ns) VALUES (?,?)',(show,mtime_ns))
+
+	def forgetDirectory(self,show):
+		self.write('DELETE FROM directories WHERE show = ?',(show,))
+
+	def recordings(self,show=None):
+		## Every recording (of show) as a dict, oldest first
+		sql = 'SELECT %s FROM recordings' %(','.join(COLUMNS))
+		if show is None:
+			rows = self.query(sql + ' ORDER BY mtime')
+		else:
+			rows = self.query(sql + ' WHERE show = ? ORDER BY mtime',(show,))
+		return [dict(zip(COLUMNS,row)) for row in rows]
+
+
+def usage():
+	print('Usage:' , sys.argv[0] , '[options] [catalog.db]')
+	print('Description: List the recordings in the catalog (default %s)' %(DEFAULT_CATALOG))
+	print('')
+	print('Options:')
+	print('-h  --help			Show this helpful information')
+	print('-s  --show=[name]		Only list the recordings of one show')
+	print('')
+
+
+if __name__ == '__main__':
+	show = None
+	try:
+		opts, args = getopt.getopt(sys.argv[1:], 'hs:', ['help', 'show='])
+	except getopt.GetoptError as err:
+		print(str(err))
+		usage()
+		sys.exit(2)
+
+	for opt, arg in opts:
+		if opt in ('-h', '--help'):
+			usage()
+			sys.exit()
+		elif opt in ('-s', '--show'):
+			show = arg
+		else:
+			assert False, 'unhandled option'
+
+	if len(args) > 1:
+		usage()
+		sys.exit(2)
+
+	catalog = RecordingCatalog(args[0] if args else DEFAULT_CATALOG)
+	print('%-20s %-16s %-11s %3s %9s %8s %6s %6s %8s  %s' %('SHOW','START','STATUS','SEG','MB','MINUTES','CC','OTHER','GAP ms','FILE'))
+	for recording in catalog.recordings(show):
+		start = recording['start_time'] or recording['mtime']
+		errors = recording['tei_errors'] + recording['sync_errors'] + recording['pcr_jumps']
+		print('%-20s %-16s %-11s %3d %9.1f %8.1f %6d %6d %8.0f  %s' %(recording['show'][:20],time.strftime('%Y-%m-%d %H:%M',time.localtime(start or 0)),\
+			recording['status'],recording['segment'],recording['bytes'] / 1e6,(recording['duration'] or 0) / 60.0,recording['cc_errors'],errors,\
+			recording['gap_ms'],os.path.basename(recording['path'])))
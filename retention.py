@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+##########################################################################
+##
+##  Retention and disk space eviction for the recordings on the NAS
+##
+##  Goals:
+##                      Replace the find/df loops in checkRecord.sh, which
+##                      re-walk the whole library for every file they
+##                      delete while the NAS is over 97% full
+##
+##                      Index every recording (show, size, mtime) in the
+##                      recording catalog so deciding what to delete never
+##                      walks the tree: expired files come off a per-show
+##                      min-heap and space is freed oldest first from a
+##                      global min-heap, one index lookup per file
+##
+##                      Reconcile the index with the file system
+##                      incrementally: one stat() per show directory, and
+##                      only directories whose mtime changed (something
+##                      was added or removed) are listed again
+##
+##  A show's retention is its 'keep_days' entry in the recording config:
+##  its recordings are deleted once they are that many days old (the
+##  old 'find -mtime +1' is keep_days 2).
+##
+##  Usage:
+##                      retention.py [-u max_usage_percent] [-c catalog.db] [-n] dir
+##
+##########################################################################
+import os
+import sys
+import json
+import heapq
+import getopt
+import time
+
+import recordingCatalog
+
+LEGACY_INDEX     = '.recordTV_index.json'   ## Where the index lived before the catalog
+MAX_USAGE        = 97.0    ## Percent of the file system allowed to be in use
+RECORDING_SUFFIX = '.ts'
+SECONDS_PER_DAY  = 86400
+
+
+def diskUsage(path):
+	## (percent used the way df reports it,bytes used,bytes usable)
+	st = os.statvfs(path)
+	used = (st.f_blocks - st.f_bfree) * st.f_frsize
+	total = used + st.f_bavail * st.f_frsize
+	return (100.0 * used / total if total else 0.0,used,total)
+
+
+class RetentionEngine(object):
+	def __init__(self,root,catalog=None,dry_run=False):
+		self.root = root
+		self.catalog = catalog or recordingCatalog.RecordingCatalog()
+		self.dry_run = dry_run
+		self.files = {}        ## path -> [show,size,mtime]
+		self.by_show = {}      ## show -> set of paths
+		self.dirs = {}         ## show -> st_mtime_ns of its directory when it was last listed
+		self.heap = []         ## (mtime,path) of every file; stale entries are skipped when popped
+		self.show_heaps = {}   ## show -> (mtime,path) of that show's files
+		self.load()
+
+	#################################################################
+	## The heaps are built from the catalog, which every change is
+	## written through to
+	#################################################################
+	def load(self):
+		self.files = dict((path,list(entry)) for path,entry in self.catalog.files().items())
+		self.dirs = self.catalog.directories()
+		if not self.files:
+			self.importLegacyIndex()
+		self.rebuildHeaps()
+
+	def importLegacyIndex(self):
+		## The JSON index kept in the recording directory before there was a catalog
+		legacy = os.path.join(self.root,LEGACY_INDEX)
+		try:
+			with open(legacy,'r') as fptr:
+				index = json.load(fptr)
+			files = index['files']
+			dirs = index['dirs']
+		except (OSError,ValueError,KeyError,TypeError):
+			return
+		with self.catalog.batch():
+			self.catalog.addFiles((path,show,size,mtime) for path,(show,size,mtime) in files.items())
+			for show,mtime_ns in dirs.items():
+				self.catalog.setDirectory(show,mtime_ns)
+		self.files = dict((path,list(entry)) for path,entry in files.items())
+		self.dirs = dirs
+		print('INFO:    IMPORTED %d RECORDINGS FROM %s INTO THE CATALOG' %(len(files),legacy))
+		try:
+			os.unlink(legacy)
+		except OSError:
+			pass
+
+	def rebuildHeaps(self):
+		self.by_show = {}
+		for path,entry in self.files.items():
+			self.by_show.setdefault(entry[0],set()).add(path)
+		self.heap = [(entry[2],path) for path,entry in self.files.items()]
+		heapq.heapify(self.heap)
+		self.show_heaps = {}
+		for path,entry in self.files.items():
+			self.show_heaps.setdefault(entry[0],[]).append((entry[2],path))
+		for heap in self.show_heaps.values():
+			heapq.heapify(heap)
+
+	#################################################################
+	## Index maintenance
+	#################################################################
+	def add(self,path,show,size=None,mtime=None):
+		if size is None or mtime is None:
+			try:
+				st = os.stat(path)
+			except OSError:
+				return
+			size,mtime = st.st_size,st.st_mtime
+		self.files[path] = [show,size,mtime]
+		self.by_show.setdefault(show,set()).add(path)
+		heapq.heappush(self.heap,(mtime,path))
+		heapq.heappush(self.show_heaps.setdefault(show,[]),(mtime,path))
+		self.catalog.addFiles([(path,show,size,mtime)])
+
+	def refresh(self,path):
+		## Pick up the final size/mtime of a file we know about (e.g. a finished recording)
+		entry = self.files.get(path)
+		if entry:
+			self.add(path,entry[0])
+
+	def forget(self,path):
+		entry = self.files.pop(path,None)
+		if entry:
+			self.by_show.get(entry[0],set()).discard(path)
+			self.catalog.forgetFiles([path])
+
+	def valid(self,mtime,path):
+		## Heap entries go stale when a file is removed or re-added with a new mtime
+		entry = self.files.get(path)
+		return entry is not None and entry[2] == mtime
+
+	def reconcile(self):
+		#################################################################
+		## Bring the index up to date with the file system without a
+		## full walk: a show directory is only listed again when its
+		## mtime changed, and only files new to the index are stat()ed
+		#################################################################
+		try:
+			shows = [name for name in os.listdir(self.root) if not name.startswith('.') and os.path.isdir(os.path.join(self.root,name))]
+		except OSError as diag:
+			print('ERROR:   FAILED TO LIST %s (%s)' %(self.root,diag))
+			return
+
+		with self.catalog.batch():
+			self.reconcileShows(shows)
+
+		## Heaps only ever grow between rebuilds; compact them once they are mostly stale
+		if len(self.heap) > 2 * len(self.files) + 64:
+			self.rebuildHeaps()
+
+	def reconcileShows(self,shows):
+		for show in list(self.dirs):
+			if show not in shows:
+				self.dropShow(show)
+
+		for show in shows:
+			directory = os.path.join(self.root,show)
+			try:
+				mtime_ns = os.stat(directory).st_mtime_ns
+				if self.dirs.get(show) == mtime_ns:
+					continue
+				names = set(name for name in os.listdir(directory) if name.endswith(RECORDING_SUFFIX))
+			except OSError:
+				continue
+
+			known = set(self.by_show.get(show,()))
+			current = set(os.path.join(directory,name) for name in names)
+			for path in known - current:
+				self.forget(path)
+			for path in current - known:
+				self.add(path,show)
+			self.dirs[show] = mtime_ns
+			self.catalog.setDirectory(show,mtime_ns)
+
+	def dropShow(self,show):
+		for path in list(self.by_show.get(show,())):
+			self.forget(path)
+		self.by_show.pop(show,None)
+		self.dirs.pop(show,None)
+		self.show_heaps.pop(show,None)
+		self.catalog.forgetDirectory(show)
+
+	#################################################################
+	## Deleting
+	#################################################################
+	def remove(self,path,reason):
+		print('NOTICE:  [%s] REMOVING FILE %s (%s)' %(time.strftime('%Y-%m-%d %H:%M:%S'),path,reason))
+		if not self.dry_run:
+			try:
+				os.unlink(path)
+			except FileNotFoundError:
+				pass
+			except OSError as diag:
+				print('ERROR:   FAILED TO REMOVE %s (%s)' %(path,diag))
+				return False
+			self.forget(path)
+		return True
+
+	def expire(self,policies,protected=(),now=None):
+		## policies: show -> keep_days.  Returns the number of files removed.
+		if now is None:
+			now = time.time()
+		removed = 0
+		for show,keep_days in policies.items():
+			heap = self.show_heaps.get(show)
+			if not heap:
+				continue
+			cutoff = now - float(keep_days) * SECONDS_PER_DAY
+			kept = []
+			while heap and heap[0][0] < cutoff:
+				mtime,path = heapq.heappop(heap)
+				if not self.valid(mtime,path):
+					continue
+				if path in protected:
+					kept.append((mtime,path))
+					continue
+				if self.remove(path,'OLDER THAN %s DAYS' %(keep_days)):
+					removed += 1
+			for item in kept:
+				heapq.heappush(heap,item)
+		return removed
+
+	def evict(self,max_usage=MAX_USAGE,protected=()):
+		## Free space oldest recording first until usage is back under max_usage.
+		## Usage is measured once; what each deletion frees comes from the index.
+		try:
+			usage,used,total = diskUsage(self.root)
+		except OSError as diag:
+			print('ERROR:   FAILED TO CHECK DISK USAGE OF %s (%s)' %(self.root,diag))
+			return 0
+		if usage <= max_usage:
+			return 0
+
+		need = used - max_usage / 100.0 * total
+		removed = 0
+		kept = []
+		while need > 0 and self.heap:
+			mtime,path = heapq.heappop(self.heap)
+			if not self.valid(mtime,path):
+				continue
+			if path in protected:
+				kept.append((mtime,path))
+				continue
+			size = self.files[path][1]
+			if self.remove(path,'FILE SYSTEM %.1f%% FULL' %(usage)):
+				need -= size
+				removed += 1
+		for item in kept:
+			heapq.heappush(self.heap,item)
+		if need > 0:
+			print('WARNING: NOTHING LEFT TO REMOVE; %s IS STILL OVER %.0f%% FULL' %(self.root,max_usage))
+		return removed
+
+	def run(self,policies,protected=(),max_usage=MAX_USAGE):
+		## Reconcile, expire and evict; returns the number of files removed
+		self.reconcile()
+		removed = self.expire(policies,protected)
+		removed += self.evict(max_usage,protected)
+		return removed
+
+	def totals(self):
+		## show -> (files,bytes)
+		result = {}
+		for show,size,mtime in self.files.values():
+			count,total = result.get(show,(0,0))
+			result[show] = (count + 1,total + size)
+		return result
+
+
+def usage():
+	print('Usage:' , sys.argv[0] , '[options] dir')
+	print('Description: Show the recording index of dir and free space the way the recorder does')
+	print('')
+	print('Options:')
+	print('-h  --help			Show this helpful information')
+	print('-u  --usage=[percent]	Maximum file system usage (default %.0f)' %(MAX_USAGE))
+	print('-c  --catalog=[file]	Recording catalog (default %s)' %(recordingCatalog.DEFAULT_CATALOG))
+	print('-n  --dry-run		Only print what would be removed')
+	print('')
+
+
+if __name__ == '__main__':
+	max_usage = MAX_USAGE
+	catalog_file = recordingCatalog.DEFAULT_CATALOG
+	dry_run = False
+	try:
+		opts, args = getopt.getopt(sys.argv[1:], 'hu:c:n', ['help', 'usage=', 'catalog=', 'dry-run'])
+	except getopt.GetoptError as err:
+		print(str(err))
+		usage()
+		sys.exit(2)
+
+	for opt, arg in opts:
+		if opt in ('-h', '--help'):
+			usage()
+			sys.exit()
+		elif opt in ('-u', '--usage'):
+			max_usage = float(arg)
+		elif opt in ('-c', '--catalog'):
+			catalog_file = arg
+		elif opt in ('-n', '--dry-run'):
+			dry_run = True
+		else:
+			assert False, 'unhandled option'
+
+	if len(args) != 1:
+		usage()
+		sys.exit(2)
+
+	engine = RetentionEngine(args[0],recordingCatalog.RecordingCatalog(catalog_file),dry_run)
+	start = time.time()
+	engine.run({},(),max_usage)
+	for show,(count,total) in sorted(engine.totals().items()):
+		print('INFO:    %-40s %5d FILES %10.1f MB' %(show,count,total / 1e6))
+	print('INFO:    %d FILES INDEXED IN %.1f ms; FILE SYSTEM %.1f%% FULL' %(len(engine.files),1000.0 * (time.time() - start),diskUsage(args[0])[0]))
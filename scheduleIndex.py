@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+##########################################################################
+##
+##  Precompiled weekly schedule index
+##
+##  Goals:
+##                      Turn the 'day'/'start'/'end' rules written by
+##                      configSchedule.py into sorted minute-of-week
+##                      slots once, instead of walking up to 8 days with
+##                      strftime() every time a recording is rescheduled
+##
+##                      Answer "when is the next occurrence" and "what is
+##                      live right now" with a bisect
+##
+##                      Get the real start/stop times right across DST
+##                      changes and for shows that span midnight: slots are
+##                      local wall-clock times and are only turned into
+##                      unix times (with time.mktime, which knows about
+##                      DST) for the concrete date they fall on
+##
+##  A rule is only recompiled when its day/start/end change.
+##
+##########################################################################
+import bisect
+import datetime
+import time
+
+MINUTES_PER_DAY  = 1440
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+WEEKDAYS = ('Mon','Tue','Wed','Thu','Fri','Sat','Sun')
+LIVE_CHECKPOINT  = 64   ## liveAt() replays at most this many slot starts/ends after a checkpoint
+
+
+def parseHHMM(value):
+	## '18:29' -> (18,29); same slicing the original scheduler used
+	return (int(value[:2]),int(value[-2:]))
+
+
+def ruleDays(rule):
+	## 'day' is either a single day name or a list of them
+	days = rule['day']
+	if isinstance(days,str):
+		days = [days]
+	return sorted(set(WEEKDAYS.index(day) for day in days if day in WEEKDAYS))
+
+
+def ruleSignature(rule):
+	days = rule.get('day')
+	return (tuple(days) if isinstance(days,list) else days,rule.get('start'),rule.get('end'))
+
+
+def compileRule(rule):
+	## Returns the sorted list of weekly slots (start_minute_of_week,end_minute_of_week,start_hm,end_hm,spans_midnight)
+	start_hm = parseHHMM(rule['start'])
+	end_hm = parseHHMM(rule['end'])
+	start_min = start_hm[0] * 60 + start_hm[1]
+	end_min = end_hm[0] * 60 + end_hm[1]
+	spans = end_min < start_min
+	duration = end_min - start_min + (MINUTES_PER_DAY if spans else 0)
+
+	slots = []
+	for day in ruleDays(rule):
+		start_mow = day * MINUTES_PER_DAY + start_min
+		slots.append((start_mow,start_mow + duration,start_hm,end_hm,spans))
+	return slots
+
+
+def localUnixTime(day,hm):
+	## Unix time of a local wall clock time on a given date; tm_isdst=-1 lets mktime apply DST
+	return int(time.mktime((day.year,day.month,day.day,hm[0],hm[1],0,0,0,-1)))
+
+
+def minuteOfWeek(now):
+	lt = time.localtime(now)
+	return lt.tm_wday * MINUTES_PER_DAY + lt.tm_hour * 60 + lt.tm_min
+
+
+class ScheduleIndex(object):
+	def __init__(self):
+		self.rules = {}
+		self.weekly = []       ## (start_mow,end_mow,name) for every slot of every rule, sorted
+		self.weekly_starts = []
+		self.changes = []      ## (minute_of_week,+1/-1,name) of every slot start and end, sorted
+		self.change_minutes = []
+		self.checkpoints = []  ## name -> count of its slots live before every LIVE_CHECKPOINT'th change
+		self.dirty = False
+
+	def update(self,name,rule):
+		## (Re)compile a rule if it is new or its day/start/end changed; returns True if it was recompiled
+		signature = ruleSignature(rule)
+		entry = self.rules.get(name)
+		if entry and entry['signature'] == signature:
+			return False
+		slots = compileRule(rule)
+		self.rules[name] = {'signature':signature,'slots':slots,'starts':[slot[0] for slot in slots]}
+		self.dirty = True
+		return True
+
+	def remove(self,name):
+		if self.rules.pop(name,None):
+			self.dirty = True
+
+	def rebuild(self):
+		## Global sorted slot list for nextStart(); slots that run past the end of the week are
+		## also entered one week earlier so a query early on Monday still sees them.  For
+		## liveAt(), every slot start and end in week order, with what is live every
+		## LIVE_CHECKPOINT of them (found by sweeping through them once).
+		weekly = []
+		changes = []
+		for name,entry in self.rules.items():
+			for slot in entry['slots']:
+				weekly.append((slot[0],slot[1],name))
+				if slot[1] > MINUTES_PER_WEEK:
+					weekly.append((slot[0] - MINUTES_PER_WEEK,slot[1] - MINUTES_PER_WEEK,name))
+					changes += [(slot[0],1,name),(MINUTES_PER_WEEK,-1,name),(0,1,name),(slot[1] - MINUTES_PER_WEEK,-1,name)]
+				else:
+					changes += [(slot[0],1,name),(slot[1],-1,name)]
+		weekly.sort()
+		self.weekly = weekly
+		self.weekly_starts = [slot[0] for slot in weekly]
+
+		changes.sort(key=lambda change: change[0])
+		checkpoints = []
+		count = {}
+		for n,(minute,delta,name) in enumerate(changes):
+			if not n % LIVE_CHECKPOINT:
+				checkpoints.append(dict(count))
+			count[name] = count.get(name,0) + delta
+			if not count[name]:
+				del(count[name])
+		self.changes = changes
+		self.change_minutes = [change[0] for change in changes]
+		self.checkpoints = checkpoints
+		self.dirty = False
+
+	def occurrence(self,slot,monday,week_offset):
+		day = monday + datetime.timedelta(days=week_offset * 7 + slot[0] // MINUTES_PER_DAY)
+		end_day = day + datetime.timedelta(days=1) if slot[4] else day
+		return (localUnixTime(day,slot[2]),localUnixTime(end_day,slot[3]))
+
+	def nextOccurrence(self,name,now=None):
+		## (unix_start,unix_stop) of the occurrence that is live at, or is the next one after, now
+		entry = self.rules.get(name)
+		if not entry or not entry['slots']:
+			return None
+		if now is None:
+			now = time.time()
+
+		lt = time.localtime(now)
+		monday = datetime.date(lt.tm_year,lt.tm_mon,lt.tm_mday) - datetime.timedelta(days=lt.tm_wday)
+		slots = entry['slots']
+		count = len(slots)
+
+		## Start with the latest slot that started at or before now (it may still be running),
+		## then walk forward through the following slots
+		i = bisect.bisect_right(entry['starts'],minuteOfWeek(now)) - 1
+		for n in range(count + 2):
+			week_offset,index = divmod(i + n,count)
+			start,stop = self.occurrence(slots[index],monday,week_offset)
+			if now < stop:
+				return (start,stop)
+		return None
+
+	def liveAt(self,now=None):
+		## Names of every rule with a slot covering now (by local wall clock)
+		if self.dirty:
+			self.rebuild()
+		if now is None:
+			now = time.time()
+		## Every start/end up to now: from the checkpoint before the last of them, replay the rest
+		end = bisect.bisect_right(self.change_minutes,minuteOfWeek(now))
+		if not end:
+			return []
+		first = (end - 1) // LIVE_CHECKPOINT * LIVE_CHECKPOINT
+		count = dict(self.checkpoints[first // LIVE_CHECKPOINT])
+		for minute,delta,name in self.changes[first:end]:
+			count[name] = count.get(name,0) + delta
+		return sorted(name for name in count if count[name] > 0)
+
+	def nextStart(self,now=None):
+		## (minute_of_week,name) of the next slot to start strictly after now, across every rule
+		if self.dirty:
+			self.rebuild()
+		if not self.weekly:
+			return None
+		if now is None:
+			now = time.time()
+		i = bisect.bisect_right(self.weekly_starts,minuteOfWeek(now))
+		while i < len(self.weekly) and self.weekly[i][0] < 0:
+			i += 1
+		if i >= len(self.weekly):
+			i = bisect.bisect_left(self.weekly_starts,0)
+		return (self.weekly[i][0],self.weekly[i][2])
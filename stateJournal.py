@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+##########################################################################
+##
+##  Crash-safe journal of the recorder's run time state
+##
+##  Goals:
+##                      Remember what only lives in CFG_RECORDINGS while
+##                      the recorder runs (lockkey, which show records on
+##                      which tuner into which file, through which
+##                      process or UDP port) so a recorder restarted after
+##                      a crash can pick its recordings up where they are
+##                      instead of re-tuning from scratch
+##
+##                      Append-only: every change is one JSON line, synced
+##                      before the recorder goes on, so the journal is
+##                      never half rewritten.  A torn last line (crash in
+##                      the middle of a write) is ignored on replay.
+##
+##                      Compacted on startup to just the current state
+##                      (written to a new file and renamed over the old)
+##
+##  Like the catalog, keep it on a local disk, not the NAS.
+##
+##  Usage:
+##                      stateJournal.py [journal]
+##
+##########################################################################
+import os
+import sys
+import json
+import signal
+import time
+
+DEFAULT_JOURNAL = os.path.expanduser('~/.recordTV.journal')
+
+OP_LOCKKEY = 'lockkey'   ## {'key'}
+OP_START   = 'start'     ## {'name','device','tuner','filename', and 'pid' or 'port' (+ 'program' when demuxed)}
+OP_STOP    = 'stop'      ## {'filename'}
+
+
+class StateJournal(object):
+	def __init__(self,filename=DEFAULT_JOURNAL):
+		self.filename = filename
+		self.fptr = None
+
+	def replay(self):
+		## (lockkey,name -> start record) as of the last complete line
+		lockkey = None
+		active = {}
+		try:
+			with open(self.filename,'r') as fptr:
+				for line in fptr:
+					try:
+						record = json.loads(line)
+					except ValueError:
+						break
+					if record.get('op') == OP_LOCKKEY:
+						lockkey = record['key']
+					elif record.get('op') == OP_START:
+						active[record['name']] = record
+					elif record.get('op') == OP_STOP:
+						for name in [name for name in active if active[name]['filename'] == record['filename']]:
+							del(active[name])
+		except OSError:
+			pass
+		return (lockkey,active)
+
+	def compact(self,lockkey,active):
+		## Start the journal over with just the current state
+		self.close()
+		tmp = self.filename + '.new'
+		with open(tmp,'w') as fptr:
+			for record in [{'op':OP_LOCKKEY,'key':lockkey,'time':time.time()}] + [active[name] for name in sorted(active)]:
+				fptr.write(json.dumps(record,sort_keys=True) + '\n')
+			fptr.flush()
+			os.fsync(fptr.fileno())
+		os.replace(tmp,self.filename)
+		self.fptr = open(self.filename,'a')
+
+	def append(self,record):
+		if not self.fptr:
+			self.fptr = open(self.filename,'a')
+		self.fptr.write(json.dumps(record,sort_keys=True) + '\n')
+		self.fptr.flush()
+		try:
+			os.fdatasync(self.fptr.fileno())
+		except OSError:
+			pass
+
+	def record(self,name,device_id,tuner,filename,**how):
+		## how: pid= of a hdhomerun_config child, or port= (and program= when demuxed) of an in-process capture
+		record = {'op':OP_START,'name':name,'device':device_id,'tuner':tuner,'filename':filename,'time':time.time()}
+		record.update(how)
+		return record
+
+	def started(self,record):
+		self.append(record)
+
+	def stopped(self,filename):
+		self.append({'op':OP_STOP,'filename':filename,'time':time.time()})
+
+	def close(self):
+		if self.fptr:
+			self.fptr.close()
+			self.fptr = None
+
+
+def processWriting(pid,filename):
+	## Is pid (still) a hdhomerun_config child saving to filename, either named on its command line or
+	## as its stdout?  Needs /proc; anything that can't be checked is assumed not to be.
+	try:
+		with open('/proc/%d/cmdline' %(pid),'rb') as fptr:
+			args = fptr.read().decode('utf-8','replace').split('\0')
+		if 'save' not in args:
+			return False
+		return filename in args or os.readlink('/proc/%d/fd/1' %(pid)) == filename
+	except (OSError,ValueError):
+		return False
+
+
+class AdoptedProcess(object):
+	"""A hdhomerun_config child left running by the recorder that started it; looks
+	enough like a subprocess.Popen handle (kill/poll/wait/pid) for the recorder"""
+
+	def __init__(self,pid):
+		self.pid = pid
+		self.returncode = None
+
+	def poll(self):
+		## It isn't our child, so all there is to go on is whether it still exists
+		if self.returncode is None:
+			try:
+				os.kill(self.pid,0)
+			except ProcessLookupError:
+				self.returncode = 0
+			except PermissionError:
+				pass
+		return self.returncode
+
+	def kill(self):
+		try:
+			os.kill(self.pid,signal.SIGKILL)
+		except OSError:
+			pass
+
+	terminate = kill
+
+	def wait(self,timeout=5.0):
+		deadline = time.time() + timeout
+		while self.poll() is None and time.time() < deadline:
+			time.sleep(0.01)
+		return self.returncode
+
+
+if __name__ == '__main__':
+	journal = StateJournal(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_JOURNAL)
+	start = time.time()
+	lockkey,active = journal.replay()
+	print('INFO:    REPLAYED %s IN %.2f ms: LOCKKEY %s, %d ACTIVE RECORDINGS' %(journal.filename,1000.0 * (time.time() - start),lockkey,len(active)))
+	for name in sorted(active):
+		record = active[name]
+		how = 'PID %d' %(record['pid']) if 'pid' in record else 'PORT %d' %(record['port']) + (' PROGRAM %d' %(record['program']) if 'program' in record else '')
+		print('INFO:    %-20s %s-%d %s (%s)' %(name,record['device'],record['tuner'],record['filename'],how))
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+##########################################################################
+##
+##  Background health monitor for active recordings
+##
+##  Goals:
+##                      Watch every active recording from a sampler
+##                      thread so the scheduler never sleeps/stat()s on
+##                      behalf of a recording
+##
+##                      Keep a rolling bitrate per recording and flag
+##                      stalls (nothing received) and bitrate collapse
+##                      (far below what the channel normally sends)
+##
+##                      Flag recordings whose transport stream is
+##                      damaged (CC errors, lost sync, ...) when the
+##                      capture runs a TSAnalyzer
+##
+##  In-process captures are sampled from their byte counters; recordings
+##  made by a hdhomerun_config child are sampled with os.stat().  The
+##  expected rate for a channel is its 'bitrate' entry in CFG_CHANNELS if
+##  there is one, otherwise it is learned from healthy recordings of that
+##  channel.
+##
+##########################################################################
+import os
+import collections
+import threading
+import time
+
+SAMPLE_INTERVAL  = 1.0    ## Seconds between samples
+BITRATE_WINDOW   = 10.0   ## Seconds of samples the rolling bitrate is computed over
+STALL_TIME       = 5.0    ## No new data for this long = stalled
+COLLAPSE_RATIO   = 0.2    ## Rolling bitrate below this fraction of expected = collapsed
+LEARN_TIME       = 60.0   ## Seconds of healthy recording needed before a learned rate is trusted
+LEARN_ALPHA      = 0.05   ## Weight of each new sample in the learned per-channel rate
+DAMAGE_RATE      = 20.0   ## TS errors per second (averaged over BITRATE_WINDOW) that count as damaged
+
+STATE_STARTING  = 'starting'
+STATE_OK        = 'ok'
+STATE_STALLED   = 'stalled'
+STATE_COLLAPSED = 'collapsed'
+STATE_MISSING   = 'missing'
+STATE_DAMAGED   = 'damaged'
+
+BAD_STATES = (STATE_STALLED,STATE_COLLAPSED,STATE_MISSING,STATE_DAMAGED)
+
+
+class HealthMonitor(object):
+	def __init__(self,callback=None,expected_rates=None):
+		## callback(name,filename,state) is called from the sampler thread whenever a
+		## recording goes bad; it must be cheap and thread safe
+		self.callback = callback
+		self.expected_rates = expected_rates or {}
+		self.learned = {}
+		self.watched = {}
+		self.lock = threading.Lock()
+		self.running = True
+		self.thread = threading.Thread(target=self.run,name='stream-health')
+		self.thread.daemon = True
+		self.thread.start()
+
+	def watch(self,filename,name,handle=None,channel_name=None):
+		now = time.time()
+		entry = {'name':name,'filename':filename,'handle':handle,'channel_name':channel_name,\
+			'started':now,'samples':collections.deque(),'lastGrowth':now,'lastBytes':-1,\
+			'bitrate':0.0,'errorRate':0.0,'state':STATE_STARTING}
+		with self.lock:
+			self.watched[filename] = entry
+
+	def unwatch(self,filename):
+		with self.lock:
+			self.watched.pop(filename,None)
+
+	def status(self,filename):
+		with self.lock:
+			entry = self.watched.get(filename)
+			if not entry:
+				return None
+			return {'state':entry['state'],'bitrate':entry['bitrate'],'bytes':max(entry['lastBytes'],0),\
+				'errorRate':entry['errorRate'],'expected':self.expectedRate(entry['channel_name'])}
+
+	def expectedRate(self,channel_name):
+		if channel_name in self.expected_rates:
+			return self.expected_rates[channel_name]
+		learned = self.learned.get(channel_name)
+		if learned and learned[1] >= LEARN_TIME:
+			return learned[0]
+		return None
+
+	def measure(self,entry):
+		## Bytes recorded so far, or None if the output file has disappeared
+		handle = entry['handle']
+		if handle is not None and hasattr(handle,'counters'):
+			return handle.counters()['bytes']
+		try:
+			return os.stat(entry['filename']).st_size
+		except OSError:
+			return None
+
+	def sample(self,entry,now):
+		size = self.measure(entry)
+		if size is None:
+			return STATE_MISSING
+		analyzer = getattr(entry['handle'],'analyzer',None)
+		errors = analyzer.errors() if analyzer else 0
+
+		if size != entry['lastBytes']:
+			entry['lastGrowth'] = now
+			entry['lastBytes'] = size
+
+		samples = entry['samples']
+		samples.append((now,size,errors))
+		while len(samples) > 2 and now - samples[0][0] > BITRATE_WINDOW:
+			samples.popleft()
+		if len(samples) > 1 and samples[-1][0] > samples[0][0]:
+			span = samples[-1][0] - samples[0][0]
+			entry['bitrate'] = 8.0 * (samples[-1][1] - samples[0][1]) / span
+			entry['errorRate'] = (samples[-1][2] - samples[0][2]) / span
+
+		if now - entry['lastGrowth'] >= STALL_TIME:
+			return STATE_STALLED
+		if now - entry['started'] < BITRATE_WINDOW:
+			return STATE_STARTING
+		if entry['errorRate'] > DAMAGE_RATE:
+			return STATE_DAMAGED
+
+		expected = self.expectedRate(entry['channel_name'])
+		if expected and entry['bitrate'] < COLLAPSE_RATIO * expected:
+			return STATE_COLLAPSED
+
+		## Healthy: let this recording teach us what the channel normally sends
+		if entry['channel_name'] not in self.expected_rates:
+			rate,learned_time = self.learned.get(entry['channel_name'],(entry['bitrate'],0.0))
+			self.learned[entry['channel_name']] = (rate + LEARN_ALPHA * (entry['bitrate'] - rate),learned_time + SAMPLE_INTERVAL)
+		return STATE_OK
+
+	def run(self):
+		while self.running:
+			now = time.time()
+			with self.lock:
+				entries = list(self.watched.values())
+
+			for entry in entries:
+				state = self.sample(entry,now)
+				previous = entry['state']
+				entry['state'] = state
+				if state in BAD_STATES and previous not in BAD_STATES and self.callback:
+					self.callback(entry['name'],entry['filename'],state)
+
+			time.sleep(max(0.0,SAMPLE_INTERVAL - (time.time() - now)))
+
+	def shutdown(self):
+		self.running = False
+		self.thread.join(2 * SAMPLE_INTERVAL)
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+##########################################################################
+##
+##  Tests of the PSIP virtual channel table parser and the lineup
+##
+##  Usage:
+##                      python3 -m unittest test_channelScan
+##
+##########################################################################
+import os
+import shutil
+import tempfile
+import unittest
+
+import tsDemux
+import channelScan
+import fakeHDHR
+
+
+def vctEntry(name,major,minor,tsid,program,service_type=channelScan.SERVICE_TV,hidden=False,descriptors=b''):
+	## One channel of a VCT, laid out by hand as in ATSC A/65 (not with buildVCT)
+	return name.ljust(7,'\0').encode('utf-16-be') + \
+		bytes([0xF0 | (major >> 6),((major & 0x3F) << 2) | (minor >> 8),minor & 0xFF]) + \
+		bytes([0x04]) + b'\x00\x00\x00\x00' + bytes([tsid >> 8,tsid & 0xFF,program >> 8,program & 0xFF]) + \
+		bytes([0x0D | (0x10 if hidden else 0),0xC0 | service_type,0x00,0x01]) + \
+		bytes([0xFC | (len(descriptors) >> 8),len(descriptors) & 0xFF]) + descriptors
+
+
+def vctSection(tsid,entries,section=0,last=0):
+	## A TVCT section; section_number/last_section_number patched in and the CRC redone
+	body = bytes([0,len(entries)]) + b''.join(entries) + b'\xfc\x00'
+	data = tsDemux.buildSection(channelScan.TABLE_TVCT,tsid,0,body)
+	data = data[:6] + bytes([section,last]) + data[8:-4]
+	crc = tsDemux.crc32(data)
+	return data + bytes([(crc >> 24) & 0xFF,(crc >> 16) & 0xFF,(crc >> 8) & 0xFF,crc & 0xFF])
+
+
+class ParseVCTTest(unittest.TestCase):
+	def testBuiltTable(self):
+		section = channelScan.buildVCT(0x0815,[(46,1,'WGCL-TV',3),(46,3,'WGCLSD2',5),(999,1023,'LONGNAME',0x1234)])
+		self.assertEqual(tsDemux.crc32(section),0)
+		tsid,number,last,channels = channelScan.parseVCT(section)
+		self.assertEqual((tsid,number,last),(0x0815,0,0))
+		self.assertEqual([(channel['virtual'],channel['name'],channel['program'],channel['tsid']) for channel in channels],\
+			[('46.1','WGCL-TV',3,0x0815),('46.3','WGCLSD2',5,0x0815),('999.1023','LONGNAM',0x1234,0x0815)])
+		self.assertTrue(all(channel['service_type'] == channelScan.SERVICE_TV and not channel['hidden'] for channel in channels))
+
+	def testHandLaidOut(self):
+		## Descriptors after a channel are skipped; hidden and service type are read
+		section = vctSection(0x0101,[vctEntry('WSB-HD',2,1,0x0101,1,descriptors=b'\xa1\x07' + b'\x00' * 7),\
+			vctEntry('GUIDE',2,9,0x0101,9,service_type=0x04,hidden=True),vctEntry('Me TV',2,2,0x0101,2)])
+		tsid,number,last,channels = channelScan.parseVCT(section)
+		self.assertEqual([channel['virtual'] for channel in channels],['2.1','2.9','2.2'])
+		self.assertEqual(channels[2]['name'],'Me TV')
+		self.assertEqual((channels[1]['hidden'],channels[1]['service_type']),(True,0x04))
+		self.assertFalse(channels[0]['hidden'])
+
+	def testTruncated(self):
+		## A channel count larger than what the section holds stops at the end of the data
+		section = bytearray(vctSection(0x0101,[vctEntry('WSB-HD',2,1,0x0101,1)]))
+		section[9] = 3
+		self.assertEqual(len(channelScan.parseVCT(bytes(section))[3]),1)
+
+	def testVirtualOf(self):
+		self.assertEqual(channelScan.virtualOf({'name':'5.1 WAGA-HD'}),'5.1')
+		self.assertEqual(channelScan.virtualOf({'name':'36-02 Bounce'}),'36.2')
+		self.assertEqual(channelScan.virtualOf({'name':'WAGA','virtual':'5.1'}),'5.1')
+		self.assertIsNone(channelScan.virtualOf({'name':'WAGA-HD'}))
+
+
+class PSIPDemuxTest(unittest.TestCase):
+	def feed(self,dgrams,use_numpy):
+		demux = channelScan.PSIPDemux(use_numpy)
+		demux.feed(b''.join(dgrams))
+		return demux
+
+	def testLineup(self):
+		for use_numpy in set([False,tsDemux.HAVE_NUMPY]):
+			demux = self.feed(fakeHDHR.buildMultiplex((3,5,7),fakeHDHR.FAKE_LINEUP[19]),use_numpy)
+			self.assertTrue(demux.complete())
+			lineup = demux.lineup()
+			self.assertEqual([(channel['virtual'],channel['name'],channel['program']) for channel in lineup],\
+				[('46.1','WGCL-TV',3),('46.3','WGCLSD2',5),(None,'PROGRAM 7',7)])
+			self.assertEqual(lineup[0]['streams'],[[0x02,0x61],[0x81,0x64]])
+
+	def testIncomplete(self):
+		## No VCT yet: the lineup is there, but not complete
+		demux = self.feed(fakeHDHR.buildMultiplex((3,)),False)
+		self.assertFalse(demux.complete())
+		self.assertEqual([channel['program'] for channel in demux.lineup()],[3])
+		self.assertEqual(channelScan.PSIPDemux().lineup(),[])
+
+	def testHiddenLeftOut(self):
+		section = vctSection(fakeHDHR.FAKE_TSID,[vctEntry('WSB-HD',2,1,fakeHDHR.FAKE_TSID,1),\
+			vctEntry('GUIDE',2,9,fakeHDHR.FAKE_TSID,2,service_type=0x04,hidden=True)])
+		demux = self.feed(fakeHDHR.buildMultiplex((1,2)) + [tsDemux.sectionPacket(channelScan.PSIP_PID,section)],False)
+		self.assertTrue(demux.complete())
+		self.assertEqual([channel['virtual'] for channel in demux.lineup()],['2.1'])
+
+	def testSeveralSections(self):
+		first = vctSection(fakeHDHR.FAKE_TSID,[vctEntry('WSB-HD',2,1,fakeHDHR.FAKE_TSID,1)],0,1)
+		second = vctSection(fakeHDHR.FAKE_TSID,[vctEntry('Me TV',2,2,fakeHDHR.FAKE_TSID,2)],1,1)
+		demux = self.feed(fakeHDHR.buildMultiplex((1,2)) + [tsDemux.sectionPacket(channelScan.PSIP_PID,first)],False)
+		self.assertFalse(demux.complete())
+		demux.feed(tsDemux.sectionPacket(channelScan.PSIP_PID,second,1))
+		self.assertTrue(demux.complete())
+		self.assertEqual([channel['virtual'] for channel in demux.lineup()],['2.1','2.2'])
+
+	def testBadCRC(self):
+		section = bytearray(vctSection(fakeHDHR.FAKE_TSID,[vctEntry('WSB-HD',2,1,fakeHDHR.FAKE_TSID,1)]))
+		section[20] ^= 0xFF
+		demux = self.feed(fakeHDHR.buildMultiplex((1,)) + [tsDemux.sectionPacket(channelScan.PSIP_PID,bytes(section))],False)
+		self.assertEqual(demux.psi_errors,1)
+		self.assertFalse(demux.complete())
+
+
+class LineupTest(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.lineup = channelScan.Lineup(os.path.join(self.dir,'lineup'))
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def channel(self,virtual,program):
+		return {'virtual':virtual,'name':'X','program':program,'tsid':1,'hidden':False,'service_type':2,'streams':[]}
+
+	def testUpdate(self):
+		self.assertEqual(self.lineup.update(19,[self.channel('46.1',3),self.channel('46.3',5)],now=100),['46.1','46.3'])
+		self.assertEqual(self.lineup.update(19,[self.channel('46.1',3),self.channel('46.3',4)],now=200),['46.3'])
+		self.assertEqual(self.lineup.update(19,[self.channel('46.1',3)],now=300),['46.3'])
+		self.assertEqual(self.lineup.scanned(19),300)
+
+	def testFindMoved(self):
+		## A station found on two RF channels is where it was seen last
+		self.lineup.update(19,[self.channel('46.1',3)],now=100)
+		self.lineup.update(30,[self.channel('46.1',7)],now=200)
+		self.assertEqual(self.lineup.find('46.1')[0],30)
+		self.assertEqual(self.lineup.virtuals()['46.1'][1]['program'],7)
+		self.assertIsNone(self.lineup.find('2.1'))
+
+	def testMissing(self):
+		self.lineup.update(19,[self.channel('46.1',3)],now=100)
+		self.lineup.missing(19,now=200)
+		self.assertEqual(self.lineup.channels[19]['missing'],200)
+		self.assertEqual(len(self.lineup.programs(19)),1)
+		self.lineup.missing(19,forget=True)
+		self.assertEqual(self.lineup.programs(19),[])
+
+	def testSaveLoad(self):
+		self.assertFalse(self.lineup.load())
+		self.lineup.update(19,[self.channel('46.1',3)],now=100)
+		self.lineup.save()
+		loaded = channelScan.Lineup(self.lineup.filename)
+		self.assertTrue(loaded.load())
+		self.assertEqual(loaded.channels,self.lineup.channels)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+##########################################################################
+##
+##  Tests of the in-process capture engine, over UDP on the loopback
+##
+##  Usage:
+##                      python3 -m unittest test_hdhrCapture
+##
+##########################################################################
+import os
+import time
+import shutil
+import socket
+import tempfile
+import unittest
+
+import hdhrCapture
+import tsAnalyzer
+import tsDemux
+import timeshift
+import benchmark
+import fakeHDHR
+
+TS = hdhrCapture.TS_PACKET_SIZE
+
+
+def datagramsOf(data,packets=fakeHDHR.PACKETS_PER_DGRAM):
+	return [data[pos:pos + TS * packets] for pos in range(0,len(data),TS * packets)]
+
+
+def pidsOf(data):
+	return set(((data[pos + 1] & 0x1F) << 8) | data[pos + 2] for pos in range(0,len(data),TS))
+
+
+class CaptureTest(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.engine = hdhrCapture.CaptureEngine()
+		self.sock = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+		self.sent = 0
+
+	def tearDown(self):
+		self.sock.close()
+		self.engine.shutdown()
+		shutil.rmtree(self.dir)
+
+	def send(self,stream,dgrams):
+		## Send dgrams to stream's port and wait for the capture thread to have them all
+		for dgram in dgrams:
+			self.sock.sendto(dgram,('127.0.0.1',stream.port))
+		self.sent += len(dgrams)
+		deadline = time.time() + 5
+		while stream.datagrams < self.sent and time.time() < deadline:
+			time.sleep(0.01)
+		self.assertEqual(stream.datagrams,self.sent)
+
+	def read(self,filename):
+		with open(filename,'rb') as fptr:
+			return fptr.read()
+
+	def testStream(self):
+		filename = os.path.join(self.dir,'plain.ts')
+		stream = self.engine.openStream(filename,'127.0.0.1',analyzer=tsAnalyzer.TSAnalyzer())
+		dgrams = fakeHDHR.buildDatagrams() * 4
+		self.send(stream,dgrams)
+		self.assertIsNone(stream.poll())
+		self.assertIsNotNone(stream.firstData)
+		stream.kill()
+		self.assertEqual(stream.poll(),0)
+		self.assertEqual(self.read(filename),b''.join(dgrams))
+		counters = stream.counters()
+		self.assertEqual((counters['bytes'],counters['packets'],counters['datagrams']),(len(b''.join(dgrams)),len(dgrams) * 7,len(dgrams)))
+		self.assertEqual((stream.analyzer.packets,stream.analyzer.errors()),(len(dgrams) * 7,0))
+
+	def testRTP(self):
+		## The 12 byte RTP header of every datagram is left out of the file
+		filename = os.path.join(self.dir,'rtp.ts')
+		stream = self.engine.openStream(filename,'127.0.0.1',rtp=True)
+		dgrams = fakeHDHR.buildDatagrams()
+		self.send(stream,[b'\x80\x21' + bytes([0,n]) + b'\x00' * 8 + dgram for n,dgram in enumerate(dgrams)])
+		stream.kill()
+		self.assertEqual(self.read(filename),b''.join(dgrams))
+
+	def testMux(self):
+		## Two programs out of one multiplex; the mux goes away with its last program
+		one = benchmark.filterMultiplex()
+		mux = self.engine.openMux('127.0.0.1')
+		three = mux.addProgram(3,os.path.join(self.dir,'three.ts'))
+		four = mux.addProgram(4,os.path.join(self.dir,'four.ts'),keep=tsDemux.pidFilter('video'))
+		self.send(mux,datagramsOf(one * 2))
+		self.assertEqual(mux.users(),2)
+		three.kill()
+		self.assertIsNone(mux.poll())
+		four.kill()
+		self.assertEqual(mux.poll(),0)
+		self.assertEqual(pidsOf(self.read(three.filename)),set([tsDemux.PAT_PID,0x30,0x31,0x34,0x35,0x36,0x37,0x38]))
+		self.assertEqual(pidsOf(self.read(four.filename)),set([tsDemux.PAT_PID,0x40,0x41]))
+		self.assertEqual(three.counters()['bytes'],os.path.getsize(three.filename))
+
+	def testJoinWarmMux(self):
+		## A filtered program added once the multiplex's tables have been seen still gets its PMT
+		one = benchmark.filterMultiplex()
+		first = os.path.join(self.dir,'first.ts')
+		mux = self.engine.openMux('127.0.0.1')
+		mux.addProgram(4,first)
+		self.send(mux,datagramsOf(one))
+		mux.flush()
+		late = mux.addProgram(3,os.path.join(self.dir,'late.ts'),keep=tsDemux.pidFilter('video,audio,eng'))
+		self.send(mux,datagramsOf(one * 2))
+		late.kill()
+		data = self.read(late.filename)
+		self.assertEqual(pidsOf(data),set([tsDemux.PAT_PID,0x30,0x31,0x34,0x36]))
+		pmt = [data[pos:pos + TS] for pos in range(0,len(data),TS) if data[pos + 2] == 0x30]
+		self.assertEqual(len(pmt),2)
+
+	def testTimeshift(self):
+		## A program added later starts with what the ring still holds from since on
+		one = b''.join(fakeHDHR.buildMultiplex())
+		ring = timeshift.RingBuffer(os.path.join(self.dir,'ring'),4 * 1024 * 1024)
+		mux = self.engine.openMux('127.0.0.1',ring=ring)
+		self.send(mux,datagramsOf(one * 2))
+		since = time.time() - 60
+		output = mux.addProgram(3,os.path.join(self.dir,'shift.ts'),since=since)
+		self.assertGreater(output.backfill,0)
+		self.send(mux,datagramsOf(one))
+		output.kill()
+		## The ring keeps the mux alive without a program
+		self.assertIsNone(mux.poll())
+		## The PAT comes first in the multiplex, so the backlog (two rounds) and the live round are whole
+		wanted = set([tsDemux.PAT_PID]) | set(fakeHDHR.programPIDs(3))
+		self.assertEqual(os.path.getsize(output.filename),len([pos for pos in range(0,len(one),TS) if \
+			((one[pos + 1] & 0x1F) << 8) | one[pos + 2] in wanted]) * TS * 3)
+		self.assertEqual(mux.counters()['bytes'],len(one) * 3)
+		mux.kill()
+		self.assertEqual(mux.poll(),0)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+##########################################################################
+##
+##  Tests of the HDHomeRun control protocol client
+##
+##  Usage:
+##                      python3 -m unittest test_hdhrControl
+##
+##########################################################################
+import struct
+import unittest
+
+import hdhrControl
+import fakeHDHR
+
+## A discover request for any tuner, as libhdhomerun sends it
+DISCOVER_REQUEST = bytes.fromhex('0002000c0104000000010204ffffffff4e507f35')
+
+
+class PacketTest(unittest.TestCase):
+	def testKnownPacket(self):
+		payload = hdhrControl.encodeTLV(hdhrControl.HDHOMERUN_TAG_DEVICE_TYPE,struct.pack('>I',hdhrControl.HDHOMERUN_DEVICE_TYPE_TUNER)) + \
+			hdhrControl.encodeTLV(hdhrControl.HDHOMERUN_TAG_DEVICE_ID,struct.pack('>I',hdhrControl.HDHOMERUN_DEVICE_ID_WILDCARD))
+		self.assertEqual(hdhrControl.buildPacket(hdhrControl.HDHOMERUN_TYPE_DISCOVER_REQ,payload),DISCOVER_REQUEST)
+
+	def testParse(self):
+		packet_type,payload = hdhrControl.parsePacket(DISCOVER_REQUEST)
+		self.assertEqual(packet_type,hdhrControl.HDHOMERUN_TYPE_DISCOVER_REQ)
+		self.assertEqual(hdhrControl.decodeTLVs(payload),{hdhrControl.HDHOMERUN_TAG_DEVICE_TYPE:b'\x00\x00\x00\x01',\
+			hdhrControl.HDHOMERUN_TAG_DEVICE_ID:b'\xff\xff\xff\xff'})
+
+	def testBadCRC(self):
+		frame = bytearray(DISCOVER_REQUEST)
+		frame[-1] ^= 0x01
+		self.assertIsNone(hdhrControl.parsePacket(bytes(frame)))
+		frame = bytearray(DISCOVER_REQUEST)
+		frame[6] ^= 0x01
+		self.assertIsNone(hdhrControl.parsePacket(bytes(frame)))
+
+	def testBadLength(self):
+		self.assertIsNone(hdhrControl.parsePacket(DISCOVER_REQUEST[:-1]))
+		self.assertIsNone(hdhrControl.parsePacket(DISCOVER_REQUEST + b'\x00'))
+		self.assertIsNone(hdhrControl.parsePacket(b'\x00\x02\x00'))
+
+
+class TLVTest(unittest.TestCase):
+	def testString(self):
+		self.assertEqual(hdhrControl.encodeTLV(hdhrControl.HDHOMERUN_TAG_GETSET_NAME,'/tuner0/channel'),b'\x03\x10/tuner0/channel\x00')
+
+	def testLongLength(self):
+		## 200 = 0x48 | 1 << 7: low 7 bits first, with the high bit set
+		tlv = hdhrControl.encodeTLV(hdhrControl.HDHOMERUN_TAG_GETSET_VALUE,b'x' * 200)
+		self.assertEqual(tlv[:3],b'\x04\xc8\x01')
+		self.assertEqual(len(tlv),203)
+		self.assertEqual(hdhrControl.decodeTLVs(tlv),{hdhrControl.HDHOMERUN_TAG_GETSET_VALUE:b'x' * 200})
+
+	def testLengthBoundary(self):
+		for length in (0,1,127,128,129,1000):
+			tlv = hdhrControl.encodeTLV(0x20,b'y' * length)
+			self.assertEqual(len(tlv),length + (2 if length < 128 else 3))
+			self.assertEqual(hdhrControl.decodeTLVs(tlv),{0x20:b'y' * length})
+
+	def testSeveral(self):
+		payload = hdhrControl.encodeTLV(hdhrControl.HDHOMERUN_TAG_GETSET_NAME,'/tuner1/target') + \
+			hdhrControl.encodeTLV(hdhrControl.HDHOMERUN_TAG_GETSET_VALUE,'udp://10.0.0.2:5000') + \
+			hdhrControl.encodeTLV(hdhrControl.HDHOMERUN_TAG_GETSET_LOCKKEY,struct.pack('>I',1234))
+		tags = hdhrControl.decodeTLVs(payload)
+		self.assertEqual(hdhrControl.tagString(tags[hdhrControl.HDHOMERUN_TAG_GETSET_NAME]),'/tuner1/target')
+		self.assertEqual(hdhrControl.tagString(tags[hdhrControl.HDHOMERUN_TAG_GETSET_VALUE]),'udp://10.0.0.2:5000')
+		self.assertEqual(struct.unpack('>I',tags[hdhrControl.HDHOMERUN_TAG_GETSET_LOCKKEY])[0],1234)
+
+	def testTruncated(self):
+		## A TLV running past the end of the payload is left out, the ones before it kept
+		payload = hdhrControl.encodeTLV(0x03,'/sys/model') + hdhrControl.encodeTLV(0x04,b'z' * 300)
+		self.assertEqual(hdhrControl.decodeTLVs(payload[:-1]),{0x03:b'/sys/model\x00'})
+		self.assertEqual(hdhrControl.decodeTLVs(payload[:len(payload) - 301]),{0x03:b'/sys/model\x00'})
+		self.assertEqual(hdhrControl.decodeTLVs(b'\x03'),{})
+
+
+class LockkeyTest(unittest.TestCase):
+	def testLeadingDigits(self):
+		## Same as strtoul() in hdhomerun_config
+		self.assertEqual(hdhrControl.lockkeyValue('3J531UQB'),3)
+		self.assertEqual(hdhrControl.lockkeyValue('  42abc'),42)
+		self.assertEqual(hdhrControl.lockkeyValue('ABC'),0)
+		self.assertEqual(hdhrControl.lockkeyValue(None),0)
+		self.assertEqual(hdhrControl.lockkeyValue(0x1FFFFFFFF),0xFFFFFFFF)
+
+
+class ControlTest(unittest.TestCase):
+	def setUp(self):
+		self.device = fakeHDHR.FakeDevice('10BEEF01',2)
+		self.server = fakeHDHR.startFakeDevice(self.device)
+		self.control = hdhrControl.HDHRControl('10BEEF01','127.0.0.1',self.server.server_address[1])
+
+	def tearDown(self):
+		self.control.close()
+		self.server.shutdown()
+		self.server.server_close()
+
+	def testGetSet(self):
+		self.assertEqual(self.control.get('/sys/model'),'hdhomerun_atsc')
+		self.assertEqual(self.control.set('/tuner0/lockkey',hdhrControl.lockkeyValue('7XYZ'),'7XYZ'),'7')
+		self.assertEqual(self.control.set('/tuner0/channel','auto:19','7XYZ'),'auto:19')
+		self.assertEqual(self.control.get('/tuner0/channel'),'auto:19')
+
+	def testError(self):
+		self.control.set('/tuner1/lockkey','7','7')
+		with self.assertRaises(hdhrControl.HDHRError):
+			self.control.set('/tuner1/channel','auto:19','8')
+		with self.assertRaises(hdhrControl.HDHRError):
+			self.control.get('/tuner9/channel')
+
+	def testReconnect(self):
+		## One retry on a fresh connection when the old one has gone away
+		self.control.get('/sys/model')
+		self.control.sock.close()
+		self.assertEqual(self.control.get('/sys/hwmodel'),'HDHR-2US')
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+##########################################################################
+##
+##  Tests of the weekly schedule index
+##
+##  The clock is pinned to America/New_York, where 2026 springs forward
+##  on Sun 08 Mar (02:00 -> 03:00) and falls back on Sun 01 Nov
+##  (02:00 -> 01:00).
+##
+##  Usage:
+##                      python3 -m unittest test_scheduleIndex
+##
+##########################################################################
+import os
+import time
+import calendar
+import unittest
+
+import scheduleIndex
+
+HOUR = 3600
+
+
+def setUpModule():
+	global saved_tz
+	saved_tz = os.environ.get('TZ')
+	os.environ['TZ'] = 'America/New_York'
+	time.tzset()
+
+
+def tearDownModule():
+	if saved_tz is None:
+		del(os.environ['TZ'])
+	else:
+		os.environ['TZ'] = saved_tz
+	time.tzset()
+
+
+def utc(*when):
+	## Unix time of a UTC wall clock time (year,month,day,hour,minute)
+	return calendar.timegm(when + (0,) * (6 - len(when)))
+
+
+def local(*when):
+	return time.mktime(when + (0,) * (6 - len(when)) + (0,0,-1))
+
+
+def indexOf(**rules):
+	index = scheduleIndex.ScheduleIndex()
+	for name,rule in rules.items():
+		index.update(name,rule)
+	return index
+
+
+class NextOccurrenceTest(unittest.TestCase):
+	def testPlainWeekday(self):
+		index = indexOf(news={'day':['Mon','Wed'],'start':'18:29','end':'19:01'})
+		## Mon 12 Oct 2026, EDT (UTC-4)
+		self.assertEqual(index.nextOccurrence('news',local(2026,10,12,12,0)),(utc(2026,10,12,22,29),utc(2026,10,12,23,1)))
+		## Over on Monday: Wednesday is next
+		self.assertEqual(index.nextOccurrence('news',local(2026,10,12,19,1)),(utc(2026,10,14,22,29),utc(2026,10,14,23,1)))
+
+	def testLiveOccurrence(self):
+		index = indexOf(news={'day':'Mon','start':'18:29','end':'19:01'})
+		self.assertEqual(index.nextOccurrence('news',local(2026,10,12,18,45)),(utc(2026,10,12,22,29),utc(2026,10,12,23,1)))
+
+	def testSpringForward(self):
+		## 01:30 EST to 03:30 EDT is one hour
+		index = indexOf(late={'day':'Sun','start':'01:30','end':'03:30'})
+		start,stop = index.nextOccurrence('late',local(2026,3,7,12,0))
+		self.assertEqual((start,stop),(utc(2026,3,8,6,30),utc(2026,3,8,7,30)))
+		self.assertEqual(stop - start,HOUR)
+
+	def testSpringForwardAcrossMidnight(self):
+		## Sat 23:00 EST to Sun 04:00 EDT is four hours
+		index = indexOf(movie={'day':'Sat','start':'23:00','end':'04:00'})
+		self.assertEqual(index.nextOccurrence('movie',local(2026,3,7,12,0)),(utc(2026,3,8,4,0),utc(2026,3,8,8,0)))
+
+	def testFallBack(self):
+		## 00:30 EDT to 02:30 EST is three hours
+		index = indexOf(late={'day':'Sun','start':'00:30','end':'02:30'})
+		start,stop = index.nextOccurrence('late',local(2026,10,31,12,0))
+		self.assertEqual((start,stop),(utc(2026,11,1,4,30),utc(2026,11,1,7,30)))
+		self.assertEqual(stop - start,3 * HOUR)
+
+	def testFallBackAcrossMidnight(self):
+		## Sat 23:34 EDT to Sun 00:38 EDT, before the change; then the same show a week later in EST
+		index = indexOf(tonight={'day':'Sat','start':'23:34','end':'00:38'})
+		self.assertEqual(index.nextOccurrence('tonight',local(2026,10,31,12,0)),(utc(2026,11,1,3,34),utc(2026,11,1,4,38)))
+		self.assertEqual(index.nextOccurrence('tonight',utc(2026,11,1,4,38)),(utc(2026,11,8,4,34),utc(2026,11,8,5,38)))
+
+	def testMidnightSpanning(self):
+		index = indexOf(tonight={'day':['Mon','Tue'],'start':'23:34','end':'00:38'})
+		## Still live after midnight on Tuesday, from Monday's start
+		self.assertEqual(index.nextOccurrence('tonight',local(2026,10,13,0,10)),(local(2026,10,12,23,34),local(2026,10,13,0,38)))
+		## Once that is over, Tuesday's runs into Wednesday
+		self.assertEqual(index.nextOccurrence('tonight',local(2026,10,13,0,38)),(local(2026,10,13,23,34),local(2026,10,14,0,38)))
+
+	def testEndOfWeek(self):
+		index = indexOf(late={'day':'Sun','start':'23:30','end':'00:30'})
+		## Live early on Monday from the Sunday of the week before
+		self.assertEqual(index.nextOccurrence('late',local(2026,10,19,0,15)),(local(2026,10,18,23,30),local(2026,10,19,0,30)))
+		## Over: next Sunday
+		self.assertEqual(index.nextOccurrence('late',local(2026,10,19,0,30)),(local(2026,10,25,23,30),local(2026,10,26,0,30)))
+		## Saturday: the Sunday of the same week
+		self.assertEqual(index.nextOccurrence('late',local(2026,10,24,12,0)),(local(2026,10,25,23,30),local(2026,10,26,0,30)))
+
+	def testWrapsToNextWeek(self):
+		index = indexOf(news={'day':'Mon','start':'06:59','end':'07:23'})
+		self.assertEqual(index.nextOccurrence('news',local(2026,10,18,22,0)),(local(2026,10,19,6,59),local(2026,10,19,7,23)))
+
+	def testUnknownRule(self):
+		self.assertIsNone(indexOf().nextOccurrence('missing',local(2026,10,12,12,0)))
+
+	def testRecompileOnlyWhenChanged(self):
+		index = indexOf(news={'day':'Mon','start':'18:29','end':'19:01'})
+		self.assertFalse(index.update('news',{'day':'Mon','start':'18:29','end':'19:01','keep_days':2}))
+		self.assertTrue(index.update('news',{'day':'Tue','start':'18:29','end':'19:01'}))
+		self.assertEqual(index.nextOccurrence('news',local(2026,10,12,12,0)),(local(2026,10,13,18,29),local(2026,10,13,19,1)))
+
+
+class LiveAtTest(unittest.TestCase):
+	def setUp(self):
+		self.index = indexOf(news={'day':['Mon','Tue','Wed','Thu','Fri'],'start':'18:29','end':'19:01'},\
+			tonight={'day':['Mon','Tue'],'start':'23:34','end':'00:38'},\
+			late={'day':'Sun','start':'23:30','end':'00:30'},\
+			allday={'day':'Wed','start':'00:00','end':'23:59'})
+
+	def testLive(self):
+		self.assertEqual(self.index.liveAt(local(2026,10,12,18,30)),['news'])
+		self.assertEqual(self.index.liveAt(local(2026,10,14,18,30)),['allday','news'])
+		self.assertEqual(self.index.liveAt(local(2026,10,12,12,0)),[])
+
+	def testEndsAreExclusive(self):
+		self.assertEqual(self.index.liveAt(local(2026,10,12,18,29)),['news'])
+		self.assertEqual(self.index.liveAt(local(2026,10,12,19,1)),[])
+
+	def testMidnightSpanning(self):
+		self.assertEqual(self.index.liveAt(local(2026,10,13,0,10)),['tonight'])
+		self.assertEqual(self.index.liveAt(local(2026,10,14,0,10)),['allday','tonight'])
+
+	def testEndOfWeek(self):
+		self.assertEqual(self.index.liveAt(local(2026,10,18,23,45)),['late'])
+		self.assertEqual(self.index.liveAt(local(2026,10,19,0,15)),['late'])
+		self.assertEqual(self.index.liveAt(local(2026,10,19,0,30)),[])
+
+	def testManyRules(self):
+		## More slot starts/ends than a checkpoint covers
+		index = indexOf(**dict(('show%d' %(n),{'day':'Thu','start':'%02d:%02d' %(n // 60,n % 60),'end':'23:00'}) for n in range(200)))
+		self.assertEqual(len(index.liveAt(local(2026,10,15,22,0))),200)
+		self.assertEqual(index.liveAt(local(2026,10,15,0,0)),['show0'])
+		self.assertEqual(len(index.liveAt(local(2026,10,15,3,0,30))),181)
+		index.remove('show0')
+		self.assertEqual(index.liveAt(local(2026,10,15,0,0)),[])
+
+	def testNextStart(self):
+		self.assertEqual(self.index.nextStart(local(2026,10,12,12,0)),(18 * 60 + 29,'news'))
+		self.assertEqual(self.index.nextStart(local(2026,10,18,23,40)),(18 * 60 + 29,'news'))
+		self.assertEqual(self.index.nextStart(local(2026,10,13,23,40)),(2 * 1440,'allday'))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+##########################################################################
+##
+##  Tests of the MPEG-TS integrity analyzer
+##
+##  Usage:
+##                      python3 -m unittest test_tsAnalyzer
+##
+##########################################################################
+import unittest
+
+import tsAnalyzer
+import benchmark
+import fakeHDHR
+
+TS = tsAnalyzer.TS_PACKET_SIZE
+MODES = sorted(set([False,tsAnalyzer.HAVE_NUMPY]))
+
+
+def pcrPacket(pid,cc,pcr,discontinuity=False):
+	## A packet with an adaptation field carrying pcr (27 MHz) and a payload
+	base,ext = divmod(pcr,300)
+	field = bytes([7,0x10 | (0x80 if discontinuity else 0),(base >> 25) & 0xFF,(base >> 17) & 0xFF,(base >> 9) & 0xFF,\
+		(base >> 1) & 0xFF,((base & 0x01) << 7) | 0x7E | (ext >> 8),ext & 0xFF])
+	return bytes([0x47,(pid >> 8) & 0x1F,pid & 0xFF,0x30 | (cc & 0x0F)]) + field + b'\x00' * (184 - len(field))
+
+
+def analyze(data,use_numpy,piece=None):
+	analyzer = tsAnalyzer.TSAnalyzer(use_numpy)
+	piece = piece or len(data) or 1
+	for pos in range(0,len(data),piece):
+		analyzer.feed(memoryview(data)[pos:pos + piece])
+	return analyzer.counters()
+
+
+class AnalyzerTest(unittest.TestCase):
+	def setUp(self):
+		self.one = benchmark.filterMultiplex()
+		self.mux = b''.join(fakeHDHR.buildMultiplex())
+
+	def testClean(self):
+		for use_numpy in MODES:
+			counters = analyze(self.one,use_numpy)
+			self.assertEqual(counters['packets'],len(self.one) // TS)
+			self.assertEqual([counters[key] for key in ('sync_errors','skipped_bytes','tei_errors','cc_errors','pcr_jumps')],[0] * 5)
+			## The fake multiplex repeats without a CC discontinuity, in pieces that split packets
+			counters = analyze(self.mux * 3,use_numpy,1000)
+			self.assertEqual((counters['packets'],counters['cc_errors']),(len(self.mux) * 3 // TS,0))
+
+	def testDroppedPacket(self):
+		## A packet missing: one error for its PID, wherever the pieces are split
+		video = [pos for pos in range(0,len(self.one),TS) if self.one[pos + 2] == 0x31]
+		data = self.one[:video[10]] + self.one[video[10] + TS:]
+		for use_numpy in MODES:
+			for piece in (None,TS * 7,1000):
+				self.assertEqual(analyze(data,use_numpy,piece)['cc_errors'],1)
+
+	def testDuplicateAndNull(self):
+		## A repeated packet (same counter) is allowed; null packets aren't counted at all
+		video = [pos for pos in range(0,len(self.one),TS) if self.one[pos + 2] == 0x31]
+		data = self.one[:video[10]] + self.one[video[10]:video[10] + TS] + self.one[video[10]:]
+		null = fakeHDHR.buildTSPacket(tsAnalyzer.NULL_PID,5)
+		for use_numpy in MODES:
+			self.assertEqual(analyze(data + null + null,use_numpy)['cc_errors'],0)
+
+	def testDiscontinuityIndicator(self):
+		for use_numpy in MODES:
+			data = pcrPacket(0x31,0,27000000) + pcrPacket(0x31,9,27000000 * 2,True)
+			counters = analyze(data,use_numpy)
+			self.assertEqual((counters['cc_errors'],counters['pcr_jumps']),(0,0))
+			counters = analyze(pcrPacket(0x31,0,27000000) + pcrPacket(0x31,9,27000000 + 2700000),use_numpy)
+			self.assertEqual(counters['cc_errors'],1)
+
+	def testTEI(self):
+		data = bytearray(self.one)
+		for pos in (TS * 3,TS * 50):
+			data[pos + 1] |= 0x80
+		for use_numpy in MODES:
+			self.assertEqual(analyze(bytes(data),use_numpy)['tei_errors'],2)
+
+	def testSync(self):
+		## Junk between packets: one sync error for the run of it, and its length skipped
+		for use_numpy in MODES:
+			counters = analyze(self.one[:TS * 100] + b'\x00\x01' * 150 + self.one[TS * 100:],use_numpy,4096)
+			self.assertEqual((counters['sync_errors'],counters['skipped_bytes'],counters['cc_errors']),(1,300,0))
+			self.assertEqual(counters['packets'],len(self.one) // TS)
+
+	def testNeverSyncs(self):
+		## Noise without a packet in it: one sync error, and only a packet's worth is held on to
+		for use_numpy in MODES:
+			analyzer = tsAnalyzer.TSAnalyzer(use_numpy)
+			for n in range(50):
+				analyzer.feed(memoryview(bytes(range(256)) * 64))
+			self.assertLessEqual(len(analyzer.carry),TS)
+			self.assertEqual(analyzer.sync_errors,1)
+			self.assertEqual(analyzer.skipped_bytes + len(analyzer.carry),50 * 256 * 64)
+
+	def testPCR(self):
+		## 40 ms steps are fine; a step back or of more than PCR_MAX_GAP is a jump
+		second = tsAnalyzer.PCR_HZ
+		steps = [0,second // 25,second // 25 * 2,second // 25 * 2 - 1000,second * 5,second * 5 + second // 25]
+		data = b''.join(pcrPacket(0x31,n,second + step) for n,step in enumerate(steps))
+		for use_numpy in MODES:
+			counters = analyze(data,use_numpy)
+			self.assertEqual(counters['pcr_jumps'],2)
+			self.assertEqual((counters['first_pcr'],counters['last_pcr']),(second,second * 6 + second // 25))
+			self.assertAlmostEqual(counters['pcr_seconds'],0.12)
+
+	def testPCRWrap(self):
+		for use_numpy in MODES:
+			data = pcrPacket(0x31,0,tsAnalyzer.PCR_WRAP - 300) + pcrPacket(0x31,1,300)
+			self.assertEqual(analyze(data,use_numpy)['pcr_jumps'],0)
+
+
+if __name__ == '__main__':
+	unittest.main()
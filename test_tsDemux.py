@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+##########################################################################
+##
+##  Tests of the MPEG-TS program demultiplexer and its PID filter
+##
+##  Usage:
+##                      python3 -m unittest test_tsDemux
+##
+##########################################################################
+import unittest
+
+import tsDemux
+import benchmark
+
+TS = tsDemux.TS_PACKET_SIZE
+MODES = sorted(set([False,tsDemux.HAVE_NUMPY]))
+
+## What 'video,audio,eng' keeps of program 3 in benchmark.filterMultiplex(): the video (also
+## the PCR), the English main audio and the English DVS; not the Spanish SAP nor the data
+FILTERED = (0x31,0x34,0x36)
+
+
+def packetsOf(data):
+	return [data[pos:pos + TS] for pos in range(0,len(data),TS)]
+
+
+class _Sink(object):
+	def __init__(self):
+		self.chunks = []
+
+	def write(self,data):
+		self.chunks.append(bytes(data))
+
+	def packets(self):
+		return packetsOf(b''.join(self.chunks))
+
+
+def pidOf(packet):
+	return ((packet[1] & 0x1F) << 8) | packet[2]
+
+
+def pidCounts(packets):
+	counts = {}
+	for packet in packets:
+		counts[pidOf(packet)] = counts.get(pidOf(packet),0) + 1
+	return counts
+
+
+def sectionOf(packet):
+	## The section starting in a packet with pointer_field 0
+	offset = tsDemux.packetPayload(packet) + 1
+	return packet[offset:offset + 3 + (((packet[offset + 1] & 0x0F) << 8) | packet[offset + 2])]
+
+
+class TablesTest(unittest.TestCase):
+	def testPAT(self):
+		## Program 0 (the NIT) isn't a program
+		section = tsDemux.buildPAT(0x0815,[(0,0x10),(3,0x30),(4,0x40)],5)
+		self.assertEqual(tsDemux.crc32(section),0)
+		self.assertEqual(tsDemux.parsePAT(section),(0x0815,5,{3:0x30,4:0x40}))
+
+	def testPMT(self):
+		section = tsDemux.buildPMT(3,0x31,[(0x02,0x31),(0x81,0x34)])
+		self.assertEqual(tsDemux.parsePMT(section),(3,0x31,[(0x02,0x31),(0x81,0x34)]))
+		self.assertEqual([entry[:3] for entry in tsDemux.pmtEntries(section)],[(0x02,0x31,None),(0x81,0x34,None)])
+
+	def testSeen(self):
+		for use_numpy in MODES:
+			demux = tsDemux.TSDemux(use_numpy)
+			demux.feed(benchmark.filterMultiplex())
+			self.assertEqual(demux.programs(),{3:(0x30,0x31,[(0x02,0x31),(0x81,0x34),(0x81,0x35),(0x81,0x36),(0x86,0x37),(0x05,0x38)]),\
+				4:(0x40,0x41,[(0x02,0x41),(0x81,0x44)])})
+			self.assertEqual((demux.psi_errors,demux.sync_errors),(0,0))
+
+	def testBadCRC(self):
+		## A damaged PAT is counted and not taken
+		pat = bytearray(tsDemux.buildPAT(0x0815,[(3,0x30)]))
+		pat[9] ^= 0x01
+		demux = tsDemux.TSDemux(False)
+		demux.feed(tsDemux.sectionPacket(tsDemux.PAT_PID,bytes(pat)))
+		self.assertEqual(demux.psi_errors,1)
+		self.assertEqual(demux.programs(),{})
+
+
+class DemuxTest(unittest.TestCase):
+	def setUp(self):
+		self.one = benchmark.filterMultiplex()
+		self.counts = pidCounts(packetsOf(self.one))
+
+	def demux(self,use_numpy,programs,data):
+		## What programs get of data once the demuxer has seen a round of the tables
+		demux = tsDemux.TSDemux(use_numpy)
+		sinks = dict((program,_Sink()) for program in programs)
+		for program in programs:
+			demux.addProgram(program,sinks[program])
+		demux.feed(self.one)
+		for sink in sinks.values():
+			sink.chunks = []
+		demux.feed(data)
+		return demux,dict((program,b''.join(sink.chunks)) for program,sink in sinks.items())
+
+	def testOneProgram(self):
+		## Every stream of program 3, its own PMT as it was, and a PAT listing only program 3
+		for use_numpy in MODES:
+			demux,out = self.demux(use_numpy,[3],self.one * 3)
+			packets = packetsOf(out[3])
+			wanted = (tsDemux.PAT_PID,0x30,0x31,0x34,0x35,0x36,0x37,0x38)
+			self.assertEqual(pidCounts(packets),dict((pid,self.counts[pid] * 3) for pid in wanted))
+			pmt = [packet for packet in packets if pidOf(packet) == 0x30]
+			self.assertTrue(all(packet in packetsOf(self.one) for packet in pmt))
+			pat = [packet for packet in packets if pidOf(packet) == tsDemux.PAT_PID]
+			self.assertEqual(tsDemux.parsePAT(sectionOf(pat[0])),(0x0815,0,{3:0x30}))
+			self.assertEqual(demux.counters()['packets'],len(packetsOf(self.one)) * 4)
+
+	def testSharedMux(self):
+		## Two programs out of one multiplex, each with only its own PIDs
+		for use_numpy in MODES:
+			demux,out = self.demux(use_numpy,[3,4],self.one * 2)
+			self.assertEqual(set(pidCounts(packetsOf(out[3]))),set([tsDemux.PAT_PID,0x30,0x31,0x34,0x35,0x36,0x37,0x38]))
+			self.assertEqual(pidCounts(packetsOf(out[4])),dict((pid,self.counts[pid] * 2) for pid in (tsDemux.PAT_PID,0x40,0x41,0x44)))
+			pat = [packet for packet in packetsOf(out[4]) if pidOf(packet) == tsDemux.PAT_PID]
+			self.assertEqual(tsDemux.parsePAT(sectionOf(pat[0]))[2],{4:0x40})
+
+	def testPieces(self):
+		## Fed in pieces that split packets, with and without NumPy: the same bytes come out
+		data = self.one * 3
+		whole = self.demux(False,[3,4],data)[1]
+		for use_numpy in MODES:
+			demux = tsDemux.TSDemux(use_numpy)
+			sinks = {3:_Sink(),4:_Sink()}
+			for program in sinks:
+				demux.addProgram(program,sinks[program])
+			demux.feed(self.one)
+			for sink in sinks.values():
+				sink.chunks = []
+			for pos in range(0,len(data),1000):
+				demux.feed(memoryview(data)[pos:pos + 1000])
+			self.assertEqual(dict((program,b''.join(sink.chunks)) for program,sink in sinks.items()),whole)
+
+	def testResync(self):
+		## Junk between two rounds costs one sync error and nothing of the rounds
+		for use_numpy in MODES:
+			demux,out = self.demux(use_numpy,[4],self.one + b'\x00\x47' * 50 + self.one)
+			self.assertEqual(demux.sync_errors,1)
+			self.assertEqual(pidCounts(packetsOf(out[4])),dict((pid,self.counts[pid] * 2) for pid in (tsDemux.PAT_PID,0x40,0x41,0x44)))
+
+	def testRemoveProgram(self):
+		demux,out = self.demux(False,[3,4],b'')
+		demux.removeProgram(3)
+		self.assertEqual(list(demux.outputs),[4])
+		self.assertNotIn(0x31,demux.routes)
+
+
+class PMTFilterTest(unittest.TestCase):
+	def setUp(self):
+		self.one = benchmark.filterMultiplex()
+		self.counts = pidCounts(packetsOf(self.one))
+
+	def check(self,packets,rounds,first=0):
+		## rounds of the multiplex, reduced to program 3's PAT, filtered PMT and the kept streams
+		expected = dict((pid,self.counts[pid] * rounds) for pid in FILTERED)
+		expected.update({tsDemux.PAT_PID:rounds,0x30:rounds})
+		self.assertEqual(pidCounts(packets),expected)
+		pat = [packet for packet in packets if pidOf(packet) == tsDemux.PAT_PID]
+		pmt = [packet for packet in packets if pidOf(packet) == 0x30]
+		self.assertEqual(tsDemux.parsePAT(sectionOf(pat[0]))[2],{3:0x30})
+		self.assertEqual(tsDemux.crc32(sectionOf(pmt[0])),0)
+		self.assertEqual(tsDemux.parsePMT(sectionOf(pmt[0])),(3,0x31,[(0x02,0x31),(0x81,0x34),(0x81,0x36)]))
+		## The rewritten tables count on from first without a gap
+		self.assertEqual([packet[3] & 0x0F for packet in pmt],[n & 0x0F for n in range(first,first + rounds)])
+		self.assertEqual([packet[3] & 0x0F for packet in pat],[n & 0x0F for n in range(first,first + rounds)])
+
+	def testAddedBeforeTables(self):
+		for use_numpy in MODES:
+			demux = tsDemux.TSDemux(use_numpy)
+			sink = _Sink()
+			demux.addProgram(3,sink,keep=tsDemux.pidFilter('video,audio,eng'))
+			demux.feed(self.one)
+			## What comes before the first PAT and PMT is left out
+			self.assertEqual(pidCounts(sink.packets())[0x30],1)
+			sink.chunks = []
+			demux.feed(self.one * 5)
+			self.check(sink.packets(),5,1)
+
+	def testAddedAfterTables(self):
+		## A program joining a demuxer that has seen the PAT and PMT (a shared or warm tuner)
+		for use_numpy in MODES:
+			demux = tsDemux.TSDemux(use_numpy)
+			demux.feed(self.one)
+			sink = _Sink()
+			demux.addProgram(3,sink,keep=tsDemux.pidFilter('video,audio,eng'))
+			self.assertIsNotNone(demux.outputs[3]['pmt'])
+			demux.feed(self.one * 5)
+			self.check(sink.packets(),5)
+
+	def testPMTMoves(self):
+		## A new PAT with the PMT on another PID: nothing is written for it until that PMT is seen
+		demux = tsDemux.TSDemux(False)
+		demux.feed(self.one)
+		sink = _Sink()
+		demux.addProgram(3,sink,keep=tsDemux.pidFilter('video'))
+		demux.feed(tsDemux.sectionPacket(tsDemux.PAT_PID,tsDemux.buildPAT(1,[(3,0x50)],1)))
+		self.assertEqual(demux.outputs[3]['pmt_pid'],0x50)
+		self.assertIsNone(demux.outputs[3]['pmt'])
+		demux.feed(tsDemux.sectionPacket(0x50,tsDemux.buildPMT(3,0x51,[(0x02,0x51),(0x81,0x54)])))
+		self.assertEqual(tsDemux.parsePMT(sectionOf(demux.outputs[3]['pmt'][0])),(3,0x51,[(0x02,0x51)]))
+		self.assertEqual(demux.outputs[3]['pids'],set([tsDemux.PAT_PID,0x50,0x51]))
+
+
+if __name__ == '__main__':
+	unittest.main()
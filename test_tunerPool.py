@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+##########################################################################
+##
+##  Tests of the tuner pool and its allocation plan
+##
+##  Usage:
+##                      python3 -m unittest test_tunerPool
+##
+##########################################################################
+import unittest
+
+import tunerPool
+
+NOW = 1000000.0
+HOUR = 3600
+
+
+def recording(start,stop,priority=None,channel=None,active=None):
+	## A recording starting/stopping start/stop hours from NOW; active=(device,tuner) holds that tuner
+	entry = {'unix_start_time':NOW + start * HOUR,'unix_stop_time':NOW + stop * HOUR,'status':None,'channel':channel}
+	if priority is not None:
+		entry['priority'] = priority
+	if active:
+		entry['status'] = 'active'
+		entry['device'],entry['tuner'] = active
+	return entry
+
+
+def poolOf(*devices,**options):
+	## devices: (device_id,number of tuners), all online
+	pool = tunerPool.TunerPool(**options)
+	for device_id,num_tuners in devices:
+		pool.addDevice(device_id,'10.0.0.%d' %(len(pool.devices) + 1),num_tuners)
+		pool.setOnline(device_id,True)
+	return pool
+
+
+class TunersTest(unittest.TestCase):
+	def testOnlineOnly(self):
+		pool = poolOf(('BBBB0002',2),('AAAA0001',1))
+		self.assertEqual(pool.tuners(),[('AAAA0001',0),('BBBB0002',0),('BBBB0002',1)])
+		pool.setOnline('AAAA0001',False)
+		self.assertEqual(pool.tuners(),[('BBBB0002',0),('BBBB0002',1)])
+
+	def testDirty(self):
+		pool = poolOf(('AAAA0001',2))
+		pool.allocate({},NOW)
+		self.assertFalse(pool.dirty)
+		pool.setOnline('AAAA0001',True)
+		self.assertFalse(pool.dirty)
+		pool.setOnline('AAAA0001',False)
+		self.assertTrue(pool.dirty)
+
+	def testTunerName(self):
+		self.assertEqual(tunerPool.tunerName(('1052A5C2',1)),'1052A5C2-1')
+
+
+class AllocateTest(unittest.TestCase):
+	def testSpreadOverDevices(self):
+		pool = poolOf(('AAAA0001',1),('BBBB0002',1))
+		recordings = {'A':recording(1,2),'B':recording(1,2)}
+		self.assertEqual(pool.allocate(recordings,NOW),{})
+		self.assertEqual(sorted(pool.plan.values()),[('AAAA0001',0),('BBBB0002',0)])
+
+	def testConflict(self):
+		pool = poolOf(('AAAA0001',2))
+		recordings = {'A':recording(1,3),'B':recording(2,4),'C':recording(2.5,3.5)}
+		self.assertEqual(pool.allocate(recordings,NOW),{'C':['A','B']})
+		self.assertNotIn('C',pool.plan)
+
+	def testBackToBack(self):
+		pool = poolOf(('AAAA0001',1))
+		recordings = {'A':recording(1,2),'B':recording(2,3),'C':recording(3,4)}
+		self.assertEqual(pool.allocate(recordings,NOW),{})
+		self.assertEqual(set(pool.plan.values()),set([('AAAA0001',0)]))
+
+	def testPriorityFirst(self):
+		## B starts later but outranks A, so it gets the only tuner
+		pool = poolOf(('AAAA0001',1))
+		recordings = {'A':recording(1,3),'B':recording(2,4,priority=5)}
+		self.assertEqual(pool.allocate(recordings,NOW),{'A':['B']})
+		self.assertEqual(pool.plan,{'B':('AAAA0001',0)})
+
+	def testActiveKeepsTuner(self):
+		pool = poolOf(('AAAA0001',2))
+		recordings = {'A':recording(-1,2,active=('AAAA0001',1)),'B':recording(1,2)}
+		pool.allocate(recordings,NOW)
+		self.assertEqual(pool.plan,{'A':('AAAA0001',1),'B':('AAAA0001',0)})
+
+	def testOverIsLeftOut(self):
+		pool = poolOf(('AAAA0001',1))
+		self.assertEqual(pool.allocate({'A':recording(-3,-1),'B':recording(1,2)},NOW),{})
+		self.assertEqual(pool.plan,{'B':('AAAA0001',0)})
+
+	def testPreemption(self):
+		pool = poolOf(('AAAA0001',1))
+		recordings = {'A':recording(-1,2,priority=1,active=('AAAA0001',0)),'B':recording(1,2,priority=3)}
+		self.assertEqual(pool.allocate(recordings,NOW),{})
+		self.assertEqual(pool.preemptions,{'B':['A']})
+		self.assertEqual(pool.plan,{'B':('AAAA0001',0)})
+
+	def testNoPreemptionOfEqualPriority(self):
+		pool = poolOf(('AAAA0001',1))
+		recordings = {'A':recording(-1,2,active=('AAAA0001',0)),'B':recording(1,2)}
+		self.assertEqual(pool.allocate(recordings,NOW),{'B':['A']})
+		self.assertEqual(pool.preemptions,{})
+
+	def testSharedMultiplex(self):
+		## A and B are on the same RF channel and share a tuner; C needs the other one
+		pool = poolOf(('AAAA0001',2),multiplex=lambda recording: recording['channel'])
+		recordings = {'A':recording(1,3,channel=19),'B':recording(2,4,channel=19),'C':recording(2,3,channel=10)}
+		self.assertEqual(pool.allocate(recordings,NOW),{})
+		self.assertEqual(pool.plan['A'],pool.plan['B'])
+		self.assertNotEqual(pool.plan['A'],pool.plan['C'])
+
+	def testNotSharedWithoutDemux(self):
+		pool = poolOf(('AAAA0001',1))
+		recordings = {'A':recording(1,3,channel=19),'B':recording(2,4,channel=19)}
+		self.assertEqual(pool.allocate(recordings,NOW),{'B':['A']})
+
+	def testSharedAssignmentsMerge(self):
+		## A and B merge into one assignment covering 1-4, so C (another multiplex) can't fit between
+		pool = poolOf(('AAAA0001',1),multiplex=lambda recording: recording['channel'])
+		recordings = {'A':recording(1,2.5,channel=19),'B':recording(2,4,channel=19),'C':recording(3,3.5,channel=10)}
+		self.assertEqual(pool.allocate(recordings,NOW),{'C':['A','B']})
+
+
+class StartTest(unittest.TestCase):
+	def testChooseTuner(self):
+		pool = poolOf(('AAAA0001',2))
+		recordings = {'A':recording(0,2),'B':recording(0,2,active=('AAAA0001',0))}
+		pool.plan = {'A':('AAAA0001',1)}
+		self.assertEqual(pool.chooseTuner('A',recordings),('AAAA0001',1))
+		self.assertIsNone(pool.chooseTuner('A',recordings,exclude=[('AAAA0001',1)]))
+
+	def testSharedTuner(self):
+		pool = poolOf(('AAAA0001',2),multiplex=lambda recording: recording['channel'])
+		recordings = {'A':recording(0,2,channel=19),'B':recording(-1,2,channel=19,active=('AAAA0001',1)),\
+			'C':recording(0,2,channel=10)}
+		self.assertEqual(pool.sharedTuner('A',recordings),('AAAA0001',1))
+		self.assertIsNone(pool.sharedTuner('C',recordings))
+
+	def testPreemptionVictims(self):
+		## The lowest priority tuner goes; between equals, the one that started last
+		pool = poolOf(('AAAA0001',3))
+		recordings = {'A':recording(-2,2,priority=1,active=('AAAA0001',0)),'B':recording(-1,2,priority=1,active=('AAAA0001',1)),\
+			'C':recording(-1,2,priority=0,active=('AAAA0001',2)),'D':recording(0,2,priority=2)}
+		self.assertEqual(pool.preemptionVictims('D',recordings),['C'])
+		self.assertEqual(pool.preemptionVictims('D',recordings,exclude=[('AAAA0001',2)]),['B'])
+		recordings['D']['priority'] = 1
+		self.assertEqual(pool.preemptionVictims('D',recordings,exclude=[('AAAA0001',2)]),[])
+
+
+if __name__ == '__main__':
+	unittest.main()
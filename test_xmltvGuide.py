@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+##########################################################################
+##
+##  Tests of the XMLTV guide index and the series rules matched on it
+##
+##  The clock is pinned to America/New_York, as airing names carry the
+##  local start time.
+##
+##  Usage:
+##                      python3 -m unittest test_xmltvGuide
+##
+##########################################################################
+import os
+import gzip
+import time
+import shutil
+import calendar
+import tempfile
+import unittest
+
+import xmltvGuide
+
+GUIDE = '''<?xml version="1.0" encoding="UTF-8"?>
+<tv generator-info-name="test">
+  <channel id="I5.1.waga"><display-name>5.1 WAGA</display-name><display-name>WAGA</display-name></channel>
+  <channel id="I46.1.wgcl"><display-name>46.1 WGCL</display-name></channel>
+  <channel id="I99.1.far"><display-name>99.1 FAR</display-name></channel>
+  <programme start="20261020200000 -0400" stop="20261020210000 -0400" channel="I46.1.wgcl">
+    <title>NCIS</title><sub-title>Out of Time</sub-title>
+    <episode-num system="xmltv_ns">23.4.</episode-num><episode-num system="dd_progid">EP0001</episode-num><new/>
+  </programme>
+  <programme start="20261020210000 -0400" stop="20261020220000 -0400" channel="I46.1.wgcl">
+    <title>NCIS</title><sub-title>Kill Chain</sub-title><previously-shown/>
+  </programme>
+  <programme start="20261021000000 -0400" stop="20261021010000 -0400" channel="I5.1.waga">
+    <title>ncis</title><sub-title>Out of Time</sub-title><episode-num system="dd_progid">EP0001</episode-num>
+  </programme>
+  <programme start="20261022200000 -0400" channel="I46.1.wgcl">
+    <title>NCIS</title><sub-title>Next Week</sub-title><episode-num system="dd_progid">EP0002</episode-num><premiere/>
+  </programme>
+  <programme start="20261022203000 -0400" stop="20261022200000 -0400" channel="I46.1.wgcl">
+    <title>Local News</title>
+  </programme>
+  <programme start="20261020200000 -0400" stop="20261020210000 -0400" channel="I99.1.far">
+    <title>NCIS</title>
+  </programme>
+  <programme start="garbage" channel="I5.1.waga"><title>Broken</title></programme>
+</tv>
+'''
+
+CHANNELS = {'WAGA':{'name':'5.1 WAGA-HD'},'CBS':{'name':'46.1 WGCL-TV'},'PBS':{'name':'8.1 WPBA','xmltv':'I8.1.wpba'}}
+
+
+def setUpModule():
+	global saved_tz
+	saved_tz = os.environ.get('TZ')
+	os.environ['TZ'] = 'America/New_York'
+	time.tzset()
+
+
+def tearDownModule():
+	if saved_tz is None:
+		del(os.environ['TZ'])
+	else:
+		os.environ['TZ'] = saved_tz
+	time.tzset()
+
+
+def utc(*when):
+	return calendar.timegm(when + (0,) * (6 - len(when)))
+
+
+class ParseTest(unittest.TestCase):
+	def testParseTime(self):
+		self.assertEqual(xmltvGuide.parseTime('20261020200000 -0400'),utc(2026,10,21,0,0))
+		self.assertEqual(xmltvGuide.parseTime('20261020200000 +0130'),utc(2026,10,20,18,30))
+		self.assertEqual(xmltvGuide.parseTime('20261020200000 -04:00'),utc(2026,10,21,0,0))
+		self.assertEqual(xmltvGuide.parseTime('202610202000'),utc(2026,10,20,20,0))
+		self.assertEqual(xmltvGuide.parseTime('20261020200030'),utc(2026,10,20,20,0,30))
+		self.assertIsNone(xmltvGuide.parseTime('tomorrow'))
+		self.assertIsNone(xmltvGuide.parseTime(None))
+
+	def testTitleKey(self):
+		self.assertEqual(xmltvGuide.titleKey('Law & Order: SVU'),xmltvGuide.titleKey('law & order  svu'))
+		self.assertEqual(xmltvGuide.titleKey('NCIS: Los Angeles'),'ncis los angeles')
+		self.assertNotEqual(xmltvGuide.titleKey('Law & Order: SVU'),xmltvGuide.titleKey('LAW AND ORDER - SVU'))
+		self.assertEqual(xmltvGuide.titleKey(None),'')
+
+	def testChannelMatcher(self):
+		wanted = xmltvGuide.channelMatcher(CHANNELS)
+		self.assertEqual(wanted('I5.1.waga',['5.1 WAGA']),'WAGA')
+		self.assertEqual(wanted('whatever',['WGCL-TV']),'CBS')
+		self.assertEqual(wanted('whatever',['Cbs']),'CBS')
+		self.assertEqual(wanted('I8.1.wpba',[]),'PBS')
+		## PBS has an xmltv id, so its virtual number doesn't count
+		self.assertIsNone(wanted('other',['8.1 WPBA']))
+		self.assertIsNone(wanted('I99.1.far',['99.1 FAR']))
+
+
+class GuideIndexTest(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.filename = os.path.join(self.dir,'guide.xml')
+		with open(self.filename,'w') as fptr:
+			fptr.write(GUIDE)
+		self.index = xmltvGuide.GuideIndex(self.filename)
+		self.index.load(xmltvGuide.channelMatcher(CHANNELS))
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def testLoad(self):
+		self.assertEqual(len(self.index.listings),5)
+		self.assertEqual(self.index.skipped,2)
+		self.assertEqual(self.index.channels,{'I5.1.waga':'WAGA','I46.1.wgcl':'CBS','I99.1.far':None})
+		listing = self.index.listings[('CBS',utc(2026,10,21,0,0))]
+		self.assertEqual(listing,xmltvGuide.Listing('CBS',utc(2026,10,21,0,0),utc(2026,10,21,1,0),'NCIS','Out of Time','dd_progid:EP0001',True))
+		self.assertFalse(self.index.listings[('CBS',utc(2026,10,21,1,0))].new)
+		## Neither new nor previously shown: counts as new
+		self.assertTrue(self.index.listings[('WAGA',utc(2026,10,21,4,0))].new)
+		self.assertFalse(self.index.changed())
+
+	def testStopTimes(self):
+		## No stop: until the next listing; a stop before the start: the default length at the end
+		self.assertEqual(self.index.listings[('CBS',utc(2026,10,23,0,0))].stop,utc(2026,10,23,0,30))
+		self.assertEqual(self.index.listings[('CBS',utc(2026,10,23,0,30))].stop,utc(2026,10,23,0,30) + xmltvGuide.DEFAULT_LENGTH)
+
+	def testGzip(self):
+		with open(self.filename,'rb') as fptr, gzip.open(self.filename + '.gz','wb') as gz:
+			gz.write(fptr.read())
+		index = xmltvGuide.GuideIndex(self.filename + '.gz')
+		index.load()
+		self.assertEqual(sorted(index.schedules),['I46.1.wgcl','I5.1.waga','I99.1.far'])
+		self.assertEqual(index.diff(index),(0,0,0))
+
+	def testBadFile(self):
+		with open(self.filename,'w') as fptr:
+			fptr.write(GUIDE[:400])
+		self.assertTrue(self.index.changed())
+		with self.assertRaises(xmltvGuide.ParseError):
+			self.index.load()
+		## The old listings are kept
+		self.assertEqual(len(self.index.listings),5)
+
+	def testFind(self):
+		self.assertEqual([(listing.channel,listing.start) for listing in self.index.find('ncis')],\
+			[('CBS',utc(2026,10,21,0,0)),('CBS',utc(2026,10,21,1,0)),('WAGA',utc(2026,10,21,4,0)),('CBS',utc(2026,10,23,0,0))])
+		self.assertEqual(len(self.index.find('NCIS',['WAGA'])),1)
+		## Live at since counts; starting at until doesn't
+		self.assertEqual([listing.start for listing in self.index.find('NCIS',['CBS'],utc(2026,10,21,0,30),utc(2026,10,23,0,0))],\
+			[utc(2026,10,21,0,0),utc(2026,10,21,1,0)])
+		self.assertEqual(self.index.find('Unknown'),[])
+
+	def testBetween(self):
+		self.assertEqual([listing.title for listing in self.index.between('CBS',utc(2026,10,23,0,15),utc(2026,10,23,1,0))],['NCIS','Local News'])
+		self.assertEqual(self.index.between('CBS',utc(2026,10,22,0,0),utc(2026,10,22,12,0)),[])
+		self.assertEqual(self.index.between('NBC',0,utc(2030,1,1)),[])
+
+	def testDiff(self):
+		old = xmltvGuide.GuideIndex(self.filename)
+		old.load(xmltvGuide.channelMatcher(CHANNELS))
+		with open(self.filename,'w') as fptr:
+			fptr.write(GUIDE.replace('Kill Chain','Killchain').replace('<title>Local News</title>','<title>News</title>').\
+				replace('channel="I99.1.far"','channel="I5.1.waga"'))
+		self.index.load(xmltvGuide.channelMatcher(CHANNELS))
+		self.assertEqual(self.index.diff(old),(1,2,0))
+
+
+class SeriesAiringsTest(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		filename = os.path.join(self.dir,'guide.xml')
+		with open(filename,'w') as fptr:
+			fptr.write(GUIDE)
+		self.index = xmltvGuide.GuideIndex(filename)
+		self.index.load(xmltvGuide.channelMatcher(CHANNELS))
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def testEveryAiring(self):
+		entries = xmltvGuide.seriesAirings(self.index,{'NCIS':{'series':'NCIS','keep_days':7}},utc(2026,10,20),utc(2026,10,24))
+		self.assertEqual(sorted(entries),['NCIS CBS 2026-10-20 20:00','NCIS CBS 2026-10-20 21:00','NCIS CBS 2026-10-22 20:00',\
+			'NCIS WAGA 2026-10-21 00:00'])
+		entry = entries['NCIS CBS 2026-10-20 20:00']
+		self.assertEqual(entry,{'keep_days':7,'show':'NCIS','channel_name':'CBS','episode':'dd_progid:EP0001',\
+			'airing':[utc(2026,10,21,0,0) - 60,utc(2026,10,21,1,0) + 60]})
+		self.assertEqual(entries['NCIS CBS 2026-10-20 21:00']['episode'],'Kill Chain')
+
+	def testNewOnly(self):
+		## The rerun is left out, and so is the second airing of EP0001
+		rules = {'NCIS':{'series':'NCIS','new_only':True}}
+		entries = xmltvGuide.seriesAirings(self.index,rules,utc(2026,10,20),utc(2026,10,24))
+		self.assertEqual(sorted(entries),['NCIS CBS 2026-10-20 20:00','NCIS CBS 2026-10-22 20:00'])
+		## Once EP0001 is recorded, it isn't recorded again
+		entries = xmltvGuide.seriesAirings(self.index,rules,utc(2026,10,20),utc(2026,10,24),recorded=set([('NCIS','dd_progid:EP0001')]))
+		self.assertEqual(sorted(entries),['NCIS CBS 2026-10-22 20:00'])
+		## By another rule it is
+		entries = xmltvGuide.seriesAirings(self.index,rules,utc(2026,10,20),utc(2026,10,24),recorded=set([('Other','dd_progid:EP0001')]))
+		self.assertEqual(len(entries),2)
+
+	def testChannels(self):
+		rules = {'A':{'series':'NCIS','channel_name':'WAGA'},'B':{'series':'NCIS','channel_name':['WAGA','CBS']}}
+		entries = xmltvGuide.seriesAirings(self.index,rules,utc(2026,10,20),utc(2026,10,22))
+		self.assertEqual(sorted(entries),['A WAGA 2026-10-21 00:00','B CBS 2026-10-20 20:00','B CBS 2026-10-20 21:00','B WAGA 2026-10-21 00:00'])
+
+	def testPadding(self):
+		rules = {'NCIS':{'series':'NCIS','channel_name':'WAGA','start_early':300,'end_late':600}}
+		entries = xmltvGuide.seriesAirings(self.index,rules,utc(2026,10,20),utc(2026,10,22),start_early=0,end_late=0)
+		self.assertEqual(entries['NCIS WAGA 2026-10-21 00:00']['airing'],[utc(2026,10,21,4,0) - 300,utc(2026,10,21,5,0) + 600])
+		## An airing starting within start_early of until is already in
+		entries = xmltvGuide.seriesAirings(self.index,rules,utc(2026,10,20),utc(2026,10,21,3,56))
+		self.assertEqual(len(entries),1)
+		entries = xmltvGuide.seriesAirings(self.index,rules,utc(2026,10,20),utc(2026,10,21,3,54))
+		self.assertEqual(entries,{})
+
+
+if __name__ == '__main__':
+	unittest.main()
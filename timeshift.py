@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+##########################################################################
+##
+##  Timeshift ring buffer for tuners kept warm on a channel
+##
+##  Goals:
+##                      Keep the last few minutes of a multiplex an idle
+##                      tuner is streaming, so a recording that starts on
+##                      that channel can begin with what was broadcast
+##                      before it started (its pre-roll) instead of the
+##                      tuner being held from a minute early
+##
+##                      A fixed size file mapped into memory (mmap): the
+##                      capture thread copies each batch in with one
+##                      slice assignment, nothing is allocated while it
+##                      runs and the file never grows
+##
+##                      An index of when each batch arrived, so "from
+##                      time t on" is a lookup instead of a scan of the
+##                      stream for PCRs
+##
+##  The ring belongs on a local disk or a tmpfs, never the NAS: the
+##  kernel writes the mapped pages back by itself, and on tmpfs the ring
+##  is simply that much RAM.
+##
+##  Usage:
+##                      timeshift.py [-m megabytes] file.ts     replay a recording through a ring and report it
+##
+##########################################################################
+import os
+import sys
+import mmap
+import getopt
+import threading
+import collections
+import time
+
+TS_PACKET_SIZE = 188
+READ_SIZE      = 4 * 1024 * 1024   ## Pieces the ring is read back in (each one is a copy)
+SAFETY_MARGIN  = 8                 ## 1/n of the ring nearest to being overwritten is never handed out
+SLACK_SECONDS  = 10                ## Stream a ring is sized for on top of what it is to hand out (bursts, batching)
+
+
+def ringSize(seconds,bitrate):
+	## Bytes a ring needs so find() can still hand out seconds of a stream at bitrate (bits/second)
+	stream = (seconds + SLACK_SECONDS) * bitrate / 8.0
+	return int(stream * SAFETY_MARGIN / (SAFETY_MARGIN - 1))
+
+
+class RingBuffer(object):
+	"""The last size bytes written, at absolute stream offsets: offset n is byte n
+	of everything ever written, and is still in the ring while n >= oldest()"""
+
+	def __init__(self,filename,size):
+		self.filename = filename
+		self.size = max(TS_PACKET_SIZE,size // TS_PACKET_SIZE * TS_PACKET_SIZE)
+		fd = os.open(filename,os.O_RDWR | os.O_CREAT | os.O_TRUNC,0o600)
+		try:
+			os.ftruncate(fd,self.size)
+			self.map = mmap.mmap(fd,self.size)
+		finally:
+			os.close(fd)
+		self.total = 0
+		self.index = collections.deque()   ## (time written,absolute offset of the batch)
+		self.lock = threading.Lock()
+
+	def write(self,data):
+		## Called from the capture thread with each batch as it is flushed
+		length = len(data)
+		if length > self.size:
+			data = data[length - self.size:]
+			self.total += length - self.size
+			length = self.size
+		pos = self.total % self.size
+		first = min(length,self.size - pos)
+		self.map[pos:pos + first] = data[:first]
+		if first < length:
+			self.map[:length - first] = data[first:]
+		with self.lock:
+			self.index.append((time.time(),self.total))
+			self.total += length
+			oldest = self.total - self.size
+			while self.index and self.index[0][1] < oldest:
+				self.index.popleft()
+
+	def oldest(self):
+		return max(0,self.total - self.size)
+
+	def seconds(self):
+		## How far back the ring reaches right now
+		with self.lock:
+			return self.index[-1][0] - self.index[0][0] if self.index else 0.0
+
+	def find(self,when):
+		## (offset,time) of the first batch holding data that arrived at or after when, leaving
+		## out the part of the ring about to be overwritten; (total,None) if there is none
+		with self.lock:
+			safe = self.oldest() + (self.size // SAFETY_MARGIN if self.total > self.size else 0)
+			previous = None
+			for written,offset in reversed(self.index):
+				if written < when or offset < safe:
+					break
+				previous = (offset,written)
+			return previous or (self.total,None)
+
+	def read(self,start,end):
+		## Copies of [start,end) in READ_SIZE pieces.  Reading races the capture thread, so only
+		## ask for what find() handed out; it stays put for the ring's margin worth of stream.
+		while start < end:
+			pos = start % self.size
+			length = min(end - start,self.size - pos,READ_SIZE)
+			yield self.map[pos:pos + length]
+			start += length
+
+	def close(self):
+		self.map.close()
+		try:
+			os.unlink(self.filename)
+		except OSError:
+			pass
+
+
+def usage():
+	print('Usage:' , sys.argv[0] , '[options] file.ts')
+	print('Description: Replay a recording through a timeshift ring buffer and time it')
+	print('')
+	print('Options:')
+	print('-h  --help			Show this helpful information')
+	print('-m  --megabytes=[n]	Size of the ring (default 64)')
+	print('')
+
+
+if __name__ == '__main__':
+	megabytes = 64
+	try:
+		opts, args = getopt.getopt(sys.argv[1:], 'hm:', ['help', 'megabytes='])
+	except getopt.GetoptError as err:
+		print(str(err))
+		usage()
+		sys.exit(2)
+
+	for opt, arg in opts:
+		if opt in ('-h', '--help'):
+			usage()
+			sys.exit()
+		elif opt in ('-m', '--megabytes'):
+			megabytes = float(arg)
+		else:
+			assert False, 'unhandled option'
+
+	if len(args) != 1:
+		usage()
+		sys.exit(2)
+
+	ring = RingBuffer(args[0] + '.ring',int(megabytes * 1024 * 1024))
+	try:
+		chunk = 1024 * 1024 // TS_PACKET_SIZE * TS_PACKET_SIZE
+		start = time.time()
+		with open(args[0],'rb') as fptr:
+			while True:
+				data = fptr.read(chunk)
+				if not data:
+					break
+				ring.write(data)
+		wrote = time.time() - start
+		offset,written = ring.find(0)
+		start = time.time()
+		read = sum(len(piece) for piece in ring.read(offset,ring.total))
+		print('INFO:    WROTE %.1f MB AT %.1f MB/s, READ BACK THE LAST %.1f MB AT %.1f MB/s' %(ring.total / 1e6,\
+			ring.total / max(wrote,1e-9) / 1e6,read / 1e6,read / max(time.time() - start,1e-9) / 1e6))
+	finally:
+		ring.close()
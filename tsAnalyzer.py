@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+##########################################################################
+##
+##  MPEG-TS integrity analyzer
+##
+##  Goals:
+##                      Spot recordings that are full of dropped packets
+##                      or lost sync even though the file keeps growing
+##
+##                      Fast enough to run live on the capture path of a
+##                      BeagleBone: packets are checked a whole chunk at a
+##                      time with NumPy when it is installed (a plain
+##                      Python fallback is used when it isn't)
+##
+##  Checks:
+##                      sync byte (0x47) / re-sync events
+##                      transport_error_indicator
+##                      continuity counter discontinuities per PID
+##                      PCR jumps (backwards or more than PCR_MAX_GAP)
+##
+##  Usage:
+##                      tsAnalyzer.py file.ts [file.ts ...]
+##
+##########################################################################
+import sys
+
+try:
+	import numpy
+	HAVE_NUMPY = True
+except ImportError:
+	numpy = None
+	HAVE_NUMPY = False
+
+TS_PACKET_SIZE = 188
+TS_SYNC_BYTE   = 0x47
+NULL_PID       = 0x1FFF
+PCR_HZ         = 27000000
+PCR_WRAP       = (1 << 33) * 300
+PCR_MAX_GAP    = PCR_HZ // 10        ## ISO 13818-1 requires a PCR at least every 100 ms
+READ_SIZE      = 4 * 1024 * 1024
+
+
+def pcrValue(packet,offset=0):
+	## 27 MHz PCR from a packet that is known to carry one
+	b = packet
+	base = (b[offset + 6] << 25) | (b[offset + 7] << 17) | (b[offset + 8] << 9) | (b[offset + 9] << 1) | (b[offset + 10] >> 7)
+	ext = ((b[offset + 10] & 0x01) << 8) | b[offset + 11]
+	return base * 300 + ext
+
+
+class TSAnalyzer(object):
+	"""Streaming analyzer; feed() it data in any size pieces"""
+
+	def __init__(self,use_numpy=HAVE_NUMPY):
+		self.use_numpy = use_numpy and HAVE_NUMPY
+		self.carry = b''
+		self.lost = False      ## Bytes are being skipped looking for sync (counted once as a sync error)
+		self.lastCC = {}
+		self.lastPCR = {}
+		self.bytes = 0
+		self.packets = 0
+		self.sync_errors = 0
+		self.skipped_bytes = 0
+		self.tei_errors = 0
+		self.cc_errors = 0
+		self.pcr_jumps = 0
+		self.first_pcr = None
+		self.last_pcr = None
+		self.pcr_elapsed = 0   ## 27 MHz ticks of PCR time covered, summed across jumps
+
+	def errors(self):
+		return self.sync_errors + self.tei_errors + self.cc_errors + self.pcr_jumps
+
+	def counters(self):
+		return {'packets':self.packets,'sync_errors':self.sync_errors,'skipped_bytes':self.skipped_bytes,\
+			'tei_errors':self.tei_errors,'cc_errors':self.cc_errors,'pcr_jumps':self.pcr_jumps,\
+			'first_pcr':self.first_pcr,'last_pcr':self.last_pcr,'pcr_seconds':float(self.pcr_elapsed) / PCR_HZ}
+
+	def feed(self,data):
+		self.bytes += len(data)
+		if self.carry:
+			data = self.carry + bytes(data)
+			self.carry = b''
+
+		## Split the data into runs of aligned packets, counting every re-sync
+		pos = 0
+		end = len(data)
+		while pos < end:
+			if data[pos] != TS_SYNC_BYTE:
+				if not isinstance(data,(bytes,bytearray)):
+					## resync() searches with find(); copy a memoryview once, not on every attempt
+					data = bytes(data)
+				next_pos = self.resync(data,pos)
+				if next_pos is None:
+					## No packet starts before the last packet's worth of data; skip up to there
+					## and keep only that tail, so a stream that never syncs can't pile up
+					keep = max(pos,end - TS_PACKET_SIZE)
+					if keep > pos:
+						if not self.lost:
+							self.sync_errors += 1
+						self.lost = True
+						self.skipped_bytes += keep - pos
+					self.carry = bytes(data[keep:])
+					return
+				if not self.lost:
+					self.sync_errors += 1
+				self.lost = False
+				self.skipped_bytes += next_pos - pos
+				pos = next_pos
+				continue
+
+			run_end = self.alignedRunEnd(data,pos,end)
+			if run_end == pos:
+				self.carry = bytes(data[pos:])
+				return
+			if self.use_numpy:
+				self.checkPacketsNumpy(data,pos,run_end)
+			else:
+				self.checkPacketsPython(data,pos,run_end)
+			pos = run_end
+
+	def resync(self,data,pos):
+		## Next offset that looks like the start of two consecutive packets (data: bytes)
+		end = len(data)
+		while True:
+			pos = data.find(b'\x47',pos + 1)
+			if pos < 0 or pos + TS_PACKET_SIZE >= end:
+				return None
+			if data[pos + TS_PACKET_SIZE] == TS_SYNC_BYTE:
+				return pos
+
+	def alignedRunEnd(self,data,pos,end):
+		## End of the longest run of whole packets starting at pos that all begin with 0x47
+		count = (end - pos) // TS_PACKET_SIZE
+		if count == 0:
+			return pos
+		if self.use_numpy:
+			syncs = numpy.frombuffer(data,dtype=numpy.uint8,count=count * TS_PACKET_SIZE,offset=pos)[::TS_PACKET_SIZE]
+			bad = numpy.flatnonzero(syncs != TS_SYNC_BYTE)
+			if len(bad):
+				count = int(bad[0])
+		else:
+			for n in range(count):
+				if data[pos + n * TS_PACKET_SIZE] != TS_SYNC_BYTE:
+					count = n
+					break
+		return pos + count * TS_PACKET_SIZE
+
+	def checkPCR(self,pid,pcr,discontinuity):
+		if self.first_pcr is None:
+			self.first_pcr = pcr
+		self.last_pcr = pcr
+		previous = self.lastPCR.get(pid)
+		self.lastPCR[pid] = pcr
+		if previous is None or discontinuity:
+			return
+		delta = (pcr - previous) % PCR_WRAP
+		if delta > PCR_MAX_GAP:
+			self.pcr_jumps += 1
+		else:
+			self.pcr_elapsed += delta
+
+	def checkPacketsPython(self,data,start,end):
+		lastCC = self.lastCC
+		for pos in range(start,end,TS_PACKET_SIZE):
+			b1 = data[pos + 1]
+			pid = ((b1 & 0x1F) << 8) | data[pos + 2]
+			if b1 & 0x80:
+				self.tei_errors += 1
+			if pid == NULL_PID:
+				continue
+			b3 = data[pos + 3]
+			afc = (b3 >> 4) & 0x03
+			discontinuity = False
+			if afc & 0x02 and data[pos + 4] > 0:
+				flags = data[pos + 5]
+				discontinuity = bool(flags & 0x80)
+				if flags & 0x10 and data[pos + 4] >= 7:
+					self.checkPCR(pid,pcrValue(data,pos),discontinuity)
+			if afc & 0x01:
+				cc = b3 & 0x0F
+				previous = lastCC.get(pid)
+				if previous is not None and not discontinuity and cc != previous and cc != ((previous + 1) & 0x0F):
+					self.cc_errors += 1
+				lastCC[pid] = cc
+		self.packets += (end - start) // TS_PACKET_SIZE
+
+	def checkPacketsNumpy(self,data,start,end):
+		count = (end - start) // TS_PACKET_SIZE
+		packets = numpy.frombuffer(data,dtype=numpy.uint8,count=count * TS_PACKET_SIZE,offset=start).reshape(count,TS_PACKET_SIZE)
+		self.packets += count
+
+		b1 = packets[:,1]
+		self.tei_errors += int(numpy.count_nonzero(b1 & 0x80))
+
+		pids = ((b1.astype(numpy.uint16) & 0x1F) << 8) | packets[:,2]
+		b3 = packets[:,3]
+		afc = (b3 >> 4) & 0x03
+		has_af = ((afc & 0x02) != 0) & (packets[:,4] > 0)
+		discontinuity = has_af & ((packets[:,5] & 0x80) != 0)
+
+		#################################################################
+		## PCRs are rare (a few dozen a second), so only locating them is
+		## vectorized; the arithmetic on each one is done in Python
+		#################################################################
+		for n in numpy.flatnonzero(has_af & ((packets[:,5] & 0x10) != 0) & (packets[:,4] >= 7) & (pids != NULL_PID)):
+			self.checkPCR(int(pids[n]),pcrValue(packets[n].tobytes()),bool(discontinuity[n]))
+
+		#################################################################
+		## Continuity counters: group payload packets by PID (stable sort
+		## keeps each PID's packets in stream order) and compare every
+		## packet with the one before it in its group
+		#################################################################
+		with_payload = numpy.flatnonzero(((afc & 0x01) != 0) & (pids != NULL_PID))
+		if not len(with_payload):
+			return
+		order = with_payload[numpy.argsort(pids[with_payload],kind='stable')]
+		p = pids[order]
+		cc = (b3[order] & 0x0F).astype(numpy.int16)
+		disc = discontinuity[order]
+
+		same = p[1:] == p[:-1]
+		step = (cc[1:] - cc[:-1]) & 0x0F
+		self.cc_errors += int(numpy.count_nonzero(same & (step != 1) & (step != 0) & ~disc[1:]))
+
+		## First packet of each PID in this chunk against the last one from the previous chunk
+		firsts = numpy.concatenate(([0],numpy.flatnonzero(~same) + 1))
+		lasts = numpy.concatenate((firsts[1:] - 1,[len(p) - 1]))
+		lastCC = self.lastCC
+		for first,last in zip(firsts.tolist(),lasts.tolist()):
+			pid = int(p[first])
+			previous = lastCC.get(pid)
+			current = int(cc[first])
+			if previous is not None and not disc[first] and current != previous and current != ((previous + 1) & 0x0F):
+				self.cc_errors += 1
+			lastCC[pid] = int(cc[last])
+
+
+def analyzeFile(filename,use_numpy=HAVE_NUMPY):
+	analyzer = TSAnalyzer(use_numpy)
+	with open(filename,'rb') as fptr:
+		while True:
+			chunk = fptr.read(READ_SIZE)
+			if not chunk:
+				break
+			analyzer.feed(chunk)
+	return analyzer
+
+
+def report(name,analyzer):
+	counters = analyzer.counters()
+	print('INFO:    %s: %d PACKETS, %d SYNC ERRORS (%d BYTES SKIPPED), %d TEI, %d CC ERRORS, %d PCR JUMPS, %.1f s OF PCR TIME' %(\
+		name,counters['packets'],counters['sync_errors'],counters['skipped_bytes'],counters['tei_errors'],\
+		counters['cc_errors'],counters['pcr_jumps'],counters['pcr_seconds']))
+
+
+if __name__ == '__main__':
+	if len(sys.argv) < 2:
+		print('Usage:' , sys.argv[0] , 'file.ts [file.ts ...]')
+		sys.exit(2)
+
+	status = 0
+	for filename in sys.argv[1:]:
+		analyzer = analyzeFile(filename)
+		report(filename,analyzer)
+		if analyzer.errors():
+			status = 1
+	sys.exit(status)
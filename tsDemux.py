@@ -0,0 +1,616 @@
+#!/usr/bin/env python3
+##########################################################################
+##
+##  MPEG-TS program demultiplexer
+##
+##  Goals:
+##                      Record several programs (subchannels) of one RF
+##                      channel from a single tuner: the tuner streams the
+##                      whole multiplex and each requested program's PIDs
+##                      are split out into their own output in one pass
+##
+##                      Follow the PAT/PMT as they change so each output
+##                      gets the PMT, PCR and elementary stream PIDs of
+##                      its program, and a PAT rewritten to list only
+##                      that program (what the HDhomerun itself sends
+##                      when /tunerN/program is set)
+##
+##                      Optionally keep only some of a program's streams
+##                      (its video, audio in one language, ... or given
+##                      PIDs): the PMT the output gets is rewritten to
+##                      list just those, and PSIP/EIT tables, secondary
+##                      audio and data streams never reach the file
+##
+##                      Keep up with a full ~19 Mbit/s ATSC multiplex on a
+##                      BeagleBone: PIDs are looked up a whole chunk at a
+##                      time with NumPy when it is installed (a plain
+##                      Python fallback is used when it isn't)
+##
+##  Usage:
+##                      tsDemux.py file.ts                  list the programs in a recording
+##                      tsDemux.py -p 3 [-p 5] file.ts      write file_3.ts, file_5.ts
+##                      tsDemux.py -k video,audio,eng -p 3 file.ts    ... with only its video and English audio
+##
+##########################################################################
+import os
+import sys
+import getopt
+
+try:
+	import numpy
+	HAVE_NUMPY = True
+except ImportError:
+	numpy = None
+	HAVE_NUMPY = False
+
+TS_PACKET_SIZE = 188
+TS_SYNC_BYTE   = 0x47
+PAT_PID        = 0x0000
+NUM_PIDS       = 0x2000
+READ_SIZE      = 4 * 1024 * 1024
+
+TABLE_PAT = 0x00
+TABLE_PMT = 0x02
+
+DESCRIPTOR_LANGUAGE = 0x0A   ## ISO_639_language_descriptor
+
+## Stream types of each class a PID filter can ask for.  ATSC captions travel inside
+## the video stream; 'subtitles' are the private PES streams (DVB subtitles, teletext).
+STREAM_CLASSES = {'video':(0x01,0x02,0x10,0x1B,0x24),
+                  'audio':(0x03,0x04,0x0F,0x11,0x81,0x87),
+                  'subtitles':(0x06,)}
+
+
+def _crcTable():
+	table = []
+	for n in range(256):
+		crc = n << 24
+		for i in range(8):
+			crc = ((crc << 1) ^ 0x04C11DB7) if crc & 0x80000000 else (crc << 1)
+		table.append(crc & 0xFFFFFFFF)
+	return table
+
+_CRC_TABLE = _crcTable()
+
+
+def crc32(data):
+	## CRC-32/MPEG-2 used by PSI sections; a whole section including its CRC gives 0
+	crc = 0xFFFFFFFF
+	table = _CRC_TABLE
+	for b in data:
+		crc = ((crc << 8) & 0xFFFFFFFF) ^ table[(crc >> 24) ^ b]
+	return crc
+
+
+def buildSection(table_id,table_id_ext,version,body):
+	## Long form PSI section (syntax indicator set, single section) with its CRC
+	length = 5 + len(body) + 4
+	section = bytes([table_id,0xB0 | ((length >> 8) & 0x0F),length & 0xFF,(table_id_ext >> 8) & 0xFF,table_id_ext & 0xFF,\
+		0xC1 | ((version & 0x1F) << 1),0,0]) + body
+	crc = crc32(section)
+	return section + bytes([(crc >> 24) & 0xFF,(crc >> 16) & 0xFF,(crc >> 8) & 0xFF,crc & 0xFF])
+
+
+def buildPAT(transport_stream_id,programs,version=0):
+	## programs is a list of (program_number,pmt_pid)
+	body = b''.join(bytes([(number >> 8) & 0xFF,number & 0xFF,0xE0 | ((pid >> 8) & 0x1F),pid & 0xFF]) for number,pid in programs)
+	return buildSection(TABLE_PAT,transport_stream_id,version,body)
+
+
+def buildPMT(program,pcr_pid,streams,version=0):
+	## streams is a list of (stream_type,pid); no descriptors
+	body = bytes([0xE0 | ((pcr_pid >> 8) & 0x1F),pcr_pid & 0xFF,0xF0,0x00])
+	body += b''.join(bytes([stream_type,0xE0 | ((pid >> 8) & 0x1F),pid & 0xFF,0xF0,0x00]) for stream_type,pid in streams)
+	return buildSection(TABLE_PMT,program,version,body)
+
+
+def sectionPacket(pid,section,cc=0):
+	## A section small enough for one packet: pointer_field 0, section, 0xff stuffing
+	payload = b'\x00' + section
+	return bytes([TS_SYNC_BYTE,0x40 | ((pid >> 8) & 0x1F),pid & 0xFF,0x10 | (cc & 0x0F)]) + payload + b'\xff' * (184 - len(payload))
+
+
+def parsePAT(section):
+	## -> (transport_stream_id,version,{program_number:pmt_pid}); program 0 (the NIT) is skipped
+	end = 3 + (((section[1] & 0x0F) << 8) | section[2]) - 4
+	programs = {}
+	for pos in range(8,end - 3,4):
+		number = (section[pos] << 8) | section[pos + 1]
+		if number:
+			programs[number] = ((section[pos + 2] & 0x1F) << 8) | section[pos + 3]
+	return ((section[3] << 8) | section[4],(section[5] >> 1) & 0x1F,programs)
+
+
+def parsePMT(section):
+	## -> (program_number,pcr_pid,[(stream_type,pid),...])
+	end = 3 + (((section[1] & 0x0F) << 8) | section[2]) - 4
+	program = (section[3] << 8) | section[4]
+	pcr_pid = ((section[8] & 0x1F) << 8) | section[9]
+	pos = 12 + (((section[10] & 0x0F) << 8) | section[11])
+	streams = []
+	while pos + 5 <= end:
+		streams.append((section[pos],((section[pos + 1] & 0x1F) << 8) | section[pos + 2]))
+		pos += 5 + (((section[pos + 3] & 0x0F) << 8) | section[pos + 4])
+	return (program,pcr_pid,streams)
+
+
+def pmtEntries(section):
+	## -> [(stream_type,pid,language or None,entry)], entry being the raw ES loop entry with its descriptors
+	end = 3 + (((section[1] & 0x0F) << 8) | section[2]) - 4
+	pos = 12 + (((section[10] & 0x0F) << 8) | section[11])
+	entries = []
+	while pos + 5 <= end:
+		next_pos = pos + 5 + (((section[pos + 3] & 0x0F) << 8) | section[pos + 4])
+		language = None
+		desc = pos + 5
+		while desc + 2 <= next_pos:
+			if section[desc] == DESCRIPTOR_LANGUAGE and section[desc + 1] >= 3:
+				language = bytes(section[desc + 2:desc + 5]).decode('latin-1').lower()
+				break
+			desc += 2 + section[desc + 1]
+		entries.append((section[pos],((section[pos + 1] & 0x1F) << 8) | section[pos + 2],language,bytes(section[pos:next_pos])))
+		pos = next_pos
+	return entries
+
+
+def pidFilter(spec):
+	## A PID filter from a spec such as 'video,audio,eng' or [0x31,0x34]: stream classes
+	## (see STREAM_CLASSES), PIDs and ISO 639 language codes.  None or empty keeps everything.
+	if not spec:
+		return None
+	if isinstance(spec,str):
+		spec = spec.split(',')
+	keep = set()
+	for item in spec:
+		if isinstance(item,str):
+			item = item.strip().lower()
+			if item in STREAM_CLASSES or (len(item) == 3 and item.isalpha()):
+				keep.add(item)
+				continue
+			try:
+				item = int(item,0)
+			except ValueError:
+				raise ValueError('unknown stream %r (a class, PID or language)' %(item))
+		if not 0 < item < NUM_PIDS - 1:
+			raise ValueError('PID %r out of range' %(item))
+		keep.add(item)
+	return frozenset(keep)
+
+
+def selectStreams(entries,keep):
+	## PIDs of the pmtEntries() a filter keeps: the ones it names, and those of the classes it
+	## names.  Languages narrow down audio and subtitles (streams without one are kept);
+	## if none of a class is in the wanted languages, the first of that class is kept.
+	languages = set(item for item in keep if isinstance(item,str) and item not in STREAM_CLASSES)
+	kept = set(pid for stream_type,pid,language,entry in entries if pid in keep)
+	for name,types in STREAM_CLASSES.items():
+		if name not in keep:
+			continue
+		streams = [(pid,language) for stream_type,pid,language,entry in entries if stream_type in types]
+		if languages and name != 'video':
+			matched = [pid for pid,language in streams if language is None or language in languages]
+			kept.update(matched or [pid for pid,language in streams[:1]])
+		else:
+			kept.update(pid for pid,language in streams)
+	return kept
+
+
+def filterPMT(section,pids):
+	## The PMT section with only the streams in pids (descriptors and version kept)
+	body = bytes(section[8:12 + (((section[10] & 0x0F) << 8) | section[11])])
+	body += b''.join(entry for stream_type,pid,language,entry in pmtEntries(section) if pid in pids)
+	return buildSection(TABLE_PMT,(section[3] << 8) | section[4],(section[5] >> 1) & 0x1F,body)
+
+
+def sectionPackets(pid,section):
+	## A section of any size split over packets (continuity counters from 0)
+	payload = b'\x00' + section
+	payload += b'\xff' * (-len(payload) % 184)
+	return [bytes([TS_SYNC_BYTE,(0x40 if n == 0 else 0x00) | ((pid >> 8) & 0x1F),pid & 0xFF,0x10 | (n & 0x0F)]) + payload[n * 184:(n + 1) * 184] \
+		for n in range(len(payload) // 184)]
+
+
+def packetPayload(packet):
+	## Offset of the payload in a packet, or None if it has none
+	afc = (packet[3] >> 4) & 0x03
+	if not afc & 0x01:
+		return None
+	if afc & 0x02:
+		offset = 5 + packet[4]
+		return offset if offset < TS_PACKET_SIZE else None
+	return 4
+
+
+class TSDemux(object):
+	"""Streaming demultiplexer; feed() it the multiplex in any size pieces and the
+	packets of each added program are passed to that program's sink.write()"""
+
+	def __init__(self,use_numpy=HAVE_NUMPY):
+		self.use_numpy = use_numpy and HAVE_NUMPY
+		self.carry = b''
+		self.outputs = {}          ## program_number -> output state
+		self.sections = {}         ## pid -> partial section being assembled
+		self.lastSection = {}      ## pid -> last complete section seen (unchanged tables are not re-parsed)
+		self.tsid = 0
+		self.pat_version = 0
+		self.pmt_pids = {}         ## program_number -> pmt_pid from the PAT
+		self.pmts = {}             ## program_number -> (pcr_pid,[(stream_type,pid),...],pmt_pid)
+		self.psi_pids = set([PAT_PID])
+		self.routes = {}
+		self.psi_lut = None
+		self.packets = 0
+		self.sync_errors = 0
+		self.psi_errors = 0
+		self.rebuildRoutes()
+
+	def addProgram(self,program,sink,previous=None,keep=None):
+		## previous: another TSDemux that has been feeding program to sink up to here (e.g. from a
+		## timeshift buffer); the rewritten PAT (and PMT) carry on its continuity counters.
+		## keep: a pidFilter() of the program's streams to write (None = all of them)
+		output = {'program':program,'sink':sink,'pids':set(),'pat':None,'pat_cc':0,'packets':0,\
+			'keep':keep,'pmt_pid':None,'pmt':None,'pmt_cc':0}
+		if previous and program in previous.outputs:
+			for key in ('pat_cc','pmt_cc','packets'):
+				output[key] = previous.outputs[program][key]
+		self.outputs[program] = output
+		## Start from whatever tables have been seen already
+		self.updateOutput(output)
+		self.rebuildRoutes()
+
+	def removeProgram(self,program):
+		self.outputs.pop(program,None)
+		self.rebuildRoutes()
+
+	def programs(self):
+		## program_number -> (pmt_pid,pcr_pid or None,[(stream_type,pid),...] or None) as far as known
+		result = {}
+		for program,pmt_pid in self.pmt_pids.items():
+			result[program] = (pmt_pid,None,None)
+		for program,info in self.pmts.items():
+			if program in result:
+				result[program] = (result[program][0],info[0],info[1])
+		return result
+
+	#################################################################
+	## PSI handling
+	#################################################################
+	def updateOutput(self,output):
+		program = output['program']
+		pids = set([PAT_PID])
+		pmt_pid = self.pmt_pids.get(program)
+		if pmt_pid is not None:
+			pids.add(pmt_pid)
+			output['pat'] = sectionPacket(PAT_PID,buildPAT(self.tsid,[(program,pmt_pid)],self.pat_version))
+			if output['keep'] is not None and output['pmt_pid'] != pmt_pid:
+				## A PMT filtered for another PID (or none yet); this one is built below once seen
+				output['pmt'] = None
+				output['pmt_pid'] = pmt_pid
+			info = self.pmts.get(program)
+			if info and info[2] == pmt_pid:
+				pids.add(info[0])
+				if output['keep'] is None:
+					pids.update(pid for stream_type,pid in info[1])
+				else:
+					## The PCR PID stays even if it is a stream the filter doesn't want
+					kept = selectStreams(pmtEntries(self.lastSection[pmt_pid]),output['keep']) | set([info[0]])
+					pids.update(kept)
+					output['pmt'] = sectionPackets(pmt_pid,filterPMT(self.lastSection[pmt_pid],kept))
+		output['pids'] = pids
+
+	def rebuildRoutes(self):
+		## pid -> outputs that want it; the PAT goes to every output (each gets its own rewrite)
+		routes = {}
+		for output in self.outputs.values():
+			for pid in output['pids']:
+				routes.setdefault(pid,[]).append(output)
+		self.routes = routes
+		self.psi_pids = set([PAT_PID]) | set(self.pmt_pids.values())
+		if self.use_numpy:
+			self.psi_lut = numpy.zeros(NUM_PIDS,dtype=bool)
+			self.psi_lut[list(self.psi_pids)] = True
+			for output in self.outputs.values():
+				output['lut'] = numpy.zeros(NUM_PIDS,dtype=bool)
+				output['lut'][list(output['pids'])] = True
+
+	def parsePSI(self,pid,packet):
+		## Assemble sections on a PSI pid; complete ones are handed to handleSection()
+		offset = packetPayload(packet)
+		if offset is None:
+			return
+		if packet[1] & 0x40:
+			pointer = packet[offset]
+			partial = self.sections.get(pid)
+			if partial is not None:
+				self.collect(pid,partial + bytes(packet[offset + 1:offset + 1 + pointer]))
+			self.sections[pid] = b''
+			self.collect(pid,bytes(packet[offset + 1 + pointer:]))
+		elif pid in self.sections:
+			self.collect(pid,self.sections[pid] + bytes(packet[offset:]))
+
+	def collect(self,pid,data):
+		## data starts at a section boundary; keep any incomplete tail for the next packet
+		while len(data) >= 3 and data[0] != 0xFF:
+			length = 3 + (((data[1] & 0x0F) << 8) | data[2])
+			if len(data) < length:
+				self.sections[pid] = data
+				return
+			self.handleSection(pid,data[:length])
+			data = data[length:]
+		self.sections.pop(pid,None)
+
+	def handleSection(self,pid,section):
+		if self.lastSection.get(pid) == section:
+			return
+		if len(section) < 12 or not section[1] & 0x80 or crc32(section):
+			self.psi_errors += 1
+			return
+		if not section[5] & 0x01:
+			## current_next_indicator clear: not in effect yet
+			return
+		self.lastSection[pid] = section
+
+		if pid == PAT_PID and section[0] == TABLE_PAT:
+			self.tsid,self.pat_version,self.pmt_pids = parsePAT(section)
+			for output in self.outputs.values():
+				self.updateOutput(output)
+			self.rebuildRoutes()
+		elif section[0] == TABLE_PMT:
+			program,pcr_pid,streams = parsePMT(section)
+			if self.pmt_pids.get(program) != pid:
+				return
+			self.pmts[program] = (pcr_pid,streams,pid)
+			if program in self.outputs:
+				self.updateOutput(self.outputs[program])
+				self.rebuildRoutes()
+
+	def patPacket(self,output):
+		packet = output['pat']
+		cc = output['pat_cc']
+		output['pat_cc'] = (cc + 1) & 0x0F
+		return packet[:3] + bytes([0x10 | cc]) + packet[4:]
+
+	def pmtPackets(self,output):
+		## The filtered PMT, in place of the start of each original one
+		packets = []
+		for packet in output['pmt']:
+			packets.append(packet[:3] + bytes([0x10 | output['pmt_cc']]) + packet[4:])
+			output['pmt_cc'] = (output['pmt_cc'] + 1) & 0x0F
+		return b''.join(packets)
+
+	#################################################################
+	## Packet routing
+	#################################################################
+	def feed(self,data):
+		if self.carry:
+			data = self.carry + bytes(data)
+			self.carry = b''
+
+		pos = 0
+		end = len(data)
+		while pos < end:
+			if data[pos] != TS_SYNC_BYTE:
+				next_pos = self.resync(data,pos)
+				if next_pos is None:
+					## Only the last packet's worth can still hold a packet start
+					self.carry = bytes(data[max(pos,end - TS_PACKET_SIZE):])
+					return
+				self.sync_errors += 1
+				pos = next_pos
+				continue
+
+			run_end = self.alignedRunEnd(data,pos,end)
+			if run_end == pos:
+				self.carry = bytes(data[pos:])
+				return
+			if self.use_numpy:
+				self.routeNumpy(data,pos,run_end)
+			else:
+				self.routePython(data,pos,run_end)
+			pos = run_end
+
+	def resync(self,data,pos):
+		## Next offset that looks like the start of two consecutive packets
+		data = bytes(data)
+		end = len(data)
+		while True:
+			pos = data.find(b'\x47',pos + 1)
+			if pos < 0 or pos + TS_PACKET_SIZE >= end:
+				return None
+			if data[pos + TS_PACKET_SIZE] == TS_SYNC_BYTE:
+				return pos
+
+	def alignedRunEnd(self,data,pos,end):
+		count = (end - pos) // TS_PACKET_SIZE
+		if count == 0:
+			return pos
+		if self.use_numpy:
+			syncs = numpy.frombuffer(data,dtype=numpy.uint8,count=count * TS_PACKET_SIZE,offset=pos)[::TS_PACKET_SIZE]
+			bad = numpy.flatnonzero(syncs != TS_SYNC_BYTE)
+			if len(bad):
+				count = int(bad[0])
+		else:
+			for n in range(count):
+				if data[pos + n * TS_PACKET_SIZE] != TS_SYNC_BYTE:
+					count = n
+					break
+		return pos + count * TS_PACKET_SIZE
+
+	def routePython(self,data,start,end):
+		chunks = dict((program,[]) for program in self.outputs)
+		psi_pids = self.psi_pids
+		for pos in range(start,end,TS_PACKET_SIZE):
+			pid = ((data[pos + 1] & 0x1F) << 8) | data[pos + 2]
+			if pid in psi_pids:
+				self.parsePSI(pid,data[pos:pos + TS_PACKET_SIZE])
+				psi_pids = self.psi_pids
+			targets = self.routes.get(pid)
+			if not targets:
+				continue
+			for output in targets:
+				if pid == PAT_PID:
+					if output['pat']:
+						chunks[output['program']].append(self.patPacket(output))
+				elif pid == output['pmt_pid']:
+					if output['pmt'] and data[pos + 1] & 0x40:
+						chunks[output['program']].append(self.pmtPackets(output))
+				else:
+					chunks[output['program']].append(data[pos:pos + TS_PACKET_SIZE])
+		self.packets += (end - start) // TS_PACKET_SIZE
+		self.write(chunks)
+
+	def routeNumpy(self,data,start,end):
+		count = (end - start) // TS_PACKET_SIZE
+		packets = numpy.frombuffer(data,dtype=numpy.uint8,count=count * TS_PACKET_SIZE,offset=start).reshape(count,TS_PACKET_SIZE)
+		pids = ((packets[:,1].astype(numpy.uint16) & 0x1F) << 8) | packets[:,2]
+		self.packets += count
+
+		## PAT/PMT packets are rare; parse them first so the routes cover this whole chunk
+		## (a new PAT can add PMT pids, so look again after it)
+		psi = numpy.flatnonzero(self.psi_lut[pids]).tolist()
+		while psi:
+			n = psi.pop(0)
+			psi_lut = self.psi_lut
+			self.parsePSI(int(pids[n]),packets[n].tobytes())
+			if self.psi_lut is not psi_lut:
+				psi = (numpy.flatnonzero(self.psi_lut[pids[n + 1:]]) + n + 1).tolist()
+
+		chunks = {}
+		for program,output in list(self.outputs.items()):
+			selected = numpy.flatnonzero(output['lut'][pids])
+			if not len(selected):
+				continue
+			out = packets[selected]
+			out_pids = pids[selected]
+			for n in numpy.flatnonzero(out_pids == PAT_PID).tolist():
+				if output['pat']:
+					out[n] = numpy.frombuffer(self.patPacket(output),dtype=numpy.uint8)
+				else:
+					out[n] = 0xFF
+			if not output['pat']:
+				## No PAT yet to rewrite; drop the originals instead of passing them through
+				out = out[out_pids != PAT_PID]
+				out_pids = out_pids[out_pids != PAT_PID]
+			if output['pmt_pid'] is not None:
+				chunks[program] = self.rewritePMT(output,out,numpy.flatnonzero(out_pids == output['pmt_pid']).tolist())
+			else:
+				chunks[program] = [memoryview(out.reshape(-1))]
+		self.write(chunks)
+
+	def rewritePMT(self,output,out,rows):
+		## Pieces of out with the filtered PMT in place of each packet starting an original
+		## one, and the rest of the original PMT packets left out
+		if not rows:
+			return [memoryview(out.reshape(-1))]
+		starts = [n for n in rows if out[n,1] & 0x40] if output['pmt'] else []
+		if len(output['pmt'] or ()) == 1 and len(starts) == len(rows):
+			## The usual case: a one packet PMT replaced where it is
+			for n in rows:
+				out[n] = numpy.frombuffer(self.pmtPackets(output),dtype=numpy.uint8)
+			return [memoryview(out.reshape(-1))]
+		pieces = []
+		last = 0
+		for n in rows:
+			pieces.append(memoryview(out[last:n].reshape(-1)))
+			if n in starts:
+				pieces.append(self.pmtPackets(output))
+			last = n + 1
+		pieces.append(memoryview(out[last:].reshape(-1)))
+		return pieces
+
+	def write(self,chunks):
+		for program,pieces in chunks.items():
+			output = self.outputs.get(program)
+			if not output or not pieces:
+				continue
+			data = pieces[0] if len(pieces) == 1 else b''.join(pieces)
+			output['packets'] += len(data) // TS_PACKET_SIZE
+			output['sink'].write(data)
+
+	def counters(self):
+		return {'packets':self.packets,'sync_errors':self.sync_errors,'psi_errors':self.psi_errors,\
+			'programs':dict((program,output['packets']) for program,output in self.outputs.items())}
+
+
+class _FileSink(object):
+	def __init__(self,filename):
+		self.fptr = open(filename,'wb')
+
+	def write(self,data):
+		self.fptr.write(data)
+
+	def close(self):
+		self.fptr.close()
+
+
+def demuxFile(filename,programs,use_numpy=HAVE_NUMPY,keep=None):
+	## Split programs out of a recorded multiplex into <name>_<program>.ts (only the streams a
+	## pidFilter() keep wants); with no programs, just read it and return the demuxer so its
+	## tables can be listed
+	demux = TSDemux(use_numpy)
+	sinks = {}
+	base = os.path.splitext(filename)[0]
+	for program in programs:
+		sinks[program] = _FileSink('%s_%d.ts' %(base,program))
+		demux.addProgram(program,sinks[program],keep=keep)
+	try:
+		with open(filename,'rb') as fptr:
+			while True:
+				chunk = fptr.read(READ_SIZE)
+				if not chunk:
+					break
+				demux.feed(chunk)
+	finally:
+		for sink in sinks.values():
+			sink.close()
+	return demux
+
+
+def usage():
+	print('Usage:' , sys.argv[0] , '[options] file.ts')
+	print('Description: List or split out the programs of a recorded transport stream')
+	print('')
+	print('Options:')
+	print('-h  --help			Show this helpful information')
+	print('-p  --program=[n]	Write program n to file_n.ts (may be repeated)')
+	print('-k  --keep=[streams]	Only write these streams: classes (%s), PIDs and languages, e.g. video,audio,eng' %(', '.join(sorted(STREAM_CLASSES))))
+	print('')
+
+
+if __name__ == '__main__':
+	programs = []
+	keep = None
+	try:
+		opts, args = getopt.getopt(sys.argv[1:], 'hp:k:', ['help', 'program=', 'keep='])
+	except getopt.GetoptError as err:
+		print(str(err))
+		usage()
+		sys.exit(2)
+
+	for opt, arg in opts:
+		if opt in ('-h', '--help'):
+			usage()
+			sys.exit()
+		elif opt in ('-p', '--program'):
+			programs.append(int(arg))
+		elif opt in ('-k', '--keep'):
+			try:
+				keep = pidFilter(arg)
+			except ValueError as diag:
+				print('ERROR:   %s' %(diag))
+				sys.exit(2)
+		else:
+			assert False, 'unhandled option'
+
+	if len(args) != 1:
+		usage()
+		sys.exit(2)
+
+	demux = demuxFile(args[0],programs,keep=keep)
+	for program,(pmt_pid,pcr_pid,streams) in sorted(demux.programs().items()):
+		if streams is None:
+			print('INFO:    PROGRAM %d: PMT PID 0x%04x' %(program,pmt_pid))
+		else:
+			print('INFO:    PROGRAM %d: PMT PID 0x%04x, PCR PID 0x%04x, STREAMS %s' %(program,pmt_pid,pcr_pid,\
+				', '.join('0x%04x (type 0x%02x)' %(pid,stream_type) for stream_type,pid in streams)))
+	for program,count in sorted(demux.counters()['programs'].items()):
+		print('INFO:    WROTE %d PACKETS OF PROGRAM %d' %(count,program))
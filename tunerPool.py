@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+##########################################################################
+##
+##  Tuner pool spanning every HDhomerun device
+##
+##  Goals:
+##                      Treat the tuners of all devices as one pool
+##                      instead of tuners 0..CFG_Num_Tuners-1 on a
+##                      single hard coded device
+##
+##                      Plan tuner assignments ahead of time over the
+##                      upcoming recordings (greedy interval colouring,
+##                      highest priority first) so conflicts are reported
+##                      before airtime instead of when a show fails to
+##                      start
+##
+##                      Let a higher priority recording preempt a lower
+##                      priority one when every tuner is busy
+##
+##                      Let recordings of the same multiplex (RF channel)
+##                      share a tuner when the recorder demuxes them
+##
+##  Tuners are identified by (device_id,tuner_index).  A recording's
+##  'priority' (default 0, higher wins) comes from the recording config.
+##  multiplex(recording) returns the key of the multiplex a recording can
+##  share a tuner on, or None if it needs a tuner of its own.
+##
+##########################################################################
+import bisect
+import time
+
+DEFAULT_PRIORITY = 0
+
+
+def tunerName(tuner_id):
+	## ('1052A5C2',1) -> '1052A5C2-1', the same naming hdhomerun_config uses
+	return '%s-%d' %(tuner_id[0],tuner_id[1])
+
+
+def priorityOf(recording):
+	try:
+		return int(recording.get('priority',DEFAULT_PRIORITY))
+	except (TypeError,ValueError):
+		return DEFAULT_PRIORITY
+
+
+class TunerPool(object):
+	def __init__(self,multiplex=None):
+		self.multiplex = multiplex or (lambda recording: None)
+		self.devices = {}
+		self.plan = {}          ## name -> tuner_id planned for its next occurrence
+		self.conflicts = {}     ## name -> names that keep it from being recorded
+		self.preemptions = {}   ## name -> active names it will have to preempt
+		self.dirty = True
+
+	def addDevice(self,device_id,ip=None,num_tuners=2,port=None):
+		device = self.devices.get(device_id)
+		if not device:
+			device = {'ip':ip,'port':port,'tuners':num_tuners,'online':False,'lastSeen':0}
+			self.devices[device_id] = device
+			self.dirty = True
+		else:
+			if ip:
+				device['ip'] = ip
+			if port:
+				device['port'] = port
+		return device
+
+	def setOnline(self,device_id,online):
+		device = self.devices[device_id]
+		if online:
+			device['lastSeen'] = time.time()
+		if device['online'] != online:
+			device['online'] = online
+			self.dirty = True
+
+	def tuners(self):
+		## Every tuner of every online device, in a stable order
+		result = []
+		for device_id in sorted(self.devices):
+			device = self.devices[device_id]
+			if device['online']:
+				result.extend((device_id,tuner) for tuner in range(device['tuners']))
+		return result
+
+	def busy(self,recordings):
+		## tuner_id -> names of the recordings holding it
+		held = {}
+		for name in recordings:
+			recording = recordings[name]
+			if 'tuner' in recording and 'device' in recording:
+				held.setdefault((recording['device'],recording['tuner']),[]).append(name)
+		return held
+
+	def sharable(self,name,others,recordings):
+		## Can name share a tuner with every one of others?
+		key = self.multiplex(recordings[name])
+		return key is not None and all(self.multiplex(recordings[other]) == key for other in others)
+
+	def freeTuners(self,recordings,exclude=()):
+		held = self.busy(recordings)
+		return [tuner_id for tuner_id in self.tuners() if tuner_id not in held and tuner_id not in exclude]
+
+	def sharedTuner(self,name,recordings,exclude=()):
+		## A tuner already streaming name's multiplex for active recordings, if any
+		held = self.busy(recordings)
+		for tuner_id in self.tuners():
+			holders = held.get(tuner_id)
+			if holders and tuner_id not in exclude and name not in holders and self.sharable(name,holders,recordings) and \
+				all(recordings[holder].get('status') == 'active' for holder in holders):
+				return tuner_id
+		return None
+
+	def chooseTuner(self,name,recordings,exclude=()):
+		## The planned tuner if it is free, otherwise any free tuner
+		free = self.freeTuners(recordings,exclude)
+		if not free:
+			return None
+		planned = self.plan.get(name)
+		if planned in free:
+			return planned
+		return free[0]
+
+	def preemptionVictims(self,name,recordings,exclude=()):
+		## Active recordings holding the tuner name should take over: every holder must be
+		## outranked by name; the lowest priority tuner goes first (ties go to the one that
+		## started last).  Empty if there is no such tuner.
+		priority = priorityOf(recordings[name])
+		held = self.busy(recordings)
+		candidates = []
+		for tuner_id in self.tuners():
+			holders = held.get(tuner_id)
+			if not holders or tuner_id in exclude:
+				continue
+			if all(recordings[holder].get('status') == 'active' and priorityOf(recordings[holder]) < priority for holder in holders):
+				candidates.append((max(priorityOf(recordings[holder]) for holder in holders),\
+					-max(recordings[holder].get('unix_start_time',0) for holder in holders),sorted(holders)))
+		if not candidates:
+			return []
+		return min(candidates)[2]
+
+	def allocate(self,recordings,now=None):
+		#################################################################
+		## Plan a tuner for the next occurrence of every recording.
+		## Active recordings keep their tuner; everything else is placed
+		## highest priority first, then by start time, on the first
+		## tuner with no overlapping assignment (or where everything that
+		## overlaps is on the same multiplex).
+		#################################################################
+		if now is None:
+			now = time.time()
+		tuners = self.tuners()
+		schedule = dict((tuner_id,[]) for tuner_id in tuners)   ## tuner_id -> sorted [(start,stop,names)]
+		plan = {}
+		conflicts = {}
+		preemptions = {}
+
+		pending = []
+		for name in recordings:
+			recording = recordings[name]
+			stop = recording.get('unix_stop_time',0)
+			if stop <= now:
+				continue
+			tuner_id = (recording.get('device'),recording.get('tuner'))
+			if recording.get('status') == 'active' and tuner_id in schedule:
+				self.assign(schedule[tuner_id],now,stop,name)
+				plan[name] = tuner_id
+			elif not recording.get('status'):
+				pending.append((-priorityOf(recording),max(recording.get('unix_start_time',0),now),stop,name))
+		pending.sort()
+
+		for negative_priority,start,stop,name in pending:
+			blockers = []
+			placed = None
+			for tuner_id in tuners:
+				overlapping = self.overlapping(schedule[tuner_id],start,stop)
+				if not overlapping or self.sharable(name,overlapping,recordings):
+					placed = tuner_id
+					break
+				blockers.append((tuner_id,overlapping))
+
+			if placed is None:
+				## Can it take a tuner from lower priority recordings that are already running?
+				for tuner_id,overlapping in blockers:
+					if all(recordings[other].get('status') == 'active' and -priorityOf(recordings[other]) > negative_priority for other in overlapping):
+						placed = tuner_id
+						preemptions[name] = overlapping
+						schedule[tuner_id] = [assignment for assignment in schedule[tuner_id] if not set(assignment[2]) & set(overlapping)]
+						for other in overlapping:
+							plan.pop(other,None)
+						break
+
+			if placed is None:
+				conflicts[name] = sorted(set(other for tuner_id,overlapping in blockers for other in overlapping))
+				continue
+			self.assign(schedule[placed],start,stop,name)
+			plan[name] = placed
+
+		self.plan = plan
+		self.conflicts = conflicts
+		self.preemptions = preemptions
+		self.dirty = False
+		return conflicts
+
+	def overlappingIndexes(self,assignments,start,stop):
+		## Assignments on one tuner whose [start,stop) intersects [start,stop); assignments are
+		## sorted and never overlap each other, so only the neighbours of the insertion point matter
+		i = bisect.bisect_left(assignments,(stop,))
+		result = []
+		while i > 0 and assignments[i - 1][1] > start:
+			result.append(i - 1)
+			i -= 1
+		return result
+
+	def overlapping(self,assignments,start,stop):
+		return [name for i in self.overlappingIndexes(assignments,start,stop) for name in assignments[i][2]]
+
+	def assign(self,assignments,start,stop,name):
+		## Recordings sharing a multiplex are merged into one assignment covering all of them,
+		## which keeps the assignments of a tuner from overlapping each other
+		merged = self.overlappingIndexes(assignments,start,stop)
+		names = (name,)
+		for i in merged:
+			start = min(start,assignments[i][0])
+			stop = max(stop,assignments[i][1])
+			names += assignments[i][2]
+		for i in merged:
+			del(assignments[i])
+		bisect.insort(assignments,(start,stop,names))
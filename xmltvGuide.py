@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+##########################################################################
+##
+##  XMLTV program guide, and the series rules recorded from it
+##
+##  Goals:
+##                      Record shows from what the guide says is on
+##                      instead of fixed weekday/time slots, so a show
+##                      that is moved, pre-empted or runs long is
+##                      recorded when it actually airs
+##
+##                      Read guides of hundreds of MB (weeks of listings
+##                      for many channels) in bounded memory: the file is
+##                      parsed as a stream (iterparse) and every element
+##                      is thrown away as soon as its listing is taken
+##                      out of it.  Only the listings of channels the
+##                      recorder can receive are kept, as small tuples.
+##
+##                      Index the listings by title and by channel and
+##                      time, so matching a series rule is a dict lookup
+##                      and a bisect instead of a walk of the guide
+##
+##                      Turn series rules (title, optionally channel, new
+##                      episodes only) into one recording entry per airing
+##                      with stable names, so a new guide only changes the
+##                      entries of listings that changed
+##
+##  A series rule is an entry in the recording config with a 'series'
+##  (the guide title) instead of 'day'/'start'/'end':
+##
+##      'NCIS':{'series':'NCIS','channel_name':'CBS','new_only':True,'filename_prefix':'NCIS','keep_days':7}
+##
+##  'channel_name' (a name or a list; any channel if left out), 'new_only'
+##  and 'start_early'/'end_late' (seconds of padding) are optional; the
+##  rest is copied into every airing's entry.  A listing counts as new
+##  when the guide marks it <new/> or <premiere/>, or doesn't say it was
+##  <previously-shown/>.
+##
+##  Usage:
+##                      xmltvGuide.py [-t title] [-c channel] guide.xml[.gz]
+##
+##########################################################################
+import os
+import re
+import sys
+import gzip
+import bisect
+import getopt
+import calendar
+import collections
+import xml.etree.ElementTree as ElementTree
+import time
+
+import channelScan
+
+ParseError = ElementTree.ParseError
+
+## channel: whatever the channel was mapped to (see load()); start/stop: unix times; episode: the
+## guide's episode number (system:value); new: False only for a known rerun
+Listing = collections.namedtuple('Listing','channel start stop title subtitle episode new')
+
+## Keys of a series rule that are not copied into its airings
+RULE_KEYS = ('series','new_only','start_early','end_late')
+
+DEFAULT_LENGTH = 30 * 60   ## Length of a listing that has no stop time and nothing after it
+EPISODE_SYSTEMS = ('dd_progid','xmltv_ns','onscreen')   ## Preferred episode-num systems, best first
+
+TIME_RE = re.compile(r'^(\d{4})(\d\d)(\d\d)(\d\d)(\d\d)(\d\d)?\s*(?:([+-])(\d\d):?(\d\d))?')
+TITLE_RE = re.compile(r'[\W_]+',re.UNICODE)
+
+
+def parseTime(value):
+	## XMLTV time ('20261019220000 -0400') -> unix time; no zone means UTC
+	match = TIME_RE.match(value or '')
+	if not match:
+		return None
+	year,month,day,hour,minute,second,sign,zone_hours,zone_minutes = match.groups()
+	when = calendar.timegm((int(year),int(month),int(day),int(hour),int(minute),int(second or 0),0,0,0))
+	if sign:
+		offset = int(zone_hours) * 3600 + int(zone_minutes) * 60
+		when -= offset if sign == '+' else -offset
+	return when
+
+
+def titleKey(title):
+	## 'Law & Order: SVU' and 'LAW AND ORDER - SVU' don't match, but case and punctuation don't matter
+	return TITLE_RE.sub(' ',title or '').strip().casefold()
+
+
+def fileSignature(filename):
+	try:
+		st = os.stat(filename)
+	except OSError:
+		return None
+	return (st.st_ino,st.st_size,st.st_mtime_ns)
+
+
+def channelMatcher(channels):
+	#################################################################
+	## A wanted() for GuideIndex.load(): maps a guide channel to the
+	## name of the CFG_CHANNELS entry it is, by the virtual number in
+	## any of its display names ('5.1', '5.1 WAGA'), else by a display
+	## name that is the entry's name or call sign.  An entry with an
+	## 'xmltv' id is only ever matched by that id.
+	#################################################################
+	by_id = {}
+	by_name = {}
+	for channel_name in sorted(channels):
+		channel = channels[channel_name]
+		if channel.get('xmltv'):
+			by_id[channel['xmltv']] = channel_name
+			continue
+		virtual = channelScan.virtualOf(channel)
+		if virtual:
+			by_name.setdefault(virtual,channel_name)
+		for name in (channel_name,' '.join(channel.get('name','').split(' ')[1:])):
+			if name:
+				by_name.setdefault(name.casefold(),channel_name)
+
+	def wanted(channel_id,names):
+		if channel_id in by_id:
+			return by_id[channel_id]
+		for name in names:
+			virtual = channelScan.virtualOf({'name':name})
+			if virtual in by_name:
+				return by_name[virtual]
+		for name in names:
+			if name.casefold() in by_name:
+				return by_name[name.casefold()]
+		return None
+	return wanted
+
+
+class GuideIndex(object):
+	"""The listings of one guide file, by (channel,start), by title and by channel and time"""
+
+	def __init__(self,filename):
+		self.filename = filename
+		self.signature = None
+		self.listings = {}     ## (channel,start) -> Listing
+		self.titles = {}       ## titleKey -> [(start,channel),...] sorted
+		self.schedules = {}    ## channel -> [start,...] sorted
+		self.channels = {}     ## guide channel id -> what wanted() mapped it to (None = not kept)
+		self.skipped = 0       ## Listings of channels that weren't wanted
+
+	def changed(self):
+		## Cheap check: has the file been touched since it was loaded?
+		return fileSignature(self.filename) != self.signature
+
+	def load(self,wanted=None):
+		#################################################################
+		## Read the guide.  wanted(channel_id,display_names) says what
+		## to file the listings of a channel under, or None to drop them;
+		## without it every channel is kept under its guide id.  Raises
+		## OSError/ParseError; the index is only replaced on success.
+		#################################################################
+		signature = fileSignature(self.filename)
+		listings = {}
+		channels = {}
+		skipped = 0
+		opener = gzip.open if self.filename.endswith('.gz') else open
+		with opener(self.filename,'rb') as fptr:
+			root = None
+			for event,elem in ElementTree.iterparse(fptr,events=('start','end')):
+				if event == 'start':
+					if root is None:
+						root = elem
+					continue
+				if elem.tag == 'channel':
+					names = [child.text.strip() for child in elem if child.tag in ('display-name','lcn') and child.text]
+					channel_id = elem.get('id')
+					channels[channel_id] = wanted(channel_id,names) if wanted else channel_id
+				elif elem.tag == 'programme':
+					channel_id = elem.get('channel')
+					if channel_id not in channels:
+						channels[channel_id] = wanted(channel_id,[]) if wanted else channel_id
+					channel = channels[channel_id]
+					start = parseTime(elem.get('start'))
+					if channel is None or start is None:
+						skipped += 1
+					else:
+						listings[(channel,start)] = self.parseListing(elem,channel,start)
+				else:
+					continue
+				## Everything read so far hangs off the root; let it all go
+				root.clear()
+
+		self.listings = listings
+		self.channels = channels
+		self.skipped = skipped
+		self.signature = signature
+		self.rebuild()
+
+	def parseListing(self,elem,channel,start):
+		title = subtitle = episode = None
+		episodes = {}
+		new = None
+		for child in elem:
+			tag = child.tag
+			if tag == 'title':
+				if title is None:
+					title = (child.text or '').strip()
+			elif tag == 'sub-title':
+				if subtitle is None:
+					subtitle = (child.text or '').strip() or None
+			elif tag == 'episode-num':
+				episodes.setdefault(child.get('system') or 'onscreen',(child.text or '').strip())
+			elif tag in ('new','premiere'):
+				new = True
+			elif tag == 'previously-shown' and new is None:
+				new = False
+		for system in EPISODE_SYSTEMS:
+			if episodes.get(system):
+				episode = '%s:%s' %(system,episodes[system])
+				break
+		## Titles repeat thousands of times in a guide; keep one copy of each
+		return Listing(channel,start,parseTime(elem.get('stop')),sys.intern(title or ''),subtitle,episode,new is not False)
+
+	def rebuild(self):
+		## The title and channel indexes, and stop times for listings the guide gave none
+		titles = {}
+		schedules = {}
+		for channel,start in self.listings:
+			schedules.setdefault(channel,[]).append(start)
+		for channel,starts in schedules.items():
+			starts.sort()
+			for i,start in enumerate(starts):
+				listing = self.listings[(channel,start)]
+				if listing.stop is None or listing.stop <= start:
+					stop = starts[i + 1] if i + 1 < len(starts) else start + DEFAULT_LENGTH
+					listing = self.listings[(channel,start)] = listing._replace(stop=stop)
+				titles.setdefault(titleKey(listing.title),[]).append((start,channel))
+		for airings in titles.values():
+			airings.sort()
+		self.titles = titles
+		self.schedules = schedules
+
+	def find(self,title,channels=None,since=0,until=float('inf')):
+		## Listings of title on channels (None = any) that haven't ended by since and start before until
+		airings = self.titles.get(titleKey(title),[])
+		## Nothing runs longer than a day; start the bisect that far back
+		first = bisect.bisect_left(airings,(since - 86400,''))
+		found = []
+		for start,channel in airings[first:]:
+			if start >= until:
+				break
+			listing = self.listings[(channel,start)]
+			if listing.stop > since and (channels is None or channel in channels):
+				found.append(listing)
+		return found
+
+	def between(self,channel,since,until):
+		## What is on channel from since to until, in order
+		starts = self.schedules.get(channel,[])
+		first = max(0,bisect.bisect_right(starts,since) - 1)
+		found = []
+		for start in starts[first:bisect.bisect_left(starts,until)]:
+			listing = self.listings[(channel,start)]
+			if listing.stop > since:
+				found.append(listing)
+		return found
+
+	def diff(self,old):
+		## (added,changed,removed) counts of listings compared to an older index
+		added = changed = 0
+		for key,listing in self.listings.items():
+			previous = old.listings.get(key)
+			if previous is None:
+				added += 1
+			elif previous != listing:
+				changed += 1
+		return (added,changed,len([key for key in old.listings if key not in self.listings]))
+
+
+def seriesAirings(index,rules,since,until,start_early=60,end_late=60,recorded=()):
+	#################################################################
+	## One recording entry per airing of every series rule that hasn't
+	## ended by since and starts before until.  Entries are named after
+	## their rule, channel and local start time ('NCIS CBS 2026-10-20
+	## 20:00'), so the same listing in a newer guide gives the same
+	## entry again.
+	## With 'new_only', reruns are left out and an episode airing more
+	## than once is only recorded the first time: recorded holds the
+	## (rule,episode) pairs already recorded (by earlier airings that
+	## are no longer in the window), and entries carry the 'episode' to
+	## add to it once they have been recorded.
+	#################################################################
+	entries = {}
+	for rule_name in sorted(rules):
+		rule = rules[rule_name]
+		channels = rule.get('channel_name')
+		if isinstance(channels,str):
+			channels = [channels]
+		early = rule.get('start_early',start_early)
+		late = rule.get('end_late',end_late)
+		seen = set()
+		for listing in index.find(rule['series'],channels,since - late,until + early):
+			if rule.get('new_only'):
+				if not listing.new:
+					continue
+				episode = listing.episode or listing.subtitle
+				if episode in seen or (rule_name,episode) in recorded:
+					continue
+				if episode:
+					seen.add(episode)
+			name = '%s %s %s' %(rule_name,listing.channel,time.strftime('%Y-%m-%d %H:%M',time.localtime(listing.start)))
+			entry = dict((key,value) for key,value in rule.items() if key not in RULE_KEYS)
+			entry.update({'show':rule_name,'channel_name':listing.channel,'airing':[listing.start - early,listing.stop + late]})
+			if listing.episode or listing.subtitle:
+				entry['episode'] = listing.episode or listing.subtitle
+			entries[name] = entry
+	return entries
+
+
+def usage():
+	print('Usage:' , sys.argv[0] , '[options] guide.xml[.gz]')
+	print('Description: Read an XMLTV guide, time it and list what it has')
+	print('')
+	print('Options:')
+	print('-h  --help			Show this helpful information')
+	print('-t  --title=[title]	List the airings of a title')
+	print('-c  --channel=[id]	List the next day on a channel (guide channel id)')
+	print('')
+
+
+if __name__ == '__main__':
+	title = None
+	channel = None
+	try:
+		opts, args = getopt.getopt(sys.argv[1:], 'ht:c:', ['help', 'title=', 'channel='])
+	except getopt.GetoptError as err:
+		print(str(err))
+		usage()
+		sys.exit(2)
+
+	for opt, arg in opts:
+		if opt in ('-h', '--help'):
+			usage()
+			sys.exit()
+		elif opt in ('-t', '--title'):
+			title = arg
+		elif opt in ('-c', '--channel'):
+			channel = arg
+		else:
+			assert False, 'unhandled option'
+
+	if len(args) != 1:
+		usage()
+		sys.exit(2)
+
+	index = GuideIndex(args[0])
+	start = time.time()
+	try:
+		index.load()
+	except (OSError,ParseError) as diag:
+		print('ERROR:   FAILED TO READ %s (%s)' %(args[0],diag))
+		sys.exit(1)
+	print('INFO:    READ %s IN %.1f s: %d LISTINGS ON %d CHANNELS, %d TITLES' %(args[0],time.time() - start,len(index.listings),\
+		len(index.schedules),len(index.titles)))
+
+	now = time.time()
+	if title:
+		listings = index.find(title,None,now)
+	elif channel:
+		listings = index.between(channel,now,now + 86400)
+	else:
+		listings = []
+	for listing in listings:
+		print('INFO:    %s-%s %-24s %s%s%s' %(time.strftime('%a %b %d %H:%M',time.localtime(listing.start)),time.strftime('%H:%M',time.localtime(listing.stop)),\
+			listing.channel[:24],listing.title,' - ' + listing.subtitle if listing.subtitle else '','' if listing.new else ' (RERUN)'))